@@ -94,19 +94,37 @@ def build_parser():
                         help='number of GPUs (0 indicates CPU)')
     parser.add_argument('--cudnn_benchmark', type=strtobool, default=True,
                         help='use CuDNN benchmark mode')
+    parser.add_argument('--distributed', type=strtobool, default=False,
+                        help='multi-process training with DistributedDataParallel (one process per device). '
+                        'Launch with `python -m torch.distributed.run --nproc_per_node N`.')
+    parser.add_argument('--dist_backend', type=str, default=False, nargs='?',
+                        choices=['nccl', 'gloo', False],
+                        help='backend of torch.distributed (nccl for GPUs and gloo for CPUs by default)')
+    parser.add_argument('--dist_init_method', type=str, default='env://',
+                        help='URL to initialize the process group')
+    parser.add_argument('--ddp_bucket_cap_mb', type=int, default=25,
+                        help='size of gradient buckets all-reduced at once in MB')
     parser.add_argument("--train_dtype", default="float32",
-                        choices=["float16", "float32", "float64", "O0", "O1", "O2", "O3"],
-                        help="Data type for training")
+                        choices=["float16", "bfloat16", "float32", "float64", "O0", "O1", "O2", "O3"],
+                        help="Data type for training (float16/bfloat16: native mixed precision by autocast, O0-O3: apex)")
     parser.add_argument('--model_save_dir', type=str, default=False,
                         help='directory to save a model')
     parser.add_argument('--resume', type=str, default=False, nargs='?',
                         help='model path to resume training')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed for sampling mini-batches (shared among processes in distributed training)')
     parser.add_argument('--job_name', type=str, default=False,
                         help='job name')
     parser.add_argument('--stdout', type=strtobool, default=False,
                         help='print to standard output during training')
     parser.add_argument('--remove_old_checkpoints', type=strtobool, default=True,
                         help='remove old checkpoints to save disk (turned off when training Transformer')
+    parser.add_argument('--async_checkpoint', type=strtobool, default=False,
+                        help='save checkpoints in a background thread')
+    parser.add_argument('--checkpoint_max_in_flight', type=int, default=1,
+                        help='maximum number of checkpoints being saved asynchronously')
+    parser.add_argument('--save_optimizer_separately', type=strtobool, default=False,
+                        help='save optimizer states in optimizer.epoch-* separately from model parameters')
     # dataset
     parser.add_argument('--train_set', type=str,
                         help='tsv file path for the training set')
@@ -145,6 +163,14 @@ def build_parser():
                         help='wordpiece model path for the 1st auxiliary task')
     parser.add_argument('--wp_model_sub2', type=str, default=False, nargs='?',
                         help='wordpiece model path for the 2nd auxiliary task')
+    parser.add_argument('--n_workers', type=int, default=0,
+                        help='number of worker processes to create mini-batches in the background (0: main process only)')
+    parser.add_argument('--n_prefetch', type=int, default=2,
+                        help='number of mini-batches prefetched per worker')
+    parser.add_argument('--pin_memory', type=strtobool, default=False,
+                        help='copy input features into pinned memory (GPU only)')
+    parser.add_argument('--manifest_cache_dir', type=str, default=False, nargs='?',
+                        help='directory to cache filtered dataset manifests (tsv files)')
     # features
     parser.add_argument('--input_type', type=str, default='speech',
                         choices=['speech', 'text'],
@@ -161,6 +187,10 @@ def build_parser():
                         help='minimum number of input frames')
     parser.add_argument('--dynamic_batching', type=strtobool, default=True,
                         help='')
+    parser.add_argument('--frame_budget', type=int, default=0,
+                        help='maximum number of padded input frames per mini-batch (batch_size is ignored if set)')
+    parser.add_argument('--token_budget', type=int, default=0,
+                        help='maximum number of padded output tokens per mini-batch (batch_size is ignored if set)')
     parser.add_argument('--input_noise_std', type=float, default=0,
                         help='standard deviation of Gaussian noise to input features')
     parser.add_argument('--weight_noise_std', type=float, default=0,
@@ -214,6 +244,10 @@ def build_parser():
                         help='epoch to converto to SGD fine-tuning')
     parser.add_argument('--print_step', type=int, default=200,
                         help='print log per this value')
+    parser.add_argument('--async_plot', type=strtobool, default=False,
+                        help='render learning curves, attention weights and CTC posteriors in a background process')
+    parser.add_argument('--plot_min_interval', type=float, default=0.,
+                        help='minimum interval between renderings of the same figure in seconds')
     parser.add_argument('--metric', type=str, default='edit_distance',
                         choices=['edit_distance', 'loss', 'accuracy', 'ppl', 'bleu', 'mse'],
                         help='metric for evaluation during training')
@@ -298,6 +332,8 @@ def build_parser():
                         help='adaptive size ratio for time masking')
     parser.add_argument('--max_n_time_masks', type=int, default=20,
                         help='maximum number of time masking')
+    parser.add_argument('--time_warp_width', type=int, default=0,
+                        help='width of time warping for SpecAugment (disabled if 0)')
     # MTL
     parser.add_argument('--ctc_weight', type=float, default=0.0,
                         help='CTC loss weight for the main task')
@@ -376,6 +412,9 @@ def build_parser():
                         help='recognize by teacher-forcing')
     parser.add_argument('--recog_batch_size', type=int, default=1,
                         help='size of mini-batch in evaluation')
+    parser.add_argument('--recog_dtype', type=str, default='float32',
+                        choices=['float32', 'float16', 'bfloat16'],
+                        help='data type of autocast in decoding (bfloat16 is recommended on CPUs)')
     parser.add_argument('--recog_beam_width', type=int, default=1,
                         help='size of beam')
     parser.add_argument('--recog_max_len_ratio', type=float, default=1.0,
@@ -403,6 +442,11 @@ def build_parser():
                                   First-pass backward LM in case of synchronous bidirectional decoding.')
     parser.add_argument('--recog_ctc_weight', type=float, default=0.0,
                         help='weight of CTC score')
+    parser.add_argument('--recog_ctc_window', type=int, default=0,
+                        help='number of frames around the attention peak for CTC prefix scoring \
+                                  (0: use all frames)')
+    parser.add_argument('--recog_max_symbols_per_frame', type=int, default=3,
+                        help='maximum number of non-blank labels emitted per frame in RNN-T beam search')
     parser.add_argument('--recog_lm', type=str, default=False, nargs='?',
                         help='path to first path LM for shallow fusion')
     parser.add_argument('--recog_lm_second', type=str, default=False, nargs='?',
@@ -71,13 +71,31 @@ def build_parser():
                         help='number of GPUs (0 indicates CPU)')
     parser.add_argument('--cudnn_benchmark', type=strtobool, default=True,
                         help='use CuDNN benchmark mode')
+    parser.add_argument('--distributed', type=strtobool, default=False,
+                        help='multi-process training with DistributedDataParallel (one process per device). '
+                        'Launch with `python -m torch.distributed.run --nproc_per_node N`.')
+    parser.add_argument('--dist_backend', type=str, default=False, nargs='?',
+                        choices=['nccl', 'gloo', False],
+                        help='backend of torch.distributed (nccl for GPUs and gloo for CPUs by default)')
+    parser.add_argument('--dist_init_method', type=str, default='env://',
+                        help='URL to initialize the process group')
+    parser.add_argument('--ddp_bucket_cap_mb', type=int, default=25,
+                        help='size of gradient buckets all-reduced at once in MB')
     parser.add_argument("--train_dtype", default="float32",
-                        choices=["float16", "float32", "float64", "O0", "O1", "O2", "O3"],
-                        help="Data type for training")
+                        choices=["float16", "bfloat16", "float32", "float64", "O0", "O1", "O2", "O3"],
+                        help="Data type for training (float16/bfloat16: native mixed precision by autocast, O0-O3: apex)")
     parser.add_argument('--model_save_dir', type=str, default=False,
                         help='directory to save a model')
     parser.add_argument('--resume', type=str, default=False, nargs='?',
                         help='model path to resume training')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed for sampling mini-batches (shared among processes in distributed training)')
+    parser.add_argument('--async_checkpoint', type=strtobool, default=False,
+                        help='save checkpoints in a background thread')
+    parser.add_argument('--checkpoint_max_in_flight', type=int, default=1,
+                        help='maximum number of checkpoints being saved asynchronously')
+    parser.add_argument('--save_optimizer_separately', type=strtobool, default=False,
+                        help='save optimizer states in optimizer.epoch-* separately from model parameters')
     parser.add_argument('--job_name', type=str, default=False,
                         help='job name')
     parser.add_argument('--stdout', type=strtobool, default=False,
@@ -100,6 +118,12 @@ def build_parser():
                         help='output unit')
     parser.add_argument('--wp_model', type=str, default=False, nargs='?',
                         help='wordpiece model path')
+    parser.add_argument('--manifest_cache_dir', type=str, default=False, nargs='?',
+                        help='directory to cache filtered dataset manifests (tsv files)')
+    parser.add_argument('--streaming_corpus', type=strtobool, default=False, nargs='?',
+                        help='read the training corpus from a memory-mapped token stream')
+    parser.add_argument('--stream_block_size', type=int, default=10000,
+                        help='minimum number of tokens per shuffled block in the token stream')
     # features
     parser.add_argument('--min_n_tokens', type=int, default=1,
                         help='minimum number of input tokens')
@@ -125,6 +149,8 @@ def build_parser():
                         help='mini-batch size')
     parser.add_argument('--bptt', type=int, default=200,
                         help='BPTT length')
+    parser.add_argument('--variable_bptt', type=strtobool, default=False, nargs='?',
+                        help='sample BPTT length per mini-batch during training')
     parser.add_argument('--optimizer', type=str, default='adam',
                         choices=['adam', 'adadelta', 'adagrad', 'sgd', 'momentum', 'nesterov', 'noam'],
                         help='type of optimizer')
@@ -134,6 +160,10 @@ def build_parser():
                         help='epoch to converto to SGD fine-tuning')
     parser.add_argument('--print_step', type=int, default=100,
                         help='print log per this value')
+    parser.add_argument('--async_plot', type=strtobool, default=False,
+                        help='render learning curves, attention weights and CTC posteriors in a background process')
+    parser.add_argument('--plot_min_interval', type=float, default=0.,
+                        help='minimum interval between renderings of the same figure in seconds')
     parser.add_argument('--lr', type=float, default=1e-3,
                         help='initial learning rate')
     parser.add_argument('--lr_factor', type=float, default=10.0,
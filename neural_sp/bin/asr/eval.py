@@ -64,7 +64,8 @@ def main():
                           unit_sub2=args.unit_sub2,
                           batch_size=args.recog_batch_size,
                           first_n_utterances=args.recog_first_n_utt,
-                          is_test=True)
+                          is_test=True,
+                          manifest_cache_dir=args.manifest_cache_dir)
 
         if i == 0:
             # Load the ASR model
@@ -7,6 +7,7 @@
 """Train the ASR model."""
 
 import argparse
+import contextlib
 import copy
 import cProfile
 import logging
@@ -32,8 +33,18 @@ from neural_sp.datasets.asr import Dataset
 from neural_sp.models.data_parallel import CustomDataParallel
 from neural_sp.models.data_parallel import CPUWrapperASR
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.modules.attention_capture import AttentionCapture
 from neural_sp.models.seq2seq.speech2text import Speech2Text
+from neural_sp.trainers.checkpoint import CheckpointWriter
+from neural_sp.trainers.distributed import (
+    broadcast_object,
+    get_local_rank,
+    init_distributed,
+    reduce_observation,
+    wrap_ddp
+)
 from neural_sp.trainers.lr_scheduler import LRScheduler
+from neural_sp.trainers.mixed_precision import MixedPrecision
 from neural_sp.trainers.optimizer import set_optimizer
 from neural_sp.trainers.reporter import Reporter
 from neural_sp.utils import mkdir_join
@@ -60,8 +71,22 @@ def main():
 
     args = compute_susampling_factor(args)
 
+    # Set process group for distributed training
+    rank, world_size = 0, 1
+    if args.distributed:
+        assert args.n_gpus <= 1, 'Use one GPU per process in distributed training.'
+        assert not args.mbr_training
+        rank, world_size = init_distributed(args.dist_backend, args.dist_init_method)
+        if args.n_gpus >= 1:
+            torch.cuda.set_device(get_local_rank())
+    is_main = rank == 0
+
     # Load dataset
-    batch_size = args.batch_size * args.n_gpus if args.n_gpus >= 1 else args.batch_size
+    if args.distributed:
+        # NOTE: each process takes its shard of global mini-batches
+        batch_size = args.batch_size * world_size
+    else:
+        batch_size = args.batch_size * args.n_gpus if args.n_gpus >= 1 else args.batch_size
     train_set = Dataset(corpus=args.corpus,
                         tsv_path=args.train_set,
                         tsv_path_sub1=args.train_set_sub1,
@@ -91,7 +116,16 @@ def main():
                         subsample_factor=args.subsample_factor,
                         subsample_factor_sub1=args.subsample_factor_sub1,
                         subsample_factor_sub2=args.subsample_factor_sub2,
-                        discourse_aware=args.discourse_aware)
+                        discourse_aware=args.discourse_aware,
+                        n_workers=args.n_workers,
+                        n_prefetch=args.n_prefetch,
+                        pin_memory=args.pin_memory,
+                        frame_budget=args.frame_budget * world_size,
+                        token_budget=args.token_budget * world_size,
+                        manifest_cache_dir=args.manifest_cache_dir,
+                        seed=args.seed,
+                        rank=rank,
+                        world_size=world_size)
     dev_set = Dataset(corpus=args.corpus,
                       tsv_path=args.dev_set,
                       tsv_path_sub1=args.dev_set_sub1,
@@ -114,7 +148,8 @@ def main():
                       ctc_sub2=args.ctc_weight_sub2 > 0,
                       subsample_factor=args.subsample_factor,
                       subsample_factor_sub1=args.subsample_factor_sub1,
-                      subsample_factor_sub2=args.subsample_factor_sub2)
+                      subsample_factor_sub2=args.subsample_factor_sub2,
+                      manifest_cache_dir=args.manifest_cache_dir)
     eval_sets = [Dataset(corpus=args.corpus,
                          tsv_path=s,
                          dict_path=args.dict,
@@ -122,7 +157,8 @@ def main():
                          unit=args.unit,
                          wp_model=args.wp_model,
                          batch_size=1,
-                         is_test=True) for s in args.eval_sets]
+                         is_test=True,
+                         manifest_cache_dir=args.manifest_cache_dir) for s in args.eval_sets]
 
     args.vocab = train_set.vocab
     args.vocab_sub1 = train_set.vocab_sub1
@@ -135,16 +171,21 @@ def main():
         dir_name = os.path.basename(save_path)
     else:
         dir_name = set_asr_model_name(args)
-        if args.mbr_training:
+        if not is_main:
+            save_path = None
+        elif args.mbr_training:
             assert args.asr_init
             save_path = mkdir_join(os.path.dirname(args.asr_init), dir_name)
         else:
             save_path = mkdir_join(args.model_save_dir, '_'.join(
                 os.path.basename(args.train_set).split('.')[:-1]), dir_name)
-        save_path = set_save_path(save_path)  # avoid overwriting
+        if is_main:
+            save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = broadcast_object(save_path)
 
     # Set logger
-    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
+    if is_main:
+        set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
 
     # Load a LM conf file for LM fusion & LM initialization
     if not args.resume and args.external_lm:
@@ -158,7 +199,7 @@ def main():
     # Model setting
     model = Speech2Text(args, save_path, train_set.idx2token[0])
 
-    if not args.resume:
+    if not args.resume and is_main:
         # Save the conf file as a yaml file
         save_config(vars(args), os.path.join(save_path, 'conf.yml'))
         if args.external_lm:
@@ -227,8 +268,8 @@ def main():
                             save_checkpoints_topk=10 if is_transformer else 1)
 
     if args.resume:
-        # Restore the last saved model
-        load_checkpoint(args.resume, model, optimizer)
+        # Restore the last saved model and the position in the training set
+        load_checkpoint(args.resume, model, optimizer, dataset=train_set)
 
         # Resume between convert_to_sgd_epoch -1 and convert_to_sgd_epoch
         if resume_epoch == args.convert_to_sgd_epoch:
@@ -261,7 +302,14 @@ def main():
 
     # GPU setting
     use_apex = args.train_dtype in ["O0", "O1", "O2", "O3"]
+    use_amp = args.train_dtype in ["float16", "bfloat16"]
     amp = None
+    if use_amp:
+        # Native mixed precision training setting
+        assert args.n_gpus >= 1 or args.train_dtype == 'bfloat16', 'Use bfloat16 for CPUs.'
+        amp = MixedPrecision(args.train_dtype, 'cuda' if args.n_gpus >= 1 else 'cpu')
+        if args.resume:
+            load_checkpoint(args.resume, amp=amp)
     if args.n_gpus >= 1:
         model.cudnn_setting(deterministic=not (is_transformer or args.cudnn_benchmark),
                             benchmark=not is_transformer and args.cudnn_benchmark)
@@ -278,12 +326,17 @@ def main():
             amp.init()
             if args.resume:
                 load_checkpoint(args.resume, amp=amp)
-        model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+        if args.distributed:
+            model = wrap_ddp(model, get_local_rank(), args.ddp_bucket_cap_mb)
+        else:
+            model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
 
         if teacher is not None:
             teacher.cuda()
         if teacher_lm is not None:
             teacher_lm.cuda()
+    elif args.distributed:
+        model = wrap_ddp(model, None, args.ddp_bucket_cap_mb)
     else:
         model = CPUWrapperASR(model)
 
@@ -294,7 +347,13 @@ def main():
     setproctitle(args.job_name if args.job_name else dir_name)
 
     # Set reporter
-    reporter = Reporter(save_path)
+    reporter = Reporter(save_path, enabled=is_main,
+                        asynchronous=args.async_plot, min_interval=args.plot_min_interval)
+
+    # Set checkpoint writer
+    ckpt_writer = CheckpointWriter(asynchronous=args.async_checkpoint,
+                                   max_in_flight=args.checkpoint_max_in_flight,
+                                   split_optimizer=args.save_optimizer_separately)
 
     if args.mtl_per_batch:
         # NOTE: from easier to harder tasks
@@ -323,7 +382,7 @@ def main():
     n_steps = optimizer.n_steps * args.accum_grad_n_steps
     epoch_detail_prev = 0
     for ep in range(resume_epoch, args.n_epochs):
-        pbar_epoch = tqdm(total=len(train_set))
+        pbar_epoch = tqdm(total=len(train_set), disable=not is_main)
         session_prev = None
 
         for batch_train, is_new_epoch in train_set:
@@ -336,44 +395,63 @@ def main():
             # Change mini-batch depending on task
             if accum_n_steps == 1:
                 loss_train = 0  # moving average over gradient accumulation
+            is_update = accum_n_steps >= args.accum_grad_n_steps or is_new_epoch
             for task in tasks:
-                loss, observation = model(batch_train, task,
-                                          teacher=teacher, teacher_lm=teacher_lm)
+                # NOTE: gradients are all-reduced only before parameter updates
+                with model.no_sync() if args.distributed and not is_update else contextlib.nullcontext():
+                    with amp.autocast() if use_amp else contextlib.nullcontext():
+                        loss, observation = model(batch_train, task,
+                                                  teacher=teacher, teacher_lm=teacher_lm)
+                    if use_apex:
+                        with amp.scale_loss(loss, optimizer.optimizer) as scaled_loss:
+                            scaled_loss.backward()
+                    elif use_amp:
+                        amp.backward(loss)
+                    else:
+                        loss.backward()
+                if args.distributed:
+                    observation = reduce_observation(observation, loss.device)
                 reporter.add(observation)
-                if use_apex:
-                    with amp.scale_loss(loss, optimizer.optimizer) as scaled_loss:
-                        scaled_loss.backward()
-                else:
-                    loss.backward()
                 loss.detach()  # Trancate the graph
                 loss_train = (loss_train * (accum_n_steps - 1) + loss.item()) / accum_n_steps
-                if accum_n_steps >= args.accum_grad_n_steps or is_new_epoch:
+                if is_update:
                     if args.clip_grad_norm > 0:
+                        if use_amp:
+                            amp.unscale_(optimizer.optimizer)
                         total_norm = torch.nn.utils.clip_grad_norm_(
                             model.module.parameters(), args.clip_grad_norm)
                         reporter.add_tensorboard_scalar('total_norm', total_norm)
-                    optimizer.step()
+                    optimizer.step(amp if use_amp else None)
+                    if use_amp:
+                        reporter.add_tensorboard_scalar('loss_scale', amp.scale)
                     optimizer.zero_grad()
                     accum_n_steps = 0
                     # NOTE: parameters are forcibly updated at the end of every epoch
                 del loss
 
-            pbar_epoch.update(len(batch_train['utt_ids']))
+            pbar_epoch.update(len(batch_train['utt_ids']) * world_size)
             reporter.add_tensorboard_scalar('learning_rate', optimizer.lr)
+            reporter.add_tensorboard_scalar('padding_efficiency', train_set.padding_efficiency)
             # NOTE: loss/acc/ppl are already added in the model
             reporter.step()
             n_steps += 1
             # NOTE: n_steps is different from the step counter in Noam Optimizer
 
-            if n_steps % args.print_step == 0:
+            if n_steps % args.print_step == 0 and is_main:
                 # Compute loss in the dev set
                 batch_dev = iter(dev_set).next(batch_size=1 if 'transducer' in args.dec_type else None)[0]
+                # Record attention weights of the last utterance for plotting
+                if n_steps % (args.print_step * 10) == 0:
+                    model.module.capture_attention(AttentionCapture(utterances=[-1]))
                 # Change mini-batch depending on task
                 for task in tasks:
-                    loss, observation = model(batch_dev, task, is_eval=True)
+                    # NOTE: bypass DDP not to wait for the other processes
+                    with amp.autocast() if use_amp else contextlib.nullcontext():
+                        loss, observation = (model.module if args.distributed else model)(batch_dev, task, is_eval=True)
                     reporter.add(observation, is_eval=True)
                     loss_dev = loss.item()
                     del loss
+                model.module.capture_attention(None)
                 reporter.step(is_eval=True)
 
                 duration_step = time.time() - start_time_step
@@ -391,10 +469,10 @@ def main():
                 start_time_step = time.time()
 
             # Save fugures of loss and accuracy
-            if n_steps % (args.print_step * 10) == 0:
+            if n_steps % (args.print_step * 10) == 0 and is_main:
                 reporter.snapshot()
-                model.module.plot_attention()
-                model.module.plot_ctc()
+                model.module.plot_attention(worker=reporter.worker)
+                model.module.plot_ctc(worker=reporter.worker)
 
             # Ealuate model every 0.1 epoch during MBR training
             if args.mbr_training:
@@ -405,7 +483,7 @@ def main():
                     # Save the model
                     optimizer.save_checkpoint(
                         model, save_path, remove_old=False, amp=amp,
-                        epoch_detail=train_set.epoch_detail)
+                        epoch_detail=train_set.epoch_detail, writer=ckpt_writer, dataset=train_set)
                 epoch_detail_prev = train_set.epoch_detail
 
             if is_new_epoch:
@@ -421,20 +499,28 @@ def main():
             reporter.epoch()  # plot
 
             # Save the model
-            optimizer.save_checkpoint(
-                model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
+            if is_main:
+                optimizer.save_checkpoint(
+                    model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp,
+                    writer=ckpt_writer, dataset=train_set)
         else:
             start_time_eval = time.time()
             # dev
-            metric_dev = evaluate([model.module], dev_set, recog_params, args,
-                                  optimizer.n_epochs + 1, logger)
+            metric_dev = None
+            if is_main:
+                metric_dev = evaluate([model.module], dev_set, recog_params, args,
+                                      optimizer.n_epochs + 1, logger)
+            # NOTE: the other processes wait for the main process here, and then
+            # all processes make the same decision on lr decay and early stopping
+            metric_dev = broadcast_object(metric_dev)
             optimizer.epoch(metric_dev)  # lr decay
             reporter.epoch(metric_dev, name=args.metric)  # plot
 
-            if optimizer.is_topk or is_transformer:
+            if (optimizer.is_topk or is_transformer) and is_main:
                 # Save the model
                 optimizer.save_checkpoint(
-                    model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
+                    model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp,
+                    writer=ckpt_writer, dataset=train_set)
 
                 # test
                 if optimizer.is_topk:
@@ -465,8 +551,12 @@ def main():
     duration_train = time.time() - start_time_train
     logger.info('Total time: %.2f hour' % (duration_train / 3600))
 
-    reporter.tf_writer.close()
+    ckpt_writer.close()
+    reporter.close()
     pbar_epoch.close()
+    train_set.close()
+    if args.distributed:
+        torch.distributed.destroy_process_group()
 
     return save_path
 
@@ -530,4 +620,5 @@ if __name__ == '__main__':
     # Setting for profiling
     pr = cProfile.Profile()
     save_path = pr.runcall(main)
-    pr.dump_stats(os.path.join(save_path, 'train.profile'))
+    rank = int(os.environ.get('RANK', 0))
+    pr.dump_stats(os.path.join(save_path, 'train.profile' if rank == 0 else 'train.rank%d.profile' % rank))
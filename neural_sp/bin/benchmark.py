@@ -0,0 +1,575 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""CPU benchmark suite for encoders, decoders, LMs and the data pipeline.
+
+   Randomly initialized models are built from the same argument parsers and
+   builders as training (encoders/build.py, decoders/build.py and
+   models/lm/build.py), and are run on synthetic features. Throughput, RTF,
+   latency percentiles and peak memory of each stage are written to a json
+   file, which can be compared against a stored baseline.
+
+   Usage:
+       python neural_sp/bin/benchmark.py --out results.json
+       python neural_sp/bin/benchmark.py --configs blstm_las,rnnlm --baseline results.json
+"""
+
+import argparse
+import codecs
+from collections import OrderedDict
+import fnmatch
+import json
+import logging
+import multiprocessing
+import numpy as np
+import os
+import platform
+from queue import Empty
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import torch
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# ASR configurations: model arguments and search parameters of each search
+ASR_CONFIGS = OrderedDict([
+    ('blstm_las', {
+        'args': {'enc_type': 'conv_blstm', 'enc_n_units': 320, 'enc_n_layers': 4, 'subsample': '1_1_1_1',
+                 'conv_channels': '32_32', 'conv_kernel_sizes': '(3,3)_(3,3)',
+                 'conv_strides': '(1,1)_(1,1)', 'conv_poolings': '(2,2)_(2,2)',
+                 'dec_type': 'lstm', 'dec_n_units': 320, 'dec_n_layers': 1, 'emb_dim': 320, 'attn_dim': 320},
+        'searches': OrderedDict([('greedy', {'recog_beam_width': 1}),
+                                 ('beam5', {'recog_beam_width': 5})])}),
+    ('transformer', {
+        'args': {'enc_type': 'conv_transformer', 'enc_n_layers': 12, 'subsample': '1_1_1_1_1_1_1_1_1_1_1_1',
+                 'conv_channels': '32_32', 'conv_kernel_sizes': '(3,3)_(3,3)',
+                 'conv_strides': '(1,1)_(1,1)', 'conv_poolings': '(2,2)_(2,2)',
+                 'dec_type': 'transformer', 'dec_n_layers': 6,
+                 'transformer_d_model': 256, 'transformer_d_ff': 2048, 'transformer_n_heads': 4},
+        'searches': OrderedDict([('greedy', {'recog_beam_width': 1}),
+                                 ('beam5', {'recog_beam_width': 5})])}),
+    ('conformer', {
+        'args': {'enc_type': 'conv_conformer', 'enc_n_layers': 12, 'subsample': '1_1_1_1_1_1_1_1_1_1_1_1',
+                 'conv_channels': '32_32', 'conv_kernel_sizes': '(3,3)_(3,3)',
+                 'conv_strides': '(1,1)_(1,1)', 'conv_poolings': '(2,2)_(2,2)',
+                 'dec_type': 'transformer', 'dec_n_layers': 6,
+                 'transformer_d_model': 256, 'transformer_d_ff': 1024, 'transformer_n_heads': 4,
+                 'conformer_kernel_size': 31},
+        'searches': OrderedDict([('beam5', {'recog_beam_width': 5})])}),
+    ('blstm_transducer', {
+        'args': {'enc_type': 'conv_blstm', 'enc_n_units': 320, 'enc_n_layers': 4, 'subsample': '1_1_1_1',
+                 'conv_channels': '32_32', 'conv_kernel_sizes': '(3,3)_(3,3)',
+                 'conv_strides': '(1,1)_(1,1)', 'conv_poolings': '(2,2)_(2,2)',
+                 'dec_type': 'lstm_transducer', 'dec_n_units': 320, 'dec_n_layers': 1, 'emb_dim': 320},
+        'searches': OrderedDict([('greedy', {'recog_beam_width': 1}),
+                                 ('beam5', {'recog_beam_width': 5})])}),
+    ('transformer_ctc', {
+        'args': {'enc_type': 'conv_transformer', 'enc_n_layers': 12, 'subsample': '1_1_1_1_1_1_1_1_1_1_1_1',
+                 'conv_channels': '32_32', 'conv_kernel_sizes': '(3,3)_(3,3)',
+                 'conv_strides': '(1,1)_(1,1)', 'conv_poolings': '(2,2)_(2,2)',
+                 'dec_type': 'transformer', 'ctc_weight': 1.0,
+                 'transformer_d_model': 256, 'transformer_d_ff': 2048, 'transformer_n_heads': 4},
+        'searches': OrderedDict([('ctc_greedy', {'recog_beam_width': 1, 'recog_ctc_weight': 1.0}),
+                                 ('ctc_beam5', {'recog_beam_width': 5, 'recog_ctc_weight': 1.0})])}),
+])
+
+LM_CONFIGS = OrderedDict([
+    ('rnnlm', {'lm_type': 'lstm', 'n_units': 1024, 'n_layers': 2, 'emb_dim': 1024}),
+    ('transformerlm', {'lm_type': 'transformer', 'n_layers': 6, 'transformer_d_model': 512,
+                       'transformer_d_ff': 2048, 'transformer_n_heads': 8}),
+])
+
+DATASET_CONFIGS = OrderedDict([
+    ('dataset', {'n_workers': 0}),
+    ('dataset_async', {'n_workers': 2}),
+])
+
+
+def all_configs():
+    return list(ASR_CONFIGS.keys()) + list(LM_CONFIGS.keys()) + list(DATASET_CONFIGS.keys())
+
+
+def parse():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--configs', type=str, default='*',
+                        help='comma-separated configuration names (wildcards are allowed)')
+    parser.add_argument('--list', action='store_true',
+                        help='list configuration names and exit')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='number of utterances (or token sequences) per call')
+    parser.add_argument('--xmax', type=int, default=1000,
+                        help='number of input frames per utterance')
+    parser.add_argument('--input_dim', type=int, default=80,
+                        help='dimension of input features')
+    parser.add_argument('--frame_shift', type=float, default=10,
+                        help='frame shift of input features in milliseconds, used for RTF')
+    parser.add_argument('--vocab', type=int, default=1000,
+                        help='vocabulary size')
+    parser.add_argument('--lm_seq_len', type=int, default=100,
+                        help='number of tokens per sequence for LM benchmarks')
+    parser.add_argument('--n_utts', type=int, default=64,
+                        help='number of utterances for dataset benchmarks')
+    parser.add_argument('--n_iters', type=int, default=5,
+                        help='number of measured iterations per stage')
+    parser.add_argument('--n_warmup', type=int, default=1,
+                        help='number of warm-up iterations per stage')
+    parser.add_argument('--n_threads', type=int, default=0,
+                        help='number of intra-op threads of torch (0: default)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed')
+    parser.add_argument('--isolate', type=int, default=1,
+                        help='run each configuration in a new process to measure its peak memory')
+    parser.add_argument('--out', type=str, default='',
+                        help='path to save results in json format')
+    parser.add_argument('--baseline', type=str, default='',
+                        help='path to baseline results in json format to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative increase of median latency regarded as a regression')
+    return parser.parse_args()
+
+
+def _to_argv(overrides):
+    argv = []
+    for k, v in overrides.items():
+        argv += ['--' + k, str(v)]
+    return argv
+
+
+def make_asr_args(overrides, input_dim, vocab):
+    """Build arguments of Speech2Text from the training parser.
+
+    Args:
+        overrides (dict): non-default arguments
+        input_dim (int): dimension of input features
+        vocab (int): vocabulary size
+    Returns:
+        args (Namespace):
+
+    """
+    from neural_sp.bin import args_asr
+    from neural_sp.models.seq2seq.encoders.conv import ConvEncoder
+
+    argv = _to_argv(overrides)
+    parser = args_asr.build_parser()
+    args, _ = parser.parse_known_args(argv)
+    parser = args_asr.register_args_encoder(parser, args)
+    args, _ = parser.parse_known_args(argv)
+    parser = args_asr.register_args_decoder(parser, args)
+    args = parser.parse_args(argv)
+    if 'conv' not in args.enc_type:
+        # NOTE: CNN arguments are referred to in build_encoder
+        parser_conv = ConvEncoder.add_args(args_asr.build_parser(), args)
+        for k, v in vars(parser_conv.parse_known_args([])[0]).items():
+            if not hasattr(args, k):
+                setattr(args, k, v)
+    args.input_dim = input_dim
+    args.vocab = vocab
+    args.vocab_sub1 = -1
+    args.vocab_sub2 = -1
+    return args
+
+
+def make_lm_args(overrides, vocab):
+    """Build arguments of LM from the training parser.
+
+    Args:
+        overrides (dict): non-default arguments
+        vocab (int): vocabulary size
+    Returns:
+        args (Namespace):
+
+    """
+    from neural_sp.bin import args_lm
+
+    argv = _to_argv(overrides)
+    parser = args_lm.build_parser()
+    args, _ = parser.parse_known_args(argv)
+    parser = args_lm.register_args_lm(parser, args)
+    args = parser.parse_args(argv)
+    args.vocab = vocab
+    return args
+
+
+def summarize(elapsed, n_frames=0, n_tokens=0, n_utts=0, audio_sec=0.):
+    """Summarize elapsed time of measured iterations.
+
+    Args:
+        elapsed (list): elapsed time of each iteration in seconds
+        n_frames (int): total number of input frames processed in all iterations
+        n_tokens (int): total number of tokens processed in all iterations
+        n_utts (int): total number of utterances processed in all iterations
+        audio_sec (float): total duration of audio processed in all iterations
+    Returns:
+        metrics (dict):
+
+    """
+    elapsed = np.array(elapsed, dtype=np.float64)
+    total = max(float(elapsed.sum()), 1e-12)
+    metrics = OrderedDict()
+    metrics['n_iters'] = len(elapsed)
+    metrics['latency_ms'] = OrderedDict([
+        ('mean', float(elapsed.mean()) * 1000),
+        ('p50', float(np.percentile(elapsed, 50)) * 1000),
+        ('p90', float(np.percentile(elapsed, 90)) * 1000),
+        ('p99', float(np.percentile(elapsed, 99)) * 1000),
+    ])
+    if n_frames > 0:
+        metrics['frames_per_sec'] = n_frames / total
+    if n_tokens > 0:
+        metrics['tokens_per_sec'] = n_tokens / total
+    if n_utts > 0:
+        metrics['utts_per_sec'] = n_utts / total
+    if audio_sec > 0:
+        metrics['rtf'] = total / audio_sec
+    return metrics
+
+
+def measure(fn, n_iters, n_warmup):
+    """Call fn repeatedly and measure elapsed time.
+
+    Returns:
+        elapsed (list): elapsed time of each measured call in seconds
+        outputs (list): return value of each measured call
+
+    """
+    for _ in range(n_warmup):
+        fn()
+    elapsed, outputs = [], []
+    for _ in range(n_iters):
+        start = time.perf_counter()
+        outputs.append(fn())
+        elapsed.append(time.perf_counter() - start)
+    return elapsed, outputs
+
+
+def search(model, eout_dict, params):
+    """Run the search of the main task as in Speech2Text.decode.
+
+    Returns:
+        hyps (list): length `B`, each of which contains a list of token indices
+
+    """
+    eouts, elens = eout_dict['ys']['xs'], eout_dict['ys']['xlens']
+    dec = model.dec_fwd
+    if params['recog_ctc_weight'] == 1:
+        hyps = dec.decode_ctc(eouts, elens, params, None)
+    elif params['recog_beam_width'] == 1:
+        hyps, _ = dec.greedy(eouts, elens, params['recog_max_len_ratio'], None)
+    elif eouts.size(0) > 1 and hasattr(dec, 'beam_search_batch'):
+        nbest_hyps, _, _ = dec.beam_search_batch(eouts, elens, params)
+        hyps = [hyp[0] for hyp in nbest_hyps]
+    else:
+        nbest_hyps, _, _ = dec.beam_search(eouts, elens, params)
+        hyps = [hyp[0] for hyp in nbest_hyps]
+    return [list(hyp) for hyp in hyps]
+
+
+def benchmark_asr(name, opts):
+    from neural_sp.models.seq2seq.speech2text import Speech2Text
+
+    conf = ASR_CONFIGS[name]
+    args = make_asr_args(conf['args'], opts.input_dim, opts.vocab)
+    model = Speech2Text(args)
+    model.eval()
+    logger.info('%s: %.2f M parameters' % (name, model.total_parameters / 1000000))
+
+    bs, xmax = opts.batch_size, opts.xmax
+    xs = [np.random.randn(xmax, opts.input_dim).astype(np.float32) for _ in range(bs)]
+    audio_sec = bs * xmax * opts.frame_shift / 1000
+    results = []
+
+    with torch.no_grad():
+        elapsed, outputs = measure(lambda: model.encode(xs, 'ys'), opts.n_iters, opts.n_warmup)
+        results.append(('encode', summarize(elapsed, n_frames=bs * xmax * len(elapsed),
+                                            audio_sec=audio_sec * len(elapsed))))
+
+        eout_dict = outputs[-1]
+        for search_name, search_params in conf['searches'].items():
+            params = vars(args).copy()
+            params.update(search_params)
+            elapsed, outputs = measure(lambda: search(model, eout_dict, params), opts.n_iters, opts.n_warmup)
+            n_tokens = sum([len(hyp) for hyps in outputs for hyp in hyps])
+            metrics = summarize(elapsed, n_tokens=n_tokens, audio_sec=audio_sec * len(elapsed))
+            metrics['n_tokens_per_utt'] = n_tokens / (bs * len(elapsed))
+            results.append(('search_' + search_name, metrics))
+    return results
+
+
+def benchmark_lm(name, opts):
+    from neural_sp.models.lm.build import build_lm
+
+    args = make_lm_args(LM_CONFIGS[name], opts.vocab)
+    lm = build_lm(args)
+    lm.eval()
+    logger.info('%s: %.2f M parameters' % (name, lm.total_parameters / 1000000))
+
+    bs, ymax = opts.batch_size, opts.lm_seq_len
+    ys = torch.randint(4, opts.vocab, (bs, ymax), dtype=torch.int64)
+    results = []
+
+    def generate():
+        y = ys[:, :1]
+        state = None
+        for _ in range(ymax):
+            _, state, log_probs = lm.predict(y, state)
+            y = log_probs[:, -1:].argmax(-1)
+
+    with torch.no_grad():
+        elapsed, _ = measure(lambda: lm.predict(ys, None), opts.n_iters, opts.n_warmup)
+        results.append(('score', summarize(elapsed, n_tokens=bs * ymax * len(elapsed))))
+        elapsed, _ = measure(generate, opts.n_iters, opts.n_warmup)
+        metrics = summarize(elapsed, n_tokens=bs * ymax * len(elapsed))
+        metrics['latency_per_token_ms'] = metrics['latency_ms']['mean'] / ymax
+        results.append(('generate', metrics))
+    return results
+
+
+def benchmark_dataset(name, opts):
+    import kaldiio
+    from neural_sp.datasets.asr import Dataset
+
+    data_dir = tempfile.mkdtemp()
+    try:
+        # synthetic features and transcriptions
+        rng = np.random.RandomState(opts.seed)
+        feats = {'utt%05d' % i: rng.randn(rng.randint(opts.xmax // 2, opts.xmax + 1),
+                                          opts.input_dim).astype(np.float32)
+                 for i in range(opts.n_utts)}
+        scp_path = os.path.join(data_dir, 'feats.scp')
+        kaldiio.save_ark(os.path.join(data_dir, 'feats.ark'), feats, scp=scp_path)
+        with codecs.open(scp_path, 'r', 'utf-8') as f:
+            feat_paths = dict(line.strip().split(' ') for line in f)
+        dict_path = os.path.join(data_dir, 'dict.txt')
+        with codecs.open(dict_path, 'w', 'utf-8') as f:
+            f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+            for i in range(4, opts.vocab):
+                f.write('w%d %d\n' % (i, i))
+        tsv_path = os.path.join(data_dir, 'train.tsv')
+        with codecs.open(tsv_path, 'w', 'utf-8') as f:
+            f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+            for utt_id, feat in feats.items():
+                token_id = rng.randint(4, opts.vocab, size=max(1, len(feat) // 10))
+                text = ' '.join(['w%d' % i for i in token_id])
+                f.write('\t'.join([utt_id, utt_id[:4], feat_paths[utt_id], str(len(feat)), str(opts.input_dim),
+                                   text, ' '.join(map(str, token_id)), str(len(token_id)),
+                                   str(opts.vocab)]) + '\n')
+
+        dataset = Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='word',
+                          batch_size=max(opts.batch_size, 8), n_epochs=opts.n_iters + opts.n_warmup,
+                          min_n_frames=1, max_n_frames=opts.xmax + 1, sort_by='input',
+                          short2long=True, **DATASET_CONFIGS[name])
+        n_frames = int(dataset.df['xlen'].sum())
+
+        def epoch():
+            for _, is_new_epoch in dataset:
+                if is_new_epoch:
+                    break
+        elapsed, _ = measure(epoch, opts.n_iters, opts.n_warmup)
+        dataset.close()
+        return [('epoch', summarize(elapsed, n_frames=n_frames * len(elapsed),
+                                    n_utts=len(dataset) * len(elapsed)))]
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def _peak_rss_mb():
+    # NOTE: ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_config(name, opts):
+    """Run all stages of a configuration.
+
+    Returns:
+        results (list): list of dict, one per stage
+
+    """
+    np.random.seed(opts.seed)
+    torch.manual_seed(opts.seed)
+    if opts.n_threads > 0:
+        torch.set_num_threads(opts.n_threads)
+    rss_start = _peak_rss_mb()
+
+    try:
+        if name in ASR_CONFIGS:
+            task, stages = 'asr', benchmark_asr(name, opts)
+        elif name in LM_CONFIGS:
+            task, stages = 'lm', benchmark_lm(name, opts)
+        elif name in DATASET_CONFIGS:
+            task, stages = 'dataset', benchmark_dataset(name, opts)
+        else:
+            raise ValueError(name)
+    except ImportError as e:
+        if (e.name or '').startswith('neural_sp'):
+            raise
+        # optional dependencies such as warpctc_pytorch are not installed
+        logger.warning('Skip %s: %s' % (name, e))
+        return [OrderedDict([('config', name), ('stage', None), ('skipped', str(e))])]
+
+    results = []
+    for stage, metrics in stages:
+        result = OrderedDict([('config', name), ('task', task), ('stage', stage)])
+        result.update(metrics)
+        result['peak_rss_mb'] = _peak_rss_mb()
+        result['peak_rss_increase_mb'] = result['peak_rss_mb'] - rss_start
+        results.append(result)
+    return results
+
+
+def _worker(name, opts, queue):
+    try:
+        queue.put((run_config(name, opts), None))
+    except Exception:
+        queue.put((None, traceback.format_exc()))
+
+
+def _run_isolated(name, opts):
+    """Run a configuration in a fresh (non-daemonic) process.
+
+    NOTE: multiprocessing.Pool cannot be used here because the dataset benchmark
+    spawns its own worker processes.
+
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    p = ctx.Process(target=_worker, args=(name, opts, queue))
+    p.start()
+    while True:
+        try:
+            results, error = queue.get(timeout=1)
+            break
+        except Empty:
+            if not p.is_alive():
+                raise RuntimeError('%s crashed with exit code %s' % (name, p.exitcode))
+    p.join()
+    if error is not None:
+        raise RuntimeError('%s failed in a subprocess:\n%s' % (name, error))
+    return results
+
+
+def run_benchmarks(names, opts):
+    """Run configurations (in a new process each if opts.isolate is set).
+
+    Returns:
+        report (dict): environment and results
+
+    """
+    results = []
+    for name in names:
+        logger.info('Run %s' % name)
+        if opts.isolate:
+            results += _run_isolated(name, opts)
+        else:
+            results += run_config(name, opts)
+
+    return OrderedDict([
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('torch', torch.__version__),
+            ('platform', platform.platform()),
+            ('processor', platform.processor()),
+            ('n_threads', opts.n_threads if opts.n_threads > 0 else torch.get_num_threads()),
+        ])),
+        ('options', OrderedDict([(k, getattr(opts, k)) for k in [
+            'batch_size', 'xmax', 'input_dim', 'frame_shift', 'vocab', 'lm_seq_len', 'n_utts',
+            'n_iters', 'n_warmup', 'seed']])),
+        ('results', results),
+    ])
+
+
+def compare(report, baseline, tolerance):
+    """Compare median latency of each stage with baseline results.
+
+    Args:
+        report (dict): current results
+        baseline (dict): baseline results
+        tolerance (float): relative increase of median latency regarded as a regression
+    Returns:
+        comparisons (list): list of dict
+        regressions (list): list of dict
+
+    """
+    baseline_results = {(r['config'], r['stage']): r for r in baseline['results'] if 'skipped' not in r}
+    if baseline.get('options') != report.get('options'):
+        logger.warning('Benchmark options are different from those of the baseline.')
+
+    comparisons, regressions = [], []
+    for r in report['results']:
+        key = (r['config'], r['stage'])
+        if 'skipped' in r or key not in baseline_results:
+            continue
+        base = baseline_results[key]['latency_ms']['p50']
+        ratio = r['latency_ms']['p50'] / max(base, 1e-12)
+        comparison = OrderedDict([('config', r['config']), ('stage', r['stage']),
+                                  ('baseline_p50_ms', base), ('p50_ms', r['latency_ms']['p50']),
+                                  ('ratio', ratio)])
+        comparisons.append(comparison)
+        if ratio > 1 + tolerance:
+            regressions.append(comparison)
+    return comparisons, regressions
+
+
+def select_configs(patterns):
+    names = []
+    for pattern in patterns.split(','):
+        matched = [name for name in all_configs() if fnmatch.fnmatch(name, pattern)]
+        if len(matched) == 0:
+            raise ValueError('Unknown configuration: %s' % pattern)
+        names += [name for name in matched if name not in names]
+    return names
+
+
+def print_report(report):
+    print('%-20s %-18s %10s %10s %10s %14s %14s %8s %10s' % (
+        'config', 'stage', 'p50[ms]', 'p90[ms]', 'p99[ms]', 'frames/sec', 'tokens/sec', 'RTF', 'peak[MB]'))
+    for r in report['results']:
+        if 'skipped' in r:
+            print('%-20s skipped (%s)' % (r['config'], r['skipped']))
+            continue
+        print('%-20s %-18s %10.1f %10.1f %10.1f %14s %14s %8s %10.1f' % (
+            r['config'], r['stage'],
+            r['latency_ms']['p50'], r['latency_ms']['p90'], r['latency_ms']['p99'],
+            '%.1f' % r['frames_per_sec'] if 'frames_per_sec' in r else '-',
+            '%.1f' % r['tokens_per_sec'] if 'tokens_per_sec' in r else '-',
+            '%.3f' % r['rtf'] if 'rtf' in r else '-',
+            r['peak_rss_mb']))
+
+
+def main():
+
+    opts = parse()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    if opts.list:
+        print('\n'.join(all_configs()))
+        return 0
+
+    report = run_benchmarks(select_configs(opts.configs), opts)
+    print_report(report)
+    if opts.out:
+        with codecs.open(opts.out, 'w', 'utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if opts.baseline:
+        with codecs.open(opts.baseline, 'r', 'utf-8') as f:
+            baseline = json.load(f)
+        comparisons, regressions = compare(report, baseline, opts.tolerance)
+        for c in comparisons:
+            print('%-20s %-18s %10.1f -> %10.1f ms (x%.2f)%s' % (
+                c['config'], c['stage'], c['baseline_p50_ms'], c['p50_ms'], c['ratio'],
+                ' REGRESSION' if c in regressions else ''))
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,6 +6,7 @@
 
 """Train the LM."""
 
+import contextlib
 import cProfile
 import logging
 import os
@@ -30,7 +31,17 @@ from neural_sp.evaluators.ppl import eval_ppl
 from neural_sp.models.data_parallel import CustomDataParallel
 from neural_sp.models.data_parallel import CPUWrapperLM
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.modules.attention_capture import AttentionCapture
+from neural_sp.trainers.checkpoint import CheckpointWriter
+from neural_sp.trainers.distributed import (
+    broadcast_object,
+    get_local_rank,
+    init_distributed,
+    reduce_observation,
+    wrap_ddp
+)
 from neural_sp.trainers.lr_scheduler import LRScheduler
+from neural_sp.trainers.mixed_precision import MixedPrecision
 from neural_sp.trainers.optimizer import set_optimizer
 from neural_sp.trainers.reporter import Reporter
 from neural_sp.utils import mkdir_join
@@ -52,8 +63,21 @@ def main():
             if k != 'resume':
                 setattr(args, k, v)
 
+    # Set process group for distributed training
+    rank, world_size = 0, 1
+    if args.distributed:
+        assert args.n_gpus <= 1, 'Use one GPU per process in distributed training.'
+        rank, world_size = init_distributed(args.dist_backend, args.dist_init_method)
+        if args.n_gpus >= 1:
+            torch.cuda.set_device(get_local_rank())
+    is_main = rank == 0
+
     # Load dataset
-    batch_size = args.batch_size * args.n_gpus if args.n_gpus >= 1 else args.batch_size
+    if args.distributed:
+        # NOTE: each process takes its rows of global mini-batches
+        batch_size = args.batch_size * world_size
+    else:
+        batch_size = args.batch_size * args.n_gpus if args.n_gpus >= 1 else args.batch_size
     train_set = Dataset(corpus=args.corpus,
                         tsv_path=args.train_set,
                         dict_path=args.dict,
@@ -66,7 +90,14 @@ def main():
                         bptt=args.bptt,
                         shuffle=args.shuffle,
                         backward=args.backward,
-                        serialize=args.serialize)
+                        serialize=args.serialize,
+                        manifest_cache_dir=args.manifest_cache_dir,
+                        streaming=args.streaming_corpus,
+                        stream_block_size=args.stream_block_size,
+                        variable_bptt=args.variable_bptt,
+                        seed=args.seed,
+                        rank=rank,
+                        world_size=world_size)
     dev_set = Dataset(corpus=args.corpus,
                       tsv_path=args.dev_set,
                       dict_path=args.dict,
@@ -76,7 +107,8 @@ def main():
                       batch_size=batch_size,
                       bptt=args.bptt,
                       backward=args.backward,
-                      serialize=args.serialize)
+                      serialize=args.serialize,
+                      manifest_cache_dir=args.manifest_cache_dir)
     eval_sets = [Dataset(corpus=args.corpus,
                          tsv_path=s,
                          dict_path=args.dict,
@@ -86,7 +118,8 @@ def main():
                          batch_size=1,
                          bptt=args.bptt,
                          backward=args.backward,
-                         serialize=args.serialize) for s in args.eval_sets]
+                         serialize=args.serialize,
+                         manifest_cache_dir=args.manifest_cache_dir) for s in args.eval_sets]
 
     args.vocab = train_set.vocab
 
@@ -96,17 +129,21 @@ def main():
         dir_name = os.path.basename(save_path)
     else:
         dir_name = set_lm_name(args)
-        save_path = mkdir_join(args.model_save_dir, '_'.join(
-            os.path.basename(args.train_set).split('.')[:-1]), dir_name)
-        save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = None
+        if is_main:
+            save_path = mkdir_join(args.model_save_dir, '_'.join(
+                os.path.basename(args.train_set).split('.')[:-1]), dir_name)
+            save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = broadcast_object(save_path)
 
     # Set logger
-    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
+    if is_main:
+        set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
 
     # Model setting
     model = build_lm(args, save_path)
 
-    if not args.resume:
+    if not args.resume and is_main:
         # Save the conf file as a yaml file
         save_config(vars(args), os.path.join(save_path, 'conf.yml'))
 
@@ -152,8 +189,8 @@ def main():
                             save_checkpoints_topk=10 if is_transformer else 1)
 
     if args.resume:
-        # Restore the last saved model
-        load_checkpoint(args.resume, model, optimizer)
+        # Restore the last saved model and the position in the training set
+        load_checkpoint(args.resume, model, optimizer, dataset=train_set)
 
         # Resume between convert_to_sgd_epoch -1 and convert_to_sgd_epoch
         if resume_epoch == args.convert_to_sgd_epoch:
@@ -162,7 +199,14 @@ def main():
 
     # GPU setting
     use_apex = args.train_dtype in ["O0", "O1", "O2", "O3"]
+    use_amp = args.train_dtype in ["float16", "bfloat16"]
     amp = None
+    if use_amp:
+        # Native mixed precision training setting
+        assert args.n_gpus >= 1 or args.train_dtype == 'bfloat16', 'Use bfloat16 for CPUs.'
+        amp = MixedPrecision(args.train_dtype, 'cuda' if args.n_gpus >= 1 else 'cpu')
+        if args.resume:
+            load_checkpoint(args.resume, amp=amp)
     if args.n_gpus >= 1:
         model.cudnn_setting(deterministic=not (is_transformer or args.cudnn_benchmark),
                             benchmark=not is_transformer and args.cudnn_benchmark)
@@ -176,7 +220,12 @@ def main():
             amp.init()
             if args.resume:
                 load_checkpoint(args.resume, amp=amp)
-        model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+        if args.distributed:
+            model = wrap_ddp(model, get_local_rank(), args.ddp_bucket_cap_mb)
+        else:
+            model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+    elif args.distributed:
+        model = wrap_ddp(model, None, args.ddp_bucket_cap_mb)
     else:
         model = CPUWrapperLM(model)
 
@@ -187,7 +236,13 @@ def main():
     setproctitle(args.job_name if args.job_name else dir_name)
 
     # Set reporter
-    reporter = Reporter(save_path)
+    reporter = Reporter(save_path, enabled=is_main,
+                        asynchronous=args.async_plot, min_interval=args.plot_min_interval)
+
+    # Set checkpoint writer
+    ckpt_writer = CheckpointWriter(asynchronous=args.async_checkpoint,
+                                   max_in_flight=args.checkpoint_max_in_flight,
+                                   split_optimizer=args.save_optimizer_separately)
 
     hidden = None
     start_time_train = time.time()
@@ -196,7 +251,7 @@ def main():
     accum_n_steps = 0
     n_steps = optimizer.n_steps * args.accum_grad_n_steps
     for ep in range(resume_epoch, args.n_epochs):
-        pbar_epoch = tqdm(total=len(train_set))
+        pbar_epoch = tqdm(total=len(train_set), disable=not is_main)
 
         for ys_train, is_new_epoch in train_set:
             # Compute loss in the training set
@@ -204,38 +259,56 @@ def main():
 
             if accum_n_steps == 1:
                 loss_train = 0  # moving average over gradient accumulation
-            loss, hidden, observation = model(ys_train, hidden)
+            is_update = accum_n_steps >= args.accum_grad_n_steps or is_new_epoch
+            # NOTE: gradients are all-reduced only before parameter updates
+            with model.no_sync() if args.distributed and not is_update else contextlib.nullcontext():
+                with amp.autocast() if use_amp else contextlib.nullcontext():
+                    loss, hidden, observation = model(ys_train, hidden)
+                if use_apex:
+                    with amp.scale_loss(loss, optimizer.optimizer) as scaled_loss:
+                        scaled_loss.backward()
+                elif use_amp:
+                    amp.backward(loss)
+                else:
+                    loss.backward()
+            if args.distributed:
+                observation = reduce_observation(observation, loss.device)
             reporter.add(observation)
-            if use_apex:
-                with amp.scale_loss(loss, optimizer.optimizer) as scaled_loss:
-                    scaled_loss.backward()
-            else:
-                loss.backward()
             loss.detach()  # Trancate the graph
             loss_train = (loss_train * (accum_n_steps - 1) + loss.item()) / accum_n_steps
-            if accum_n_steps >= args.accum_grad_n_steps or is_new_epoch:
+            if is_update:
                 if args.clip_grad_norm > 0:
+                    if use_amp:
+                        amp.unscale_(optimizer.optimizer)
                     total_norm = torch.nn.utils.clip_grad_norm_(
                         model.module.parameters(), args.clip_grad_norm)
                     reporter.add_tensorboard_scalar('total_norm', total_norm)
-                optimizer.step()
+                optimizer.step(amp if use_amp else None)
+                if use_amp:
+                    reporter.add_tensorboard_scalar('loss_scale', amp.scale)
                 optimizer.zero_grad()
                 accum_n_steps = 0
                 # NOTE: parameters are forcibly updated at the end of every epoch
             del loss
             hidden = model.module.repackage_state(hidden)
 
-            pbar_epoch.update(ys_train.shape[0] * (ys_train.shape[1] - 1))
+            pbar_epoch.update(ys_train.shape[0] * (ys_train.shape[1] - 1) * world_size)
             reporter.add_tensorboard_scalar('learning_rate', optimizer.lr)
             # NOTE: loss/acc/ppl are already added in the model
             reporter.step()
             n_steps += 1
             # NOTE: n_steps is different from the step counter in Noam Optimizer
 
-            if n_steps % args.print_step == 0:
+            if n_steps % args.print_step == 0 and is_main:
                 # Compute loss in the dev set
                 ys_dev = iter(dev_set).next(bptt=args.bptt)[0]
-                loss, _, observation = model(ys_dev, None, is_eval=True)
+                # Record attention weights of the last utterance for plotting
+                if n_steps % (args.print_step * 10) == 0:
+                    model.module.capture_attention(AttentionCapture(utterances=[-1]))
+                # NOTE: bypass DDP not to wait for the other processes
+                with amp.autocast() if use_amp else contextlib.nullcontext():
+                    loss, _, observation = (model.module if args.distributed else model)(ys_dev, None, is_eval=True)
+                model.module.capture_attention(None)
                 reporter.add(observation, is_eval=True)
                 loss_dev = loss.item()
                 del loss
@@ -249,9 +322,9 @@ def main():
                 start_time_step = time.time()
 
             # Save fugures of loss and accuracy
-            if n_steps % (args.print_step * 10) == 0:
+            if n_steps % (args.print_step * 10) == 0 and is_main:
                 reporter.snapshot()
-                model.module.plot_attention()
+                model.module.plot_attention(worker=reporter.worker)
 
             if is_new_epoch:
                 break
@@ -266,24 +339,32 @@ def main():
             reporter.epoch()  # plot
 
             # Save the model
-            optimizer.save_checkpoint(
-                model, save_path, remove_old=not is_transformer, amp=amp)
+            if is_main:
+                optimizer.save_checkpoint(
+                    model, save_path, remove_old=not is_transformer, amp=amp,
+                    writer=ckpt_writer, dataset=train_set)
         else:
             start_time_eval = time.time()
             # dev
-            model.module.reset_length(args.bptt)
-            ppl_dev, _ = eval_ppl([model.module], dev_set,
-                                  batch_size=1, bptt=args.bptt)
-            model.module.reset_length(args.bptt)
+            ppl_dev = None
+            if is_main:
+                model.module.reset_length(args.bptt)
+                ppl_dev, _ = eval_ppl([model.module], dev_set,
+                                      batch_size=1, bptt=args.bptt)
+                model.module.reset_length(args.bptt)
+            # NOTE: the other processes wait for the main process here, and then
+            # all processes make the same decision on lr decay and early stopping
+            ppl_dev = broadcast_object(ppl_dev)
             optimizer.epoch(ppl_dev)  # lr decay
             reporter.epoch(ppl_dev, name='perplexity')  # plot
             logger.info('PPL (%s, ep:%d): %.2f' %
                         (dev_set.set, optimizer.n_epochs, ppl_dev))
 
-            if optimizer.is_topk or is_transformer:
+            if (optimizer.is_topk or is_transformer) and is_main:
                 # Save the model
                 optimizer.save_checkpoint(
-                    model, save_path, remove_old=not is_transformer, amp=amp)
+                    model, save_path, remove_old=not is_transformer, amp=amp,
+                    writer=ckpt_writer, dataset=train_set)
 
                 # test
                 ppl_test_avg = 0.
@@ -320,8 +401,11 @@ def main():
     duration_train = time.time() - start_time_train
     logger.info('Total time: %.2f hour' % (duration_train / 3600))
 
-    reporter.tf_writer.close()
+    ckpt_writer.close()
+    reporter.close()
     pbar_epoch.close()
+    if args.distributed:
+        torch.distributed.destroy_process_group()
 
     return save_path
 
@@ -330,4 +414,5 @@ if __name__ == '__main__':
     # Setting for profiling
     pr = cProfile.Profile()
     save_path = pr.runcall(main)
-    pr.dump_stats(os.path.join(save_path, 'train.profile'))
+    rank = int(os.environ.get('RANK', 0))
+    pr.dump_stats(os.path.join(save_path, 'train.profile' if rank == 0 else 'train.rank%d.profile' % rank))
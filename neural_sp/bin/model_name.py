@@ -85,8 +85,14 @@ def set_asr_model_name(args):
         dir_name += '_lr' + str(args.lr_factor)
     else:
         dir_name += '_lr' + str(args.lr)
-    dir_name += '_bs' + str(args.batch_size)
-    if args.train_dtype in ["O0", "O1", "O2", "O3"]:
+    if args.frame_budget > 0 or args.token_budget > 0:
+        if args.frame_budget > 0:
+            dir_name += '_frames' + str(args.frame_budget)
+        if args.token_budget > 0:
+            dir_name += '_tokens' + str(args.token_budget)
+    else:
+        dir_name += '_bs' + str(args.batch_size)
+    if args.train_dtype in ["O0", "O1", "O2", "O3", "float16", "bfloat16"]:
         dir_name += '_' + args.train_dtype
     # if args.shuffle_bucket:
     #     dir_name += '_bucket'
@@ -136,6 +142,8 @@ def set_asr_model_name(args):
         dir_name += '_tsl'
 
     # SpecAugment
+    if args.time_warp_width > 0:
+        dir_name += '_' + str(args.time_warp_width) + 'TW'
     if args.n_freq_masks > 0:
         dir_name += '_' + str(args.freq_width) + 'FM' + str(args.n_freq_masks)
     if args.n_time_masks > 0:
@@ -194,7 +202,7 @@ def set_lm_name(args):
     else:
         dir_name += '_lr' + str(args.lr)
     dir_name += '_bs' + str(args.batch_size)
-    if args.train_dtype in ["O0", "O1", "O2", "O3"]:
+    if args.train_dtype in ["O0", "O1", "O2", "O3", "float16", "bfloat16"]:
         dir_name += '_' + args.train_dtype
 
     dir_name += '_bptt' + str(args.bptt)
@@ -15,6 +15,8 @@ import time
 import torch
 import yaml
 
+from neural_sp.trainers.checkpoint import optimizer_checkpoint_path
+
 logger = logging.getLogger(__name__)
 
 
@@ -130,23 +132,34 @@ def set_save_path(save_path):
     return save_path_new
 
 
-def load_checkpoint(checkpoint_path, model=None, optimizer=None, amp=None):
+def load_checkpoint(checkpoint_path, model=None, optimizer=None, amp=None, dataset=None):
     """Load checkpoint.
 
     Args:
         checkpoint_path (str): path to the saved model (model..epoch-*)
         model (torch.nn.Module):
         optimizer (LRScheduler): optimizer wrapped by LRScheduler class
-        amp ():
+        amp (): state of mixed precision training (apex or MixedPrecision)
+        dataset (Dataset): training set to resume sampling mini-batches
     Returns:
         topk_list (list): list of (epoch, metric)
 
     """
+    # NOTE: the sampling state of datasets contains numpy arrays and RNG states
+    weights_only = dataset is None
     if os.path.isfile(checkpoint_path):
-        checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+        checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage,
+                                weights_only=weights_only)
     else:
         raise ValueError("No checkpoint found at %s" % checkpoint_path)
 
+    # Optimizer states saved separately
+    optimizer_path = optimizer_checkpoint_path(checkpoint_path)
+    load_optimizer_file = optimizer is not None or amp is not None or dataset is not None
+    if load_optimizer_file and os.path.isfile(optimizer_path):
+        checkpoint.update(torch.load(optimizer_path, map_location=lambda storage, loc: storage,
+                                     weights_only=weights_only))
+
     # Restore parameters
     if 'avg' not in checkpoint_path:
         epoch = int(os.path.basename(checkpoint_path).split('-')[-1]) - 1
@@ -166,14 +179,23 @@ def load_checkpoint(checkpoint_path, model=None, optimizer=None, amp=None):
     else:
         logger.warning('Optimizer is not loaded.')
 
-    # Restore apex
-    if amp is not None:
+    # Restore apex or loss scaling state
+    if amp is not None and 'amp_state_dict' in checkpoint.keys():
         amp.load_state_dict(checkpoint['amp_state_dict'])
     else:
         logger.warning('amp is not loaded.')
 
+    # Restore sampling state of the training set
+    if dataset is not None:
+        if 'dataset_state_dict' in checkpoint.keys():
+            dataset.load_state_dict(checkpoint['dataset_state_dict'])
+        else:
+            logger.warning('Dataset state is not loaded.')
+
     if 'optimizer_state_dict' in checkpoint.keys() and 'topk_list' in checkpoint['optimizer_state_dict'].keys():
         topk_list = checkpoint['optimizer_state_dict']['topk_list']
+    elif 'topk_list' in checkpoint.keys():
+        topk_list = checkpoint['topk_list']
     else:
         topk_list = []
     return topk_list
@@ -10,12 +10,18 @@
 """
 
 import codecs
-import kaldiio
+from collections import deque
+import logging
+import multiprocessing
 import numpy as np
 import os
-import pandas as pd
-import random
+import torch
 
+from neural_sp.datasets.feat_shard import load_feat
+from neural_sp.datasets.feat_shard import load_feats
+from neural_sp.datasets.manifest import filter_asr
+from neural_sp.datasets.manifest import load_manifests
+from neural_sp.datasets.sampler import EpochSampler
 from neural_sp.datasets.token_converter.character import Char2idx
 from neural_sp.datasets.token_converter.character import Idx2char
 from neural_sp.datasets.token_converter.phone import Idx2phone
@@ -25,9 +31,10 @@ from neural_sp.datasets.token_converter.word import Word2idx
 from neural_sp.datasets.token_converter.wordpiece import Idx2wp
 from neural_sp.datasets.token_converter.wordpiece import Wp2idx
 
-random.seed(1)
 np.random.seed(1)
 
+logger = logging.getLogger(__name__)
+
 
 def count_vocab_size(dict_path):
     vocab_count = 1  # for <blank>
@@ -38,6 +45,74 @@ def count_vocab_size(dict_path):
     return vocab_count
 
 
+# states shared by worker processes, set in `_init_worker`
+_worker_args = {}
+
+
+def _init_worker(token2idx, is_test, vocab_sub1, vocab_sub2):
+    _worker_args['token2idx'] = token2idx
+    _worker_args['is_test'] = is_test
+    _worker_args['vocab_sub1'] = vocab_sub1
+    _worker_args['vocab_sub2'] = vocab_sub2
+
+
+def _load_mini_batch(records):
+    """Create mini-batch in a worker process."""
+    return make_mini_batch(records, **_worker_args)
+
+
+def make_mini_batch(records, token2idx, is_test, vocab_sub1, vocab_sub2):
+    """Create mini-batch from records of the dataframe.
+
+    Args:
+        records (dict): values of each column in the current mini-batch
+            (token ids are given as int32 arrays)
+        token2idx (list): token <-> index converters
+        is_test (bool):
+        vocab_sub1 (int): vocabulary size for the 1st auxiliary task
+        vocab_sub2 (int): vocabulary size for the 2nd auxiliary task
+    Returns:
+        mini_batch_dict (dict): see `Dataset.__getitem__`
+
+    """
+    # inputs
+    xs = load_feats(records['feat_path'])
+
+    # main outputs
+    if is_test:
+        ys = [token2idx[0](t) for t in records['text']]
+    else:
+        ys = [t.tolist() for t in records['token_id']]
+
+    # sub1 outputs
+    ys_sub1 = []
+    if records['token_id_sub1'] is not None:
+        ys_sub1 = [t.tolist() for t in records['token_id_sub1']]
+    elif vocab_sub1 > 0 and not is_test:
+        ys_sub1 = [token2idx[1](t) for t in records['text']]
+
+    # sub2 outputs
+    ys_sub2 = []
+    if records['token_id_sub2'] is not None:
+        ys_sub2 = [t.tolist() for t in records['token_id_sub2']]
+    elif vocab_sub2 > 0 and not is_test:
+        ys_sub2 = [token2idx[2](t) for t in records['text']]
+
+    mini_batch_dict = {
+        'xs': xs,
+        'xlens': records['xlen'],
+        'ys': ys,
+        'ys_sub1': ys_sub1,
+        'ys_sub2': ys_sub2,
+        'utt_ids': records['utt_id'],
+        'speakers': records['speaker'],
+        'sessions': records['session'],
+        'text': records['text'],
+        'feat_path': records['feat_path'],  # for plot
+    }
+    return mini_batch_dict
+
+
 class Dataset(object):
 
     def __init__(self, tsv_path, dict_path,
@@ -52,7 +127,10 @@ class Dataset(object):
                  wp_model=False, wp_model_sub1=False, wp_model_sub2=False,
                  ctc=False, ctc_sub1=False, ctc_sub2=False,
                  subsample_factor=1, subsample_factor_sub1=1, subsample_factor_sub2=1,
-                 discourse_aware=False, first_n_utterances=-1):
+                 discourse_aware=False, first_n_utterances=-1,
+                 n_workers=0, n_prefetch=2, pin_memory=False,
+                 frame_budget=0, token_budget=0, seed=None, manifest_cache_dir=False,
+                 rank=0, world_size=1):
         """A class for loading dataset.
 
         Args:
@@ -80,13 +158,30 @@ class Dataset(object):
             corpus (str): name of corpus
             discourse_aware (bool):
             first_n_utterances (int): evaluate the first N utterances
+            n_workers (int): number of worker processes to create mini-batches
+                in the background. 0 means creating mini-batches in the main process.
+            n_prefetch (int): number of mini-batches prefetched per worker
+            pin_memory (bool): copy input features into pinned memory
+            frame_budget (int): maximum number of padded input frames per mini-batch.
+                Utterances of similar lengths are gathered until the budget is exceeded.
+                batch_size and dynamic_batching are ignored when this or token_budget is set.
+            token_budget (int): maximum number of padded output tokens per mini-batch
+            seed (int): random seed for sampling mini-batches.
+                If None, the seed is drawn from the global random number generator of numpy.
+            manifest_cache_dir (str): directory to cache filtered manifests.
+                Caching is disabled if False.
+            rank (int): rank of this process in distributed training
+            world_size (int): number of processes in distributed training.
+                Mini-batches (of the global batch size) are sampled identically in all
+                processes, and each process loads only its shard. The seed (or the
+                global random state of numpy if seed is None) must be shared.
 
         """
         super(Dataset, self).__init__()
 
         self.epoch = 0
         self.iteration = 0
-        self.offset = 0
+        self.sampler = EpochSampler(seed, rank, world_size)
 
         self.set = os.path.basename(tsv_path).split('.')[0]
         self.is_test = is_test
@@ -100,11 +195,28 @@ class Dataset(object):
         self.sort_stop_epoch = sort_stop_epoch
         self.sort_by = sort_by
         assert sort_by in ['input', 'output', 'shuffle', 'utt_id']
+        self.short2long = short2long
         self.dynamic_batching = dynamic_batching
         self.corpus = corpus
         self.discourse_aware = discourse_aware
         if discourse_aware:
             assert not is_test
+            assert world_size == 1
+        self.frame_budget = frame_budget
+        self.token_budget = token_budget
+        self.budget_batching = frame_budget > 0 or token_budget > 0
+
+        # for padding efficiency (= non-padded frames / padded frames) in the current epoch
+        self.n_frames_epoch = 0
+        self.n_padded_frames_epoch = 0
+        self._reset_padding_stats = False
+
+        # for asynchronous mini-batch creation
+        self.n_workers = n_workers
+        self.n_prefetch = n_prefetch
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self._pool = None
+        self._queue = deque()  # pending mini-batches in the sampled order
 
         self.vocab = count_vocab_size(dict_path)
         self.eos = 2
@@ -154,67 +266,30 @@ class Dataset(object):
                 setattr(self, 'vocab_sub' + str(i), -1)
 
         # Load dataset tsv file
-        df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
-        df = df.loc[:, ['utt_id', 'speaker', 'feat_path',
-                        'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
-        for i in range(1, 3):
-            if locals()['tsv_path_sub' + str(i)]:
-                df_sub = pd.read_csv(locals()['tsv_path_sub' + str(i)], encoding='utf-8', delimiter='\t')
-                df_sub = df_sub.loc[:, ['utt_id', 'speaker', 'feat_path',
-                                        'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
-                setattr(self, 'df_sub' + str(i), df_sub)
-            else:
-                setattr(self, 'df_sub' + str(i), None)
-        self.input_dim = kaldiio.load_mat(df['feat_path'][0]).shape[-1]
-
-        # Remove inappropriate utterances
-        if is_test or discourse_aware:
-            print('Original utterance num: %d' % len(df))
-            n_utts = len(df)
-            df = df[df.apply(lambda x: x['ylen'] > 0, axis=1)]
-            print('Removed %d empty utterances' % (n_utts - len(df)))
-            if first_n_utterances > 0:
-                n_utts = len(df)
-                df = df[df.apply(lambda x: x['ylen'] > 0, axis=1)]
-                df = df.truncate(before=0, after=first_n_utterances - 1)
-                print('Select first %d utterances' % len(df))
-        else:
-            print('Original utterance num: %d' % len(df))
-            n_utts = len(df)
-            df = df[df.apply(lambda x: min_n_frames <= x[
-                'xlen'] <= max_n_frames, axis=1)]
-            df = df[df.apply(lambda x: x['ylen'] > 0, axis=1)]
-            print('Removed %d utterances (threshold)' % (n_utts - len(df)))
-
-            if ctc and subsample_factor > 1:
-                n_utts = len(df)
-                df = df[df.apply(lambda x: x['ylen'] <= (x['xlen'] // subsample_factor), axis=1)]
-                print('Removed %d utterances (for CTC)' % (n_utts - len(df)))
-
-            for i in range(1, 3):
-                df_sub = getattr(self, 'df_sub' + str(i))
-                ctc_sub = locals()['ctc_sub' + str(i)]
-                subsample_factor_sub = locals()['subsample_factor_sub' + str(i)]
-                if df_sub is not None:
-                    if ctc_sub and subsample_factor_sub > 1:
-                        df_sub = df_sub[df_sub.apply(
-                            lambda x: x['ylen'] <= (x['xlen'] // subsample_factor_sub), axis=1)]
-
-                    if len(df) != len(df_sub):
-                        n_utts = len(df)
-                        df = df.drop(df.index.difference(df_sub.index))
-                        print('Removed %d utterances (for CTC, sub%d)' % (n_utts - len(df), i))
-                        for j in range(1, i + 1):
-                            setattr(self, 'df_sub' + str(j),
-                                    getattr(self, 'df_sub' + str(j)).drop(getattr(self, 'df_sub' + str(j)).index.difference(df.index)))
+        (df, df_sub1, df_sub2), self.labels = load_manifests(
+            [tsv_path, tsv_path_sub1, tsv_path_sub2], filter_asr,
+            dict(is_test=is_test, discourse_aware=discourse_aware,
+                 min_n_frames=min_n_frames, max_n_frames=max_n_frames,
+                 first_n_utterances=first_n_utterances,
+                 ctc=ctc, ctc_sub1=ctc_sub1, ctc_sub2=ctc_sub2,
+                 subsample_factor=subsample_factor,
+                 subsample_factor_sub1=subsample_factor_sub1,
+                 subsample_factor_sub2=subsample_factor_sub2),
+            cache_dir=manifest_cache_dir, labels=True)
+        # NOTE: token ids are read from label stores (self.labels) through `label_row`
+        df, df_sub1, df_sub2 = [None if df_i is None else df_i.drop(columns='token_id').assign(
+            label_row=np.arange(len(df_i))) for df_i in [df, df_sub1, df_sub2]]
+        self.df_sub1 = df_sub1
+        self.df_sub2 = df_sub2
+        self.input_dim = load_feat(df['feat_path'].values[0]).shape[-1]
 
         if corpus == 'swbd':
             # 1. serialize
-            # df['session'] = df['speaker'].apply(lambda x: str(x).split('-')[0])
+            # df['session'] = df['speaker'].astype(str).str.split('-').str[0]
             # 2. not serialize
-            df['session'] = df['speaker'].apply(lambda x: str(x))
+            df['session'] = df['speaker'].astype(str)
         else:
-            df['session'] = df['speaker'].apply(lambda x: str(x))
+            df['session'] = df['speaker'].astype(str)
 
         # Sort tsv records
         if discourse_aware:
@@ -252,8 +327,6 @@ class Dataset(object):
                 df = df.sort_values(by=['xlen'], ascending=short2long)
             elif sort_by == 'output':
                 df = df.sort_values(by=['ylen'], ascending=short2long)
-            elif sort_by == 'shuffle':
-                df = df.reindex(np.random.permutation(self.df.index))
 
         # Re-indexing
         if discourse_aware:
@@ -269,25 +342,39 @@ class Dataset(object):
                     setattr(self, 'df_sub' + str(i),
                             getattr(self, 'df_sub' + str(i)).reindex(df.index).reset_index())
 
-        if discourse_aware:
-            self.df_indices_buckets = self.discourse_bucketing(batch_size)
-        elif shuffle_bucket:
-            self.df_indices_buckets = self.shuffle_bucketing(batch_size)
-        else:
-            self.df_indices = list(self.df.index)
+        # order of utterances sampled in each epoch (shuffled after sort_stop_epoch)
+        self.order = np.arange(len(self.df))
+        if sort_by == 'shuffle' and not (is_test or discourse_aware):
+            self.order = self.sampler.permutation(len(self.df))
+        self._init_sampler(batch_size)
 
     def __len__(self):
         return len(self.df)
 
+    @property
+    def offset(self):
+        """Number of utterances sampled in the current epoch."""
+        return self.sampler.cursor
+
     @property
     def epoch_detail(self):
         """Percentage of the current epoch."""
+        if len(self._queue) > 0:
+            # exclude prefetched mini-batches that have not been consumed yet
+            return self._queue[0]['state']['offset'] / len(self)
         return self.offset / len(self)
 
     @property
     def n_frames(self):
         return self.df['xlen'].sum()
 
+    @property
+    def padding_efficiency(self):
+        """Ratio of non-padded input frames to padded ones in the current epoch."""
+        if self.n_padded_frames_epoch == 0:
+            return 1.
+        return self.n_frames_epoch / self.n_padded_frames_epoch
+
     def reset(self, batch_size=None):
         """Reset data counter and offset.
 
@@ -298,13 +385,32 @@ class Dataset(object):
         if batch_size is None:
             batch_size = self.batch_size
 
+        self._init_sampler(batch_size)
+        self._queue.clear()
+
+    def _init_sampler(self, batch_size):
+        """Start sampling a new epoch.
+
+            Args:
+                batch_size (int): size of mini-batch
+
+        """
         if self.discourse_aware:
-            self.df_indices_buckets = self.discourse_bucketing(batch_size)
+            self.sampler.set_buckets(self.discourse_bucketing(batch_size))
+        elif self.budget_batching:
+            self.sampler.set_buckets(self.budget_bucketing())
         elif self.shuffle_bucket:
-            self.df_indices_buckets = self.shuffle_bucketing(batch_size)
+            self.sampler.set_buckets(self.shuffle_bucketing(batch_size))
         else:
-            self.df_indices = list(self.df.index)
-        self.offset = 0
+            self.sampler.set_order(self.order)
+
+    def close(self):
+        """Terminate worker processes."""
+        self._queue.clear()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
 
     def __iter__(self):
         return self
@@ -328,80 +434,151 @@ class Dataset(object):
         if self.epoch >= self.n_epochs:
             raise StopIteration
 
-        indices, is_new_epoch = self.sample_index(batch_size)
-        mini_batch = self.__getitem__(indices)
+        if self.n_workers > 0:
+            mini_batch, is_new_epoch = self._next_async(batch_size)
+        else:
+            indices, is_new_epoch = self.sample_index(batch_size)
+            mini_batch = self.__getitem__(indices)
+
+        if self._reset_padding_stats:
+            self.n_frames_epoch = 0
+            self.n_padded_frames_epoch = 0
+            self._reset_padding_stats = False
+        self.n_frames_epoch += sum(mini_batch['xlens'])
+        self.n_padded_frames_epoch += max(mini_batch['xlens']) * len(mini_batch['xlens'])
 
         if is_new_epoch:
+            logger.info('Padding efficiency (%s, ep:%d): %.3f' % (self.set, self.epoch, self.padding_efficiency))
+            self._reset_padding_stats = True
+
             # shuffle the whole data
             if self.epoch + 1 == self.sort_stop_epoch:
                 self.sort_by = 'shuffle'
-                self.df = self.df.reindex(np.random.permutation(self.df.index))
-                for i in range(1, 3):
-                    if getattr(self, 'df_sub' + str(i)) is not None:
-                        setattr(self, 'df_sub' + str(i),
-                                getattr(self, 'df_sub' + str(i)).reindex(self.df.index).reset_index())
-
-                # Re-indexing
-                self.df = self.df.reset_index()
+                self.order = self.sampler.permutation(len(self))
 
             self.reset()
             self.epoch += 1
 
         return mini_batch, is_new_epoch
 
+    def _next_async(self, batch_size):
+        """Pop the oldest mini-batch created by worker processes.
+
+        Mini-batch indices are sampled in the main process in the same order as
+        the synchronous mode, and only the creation of mini-batches is delegated
+        to workers. Sampling does not go beyond the end of the current epoch,
+        so that the epoch transition in `__next__` is kept as it is.
+
+        Args:
+            batch_size (int): size of mini-batch
+        Returns:
+            mini_batch (dict):
+            is_new_epoch (bool): flag for the end of the current epoch
+
+        """
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self.n_workers, initializer=_init_worker,
+                initargs=(self.token2idx, self.is_test, self.vocab_sub1, self.vocab_sub2))
+
+        if len(self._queue) > 0 and self._queue[0]['batch_size'] != batch_size:
+            # discard prefetched mini-batches and re-sample with the new batch size
+            self.load_state_dict(self._queue[0]['state'])
+
+        self._prefetch(batch_size)
+        item = self._queue.popleft()
+        if not item['is_new_epoch']:
+            # keep workers busy while consuming this mini-batch
+            self._prefetch(batch_size)
+
+        mini_batch = item['result'].get()
+        if self.pin_memory:
+            mini_batch['xs'] = [torch.from_numpy(x).pin_memory() for x in mini_batch['xs']]
+        return mini_batch, item['is_new_epoch']
+
+    def _prefetch(self, batch_size):
+        """Sample mini-batch indices and submit them to worker processes.
+
+        Args:
+            batch_size (int): size of mini-batch
+
+        """
+        while len(self._queue) < self.n_workers * self.n_prefetch:
+            if len(self._queue) > 0 and self._queue[-1]['is_new_epoch']:
+                break
+            state = self._sampler_state()
+            indices, is_new_epoch = self.sample_index(batch_size)
+            result = self._pool.apply_async(_load_mini_batch, (self.get_records(indices),))
+            self._queue.append({'result': result,
+                                'is_new_epoch': is_new_epoch,
+                                'batch_size': batch_size,
+                                'state': state})
+
+    def _sampler_state(self):
+        return {'epoch': self.epoch,
+                'offset': self.offset,
+                'sort_by': self.sort_by,
+                'order': self.order,
+                'sampler': self.sampler.state_dict()}
+
+    def state_dict(self):
+        """Snapshot of the sampler state.
+
+        The position of the next mini-batch to be consumed is saved (prefetched
+        mini-batches are excluded), so that loading this resumes sampling
+        from the middle of an epoch without replaying it.
+
+        """
+        if len(self._queue) > 0:
+            return self._queue[0]['state']
+        return self._sampler_state()
+
+    def load_state_dict(self, state):
+        """Restore the sampler state.
+
+        Args:
+            state (dict): snapshot created by `state_dict`
+
+        """
+        self.epoch = state['epoch']
+        self.sort_by = state['sort_by']
+        self.order = state['order']
+        self.sampler.load_state_dict(state['sampler'])
+        # prefetched mini-batches are discarded
+        self._queue.clear()
+
     def sample_index(self, batch_size):
         """Sample data indices of mini-batch.
 
         Args:
             batch_size (int): size of mini-batch
         Returns:
-            indices (np.ndarray): indices of dataframe in the current mini-batch
+            indices (list): indices of dataframe in the current mini-batch
             is_new_epoch (bool): flag for the end of the current epoch
 
         """
         is_new_epoch = False
 
-        if self.discourse_aware:
-            indices = self.df_indices_buckets.pop(0)
-            self.offset += len(indices)
-            is_new_epoch = (len(self.df_indices_buckets) == 0)
-
-        elif self.shuffle_bucket:
-            indices = self.df_indices_buckets.pop(0)
-            self.offset += len(indices)
-            is_new_epoch = (len(self.df_indices_buckets) == 0)
-
-            # Shuffle uttrances in mini-batch
-            indices = random.sample(indices, len(indices))
+        if self.sampler.bucketing:
+            indices = self.sampler.next_bucket()
+            is_new_epoch = self.sampler.is_exhausted()
+            if self.discourse_aware:
+                return indices.tolist(), is_new_epoch
         else:
-            if len(self.df_indices) > batch_size:
-                # Change batch size dynamically
-                min_xlen = self.df[self.offset:self.offset + 1]['xlen'].values[0]
-                min_ylen = self.df[self.offset:self.offset + 1]['ylen'].values[0]
-                batch_size = self.set_batch_size(batch_size, min_xlen, min_ylen)
-
-                indices = list(self.df[self.offset:self.offset + batch_size].index)
-                self.offset += len(indices)
+            # Change batch size dynamically
+            i = self.sampler.peek()
+            _batch_size = self.set_batch_size(batch_size, self.df['xlen'].values[i], self.df['ylen'].values[i])
+            if self.sampler.n_remaining > batch_size:
+                indices = self.sampler.take(_batch_size)
             else:
                 # Last mini-batch
-                indices = self.df_indices[:]
-                self.offset = len(self)
-                is_new_epoch = True
-
-                # Change batch size dynamically
-                min_xlen = self.df[indices[0]:indices[0] + 1]['xlen'].values[0]
-                min_ylen = self.df[indices[0]:indices[0] + 1]['ylen'].values[0]
-                batch_size = self.set_batch_size(batch_size, min_xlen, min_ylen)
-
+                indices = self.sampler.take(_batch_size)
                 # Remove the rest
-                indices = indices[:batch_size]
-
-            # Shuffle uttrances in mini-batch
-            indices = random.sample(indices, len(indices))
-
-            for i in indices:
-                self.df_indices.remove(i)
+                self.sampler.skip()
+                is_new_epoch = True
 
+        # Shuffle uttrances in mini-batch
+        indices = self.sampler.shard(self.sampler.permutation(indices)).tolist()
         return indices, is_new_epoch
 
     def __getitem__(self, indices):
@@ -421,48 +598,27 @@ class Dataset(object):
                 sessions (list): name of each session
 
         """
-        # inputs
-        xs = [kaldiio.load_mat(self.df['feat_path'][i]) for i in indices]
-        xlens = [self.df['xlen'][i] for i in indices]
-        utt_ids = [self.df['utt_id'][i] for i in indices]
-        speakers = [self.df['speaker'][i] for i in indices]
-        sessions = [self.df['session'][i] for i in indices]
-        texts = [self.df['text'][i] for i in indices]
-        feat_paths = [self.df['feat_path'][i] for i in indices]
-
-        # main outputs
-        if self.is_test:
-            ys = [self.token2idx[0](self.df['text'][i]) for i in indices]
-        else:
-            ys = [list(map(int, str(self.df['token_id'][i]).split())) for i in indices]
-
-        # sub1 outputs
-        ys_sub1 = []
-        if self.df_sub1 is not None:
-            ys_sub1 = [list(map(int, str(self.df_sub1['token_id'][i]).split())) for i in indices]
-        elif self.vocab_sub1 > 0 and not self.is_test:
-            ys_sub1 = [self.token2idx[1](self.df['text'][i]) for i in indices]
-
-        # sub2 outputs
-        ys_sub2 = []
-        if self.df_sub2 is not None:
-            ys_sub2 = [list(map(int, str(self.df_sub2['token_id'][i]).split())) for i in indices]
-        elif self.vocab_sub2 > 0 and not self.is_test:
-            ys_sub2 = [self.token2idx[2](self.df['text'][i]) for i in indices]
-
-        mini_batch_dict = {
-            'xs': xs,
-            'xlens': xlens,
-            'ys': ys,
-            'ys_sub1': ys_sub1,
-            'ys_sub2': ys_sub2,
-            'utt_ids': utt_ids,
-            'speakers': speakers,
-            'sessions': sessions,
-            'text': texts,
-            'feat_path': feat_paths,  # for plot
-        }
-        return mini_batch_dict
+        return make_mini_batch(self.get_records(indices), self.token2idx, self.is_test,
+                               self.vocab_sub1, self.vocab_sub2)
+
+    def get_records(self, indices):
+        """Extract values of each column in the current mini-batch.
+
+        Args:
+            indices (np.ndarray): indices of dataframe in the current mini-batch
+        Returns:
+            records (dict):
+
+        """
+        records = {}
+        for k in ['feat_path', 'xlen', 'utt_id', 'speaker', 'session', 'text']:
+            records[k] = [self.df[k][i] for i in indices]
+        records['token_id'] = None if self.is_test else [self.labels[0][self.df['label_row'][i]] for i in indices]
+        for i in range(1, 3):
+            df_sub = getattr(self, 'df_sub' + str(i))
+            records['token_id_sub' + str(i)] = None if df_sub is None else [
+                self.labels[i][int(df_sub['label_row'][j])] for j in indices]
+        return records
 
     def set_batch_size(self, batch_size, min_xlen, min_ylen):
         if not self.dynamic_batching:
@@ -478,27 +634,60 @@ class Dataset(object):
         return max(1, batch_size)
 
     def shuffle_bucketing(self, batch_size):
-        df_indices_buckets = []  # list of list
+        xlens = self.df['xlen'].values
+        ylens = self.df['ylen'].values
+        df_indices_buckets = []  # list of array
         offset = 0
         while True:
-            min_xlen = self.df[offset:offset + 1]['xlen'].values[0]
-            min_ylen = self.df[offset:offset + 1]['ylen'].values[0]
-            _batch_size = self.set_batch_size(batch_size, min_xlen, min_ylen)
-            indices = list(self.df[offset:offset + _batch_size].index)
+            i = self.order[offset]
+            _batch_size = self.set_batch_size(batch_size, xlens[i], ylens[i])
+            indices = self.order[offset:offset + _batch_size]
             df_indices_buckets.append(indices)
             offset += len(indices)
             if offset + _batch_size >= len(self):
                 break
 
         # shuffle buckets
-        random.shuffle(df_indices_buckets)
+        self.sampler.shuffle(df_indices_buckets)
+        return df_indices_buckets
+
+    def budget_bucketing(self):
+        """Gather utterances of similar lengths under the budget of padded frames/tokens.
+
+        Returns:
+            df_indices_buckets (list): list of indices of dataframe in each mini-batch
+
+        """
+        df = self.df.sort_values(by=['xlen', 'ylen'], kind='mergesort')
+        xlens = df['xlen'].values
+        ylens = df['ylen'].values
+        indices = df.index.values
+
+        df_indices_buckets = []  # list of list
+        start = 0
+        xmax, ymax = 0, 0
+        for i in range(len(df)):
+            xmax, ymax = max(xmax, xlens[i]), max(ymax, ylens[i])
+            n_utts = i - start + 1
+            over_frames = self.frame_budget > 0 and n_utts * xmax > self.frame_budget
+            over_tokens = self.token_budget > 0 and n_utts * ymax > self.token_budget
+            if n_utts > 1 and (over_frames or over_tokens):
+                df_indices_buckets.append(indices[start:i].tolist())
+                start = i
+                xmax, ymax = xlens[i], ylens[i]
+        df_indices_buckets.append(indices[start:].tolist())
+
+        if self.shuffle_bucket or self.sort_by == 'shuffle':
+            self.sampler.shuffle(df_indices_buckets)
+        elif not self.short2long:
+            df_indices_buckets = df_indices_buckets[::-1]
         return df_indices_buckets
 
     def discourse_bucketing(self, batch_size):
         df_indices_buckets = []  # list of list
         session_groups = [(k, v) for k, v in self.df.groupby('n_utt_in_session').groups.items()]
         if self.shuffle_bucket:
-            random.shuffle(session_groups)
+            self.sampler.shuffle(session_groups)
         for n_utt, ids in session_groups:
             first_utt_ids = [i for i in ids if self.df['n_prev_utt'][i] == 0]
             for i in range(0, len(first_utt_ids), batch_size):
@@ -0,0 +1,169 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Packed feature shards read through memory mapping.
+
+   Feature matrices are concatenated in large binary files (*.shard), and each
+   shard has an index file (*.index.npz) containing the offset and shape of each
+   matrix. A matrix is referred to as `<shard_path>:<record number>`, which can
+   be used as feat_path in the dataset tsv file in place of Kaldi `ark:offset`.
+"""
+
+import kaldiio
+import numpy as np
+import os
+import re
+
+SHARD_SUFFIX = '.shard'
+INDEX_SUFFIX = '.index.npz'
+
+# shards opened in the current process
+_shards = {}
+
+
+def is_shard_path(feat_path):
+    """Return True if feat_path refers to a matrix in a feature shard."""
+    return feat_path.rsplit(':', 1)[0].endswith(SHARD_SUFFIX)
+
+
+def index_path(shard_path):
+    return shard_path[:-len(SHARD_SUFFIX)] + INDEX_SUFFIX
+
+
+class FeatShard(object):
+    """Reader of a single feature shard.
+
+    Args:
+        shard_path (str): path to a shard file
+
+    """
+
+    def __init__(self, shard_path):
+        index = np.load(index_path(shard_path))
+        self.offsets = index['offset']  # in the number of elements
+        self.xlens = index['xlen']
+        self.xdims = index['xdim']
+        self.dtype = np.dtype(str(index['dtype']))
+        # NOTE: copy-on-write mapping keeps slices writable without copying data
+        self.data = np.memmap(shard_path, dtype=self.dtype, mode='c')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        """Return a view of the i-th matrix of size `[xlen, xdim]`."""
+        start = self.offsets[i]
+        xlen, xdim = self.xlens[i], self.xdims[i]
+        return self.data[start:start + xlen * xdim].reshape(xlen, xdim)
+
+
+class FeatShardWriter(object):
+    """Writer of feature shards.
+
+    Args:
+        prefix (str): prefix of shard files. Shards are saved as <prefix>.<n>.shard
+        dtype (str): float16/float32
+        max_shard_size (int): maximum size of each shard in bytes
+
+    """
+
+    def __init__(self, prefix, dtype='float32', max_shard_size=2 ** 30):
+        assert dtype in ['float16', 'float32']
+        self.prefix = prefix
+        self.dtype = np.dtype(dtype)
+        self.max_shard_size = max_shard_size
+
+        self.n_shards = 0
+        self.f = None
+        self.shard_path = None
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _open(self):
+        self.shard_path = '%s.%d%s' % (self.prefix, self.n_shards, SHARD_SUFFIX)
+        self.f = open(self.shard_path, 'wb')
+        self.n_shards += 1
+        self.offset = 0
+        self.index = {'offset': [], 'xlen': [], 'xdim': []}
+
+    def write(self, feat):
+        """Append a feature matrix.
+
+        Args:
+            feat (np.ndarray): `[T, input_dim]`
+        Returns:
+            feat_path (str): path to refer to the matrix
+
+        """
+        assert feat.ndim == 2, feat.shape
+        if self.f is None or (self.offset > 0 and (self.offset + feat.size) * self.dtype.itemsize > self.max_shard_size):
+            self.close()
+            self._open()
+
+        self.f.write(np.ascontiguousarray(feat, dtype=self.dtype).tobytes())
+        self.index['offset'].append(self.offset)
+        self.index['xlen'].append(feat.shape[0])
+        self.index['xdim'].append(feat.shape[1])
+        self.offset += feat.size
+        return '%s:%d' % (self.shard_path, len(self.index['offset']) - 1)
+
+    def close(self):
+        """Flush the current shard and save its index."""
+        if self.f is None:
+            return
+        self.f.close()
+        np.savez(index_path(self.shard_path),
+                 offset=np.array(self.index['offset'], dtype=np.int64),
+                 xlen=np.array(self.index['xlen'], dtype=np.int64),
+                 xdim=np.array(self.index['xdim'], dtype=np.int64),
+                 dtype=np.array(self.dtype.name))
+        self.f = None
+
+
+def load_feat(feat_path):
+    """Load a feature matrix from a feature shard or a Kaldi ark file.
+
+    Args:
+        feat_path (str): <shard_path>:<record number> or Kaldi ark:offset
+    Returns:
+        feat (np.ndarray): `[T, input_dim]`
+
+    """
+    if not is_shard_path(feat_path):
+        return kaldiio.load_mat(feat_path)
+
+    shard_path, i = feat_path.rsplit(':', 1)
+    shard_path = os.path.abspath(shard_path)
+    if shard_path not in _shards:
+        _shards[shard_path] = FeatShard(shard_path)
+    return _shards[shard_path][int(i)]
+
+
+def _read_position(feat_path):
+    m = re.match(r'(.+?):(\d+)', feat_path)
+    if m is None:
+        return (feat_path, 0)
+    return (m.group(1), int(m.group(2)))
+
+
+def load_feats(feat_paths):
+    """Load feature matrices in the order of positions in each file.
+
+    Args:
+        feat_paths (list): feature paths in the current mini-batch
+    Returns:
+        feats (list): feature matrices in the original order
+
+    """
+    feats = [None] * len(feat_paths)
+    for i in sorted(range(len(feat_paths)), key=lambda i: _read_position(feat_paths[i])):
+        feats[i] = load_feat(feat_paths[i])
+    return feats
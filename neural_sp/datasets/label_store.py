@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Pre-tokenized label store.
+
+   Token ids in the `token_id` column of a dataset tsv file (space-separated
+   strings) are converted once into a flat int32 array of all tokens and an
+   int64 array of offsets of each utterance. Labels of an utterance are then
+   read as a zero-copy slice without parsing strings. The arrays can be saved
+   as *.tokens.npy and *.offsets.npy and loaded through memory mapping.
+"""
+
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+TOKENS_SUFFIX = '.tokens.npy'
+OFFSETS_SUFFIX = '.offsets.npy'
+
+logger = logging.getLogger(__name__)
+
+
+class LabelStore(object):
+    """Token ids of all utterances in flat arrays.
+
+    Args:
+        tokens (np.ndarray): `[n_tokens]` (int32)
+        offsets (np.ndarray): `[n_utts + 1]` start position of each utterance in tokens (int64)
+
+    """
+
+    def __init__(self, tokens, offsets):
+        assert len(offsets) >= 1 and offsets[-1] == len(tokens)
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, token_ids, chunk_size=10000):
+        """Convert space-separated token ids.
+
+        Args:
+            token_ids (list or pd.Series): space-separated token ids of each utterance
+                (missing values are regarded as empty)
+            chunk_size (int): number of utterances parsed at once
+        Returns:
+            LabelStore
+
+        """
+        token_ids = pd.Series(token_ids, dtype=object).fillna('').astype(str).tolist()
+        offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+        np.cumsum(_count_tokens(token_ids), out=offsets[1:])
+
+        # NOTE: parse chunks into the preallocated array not to hold all tokens as str objects
+        tokens = np.empty(offsets[-1], dtype=np.int32)
+        for s in range(0, len(token_ids), chunk_size):
+            e = min(s + chunk_size, len(token_ids))
+            _parse_tokens(token_ids[s:e], tokens[offsets[s]:offsets[e]])
+        return cls(tokens, offsets)
+
+    @classmethod
+    def from_tsv(cls, tsv_path, prefix, chunk_size=100000):
+        """Convert the token_id column of a dataset tsv file without loading the whole file.
+
+        The file is read twice by chunks (to count and to parse tokens), and tokens
+        are written to *.tokens.npy through memory mapping.
+
+        Args:
+            tsv_path (str): path to the dataset tsv file
+            prefix (str): path prefix to save *.tokens.npy and *.offsets.npy
+            chunk_size (int): number of utterances read at once
+        Returns:
+            LabelStore: memory-mapped, whose rows correspond to rows of the tsv file
+
+        """
+        def read_chunks():
+            for chunk in pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t', usecols=['token_id'],
+                                     dtype={'token_id': str}, chunksize=chunk_size):
+                yield chunk['token_id'].fillna('').tolist()
+
+        lengths = [_count_tokens(token_ids) for token_ids in read_chunks()]
+        offsets = np.zeros(sum(len(x) for x in lengths) + 1, dtype=np.int64)
+        if len(lengths) > 0:
+            np.cumsum(np.concatenate(lengths), out=offsets[1:])
+
+        # NOTE: write to a temporary file first not to leave a broken file
+        tmp_path = prefix + TOKENS_SUFFIX + '.tmp%d' % os.getpid()
+        tokens = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int32, shape=(int(offsets[-1]),))
+        s = 0
+        for token_ids in read_chunks():
+            e = s + len(token_ids)
+            _parse_tokens(token_ids, tokens[offsets[s]:offsets[e]])
+            s = e
+        tokens.flush()
+        del tokens
+        os.replace(tmp_path, prefix + TOKENS_SUFFIX)
+        _save_atomic(prefix + OFFSETS_SUFFIX, offsets)
+        return cls.load(prefix)
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        """Load arrays saved by `save`.
+
+        Args:
+            prefix (str): path prefix of *.tokens.npy and *.offsets.npy
+            mmap_mode (str): memory-mapping mode of np.load (None: load into memory)
+        Returns:
+            LabelStore
+
+        """
+        return cls(np.load(prefix + TOKENS_SUFFIX, mmap_mode=mmap_mode),
+                   np.load(prefix + OFFSETS_SUFFIX, mmap_mode=mmap_mode))
+
+    def save(self, prefix):
+        """Save arrays as *.tokens.npy and *.offsets.npy.
+
+        Args:
+            prefix (str): path prefix
+
+        """
+        _save_atomic(prefix + TOKENS_SUFFIX, self.tokens)
+        _save_atomic(prefix + OFFSETS_SUFFIX, self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __getitem__(self, i):
+        """Token ids of the i-th utterance (zero-copy).
+
+        Args:
+            i (int): row index
+        Returns:
+            tokens (np.ndarray): `[L]`
+
+        """
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def concat(self, rows, sep):
+        """Concatenate token ids of utterances with a separator.
+
+        Args:
+            rows (np.ndarray): row indices in the order of concatenation
+            sep (int): index inserted before each utterance and at the end
+        Returns:
+            concat_ids (np.ndarray): `[sum(lengths) + len(rows) + 1]` (int64)
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.asarray(self.offsets[rows])
+        lengths = np.asarray(self.offsets[rows + 1]) - starts
+        concat_ids = np.full(int(lengths.sum()) + len(rows) + 1, sep, dtype=np.int64)
+        # position of each token in its utterance
+        pos = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        concat_ids[np.repeat(np.cumsum(lengths + 1) - lengths, lengths) + pos] = \
+            self.tokens[np.repeat(starts, lengths) + pos]
+        return concat_ids
+
+
+def _count_tokens(token_ids):
+    return np.fromiter((len(t.split()) for t in token_ids), dtype=np.int64, count=len(token_ids))
+
+
+def _parse_tokens(token_ids, out):
+    """Parse space-separated token ids of utterances into `out`."""
+    if len(out) > 0:
+        tokens = np.fromstring(' '.join(token_ids), dtype=np.int32, sep=' ')
+        assert len(tokens) == len(out)
+        out[:] = tokens
+
+
+def _save_atomic(path, array):
+    # NOTE: write to a temporary file first not to leave a broken file
+    tmp_path = path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def load_label_store(token_ids, prefix=False):
+    """Load a label store, converting token ids if it has not been saved yet.
+
+    Args:
+        token_ids (list or pd.Series): space-separated token ids of each utterance
+        prefix (str): path prefix to save/load the label store.
+            If False, the label store is kept only in memory.
+    Returns:
+        LabelStore
+
+    """
+    if prefix and os.path.isfile(prefix + TOKENS_SUFFIX) and os.path.isfile(prefix + OFFSETS_SUFFIX):
+        store = LabelStore.load(prefix)
+        if len(store) == len(token_ids):
+            logger.info('Load the label store: %s' % prefix)
+            return store
+        logger.warning('Re-create the inconsistent label store: %s' % prefix)
+
+    store = LabelStore.from_strings(token_ids)
+    if prefix:
+        store.save(prefix)
+        logger.info('Saved the label store: %s' % prefix)
+        store = LabelStore.load(prefix)
+    return store
@@ -9,13 +9,18 @@
    You can use the multi-GPU version.
 """
 
+import hashlib
 import logging
 import numpy as np
 import os
-import pandas as pd
 import random
 
 from neural_sp.datasets.asr import count_vocab_size
+from neural_sp.datasets.manifest import cache_prefix
+from neural_sp.datasets.manifest import filter_lm
+from neural_sp.datasets.manifest import load_manifests
+from neural_sp.datasets.manifest import load_tsv_label_store
+from neural_sp.datasets.token_stream import TokenStream
 from neural_sp.datasets.token_converter.character import Char2idx
 from neural_sp.datasets.token_converter.character import Idx2char
 from neural_sp.datasets.token_converter.phone import Idx2phone
@@ -28,6 +33,9 @@ from neural_sp.datasets.token_converter.wordpiece import Wp2idx
 random.seed(1)
 np.random.seed(1)
 
+# columns of the tsv file loaded in the streaming mode (token ids are read by chunks)
+STREAM_COLUMNS = ['utt_id', 'speaker', 'ylen']
+
 logger = logging.getLogger(__name__)
 
 
@@ -37,7 +45,9 @@ class Dataset(object):
                  unit, batch_size, nlsyms=False, n_epochs=1e10,
                  is_test=False, min_n_tokens=1,
                  bptt=2, shuffle=False, backward=False, serialize=False,
-                 wp_model=None, corpus=''):
+                 wp_model=None, corpus='', manifest_cache_dir=False,
+                 streaming=False, stream_block_size=10000, variable_bptt=False,
+                 seed=None, rank=0, world_size=1):
         """A class for loading dataset.
 
         Args:
@@ -55,6 +65,23 @@ class Dataset(object):
             serialize (bool): serialize text according to contexts in dialogue
             wp_model (): path to the word-piece model for sentencepiece
             corpus (str): name of corpus
+            manifest_cache_dir (str): directory to cache filtered manifests.
+                Caching is disabled if False.
+            streaming (bool): read mini-batches from a memory-mapped token stream
+                instead of concatenating the whole corpus in memory. Token ids are
+                converted from the tsv file by chunks, and neither they nor the text
+                are loaded into memory. Blocks of utterances are shuffled per epoch
+                (including the first epoch) instead of utterances. The token stream
+                is saved in manifest_cache_dir and reused if specified.
+            stream_block_size (int): minimum number of tokens per block in the token stream
+            variable_bptt (bool): sample the BPTT length per mini-batch during training
+            seed (int): random seed for shuffling and sampling BPTT lengths.
+                If None, the seed is drawn from the global random number generator of numpy.
+            rank (int): rank of this process in distributed training
+            world_size (int): number of processes in distributed training.
+                Each process takes every world_size-th row of mini-batches of
+                the global batch size. The seed (or the global random state of
+                numpy if seed is None) must be shared.
 
         """
         super(Dataset, self).__init__()
@@ -74,7 +101,15 @@ class Dataset(object):
         self.shuffle = shuffle
         self.backward = backward
         self.vocab = count_vocab_size(dict_path)
+        self.streaming = streaming
+        self.variable_bptt = variable_bptt
+        self.rank = rank
+        self.world_size = world_size
+        if seed is None:
+            seed = np.random.randint(0, 2 ** 31 - 1)
+        self.rng = np.random.RandomState(seed)
         assert bptt >= 2
+        assert batch_size % world_size == 0
 
         self.idx2token = []
         self.token2idx = []
@@ -96,54 +131,69 @@ class Dataset(object):
             raise ValueError(unit)
 
         # Load dataset tsv file
-        self.df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
-        self.df = self.df.loc[:, ['utt_id', 'speaker', 'feat_path',
-                                  'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
-
-        # Remove inappropriate utterances
-        if is_test:
-            print('Original utterance num: %d' % len(self.df))
-            n_utts = len(self.df)
-            self.df = self.df[self.df.apply(lambda x: x['ylen'] > 0, axis=1)]
-            print('Removed %d empty utterances' % (n_utts - len(self.df)))
+        filter_params = dict(is_test=is_test, min_n_tokens=min_n_tokens)
+        if streaming:
+            dfs = load_manifests([tsv_path], filter_lm, filter_params,
+                                 cache_dir=manifest_cache_dir, columns=STREAM_COLUMNS)
+            cache_prefix_tsv = cache_prefix([tsv_path], {}, manifest_cache_dir) if manifest_cache_dir else False
+            # NOTE: rows of the label store correspond to rows of the tsv file
+            self.labels = load_tsv_label_store(tsv_path, cache_prefix_tsv and cache_prefix_tsv + '.labels',
+                                               tmpdir=manifest_cache_dir)
+            self.df = dfs[0].assign(label_row=dfs[0].index.values)
         else:
-            print('Original utterance num: %d' % len(self.df))
-            n_utts = len(self.df)
-            self.df = self.df[self.df.apply(lambda x: x['ylen'] >= min_n_tokens, axis=1)]
-            print('Removed %d utterances (threshold)' % (n_utts - len(self.df)))
+            dfs, stores = load_manifests([tsv_path], filter_lm, filter_params,
+                                         cache_dir=manifest_cache_dir, labels=True)
+            # NOTE: token ids are read from the label store through `label_row`
+            self.labels = stores[0]
+            self.df = dfs[0].drop(columns='token_id').assign(label_row=np.arange(len(dfs[0])))
 
         # Sort tsv records
-        if shuffle:
+        if shuffle and not streaming:
             assert not serialize
-            self.df = self.df.reindex(np.random.permutation(self.df.index))
+            self.df = self.df.reindex(self.rng.permutation(self.df.index))
         elif serialize:
             assert not shuffle
             assert corpus == 'swbd'
-            self.df['session'] = self.df['speaker'].apply(lambda x: str(x).split('-')[0])
-            self.df['onset'] = self.df['utt_id'].apply(lambda x: int(x.split('_')[-1].split('-')[0]))
+            self.df['session'] = self.df['speaker'].astype(str).str.split('-').str[0]
+            self.df['onset'] = self.df['utt_id'].str.split('_').str[-1].str.split('-').str[0].astype(int)
             self.df = self.df.sort_values(by=['session', 'onset'], ascending=True)
         else:
             self.df = self.df.sort_values(by='utt_id', ascending=True)
 
-        # Concatenate into a single sentence
-        self.concat_ids = self.concat_utterances(self.df)
+        if streaming:
+            # Write into a token file once (in the sorted order), which is shuffled by blocks
+            rows = self._rows(self.df)
+            stream_path = False
+            if cache_prefix_tsv:
+                h = hashlib.sha1(rows.tobytes())
+                h.update(b'%d-%d' % (self.eos, stream_block_size))
+                stream_path = '%s.stream-%s.npy' % (cache_prefix_tsv, h.hexdigest()[:16])
+            self.stream = TokenStream.build(self.labels, rows, self.eos, stream_block_size,
+                                            tmpdir=manifest_cache_dir, path=stream_path)
+            if shuffle:
+                self.stream.permute(self.rng.permutation(self.stream.n_blocks))
+            logger.info('Removed %d tokens / %d tokens' % (len(self.stream) - len(self), len(self.stream)))
+        else:
+            # Concatenate into a single sentence
+            self.concat_ids = self.concat_utterances(self.df)
+
+    def _rows(self, df):
+        rows = df['label_row'].values
+        if self.backward:
+            rows = rows[::-1]
+        assert (self.labels.lengths[rows] > 0).all()
+        return rows
 
     def concat_utterances(self, df):
-        indices = list(df.index)
-        if self.backward:
-            indices = indices[::-1]
-        concat_ids = []
-        for i in indices:
-            assert df['token_id'][i] != ''
-            concat_ids += [self.eos] + list(map(int, df['token_id'][i].split()))
-        concat_ids += [self.eos]  # for the last sentence
+        rows = self._rows(df)
+        concat_ids = self.labels.concat(rows, sep=self.eos)  # <eos> is also added for the last sentence
         # NOTE: <sos> and <eos> have the same index
 
         # Reshape
         n_utts = len(concat_ids)
         concat_ids = concat_ids[:n_utts // self.batch_size * self.batch_size]
         logger.info('Removed %d tokens / %d tokens' % (n_utts - len(concat_ids), n_utts))
-        concat_ids = np.array(concat_ids).reshape((self.batch_size, -1))
+        concat_ids = concat_ids.reshape((self.batch_size, -1))
 
         return concat_ids
 
@@ -155,11 +205,39 @@ class Dataset(object):
     def reset(self):
         """Reset data counter and offset."""
         if self.shuffle:
-            self.df = self.df.reindex(np.random.permutation(self.df.index))
-            self.concat_ids = self.concat_utterances(self.df)
+            if self.streaming:
+                self.stream.permute(self.rng.permutation(self.stream.n_blocks))
+            else:
+                self.df = self.df.reindex(self.rng.permutation(self.df.index))
+                self.concat_ids = self.concat_utterances(self.df)
         self.offset = 0
 
+    def state_dict(self):
+        """Snapshot of the sampling state to resume from the next mini-batch."""
+        return {'epoch': self.epoch,
+                'offset': self.offset,
+                'order': self.stream.perm.copy() if self.streaming else self.df.index.values.copy(),
+                'rng': self.rng.get_state()}
+
+    def load_state_dict(self, state):
+        """Restore the sampling state.
+
+        Args:
+            state (dict): snapshot created by `state_dict`
+
+        """
+        self.epoch = state['epoch']
+        if self.streaming:
+            self.stream.permute(state['order'])
+        else:
+            self.df = self.df.reindex(state['order'])
+            self.concat_ids = self.concat_utterances(self.df)
+        self.offset = state['offset']
+        self.rng.set_state(state['rng'])
+
     def __len__(self):
+        if self.streaming:
+            return len(self.stream) // self.batch_size * self.batch_size
         return len(self.concat_ids.reshape((-1,)))
 
     def __iter__(self):
@@ -181,17 +259,29 @@ class Dataset(object):
         """
         if batch_size is None:
             batch_size = self.batch_size
-        elif self.concat_ids.shape[0] != batch_size:
+        if not self.streaming and self.concat_ids.shape[0] != batch_size:
             self.concat_ids = self.concat_ids.reshape((batch_size, -1))
             # NOTE: only for the first iteration during evaluation
 
         if bptt is None:
-            bptt = self.bptt
+            bptt = self.sample_bptt() if self.variable_bptt else self.bptt
 
         if self.epoch >= self.max_epoch:
             raise StopIteration
 
-        ys = self.concat_ids[:, self.offset:self.offset + bptt]
+        # rows for this process
+        rows = np.arange(batch_size)
+        if batch_size == self.batch_size and self.world_size > 1:
+            rows = rows[self.rank::self.world_size]
+
+        if self.streaming:
+            # gather the same windows as self.concat_ids[rows, offset:offset + bptt]
+            n_tokens = len(self) // batch_size
+            positions = rows[:, None] * n_tokens + \
+                np.arange(self.offset, min(self.offset + bptt, n_tokens))[None]
+            ys = self.stream[positions]
+        else:
+            ys = self.concat_ids[rows, self.offset:self.offset + bptt]
         self.offset += bptt - 1
         # ys = self.concat_ids[:, self.offset:self.offset + (bptt + 1)]
         # self.offset += (bptt + 1) - 1
@@ -206,3 +296,16 @@ class Dataset(object):
             self.epoch += 1
 
         return ys, is_new_epoch
+
+    def sample_bptt(self):
+        """Sample the BPTT length of the next mini-batch.
+
+        The base length is halved with the probability of 0.05 and then
+        perturbed with Gaussian noise (Merity et al., 2018).
+
+        Returns:
+            bptt (int): BPTT length
+
+        """
+        base = self.bptt if self.rng.random_sample() < 0.95 else self.bptt / 2
+        return max(2, int(self.rng.normal(base, 5)))
@@ -0,0 +1,326 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Dataset manifest (tsv file) loading with vectorized filtering.
+
+   Filtered manifests can be cached as columnar numpy files (*.manifest.npz),
+   keyed by the hash of the tsv files and the filtering parameters, so that
+   restarted training and evaluation jobs skip parsing and filtering.
+   String columns are stored as concatenated UTF-8 bytes with offsets, so that
+   the cache is about as large as the tsv files.
+"""
+
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+from neural_sp.datasets.label_store import LabelStore
+from neural_sp.datasets.label_store import load_label_store
+from neural_sp.datasets.label_store import OFFSETS_SUFFIX
+from neural_sp.datasets.label_store import TOKENS_SUFFIX
+
+COLUMNS = ['utt_id', 'speaker', 'feat_path', 'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']
+CACHE_SUFFIX = '.manifest.npz'
+CACHE_VERSION = 2  # included in the cache key to invalidate caches of older layouts
+
+logger = logging.getLogger(__name__)
+
+
+def read_tsv(tsv_path, columns=COLUMNS):
+    """Read a dataset tsv file.
+
+    Args:
+        tsv_path (str): path to the dataset tsv file
+        columns (list): columns to be read
+    Returns:
+        df (pd.DataFrame):
+
+    """
+    df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t', usecols=columns)
+    return df.loc[:, columns]
+
+
+def filter_asr(df, df_sub1=None, df_sub2=None, is_test=False, discourse_aware=False,
+               min_n_frames=40, max_n_frames=2000, first_n_utterances=-1,
+               ctc=False, ctc_sub1=False, ctc_sub2=False,
+               subsample_factor=1, subsample_factor_sub1=1, subsample_factor_sub2=1):
+    """Remove inappropriate utterances for ASR.
+
+    Args:
+        df (pd.DataFrame): manifest for the main task
+        df_sub1 (pd.DataFrame): manifest for the 1st auxiliary task
+        df_sub2 (pd.DataFrame): manifest for the 2nd auxiliary task
+        (see neural_sp.datasets.asr.Dataset for the other arguments)
+    Returns:
+        df (pd.DataFrame):
+        df_sub1 (pd.DataFrame):
+        df_sub2 (pd.DataFrame):
+
+    """
+    df_subs = [df_sub1, df_sub2]
+    if is_test or discourse_aware:
+        print('Original utterance num: %d' % len(df))
+        n_utts = len(df)
+        df = df[df['ylen'].values > 0]
+        print('Removed %d empty utterances' % (n_utts - len(df)))
+        if first_n_utterances > 0:
+            df = df.truncate(before=0, after=first_n_utterances - 1)
+            print('Select first %d utterances' % len(df))
+    else:
+        print('Original utterance num: %d' % len(df))
+        n_utts = len(df)
+        xlens = df['xlen'].values
+        df = df[(min_n_frames <= xlens) & (xlens <= max_n_frames) & (df['ylen'].values > 0)]
+        print('Removed %d utterances (threshold)' % (n_utts - len(df)))
+
+        if ctc and subsample_factor > 1:
+            n_utts = len(df)
+            df = df[df['ylen'].values <= (df['xlen'].values // subsample_factor)]
+            print('Removed %d utterances (for CTC)' % (n_utts - len(df)))
+
+        for i, (ctc_sub, subsample_factor_sub) in enumerate(
+                [(ctc_sub1, subsample_factor_sub1), (ctc_sub2, subsample_factor_sub2)]):
+            df_sub = df_subs[i]
+            if df_sub is None:
+                continue
+            if ctc_sub and subsample_factor_sub > 1:
+                df_sub = df_sub[df_sub['ylen'].values <= (df_sub['xlen'].values // subsample_factor_sub)]
+
+            if len(df) != len(df_sub):
+                n_utts = len(df)
+                df = df.drop(df.index.difference(df_sub.index))
+                print('Removed %d utterances (for CTC, sub%d)' % (n_utts - len(df), i + 1))
+                for j in range(i + 1):
+                    df_subs[j] = df_subs[j].drop(df_subs[j].index.difference(df.index))
+
+    return df, df_subs[0], df_subs[1]
+
+
+def filter_lm(df, is_test=False, min_n_tokens=1):
+    """Remove inappropriate utterances for LM.
+
+    Args:
+        df (pd.DataFrame): manifest
+        is_test (bool):
+        min_n_tokens (int): exclude utterances shorter than this value
+    Returns:
+        df (pd.DataFrame):
+
+    """
+    print('Original utterance num: %d' % len(df))
+    n_utts = len(df)
+    if is_test:
+        df = df[df['ylen'].values > 0]
+        print('Removed %d empty utterances' % (n_utts - len(df)))
+    else:
+        df = df[df['ylen'].values >= min_n_tokens]
+        print('Removed %d utterances (threshold)' % (n_utts - len(df)))
+    return df
+
+
+def cache_key(tsv_paths, params):
+    """Hash of the contents of tsv files and filtering parameters.
+
+    Args:
+        tsv_paths (list): paths to tsv files (False/None for unused ones)
+        params (dict): filtering parameters
+    Returns:
+        key (str):
+
+    """
+    h = hashlib.sha1()
+    h.update(b'%d\0' % CACHE_VERSION)
+    for tsv_path in tsv_paths:
+        if not tsv_path:
+            h.update(b'\0')
+            continue
+        with open(tsv_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        h.update(b'\0')
+    h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def encode_strings(strings):
+    """Concatenate strings as UTF-8 bytes.
+
+    Args:
+        strings (iterable): `[N]`
+    Returns:
+        buffer (np.ndarray): `[total bytes]` (uint8)
+        offsets (np.ndarray): `[N + 1]` (int64)
+
+    """
+    encoded = [x.encode('utf-8') for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(buffer, offsets):
+    """Split UTF-8 bytes concatenated by `encode_strings`.
+
+    Args:
+        buffer (np.ndarray): `[total bytes]` (uint8)
+        offsets (np.ndarray): `[N + 1]` (int64)
+    Returns:
+        strings (np.ndarray): `[N]` (object)
+
+    """
+    data = buffer.tobytes()
+    offsets = offsets.tolist()
+    strings = np.empty(len(offsets) - 1, dtype=object)
+    strings[:] = [data[s:e].decode('utf-8') for s, e in zip(offsets[:-1], offsets[1:])]
+    return strings
+
+
+def save_cache(cache_path, dfs):
+    """Save dataframes as columnar numpy arrays.
+
+    Object columns are stored as concatenated UTF-8 bytes with offsets and masks
+    of missing values, so that the cache can be loaded without pickle.
+
+    Args:
+        cache_path (str): path to the cache file
+        dfs (list): list of pd.DataFrame or None
+
+    """
+    arrays = {}
+    meta = []
+    for i, df in enumerate(dfs):
+        if df is None:
+            meta.append(None)
+            continue
+        meta.append(list(df.columns))
+        arrays['%d/index' % i] = df.index.values
+        for k in df.columns:
+            if pd.api.types.is_numeric_dtype(df[k]):
+                v = df[k].to_numpy()
+            else:
+                arrays['%d/%s/isnull' % (i, k)] = df[k].isnull().to_numpy()
+                v, arrays['%d/%s/offsets' % (i, k)] = encode_strings(df[k].fillna('').astype(str))
+            arrays['%d/%s' % (i, k)] = v
+    arrays['meta'] = np.array(json.dumps(meta))
+
+    # NOTE: write to a temporary file first not to leave a broken cache
+    tmp_path = cache_path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def load_cache(cache_path):
+    """Load dataframes saved by `save_cache`.
+
+    Args:
+        cache_path (str): path to the cache file
+    Returns:
+        dfs (list): list of pd.DataFrame or None
+
+    """
+    dfs = []
+    with np.load(cache_path, allow_pickle=False) as arrays:
+        for i, columns in enumerate(json.loads(str(arrays['meta']))):
+            if columns is None:
+                dfs.append(None)
+                continue
+            data = {}
+            for k in columns:
+                v = arrays['%d/%s' % (i, k)]
+                if '%d/%s/isnull' % (i, k) in arrays:
+                    v = decode_strings(v, arrays['%d/%s/offsets' % (i, k)])
+                    v[arrays['%d/%s/isnull' % (i, k)]] = np.nan
+                data[k] = v
+            dfs.append(pd.DataFrame(data, index=arrays['%d/index' % i], columns=columns))
+    return dfs
+
+
+def cache_prefix(tsv_paths, params, cache_dir):
+    """Path prefix of files cached for tsv files processed with parameters."""
+    return os.path.join(cache_dir, '%s.%s' % (
+        os.path.basename(tsv_paths[0]).split('.')[0], cache_key(tsv_paths, params)))
+
+
+def load_manifests(tsv_paths, filter_fn, params, cache_dir=False, labels=False, columns=COLUMNS):
+    """Read tsv files and filter them, or load the cached result.
+
+    Args:
+        tsv_paths (list): paths to tsv files (False/None for unused ones)
+        filter_fn (callable): function taking dataframes and `params` as keyword arguments
+        params (dict): filtering parameters
+        cache_dir (str): directory to save cached manifests. Caching is disabled if False.
+        labels (bool): also return label stores converted from the token_id column.
+            They are saved next to the cached manifest and loaded through memory mapping.
+        columns (list): columns to be read (token_id is required if labels is True)
+    Returns:
+        dfs (list): list of filtered pd.DataFrame or None
+        stores (list): list of LabelStore or None aligned with rows of each dataframe.
+            Returned only when labels is True.
+
+    """
+    cache_path = False
+    if cache_dir:
+        params_key = params if columns == COLUMNS else dict(params, columns=list(columns))
+        cache_path = cache_prefix(tsv_paths, params_key, cache_dir) + CACHE_SUFFIX
+
+    if cache_path and os.path.isfile(cache_path):
+        logger.info('Load the cached manifest: %s' % cache_path)
+        dfs = load_cache(cache_path)
+    else:
+        dfs = [read_tsv(tsv_path, columns) if tsv_path else None for tsv_path in tsv_paths]
+        dfs = filter_fn(*dfs, **params)
+        if not isinstance(dfs, tuple):
+            dfs = (dfs,)
+        dfs = list(dfs)
+
+        if cache_path:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, exist_ok=True)
+            save_cache(cache_path, dfs)
+            logger.info('Saved the filtered manifest: %s' % cache_path)
+
+    if not labels:
+        return dfs
+    stores = [None if df is None else load_label_store(
+        df['token_id'], cache_path[:-len(CACHE_SUFFIX)] + '.labels%d' % i if cache_path else False)
+        for i, df in enumerate(dfs)]
+    return dfs, stores
+
+
+def load_tsv_label_store(tsv_path, prefix=False, tmpdir=None):
+    """Convert token ids in a tsv file into a label store without loading the whole file.
+
+    Args:
+        tsv_path (str): path to the dataset tsv file
+        prefix (str): path prefix to save the label store, which is reused later.
+            If False, the label store is written into a temporary directory, which
+            is removed immediately after being mapped.
+        tmpdir (str): parent of the temporary directory
+    Returns:
+        store (LabelStore): memory-mapped, whose rows correspond to rows of the tsv file
+            (i.e., the index of dataframes returned by `read_tsv`)
+
+    """
+    if not prefix:
+        tmp_dir = tempfile.mkdtemp(dir=tmpdir or None)
+        try:
+            return LabelStore.from_tsv(tsv_path, os.path.join(tmp_dir, 'labels'))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    if os.path.isfile(prefix + TOKENS_SUFFIX) and os.path.isfile(prefix + OFFSETS_SUFFIX):
+        logger.info('Load the label store: %s' % prefix)
+        return LabelStore.load(prefix)
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    store = LabelStore.from_tsv(tsv_path, prefix)
+    logger.info('Saved the label store: %s' % prefix)
+    return store
@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Epoch sampler with a cursor over a permutation array.
+
+   Data indices of the current epoch are kept in a flat integer array, and
+   sampling only advances a cursor, so that drawing a mini-batch costs
+   O(batch size) regardless of the corpus size. Bucketed modes keep the
+   boundaries of each mini-batch in a second array. The sampler owns its
+   random number generator, and the whole state (order, cursor and RNG) can be
+   saved and restored to resume from the middle of an epoch.
+
+   In distributed training, all processes share the same seed and sample the
+   same global mini-batches, and each process takes its own shard of them.
+"""
+
+import numpy as np
+
+
+class EpochSampler(object):
+    """Sampler of data indices in each epoch.
+
+    Args:
+        seed (int): random seed. If None, the seed is drawn from the global
+            random number generator of numpy.
+        rank (int): rank of this process in distributed training
+        world_size (int): number of processes in distributed training
+
+    """
+
+    def __init__(self, seed=None, rank=0, world_size=1):
+        if seed is None:
+            seed = np.random.randint(0, 2 ** 31 - 1)
+        self.rng = np.random.RandomState(seed)
+        assert 0 <= rank < world_size
+        self.rank = rank
+        self.world_size = world_size
+
+        self.indices = np.zeros(0, dtype=np.int64)  # order of data indices in the current epoch
+        self.boundaries = None  # start positions of buckets in `indices` (+ the end)
+        self.cursor = 0  # position in `indices`
+        self.bucket_cursor = 0  # position in `boundaries`
+
+    @property
+    def bucketing(self):
+        return self.boundaries is not None
+
+    @property
+    def n_buckets(self):
+        return len(self.boundaries) - 1 if self.bucketing else 0
+
+    @property
+    def n_remaining(self):
+        """Number of data indices that have not been sampled yet in the current epoch."""
+        return len(self.indices) - self.cursor
+
+    def is_exhausted(self):
+        if self.bucketing:
+            return self.bucket_cursor >= self.n_buckets
+        return self.cursor >= len(self.indices)
+
+    def set_order(self, indices):
+        """Start a new epoch sampling indices sequentially.
+
+        Args:
+            indices (array-like): data indices in the order of sampling
+
+        """
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.boundaries = None
+        self.cursor = 0
+        self.bucket_cursor = 0
+
+    def set_buckets(self, buckets):
+        """Start a new epoch sampling a bucket (mini-batch) at a time.
+
+        Args:
+            buckets (list): list of data indices in each bucket
+
+        """
+        lengths = [len(b) for b in buckets]
+        self.indices = np.concatenate(buckets).astype(np.int64) if len(buckets) > 0 else np.zeros(0, dtype=np.int64)
+        self.boundaries = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.cursor = 0
+        self.bucket_cursor = 0
+
+    def peek(self):
+        """Return the next data index without advancing the cursor."""
+        return int(self.indices[self.cursor])
+
+    def take(self, n):
+        """Sample the next n data indices (or fewer at the end of the epoch).
+
+        Args:
+            n (int): number of data indices
+        Returns:
+            indices (np.ndarray): `[n]`
+
+        """
+        assert not self.bucketing
+        indices = self.indices[self.cursor:self.cursor + n]
+        self.cursor += len(indices)
+        return indices
+
+    def skip(self):
+        """Discard the rest of the current epoch."""
+        self.cursor = len(self.indices)
+        if self.bucketing:
+            self.bucket_cursor = self.n_buckets
+
+    def next_bucket(self):
+        """Sample data indices in the next bucket.
+
+        Returns:
+            indices (np.ndarray): `[bucket_size]`
+
+        """
+        assert self.bucketing
+        start, end = self.boundaries[self.bucket_cursor:self.bucket_cursor + 2]
+        self.bucket_cursor += 1
+        self.cursor = end
+        return self.indices[start:end]
+
+    def permutation(self, x):
+        """Randomly permute a sequence or np.arange(x) if x is an integer."""
+        return self.rng.permutation(x)
+
+    def shuffle(self, items):
+        """Shuffle a list in place."""
+        items[:] = [items[i] for i in self.rng.permutation(len(items))]
+        return items
+
+    def shard(self, indices):
+        """Take the part of a global mini-batch for this process.
+
+        Mini-batches smaller than world_size are padded by repeating indices
+        from the beginning, so that every process always receives data.
+
+        Args:
+            indices (np.ndarray): `[B]` data indices in the global mini-batch
+        Returns:
+            indices (np.ndarray): `[ceil(B / world_size)]` or fewer
+                (at least one index if indices is not empty)
+
+        """
+        if self.world_size == 1 or len(indices) == 0:
+            return indices
+        if len(indices) < self.world_size:
+            indices = np.resize(indices, self.world_size)
+        return indices[self.rank::self.world_size]
+
+    def state_dict(self):
+        """Snapshot of the sampler state.
+
+        NOTE: arrays are not copied because they are never modified in place.
+
+        """
+        return {'indices': self.indices,
+                'boundaries': self.boundaries,
+                'cursor': self.cursor,
+                'bucket_cursor': self.bucket_cursor,
+                'rng': self.rng.get_state()}
+
+    def load_state_dict(self, state):
+        """Restore the sampler state.
+
+        Args:
+            state (dict): snapshot created by `state_dict`
+
+        """
+        self.indices = state['indices']
+        self.boundaries = state['boundaries']
+        self.cursor = state['cursor']
+        self.bucket_cursor = state['bucket_cursor']
+        self.rng.set_state(state['rng'])
@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Memory-mapped token stream for LM training.
+
+   All utterances in a corpus are written once into a single int32 token file
+   (`<eos> y_1 ... <eos> y_2 ... <eos>`) and read through memory mapping. The
+   stream is divided into blocks of about `block_size` tokens aligned with
+   utterance boundaries, and shuffling permutes blocks instead of utterances.
+   Each block starts with the separator before its first utterance, and the
+   last separator is kept out of the blocks, so that separators are never
+   adjacent in the permuted stream. Tokens at arbitrary positions of the
+   (permuted) stream are gathered lazily, so that memory usage does not depend
+   on the number of tokens in the corpus.
+"""
+
+import logging
+import numpy as np
+import os
+import tempfile
+
+BOUNDARIES_SUFFIX = '.boundaries.npy'
+
+logger = logging.getLogger(__name__)
+
+
+def write_token_stream(path, store, rows, sep, block_size, chunk_size=100000):
+    """Write utterances into a token file with separators.
+
+    Args:
+        path (str): path to the token file (.npy)
+        store (LabelStore): token ids of all utterances
+        rows (np.ndarray): row indices of `store` in the order of the stream
+        sep (int): index inserted before each utterance and at the end
+        block_size (int): minimum number of tokens per block
+        chunk_size (int): number of utterances written at once
+    Returns:
+        boundaries (np.ndarray): `[n_blocks + 1]` start positions of blocks
+            (+ the position of the last separator)
+
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    n_tokens = int((np.asarray(store.offsets[rows + 1]) - np.asarray(store.offsets[rows])).sum())
+    length = n_tokens + len(rows) + 1
+    tokens = np.lib.format.open_memmap(path, mode='w+', dtype=np.int32, shape=(length,))
+
+    boundaries = [0]
+    pos = 0
+    for i in range(0, len(rows), chunk_size):
+        rows_chunk = rows[i:i + chunk_size]
+        chunk = store.concat(rows_chunk, sep)[:-1]  # exclude the last separator
+        tokens[pos:pos + len(chunk)] = chunk
+
+        # blocks start at a separator before an utterance
+        lengths = np.asarray(store.offsets[rows_chunk + 1]) - np.asarray(store.offsets[rows_chunk]) + 1
+        starts = pos + np.cumsum(lengths) - lengths
+        while True:
+            j = np.searchsorted(starts, boundaries[-1] + block_size)
+            if j == len(starts):
+                break
+            boundaries.append(int(starts[j]))
+        pos += len(chunk)
+    tokens[pos] = sep  # for the last utterance (not included in any blocks)
+    tokens.flush()
+    del tokens
+
+    boundaries.append(pos)
+    return np.array(boundaries, dtype=np.int64)
+
+
+class TokenStream(object):
+    """Token stream read by (permuted) blocks.
+
+    Args:
+        tokens (np.ndarray): `[T]` token ids (typically np.memmap)
+        boundaries (np.ndarray): `[n_blocks + 1]` start positions of blocks
+            (+ the position of the last separator, i.e., `T - 1`)
+
+    """
+
+    def __init__(self, tokens, boundaries):
+        assert boundaries[0] == 0 and boundaries[-1] == len(tokens) - 1
+        self.tokens = tokens
+        self.boundaries = boundaries
+        self.permute(None)
+
+    @classmethod
+    def build(cls, store, rows, sep, block_size, tmpdir=None, path=False):
+        """Write a token file and map it.
+
+        Args:
+            store (LabelStore): token ids of all utterances
+            rows (np.ndarray): row indices of `store` in the order of the stream
+            sep (int): index inserted before each utterance and at the end
+            block_size (int): minimum number of tokens per block
+            tmpdir (str): directory to write a temporary token file. The file is
+                removed immediately after being mapped, and the disk space is
+                released when the stream is deleted.
+            path (str): path to the token file (*.npy) kept for later runs.
+                The file is reused if it exists. If False, a temporary file is used.
+        Returns:
+            TokenStream
+
+        """
+        if path:
+            boundaries_path = path[:-len('.npy')] + BOUNDARIES_SUFFIX
+            if os.path.isfile(path) and os.path.isfile(boundaries_path):
+                logger.info('Load the token stream: %s' % path)
+                return cls(np.load(path, mmap_mode='r'), np.load(boundaries_path))
+            # NOTE: write to temporary files first not to leave a broken stream
+            tmp_path = path[:-len('.npy')] + '.tmp%d.npy' % os.getpid()
+            tmp_boundaries_path = boundaries_path[:-len('.npy')] + '.tmp%d.npy' % os.getpid()
+            boundaries = write_token_stream(tmp_path, store, rows, sep, block_size)
+            np.save(tmp_boundaries_path, boundaries)
+            os.replace(tmp_boundaries_path, boundaries_path)
+            os.replace(tmp_path, path)
+            tokens = np.load(path, mmap_mode='r')
+            logger.info('Saved the token stream: %s' % path)
+        else:
+            fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=tmpdir or None)
+            os.close(fd)
+            try:
+                boundaries = write_token_stream(tmp_path, store, rows, sep, block_size)
+                tokens = np.load(tmp_path, mmap_mode='r')
+            finally:
+                os.remove(tmp_path)
+        logger.info('Token stream: %d tokens, %d blocks' % (len(tokens), len(boundaries) - 1))
+        return cls(tokens, boundaries)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @property
+    def n_blocks(self):
+        return len(self.boundaries) - 1
+
+    def permute(self, perm):
+        """Set the order of blocks.
+
+        Args:
+            perm (np.ndarray): `[n_blocks]` permutation of blocks (None: original order)
+
+        """
+        if perm is None:
+            perm = np.arange(self.n_blocks)
+        assert len(perm) == self.n_blocks
+        self.perm = np.asarray(perm, dtype=np.int64)
+        lengths = np.diff(self.boundaries)[self.perm]
+        self.vstarts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+    def __getitem__(self, positions):
+        """Gather tokens at positions in the permuted stream.
+
+        Args:
+            positions (np.ndarray): positions of any shape
+        Returns:
+            tokens (np.ndarray): token ids of the same shape as positions (int64)
+
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        k = np.searchsorted(self.vstarts, positions, side='right') - 1
+        src = self.boundaries[self.perm[k]] + (positions - self.vstarts[k])
+        # the last separator is appended after the permuted blocks
+        src = np.where(positions >= self.boundaries[-1], self.boundaries[-1], src)
+        flat = src.reshape(-1)
+        # NOTE: sort positions for sequential access to the memory-mapped file
+        order = np.argsort(flat, kind='stable')
+        out = np.empty(len(flat), dtype=np.int64)
+        out[order] = self.tokens[flat[order]]
+        return out.reshape(positions.shape)
@@ -9,6 +9,93 @@
 import numpy as np
 
 
+def _distance_table(refs, hyps):
+    """Fill dynamic programming tables of edit distance for multiple pairs.
+
+    Each row is computed from the previous row at once. The dependency on the
+    left cell is resolved by a cumulative minimum, i.e.,
+    d[i][j] = min_{k<=j} (t[k] + j - k), where t is the minimum over the
+    diagonal (substitution/match) and upper (deletion) cells.
+
+    Args:
+        refs (list): list of reference token sequences
+        hyps (list): list of hypothesis token sequences
+    Returns:
+        d (np.ndarray): `[B, max_ref_len + 1, max_hyp_len + 1]`
+
+    """
+    assert len(refs) == len(hyps)
+    bs = len(refs)
+    token2idx = {}
+    ref_max = max([len(r) for r in refs] + [0])
+    hyp_max = max([len(h) for h in hyps] + [0])
+    # NOTE: padded positions never match each other
+    refs_idx = np.full((bs, ref_max), -1, dtype=np.int64)
+    hyps_idx = np.full((bs, hyp_max), -2, dtype=np.int64)
+    for b in range(bs):
+        refs_idx[b, :len(refs[b])] = [token2idx.setdefault(t, len(token2idx)) for t in refs[b]]
+        hyps_idx[b, :len(hyps[b])] = [token2idx.setdefault(t, len(token2idx)) for t in hyps[b]]
+
+    arange = np.arange(hyp_max + 1, dtype=np.int32)
+    d = np.zeros((bs, ref_max + 1, hyp_max + 1), dtype=np.int32)
+    d[:, 0] = arange
+    t = np.zeros((bs, hyp_max + 1), dtype=np.int32)
+    for i in range(1, ref_max + 1):
+        cost = (refs_idx[:, i - 1:i] != hyps_idx).astype(np.int32)
+        t[:, 0] = i
+        t[:, 1:] = np.minimum(d[:, i - 1, :-1] + cost, d[:, i - 1, 1:] + 1)
+        d[:, i] = np.minimum.accumulate(t - arange, axis=1) + arange
+    return d
+
+
+def _backtrace(d, ref, hyp):
+    """Find out the manipulation steps.
+
+    Args:
+        d (np.ndarray): `[len(ref) + 1, len(hyp) + 1]`
+        ref (list): tokens in the reference
+        hyp (list): tokens in the hypothesis
+    Returns:
+        error_list (list): C/S/I/D from the end of sentences
+
+    """
+    x = len(ref)
+    y = len(hyp)
+    error_list = []
+    while True:
+        if x == 0 and y == 0:
+            break
+        else:
+            if x > 0 and y > 0:
+                if d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
+                    error_list.append("C")
+                    x = x - 1
+                    y = y - 1
+                elif d[x][y] == d[x][y - 1] + 1:
+                    error_list.append("I")
+                    y = y - 1
+                elif d[x][y] == d[x - 1][y - 1] + 1:
+                    error_list.append("S")
+                    x = x - 1
+                    y = y - 1
+                else:
+                    error_list.append("D")
+                    x = x - 1
+            elif x == 0 and y > 0:
+                if d[x][y] == d[x][y - 1] + 1:
+                    error_list.append("I")
+                    y = y - 1
+                else:
+                    error_list.append("D")
+                    x = x - 1
+            elif y == 0 and x > 0:
+                error_list.append("D")
+                x = x - 1
+            else:
+                raise ValueError
+    return error_list
+
+
 def compute_per(ref, hyp, normalize=False):
     """Compute Phone Error Rate.
 
@@ -20,18 +107,7 @@ def compute_per(ref, hyp, normalize=False):
         per (float): Phone Error Rate between ref and hyp
 
     """
-    # Build mapping of phone to index
-    phone_set = set(ref + hyp)
-    phone2char = dict(zip(phone_set, range(len(phone_set))))
-
-    # Map phones to a single char array
-    # NOTE: Levenshtein packages only accepts strings
-    phones_ref = [chr(phone2char[p]) for p in ref]
-    phones_hyp = [chr(phone2char[p]) for p in hyp]
-
-    import Levenshtein as lev
-    # TODO(hirofumi): install
-    per = lev.distance(''.join(phones_ref), ''.join(phones_hyp))
+    per = int(_distance_table([ref], [hyp])[0, len(ref), len(hyp)])
     if normalize:
         per /= len(ref)
     return per * 100
@@ -48,9 +124,7 @@ def compute_cer(ref, hyp, normalize=False):
         cer (float): Character Error Rate between ref and hyp
 
     """
-    import Levenshtein as lev
-    # TODO(hirofumi): install
-    cer = lev.distance(hyp, ref)
+    cer = int(_distance_table([list(ref)], [list(hyp)])[0, len(ref), len(hyp)])
     if normalize:
         cer /= len(list(ref))
     return cer * 100
@@ -72,77 +146,39 @@ def compute_wer(ref, hyp, normalize=False):
         n_del (int): the number of deletion
 
     """
-    # Initialisation
-    d = np.zeros((len(ref) + 1) * (len(hyp) + 1), dtype=np.uint16)
-    d = d.reshape((len(ref) + 1, len(hyp) + 1))
-    for i in range(len(ref) + 1):
-        for j in range(len(hyp) + 1):
-            if i == 0:
-                d[0][j] = j
-            elif j == 0:
-                d[i][0] = i
-
-    # Computation
-    for i in range(1, len(ref) + 1):
-        for j in range(1, len(hyp) + 1):
-            if ref[i - 1] == hyp[j - 1]:
-                d[i][j] = d[i - 1][j - 1]
-            else:
-                sub_tmp = d[i - 1][j - 1] + 1
-                ins_tmp = d[i][j - 1] + 1
-                del_tmp = d[i - 1][j] + 1
-                d[i][j] = min(sub_tmp, ins_tmp, del_tmp)
+    return compute_wer_batch([ref], [hyp], normalize=normalize)[0]
 
-    wer = d[len(ref)][len(hyp)]
 
-    # Find out the manipulation steps
-    x = len(ref)
-    y = len(hyp)
-    error_list = []
-    while True:
-        if x == 0 and y == 0:
-            break
-        else:
-            if x > 0 and y > 0:
-                if d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
-                    error_list.append("C")
-                    x = x - 1
-                    y = y - 1
-                elif d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                elif d[x][y] == d[x - 1][y - 1] + 1:
-                    error_list.append("S")
-                    x = x - 1
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif x == 0 and y > 0:
-                if d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif y == 0 and x > 0:
-                error_list.append("D")
-                x = x - 1
-            else:
-                raise ValueError
+def compute_wer_batch(refs, hyps, normalize=False):
+    """Compute Word Error Rate for multiple pairs of sentences at once.
 
-    n_sub = error_list.count("S")
-    n_ins = error_list.count("I")
-    n_del = error_list.count("D")
-    n_cor = error_list.count("C")
+    Args:
+        refs (list): list of words in each reference transcript
+        hyps (list): list of words in each predicted transcript
+        normalize (bool, optional): if True, divide by the length of each ref
+    Returns:
+        results (list): tuples of (wer, n_sub, n_ins, n_del) for each pair as in `compute_wer`
 
-    assert wer == (n_sub + n_ins + n_del)
-    assert n_cor == (len(ref) - n_sub - n_del)
+    """
+    d = _distance_table(refs, hyps)
+    results = []
+    for b, (ref, hyp) in enumerate(zip(refs, hyps)):
+        wer = int(d[b, len(ref), len(hyp)])
+        error_list = _backtrace(d[b], ref, hyp)
 
-    if normalize:
-        wer /= len(ref)
+        n_sub = error_list.count("S")
+        n_ins = error_list.count("I")
+        n_del = error_list.count("D")
+        n_cor = error_list.count("C")
 
-    return wer * 100, n_sub * 100, n_ins * 100, n_del * 100
+        assert wer == (n_sub + n_ins + n_del)
+        assert n_cor == (len(ref) - n_sub - n_del)
+
+        if normalize:
+            wer /= len(ref)
+
+        results.append((wer * 100, n_sub * 100, n_ins * 100, n_del * 100))
+    return results
 
 
 def wer_align(ref, hyp, normalize=False, double_byte=False):
@@ -168,60 +204,11 @@ def wer_align(ref, hyp, normalize=False, double_byte=False):
     d_char = "Ｄ" if double_byte else "D"
 
     # Build the matrix
-    d = np.zeros((len(ref) + 1) * (len(hyp) + 1),
-                 dtype=np.uint8).reshape((len(ref) + 1, len(hyp) + 1))
-    for i in range(len(ref) + 1):
-        for j in range(len(hyp) + 1):
-            if i == 0:
-                d[0][j] = j
-            elif j == 0:
-                d[i][0] = i
-    for i in range(1, len(ref) + 1):
-        for j in range(1, len(hyp) + 1):
-            if ref[i - 1] == hyp[j - 1]:
-                d[i][j] = d[i - 1][j - 1]
-            else:
-                n_sub = d[i - 1][j - 1] + 1
-                n_ins = d[i][j - 1] + 1
-                n_del = d[i - 1][j] + 1
-                d[i][j] = min(n_sub, n_ins, n_del)
+    d = _distance_table([ref], [hyp])[0]
     wer = float(d[len(ref)][len(hyp)])
 
     # Find out the manipulation steps
-    x = len(ref)
-    y = len(hyp)
-    error_list = []
-    while True:
-        if x == 0 and y == 0:
-            break
-        else:
-            if x > 0 and y > 0:
-                if d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
-                    error_list.append("C")
-                    x = x - 1
-                    y = y - 1
-                elif d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                elif d[x][y] == d[x - 1][y - 1] + 1:
-                    error_list.append("S")
-                    x = x - 1
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif x == 0 and y > 0:
-                if d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif y == 0 and x > 0:
-                error_list.append("D")
-                x = x - 1
-            else:
-                raise ValueError
+    error_list = _backtrace(d, ref, hyp)
     error_list = error_list[::-1]
 
     # Print the result in aligned way
@@ -70,6 +70,19 @@ class ModelBase(nn.Module):
     def reset_parameters(self, param_init):
         raise NotImplementedError
 
+    def capture_attention(self, capture=None):
+        """Set selection of attention weights recorded for plotting.
+
+        Args:
+            capture (AttentionCapture): None stops recording (recorded weights are kept)
+
+        """
+        for module in self.modules():
+            if hasattr(module, 'aws_dict'):
+                module.attn_capture = capture
+                if capture is not None:
+                    module.aws_dict = {}
+
     def init_forget_gate_bias_with_one(self):
         """Initialize bias in forget gate with 1. See detail in
 
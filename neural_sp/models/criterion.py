@@ -10,12 +10,40 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
 import math
 import numpy as np
 import torch
 import torch.nn.functional as F
 
 
+def float32_loss(func):
+    """Compute a loss function in float32 outside of autocast.
+
+    Softmax, logsumexp and accumulation over long sequences are unstable in
+    float16/bfloat16, so floating-point tensors in the arguments are cast to
+    float32 and autocast is disabled within the function.
+
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tensors = [a for a in list(args) + list(kwargs.values()) if torch.is_tensor(a)]
+        device_type = tensors[0].device.type if len(tensors) > 0 else 'cpu'
+        if not torch.is_autocast_enabled(device_type):
+            return func(*args, **kwargs)
+        args = [_to_float32(a) for a in args]
+        kwargs = {k: _to_float32(v) for k, v in kwargs.items()}
+        with torch.autocast(device_type, enabled=False):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _to_float32(x):
+    if torch.is_tensor(x) and x.is_floating_point():
+        return x.float()
+    return x
+
+
 class MBR(torch.autograd.Function):
     """Minimum Bayes Risk (MBR) training.
 
@@ -50,6 +78,7 @@ class MBR(torch.autograd.Function):
         return input, None, None, None
 
 
+@float32_loss
 def cross_entropy_lsm(logits, ys, lsm_prob, ignore_index, training, normalize_length=False):
     """Compute cross entropy loss for label smoothing of sequence-to-sequence models.
 
@@ -93,6 +122,7 @@ def cross_entropy_lsm(logits, ys, lsm_prob, ignore_index, training, normalize_le
     return loss, ppl
 
 
+@float32_loss
 def distillation(logits_student, logits_teacher, ylens, temperature=5.0):
     """Compute cross entropy loss for knowledge distillation of sequence-to-sequence models.
 
@@ -114,6 +144,7 @@ def distillation(logits_student, logits_teacher, ylens, temperature=5.0):
     return loss_mean
 
 
+@float32_loss
 def kldiv_lsm_ctc(logits, ylens):
     """Compute KL divergence loss for label smoothing of CTC and Transducer models.
 
@@ -135,6 +166,7 @@ def kldiv_lsm_ctc(logits, ylens):
     return loss_mean
 
 
+@float32_loss
 def focal_loss(logits, ys, ylens, alpha, gamma):
     """Compute focal loss.
 
@@ -163,6 +163,6 @@ class LMBase(ModelBase):
         log_probs = torch.log_softmax(logits, dim=-1)
         return lmout, new_state, log_probs
 
-    def plot_attention(self):
+    def plot_attention(self, worker=None):
         # raise NotImplementedError
         pass
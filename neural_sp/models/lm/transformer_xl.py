@@ -10,9 +10,7 @@ import copy
 from distutils.util import strtobool
 import logging
 import math
-import os
 import random
-import shutil
 import torch
 import torch.nn as nn
 
@@ -20,12 +18,10 @@ from neural_sp.models.lm.lm_base import LMBase
 from neural_sp.models.modules.initialization import init_like_transformer_xl
 from neural_sp.models.modules.positional_embedding import XLPositionalEmbedding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
-from neural_sp.models.torch_utils import tensor2np
+from neural_sp.trainers.report_worker import plot_attention_heads
+from neural_sp.trainers.report_worker import submit
 from neural_sp.utils import mkdir_join
 
-import matplotlib
-matplotlib.use('Agg')
-
 random.seed(1)
 
 logger = logging.getLogger(__name__)
@@ -67,6 +63,10 @@ class TransformerXL(LMBase):
         self.cache_keys = []
         self.cache_attn = []
 
+        # for attention plot
+        self.attn_capture = None
+        self.aws_dict = {}
+
         # positional embedding
         self.pos_emb = XLPositionalEmbedding(self.d_model, args.dropout_in)
         self.u_bias = nn.Parameter(torch.Tensor(self.n_heads, self.d_model // self.n_heads))
@@ -242,8 +242,8 @@ class TransformerXL(LMBase):
             elif lth < self.n_layers - 1:
                 hidden_states.append(out)
                 # NOTE: outputs from the last layer is not used for memory
-            if not self.training and layer.yy_aws is not None:
-                setattr(self, 'yy_aws_layer%d' % lth, tensor2np(layer.yy_aws))
+            if self.attn_capture is not None and lth in self.attn_capture and layer.yy_aws is not None:
+                self.aws_dict['layer%d' % lth] = self.attn_capture.select(layer.yy_aws)
         out = self.norm_out(out)
         if self.adaptive_softmax is None:
             logits = self.output(out)
@@ -258,38 +258,13 @@ class TransformerXL(LMBase):
             new_mems = self.update_memory(mems, hidden_states)
             return logits, out, new_mems
 
-    def plot_attention(self, n_cols=4):
+    def plot_attention(self, n_cols=4, worker=None):
         """Plot attention for each head in all layers."""
-        from matplotlib import pyplot as plt
-        from matplotlib.ticker import MaxNLocator
-
         save_path = mkdir_join(self.save_path, 'att_weights')
 
-        # Clean directory
-        if save_path is not None and os.path.isdir(save_path):
-            shutil.rmtree(save_path)
-            os.mkdir(save_path)
-
-        for lth in range(self.n_layers):
-            if not hasattr(self, 'yy_aws_layer%d' % lth):
-                continue
-
-            yy_aws = getattr(self, 'yy_aws_layer%d' % lth)
-
-            plt.clf()
-            fig, axes = plt.subplots(self.n_heads // n_cols, n_cols, figsize=(20, 8))
-            for h in range(self.n_heads):
-                if self.n_heads > n_cols:
-                    ax = axes[h // n_cols, h % n_cols]
-                else:
-                    ax = axes[h]
-                ax.imshow(yy_aws[-1, h, :, :], aspect="auto")
-                ax.grid(False)
-                ax.set_xlabel("Input (head%d)" % h)
-                ax.set_ylabel("Output (head%d)" % h)
-                ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-                ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-
-            fig.tight_layout()
-            fig.savefig(os.path.join(save_path, 'layer%d.png' % (lth)), dvi=500)
-            plt.close()
+        if len(self.aws_dict) == 0:
+            return
+
+        # NOTE: show the last utterance in a mini-batch
+        aws = {k: aw[-1].copy() for k, aw in self.aws_dict.items()}
+        submit(worker, save_path, plot_attention_heads, save_path, aws, n_cols)
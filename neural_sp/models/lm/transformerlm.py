@@ -8,21 +8,17 @@
 
 import copy
 import logging
-import os
 import random
-import shutil
 import torch
 import torch.nn as nn
 
 from neural_sp.models.lm.lm_base import LMBase
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
-from neural_sp.models.torch_utils import tensor2np
+from neural_sp.trainers.report_worker import plot_attention_heads
+from neural_sp.trainers.report_worker import submit
 from neural_sp.utils import mkdir_join
 
-import matplotlib
-matplotlib.use('Agg')
-
 random.seed(1)
 
 logger = logging.getLogger(__name__)
@@ -61,6 +57,10 @@ class TransformerLM(LMBase):
         self.cache_keys = []
         self.cache_attn = []
 
+        # for attention plot
+        self.attn_capture = None
+        self.aws_dict = {}
+
         self.embed = nn.Embedding(self.vocab, self.d_model, padding_idx=self.pad)
         self.pos_enc = PositionalEncoding(self.d_model, args.dropout_in, args.transformer_pe_type,
                                           args.transformer_param_init)
@@ -226,8 +226,8 @@ class TransformerLM(LMBase):
             elif lth < self.n_layers - 1:
                 hidden_states.append(out)
                 # NOTE: outputs from the last layer is not used for memory
-            if not self.training and layer.yy_aws is not None:
-                setattr(self, 'yy_aws_layer%d' % lth, tensor2np(layer.yy_aws))
+            if self.attn_capture is not None and lth in self.attn_capture and layer.yy_aws is not None:
+                self.aws_dict['layer%d' % lth] = self.attn_capture.select(layer.yy_aws)
         out = self.norm_out(out)
         if self.adaptive_softmax is None:
             logits = self.output(out)
@@ -244,38 +244,13 @@ class TransformerLM(LMBase):
         else:
             return logits, out, mems
 
-    def plot_attention(self, n_cols=4):
+    def plot_attention(self, n_cols=4, worker=None):
         """Plot attention for each head in all layers."""
-        from matplotlib import pyplot as plt
-        from matplotlib.ticker import MaxNLocator
-
         save_path = mkdir_join(self.save_path, 'att_weights')
 
-        # Clean directory
-        if save_path is not None and os.path.isdir(save_path):
-            shutil.rmtree(save_path)
-            os.mkdir(save_path)
-
-        for lth in range(self.n_layers):
-            if not hasattr(self, 'yy_aws_layer%d' % lth):
-                continue
-
-            yy_aws = getattr(self, 'yy_aws_layer%d' % lth)
-
-            plt.clf()
-            fig, axes = plt.subplots(self.n_heads // n_cols, n_cols, figsize=(20, 8))
-            for h in range(self.n_heads):
-                if self.n_heads > n_cols:
-                    ax = axes[h // n_cols, h % n_cols]
-                else:
-                    ax = axes[h]
-                ax.imshow(yy_aws[-1, h, :, :], aspect="auto")
-                ax.grid(False)
-                ax.set_xlabel("Input (head%d)" % h)
-                ax.set_ylabel("Output (head%d)" % h)
-                ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-                ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-
-            fig.tight_layout()
-            fig.savefig(os.path.join(save_path, 'layer%d.png' % (lth)), dvi=500)
-            plt.close()
+        if len(self.aws_dict) == 0:
+            return
+
+        # NOTE: show the last utterance in a mini-batch
+        aws = {k: aw[-1].copy() for k, aw in self.aws_dict.items()}
+        submit(worker, save_path, plot_attention_heads, save_path, aws, n_cols)
@@ -6,7 +6,6 @@
 
 """Single-head attention layer."""
 
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -102,21 +101,21 @@ class AttentionMechanism(nn.Module):
             key (FloatTensor): `[B, klen, kdim]`
             klens (IntTensor): `[B]`
             value (FloatTensor): `[B, klen, vdim]`
-            query (FloatTensor): `[B, 1, qdim]`
+            query (FloatTensor): `[B * beam, 1, qdim]`
             mask (ByteTensor): `[B, qlen, klen]`
-            aw_prev (FloatTensor): `[B, 1 (H), 1 (qlen), klen]`
+            aw_prev (FloatTensor): `[B * beam, 1 (H), 1 (qlen), klen]`
             cache (bool): cache key and mask
             mode: dummy interface for MoChA/MMA
-            trigger_point (IntTensor): `[B]`
+            trigger_point (IntTensor): `[B * beam]`
         Returns:
-            cv (FloatTensor): `[B, 1, vdim]`
-            aw (FloatTensor): `[B, 1 (H), 1 (qlen), klen]`
+            cv (FloatTensor): `[B * beam, 1, vdim]`
+            aw (FloatTensor): `[B * beam, 1 (H), 1 (qlen), klen]`
             beta: dummy interface for MoChA/MMA
             p_choose_i: dummy interface for MoChA/MMA
 
         """
-        bs, klen = key.size()[:2]
-        qlen = query.size(1)
+        bs, qlen = query.size()[:2]
+        klen = key.size(1)
 
         if aw_prev is None:
             aw_prev = key.new_zeros(bs, 1, klen)
@@ -132,37 +131,48 @@ class AttentionMechanism(nn.Module):
                 self.key = key
             self.mask = mask
             if mask is not None:
-                assert self.mask.size() == (bs, 1, klen), (self.mask.size(), (bs, 1, klen))
+                bs_k = key.size(0)
+                assert self.mask.size() == (bs_k, 1, klen), (self.mask.size(), (bs_k, 1, klen))
 
         # for batch beam search decoding
-        if self.key.size(0) != query.size(0):
-            self.key = self.key[0: 1, :, :].repeat([query.size(0), 1, 1])
+        # NOTE: consecutive queries (hypotheses) of the same utterance share cached encoder-side
+        # features, which are broadcasted to `[B, beam, klen, kdim]` instead of being copied
+        key = self.key
+        bs_k = key.size(0)
+        n_beams = bs // bs_k
+        assert n_beams * bs_k == bs, (bs, bs_k)
+        if value.size(0) != bs_k:
+            value = value[::n_beams]  # identical among hypotheses of the same utterance
 
         if self.atype == 'no':
             raise NotImplementedError
 
         elif self.atype in ['add', 'triggered_attention']:
-            tmp = self.key.unsqueeze(1) + self.w_query(query).unsqueeze(2)
-            e = self.v(torch.tanh(tmp)).squeeze(3)
+            tmp = key[:, None, None] + self.w_query(query).view(bs_k, n_beams, qlen, 1, -1)
+            e = self.v(torch.tanh(tmp)).view(bs, qlen, klen)
 
         elif self.atype == 'location':
-            conv_feat = self.conv(aw_prev.unsqueeze(1)).squeeze(2)  # `[B, ch, klen]`
-            conv_feat = conv_feat.transpose(2, 1).contiguous().unsqueeze(1)  # `[B, 1, klen, ch]`
-            tmp = self.key.unsqueeze(1) + self.w_query(query).unsqueeze(2)
-            e = self.v(torch.tanh(tmp + self.w_conv(conv_feat))).squeeze(3)
+            conv_feat = self.conv(aw_prev.unsqueeze(1)).squeeze(2)  # `[B * beam, ch, klen]`
+            conv_feat = conv_feat.transpose(2, 1).contiguous().unsqueeze(1)  # `[B * beam, 1, klen, ch]`
+            tmp = key[:, None, None] + self.w_query(query).view(bs_k, n_beams, qlen, 1, -1)
+            tmp = tmp + self.w_conv(conv_feat).view(bs_k, n_beams, 1, klen, -1)
+            e = self.v(torch.tanh(tmp)).view(bs, qlen, klen)
 
         elif self.atype == 'dot':
-            e = torch.bmm(self.w_query(query), self.key.transpose(2, 1))
+            e = torch.bmm(self.w_query(query).view(bs_k, n_beams * qlen, -1), key.transpose(2, 1))
+            e = e.view(bs, qlen, klen)
 
         elif self.atype in ['luong_dot', 'luong_general']:
-            e = torch.bmm(query, self.key.transpose(2, 1))
+            e = torch.bmm(query.view(bs_k, n_beams * qlen, -1), key.transpose(2, 1))
+            e = e.view(bs, qlen, klen)
 
         elif self.atype == 'luong_concat':
             query = query.repeat([1, klen, 1])
-            e = self.v(torch.tanh(self.w(torch.cat([self.key, query], dim=-1)))).transpose(2, 1)
+            key = key.unsqueeze(1).expand(-1, n_beams, -1, -1).reshape(bs, klen, -1)
+            e = self.v(torch.tanh(self.w(torch.cat([key, query], dim=-1)))).transpose(2, 1)
         assert e.size() == (bs, qlen, klen), (e.size(), (bs, qlen, klen))
 
-        NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+        NEG_INF = torch.finfo(e.dtype).min
 
         # Mask the right part from the trigger point
         if self.atype == 'triggered_attention':
@@ -172,12 +182,12 @@ class AttentionMechanism(nn.Module):
 
         # Compute attention weights, context vector
         if self.mask is not None:
-            e = e.masked_fill_(self.mask == 0, NEG_INF)
+            e = e.view(bs_k, n_beams * qlen, klen).masked_fill_(self.mask == 0, NEG_INF).view(bs, qlen, klen)
         if self.sigmoid_smoothing:
             aw = torch.sigmoid(e) / torch.sigmoid(e).sum(-1).unsqueeze(-1)
         else:
             aw = torch.softmax(e * self.sharpening_factor, dim=-1)
         aw = self.dropout(aw)
-        cv = torch.bmm(aw, value)
+        cv = torch.bmm(aw.view(bs_k, n_beams * qlen, klen), value).view(bs, qlen, -1)
 
         return cv, aw.unsqueeze(1), None, None
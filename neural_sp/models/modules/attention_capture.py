@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Opt-in capture of attention weights for analysis.
+
+   Attention weights are copied to host memory (`aws_dict` of each module) only
+   while a capture is set by `ModelBase.capture_attention`, and only for the
+   selected layers, heads and utterances. Nothing is recorded by default, so
+   that decoding does not pay for plotting.
+"""
+
+import torch
+
+from neural_sp.models.torch_utils import tensor2np
+
+
+class AttentionCapture(object):
+    """Selection of attention weights to be recorded.
+
+    Args:
+        layers (list): indices of layers (None: all layers)
+        heads (list): indices of heads (None: all heads)
+        utterances (list): indices of utterances in a mini-batch (None: all utterances).
+            Negative indices are counted from the end of the mini-batch.
+
+    """
+
+    def __init__(self, layers=None, heads=None, utterances=None):
+
+        self.layers = None if layers is None else set(layers)
+        self.heads = None if heads is None else list(heads)
+        self.utterances = None if utterances is None else list(utterances)
+
+    def __contains__(self, lth):
+        return self.layers is None or lth in self.layers
+
+    def select_utterances(self, xs):
+        """Select utterances in the first dimension.
+
+        Args:
+            xs (Tensor): `[B, ...]`
+        Returns:
+            xs (Tensor): `[B', ...]`
+
+        """
+        if self.utterances is None:
+            return xs
+        return xs[torch.tensor(self.utterances, device=xs.device)]
+
+    def select(self, aws):
+        """Select utterances and heads of attention weights and copy them to host memory.
+
+        Args:
+            aws (FloatTensor): `[B, H, qlen, klen]`
+        Returns:
+            aws (np.ndarray): `[B', H', qlen, klen]`
+
+        """
+        aws = self.select_utterances(aws)
+        if self.heads is not None:
+            aws = aws[:, self.heads]
+        return tensor2np(aws)
+
+    def select_batch(self, xs):
+        """Select the recorded utterances (e.g., their lengths) and copy them to host memory.
+
+        Args:
+            xs (Tensor): `[B, ...]`
+        Returns:
+            xs (np.ndarray): `[B', ...]`
+
+        """
+        return tensor2np(self.select_utterances(xs))
+
+
+def chunks_to_center(aws, bs, n_chunks, N_l, N_c, emax):
+    """Gather attention weights of center frames in chunks into a block-diagonal matrix.
+
+    Args:
+        aws (FloatTensor): `[B * n_chunks, H, N_l + N_c + N_r, N_l + N_c + N_r]`
+        bs (int): batch size
+        n_chunks (int): number of chunks per utterance
+        N_l (int): number of frames for left context
+        N_c (int): number of frames for current context
+        emax (int): maximum number of frames
+    Returns:
+        aws_center (FloatTensor): `[B, H, emax, emax]`
+
+    """
+    n_heads = aws.size(1)
+    aws = aws[:, :, N_l:N_l + N_c, N_l:N_l + N_c]
+    aws = aws.reshape(bs, n_chunks, n_heads, N_c, N_c).transpose(0, 1)  # `[n_chunks, B, H, N_c, N_c]`
+    aws_center = aws.new_zeros(bs, n_heads, n_chunks, N_c, n_chunks, N_c)
+    chunk_ids = torch.arange(n_chunks, device=aws.device)
+    aws_center[:, :, chunk_ids, :, chunk_ids] = aws
+    aws_center = aws_center.view(bs, n_heads, n_chunks * N_c, n_chunks * N_c)
+    return aws_center[:, :, :emax, :emax]
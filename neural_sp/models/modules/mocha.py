@@ -11,7 +11,6 @@
 
 import logging
 import math
-import numpy as np
 import random
 import torch
 import torch.nn as nn
@@ -146,7 +145,7 @@ class MonotonicEnergy(nn.Module):
         if self.r is not None:
             e = e + self.r
         if m is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(m == 0, NEG_INF)
         e = e.permute(0, 3, 1, 2)  # `[B, H_ma, qlen, klen]`
 
@@ -250,7 +249,7 @@ class ChunkEnergy(nn.Module):
         # e: `[B, qlen, klen, H_ca]`
 
         if m is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(m == 0, NEG_INF)
         e = e.permute(0, 3, 1, 2)  # `[B, H_ca, qlen, klen]`
 
@@ -794,7 +793,7 @@ def hard_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
                 else:
                     mask[b, h, :, 0, max(0, boundary - chunk_size + 1):boundary + 1] = 1
 
-    NEG_INF = float(np.finfo(torch.tensor(0, dtype=u.dtype).numpy().dtype).min)
+    NEG_INF = torch.finfo(u.dtype).min
     u = u.masked_fill(mask == 0, NEG_INF)
     beta = torch.softmax(u, dim=-1)
     return beta.view(bs, -1, qlen, klen)
@@ -8,7 +8,6 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -17,6 +16,96 @@ from neural_sp.models.modules.mocha import headdrop
 logger = logging.getLogger(__name__)
 
 
+class KVCache(object):
+    """Append-only key/value cache for incremental self-attention.
+
+    Projected keys and values are stored in buffers preallocated along the
+    time axis, so that each decoding step only projects the new tokens.
+
+    Args:
+        max_len (int): number of time steps preallocated at first (doubled when exceeded)
+
+    """
+
+    def __init__(self, max_len=64):
+
+        super(KVCache, self).__init__()
+
+        self.max_len = max_len
+        self.key = None  # `[B, max_len, H, d_k]`
+        self.value = None  # `[B, max_len, H, d_k]`
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def _resize(self, bs, max_len, key):
+        key_buf = key.new_zeros((bs, max_len) + key.size()[2:])
+        value_buf = key.new_zeros((bs, max_len) + key.size()[2:])
+        if self.key is not None:
+            key_buf[:, :self.length] = self.key[:, :self.length]
+            value_buf[:, :self.length] = self.value[:, :self.length]
+        self.key = key_buf
+        self.value = value_buf
+
+    def append(self, key, value):
+        """Append keys and values of new tokens.
+
+        Args:
+            key (FloatTensor): `[B, qlen, H, d_k]`
+            value (FloatTensor): `[B, qlen, H, d_k]`
+        Returns:
+            key (FloatTensor): `[B, klen, H, d_k]`
+            value (FloatTensor): `[B, klen, H, d_k]`
+
+        """
+        bs, qlen = key.size()[:2]
+        if self.key is None:
+            self._resize(bs, max(self.max_len, qlen), key)
+        elif self.length + qlen > self.key.size(1):
+            self._resize(bs, max(self.key.size(1) * 2, self.length + qlen), key)
+        self.key[:, self.length:self.length + qlen] = key
+        self.value[:, self.length:self.length + qlen] = value
+        self.length += qlen
+        return self.key[:, :self.length], self.value[:, :self.length]
+
+    def keep_last(self, n):
+        """Discard all but the last n time steps (for sliding-window attention).
+
+        Args:
+            n (int): number of time steps to keep
+
+        """
+        if self.length > n:
+            if n > 0:
+                self.key[:, :n] = self.key[:, self.length - n:self.length].clone()
+                self.value[:, :n] = self.value[:, self.length - n:self.length].clone()
+            self.length = n
+
+    def drop_last(self, n):
+        """Discard the last n time steps.
+
+        Args:
+            n (int): number of time steps to discard
+
+        """
+        self.length = max(0, self.length - n)
+
+    def index_select(self, index):
+        """Reorder cached keys and values along the batch dimension (for beam search).
+
+        Args:
+            index (LongTensor): `[B']`
+        Returns:
+            self (KVCache)
+
+        """
+        if self.key is not None:
+            self.key = self.key.index_select(0, index)
+            self.value = self.value.index_select(0, index)
+        return self
+
+
 class MultiheadAttentionMechanism(nn.Module):
     """Multi-headed attention (MHA) layer.
 
@@ -91,53 +180,70 @@ class MultiheadAttentionMechanism(nn.Module):
         self.mask = None
 
     def forward(self, key, value, query, mask, aw_prev=None,
-                cache=False, mode='', trigger_point=None, eps_wait=-1):
+                cache=False, mode='', trigger_point=None, eps_wait=-1, kv_cache=None):
         """Forward pass.
 
         Args:
             key (FloatTensor): `[B, klen, kdim]`
             value (FloatTensor): `[B, klen, vdim]`
-            query (FloatTensor): `[B, qlen, qdim]`
+            query (FloatTensor): `[B * beam, qlen, qdim]`
             mask (ByteTensor): `[B, qlen, klen]`
             aw_prev: dummy interface
             cache (bool): cache key, value, and mask
             mode: dummy interface for MoChA/MMA
             trigger_point: dummy interface for MoChA/MMA
             eps_wait: dummy interface for MMA
+            kv_cache (KVCache): key/value cache for incremental decoding.
+                key and value contain new tokens only, and mask covers all cached tokens.
         Returns:
-            cv (FloatTensor): `[B, qlen, vdim]`
-            aw (FloatTensor): `[B, H, qlen, klen]`
+            cv (FloatTensor): `[B * beam, qlen, vdim]`
+            aw (FloatTensor): `[B * beam, H, qlen, klen]`
             beta: dummy interface for MoChA/MMA
             p_choose: dummy interface for MoChA/MMA
 
         """
-        bs, klen = key.size()[: 2]
-        qlen = query.size(1)
+        bs, qlen = query.size()[:2]
+        bs_k = key.size(0)
 
         # Pre-computation of encoder-side features for computing scores
-        if self.key is None or not cache:
-            self.key = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
-            self.value = self.w_value(value).view(bs, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
+        if kv_cache is not None:
+            # project new tokens only
+            self.key, self.value = kv_cache.append(
+                self.w_key(key).view(bs_k, -1, self.n_heads, self.d_k),
+                self.w_value(value).view(bs_k, -1, self.n_heads, self.d_k))  # `[B, klen, H, d_k]`
+            self.mask = mask
+            if self.mask is not None:
+                self.mask = self.mask.unsqueeze(3).repeat([1, 1, 1, self.n_heads])
+        elif self.key is None or not cache:
+            klen = key.size(1)
+            self.key = self.w_key(key).view(bs_k, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
+            self.value = self.w_value(value).view(bs_k, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
             self.mask = mask
             if self.mask is not None:
                 self.mask = self.mask.unsqueeze(3).repeat([1, 1, 1, self.n_heads])
-                mask_size = (bs, qlen, klen, self.n_heads)
+                mask_size = (bs_k, qlen, klen, self.n_heads)
                 assert self.mask.size() == mask_size, (self.mask.size(), mask_size)
 
         key = self.key
-        query = self.w_query(query).view(bs, -1, self.n_heads, self.d_k)  # `[B, qlen, H, d_k]`
+        klen = key.size(1)
+        # NOTE: consecutive queries share the same key/value for beam search decoding,
+        # which are broadcasted instead of being copied
+        n_beams = bs // key.size(0)
+        assert n_beams * key.size(0) == bs, (bs, key.size(0))
+        query = self.w_query(query).view(-1, n_beams, qlen, self.n_heads, self.d_k)  # `[B, beam, qlen, H, d_k]`
 
         if self.atype == 'scaled_dot':
-            e = torch.einsum("bihd,bjhd->bijh", (query, key)) / self.scale
+            e = torch.einsum("bwihd,bjhd->bwijh", (query, key)) / self.scale
         elif self.atype == 'add':
-            e = self.v(torch.tanh(key[:, None] + query[:, :, None]).view(bs, qlen, klen, -1))
-        # e: `[B, qlen, klen, H]`
+            e = self.v(torch.tanh(key[:, None, None] + query[:, :, :, None]).view(
+                -1, n_beams, qlen, klen, self.n_heads * self.d_k))
+        # e: `[B, beam, qlen, klen, H]`
 
         # Compute attention weights
         if self.mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
-            e = e.masked_fill_(self.mask == 0, NEG_INF)  # `[B, qlen, klen, H]`
-        aw = torch.softmax(e, dim=2)
+            NEG_INF = torch.finfo(e.dtype).min
+            e = e.masked_fill_(self.mask.unsqueeze(1) == 0, NEG_INF)  # `[B, beam, qlen, klen, H]`
+        aw = torch.softmax(e, dim=3).view(bs, qlen, klen, self.n_heads)
         aw = self.dropout_attn(aw)
         aw_masked = aw.clone()
 
@@ -147,7 +253,8 @@ class MultiheadAttentionMechanism(nn.Module):
             aw_masked = headdrop(aw_masked, self.n_heads, self.dropout_head)  # `[B, H, qlen, klen]`
             aw_masked = aw_masked.permute(0, 2, 3, 1)
 
-        cv = torch.einsum("bijh,bjhd->bihd", (aw_masked, self.value))  # `[B, qlen, H, d_k]`
+        aw_masked = aw_masked.view(-1, n_beams, qlen, klen, self.n_heads)
+        cv = torch.einsum("bwijh,bjhd->bwihd", (aw_masked, self.value))  # `[B, beam, qlen, H, d_k]`
         cv = cv.contiguous().view(bs, -1, self.n_heads * self.d_k)  # `[B, qlen, H * d_k]`
         cv = self.w_out(cv)
         aw = aw.permute(0, 3, 1, 2)  # `[B, H, qlen, klen]`
@@ -167,10 +167,15 @@ class TransformerDecoderBlock(nn.Module):
         self._xy_aws_p_choose = None
         self._yy_aws_lm = None
 
+    def reset(self):
+        """Clear cached encoder-side features of source-target attention."""
+        if self.src_tgt_attention:
+            self.src_attn.reset()
+
     def forward(self, ys, yy_mask, xs=None, xy_mask=None, cache=None,
                 xy_aws_prev=None,
                 mode='hard', eps_wait=-1, lmout=None,
-                pos_embs=None, memory=None, u_bias=None, v_bias=None):
+                pos_embs=None, memory=None, u_bias=None, v_bias=None, kv_cache=None, src_cache=False):
         """Transformer decoder forward pass.
 
         Args:
@@ -187,6 +192,11 @@ class TransformerDecoderBlock(nn.Module):
             memory (FloatTensor): `[B, L_prev, d_model]`
             u_bias (FloatTensor): global parameter for TransformerXL
             v_bias (FloatTensor): global parameter for TransformerXL
+            kv_cache (KVCache): key/value cache of self-attention for incremental decoding.
+                ys contains new tokens only, and yy_mask covers all cached tokens.
+            src_cache (bool): reuse encoder-side key/value projections of source-target attention
+                until reset() is called. xs and xy_mask can be shared among `beam` hypotheses
+                by passing them in the shape of `[B, T, d_model]` and `[B, 1, T]` with `[B * beam, 1, d_model]` ys.
         Returns:
             out (FloatTensor): `[B, L, d_model]`
 
@@ -221,7 +231,7 @@ class TransformerDecoderBlock(nn.Module):
         if self.memory_transformer:
             out, self._yy_aws = self.self_attn(cat, ys_q, pos_embs, yy_mask, u_bias, v_bias)
         else:
-            out, self._yy_aws = self.self_attn(ys, ys, ys_q, mask=yy_mask)[:2]  # k/v/q
+            out, self._yy_aws = self.self_attn(ys, ys, ys_q, mask=yy_mask, kv_cache=kv_cache)[:2]  # k/v/q
         out = self.dropout(out) + residual
 
         # attention over encoder stacks
@@ -230,7 +240,8 @@ class TransformerDecoderBlock(nn.Module):
             out = self.norm2(out)
             out, self._xy_aws, self._xy_aws_beta, self._xy_aws_p_choose = self.src_attn(
                 xs, xs, out, mask=xy_mask,  # k/v/q
-                aw_prev=xy_aws_prev, mode=mode, eps_wait=eps_wait)
+                aw_prev=xy_aws_prev, cache=src_cache and 'mocha' not in self.atype,
+                mode=mode, eps_wait=eps_wait)
             out = self.dropout(out) + residual
 
         # LM integration
@@ -7,7 +7,7 @@
 """Utility funcitons for beam search decoding."""
 
 # import logging
-# import math
+import math
 # import numpy as np
 # import os
 # import random
@@ -15,8 +15,6 @@
 import torch
 # import torch.nn as nn
 
-from neural_sp.models.torch_utils import tensor2np
-
 
 class BeamSearch(object):
     def __init__(self, beam_width, eos, ctc_weight, device, beam_width_bwd=0):
@@ -47,21 +45,29 @@ class BeamSearch(object):
             is_finish = True
         return new_hyps, end_hyps, is_finish
 
-    def add_ctc_score(self, hyp, topk_ids, ctc_state, total_scores_topk,
-                      ctc_prefix_scorer, new_chunk=False, backward=False):
-        beam_width = self.beam_width_bwd if backward else self.beam_width
+    def add_ctc_score(self, hyps, topk_ids, ctc_states, total_scores_topk,
+                      ctc_prefix_scorer, peaks=None):
+        """Add CTC prefix scores of the top-K candidates of all hypotheses at once.
+
+        Args:
+            hyps (list): length `n_hyps`, each of which contains a prefix label sequence
+            topk_ids (LongTensor): `[n_hyps, beam_width]`
+            ctc_states (FloatTensor): `[n_hyps, T, 2]`
+            total_scores_topk (FloatTensor): `[n_hyps, beam_width]`
+            ctc_prefix_scorer (CTCPrefixScoreTH): CTC prefix scorer
+            peaks (LongTensor): attention peak of each hypothesis for windowed scoring `[n_hyps]`
+        Returns:
+            new_ctc_states (FloatTensor): `[n_hyps, beam_width, T, 2]`
+            total_scores_ctc (FloatTensor): `[n_hyps, beam_width]`
+            total_scores_topk (FloatTensor): `[n_hyps, beam_width]`
+
+        """
         if ctc_prefix_scorer is None:
-            return None, topk_ids.new_zeros(beam_width), total_scores_topk
+            return None, total_scores_topk.new_zeros(total_scores_topk.size()), total_scores_topk
 
-        ctc_scores, new_ctc_states = ctc_prefix_scorer(hyp, tensor2np(topk_ids[0]), ctc_state,
-                                                       new_chunk=new_chunk)
-        total_scores_ctc = torch.from_numpy(ctc_scores).to(self.device)
+        total_scores_ctc, new_ctc_states = ctc_prefix_scorer(hyps, topk_ids, ctc_states, peaks=peaks)
+        total_scores_ctc = total_scores_ctc.to(self.device)
         total_scores_topk += total_scores_ctc * self.ctc_weight
-        # Sort again
-        total_scores_topk, joint_ids_topk = torch.topk(
-            total_scores_topk, k=beam_width, dim=1, largest=True, sorted=True)
-        topk_ids = topk_ids[:, joint_ids_topk[0]]
-        new_ctc_states = new_ctc_states[joint_ids_topk[0].cpu().numpy()]
         return new_ctc_states, total_scores_ctc, total_scores_topk
 
     def add_lm_score(self, after_topk=True):
@@ -76,3 +82,269 @@ class BeamSearch(object):
                 lmstate = {'hxs': lm_hxs, 'cxs': lm_cxs}
             lmout, lmstate, scores_lm = lm.predict(y, lmstate)
         return lmout, lmstate, scores_lm
+
+
+class BatchBeamSearch(object):
+    """Beam search over all utterances in a mini-batch at once.
+
+    Hypotheses are kept in a flattened `[B * beam_width]` layout, where the
+    hypotheses of the b-th utterance occupy rows `b * beam_width` to
+    `(b + 1) * beam_width - 1`. Finished hypotheses are moved to a pool per
+    utterance, and an utterance stops expanding once its pool is full,
+    all of its hypotheses are pruned, or it reaches its maximum length.
+
+    Args:
+        bs (int): batch size
+        beam_width (int): size of beam
+        eos (int): index for <eos> (shared with <sos>)
+        elens (IntTensor or list): `[B]`
+        max_len_ratio (float): maximum hypothesis length ratio to the encoder length
+        min_len_ratio (float): minimum hypothesis length ratio to the encoder length
+        device (torch.device): device
+
+    """
+
+    def __init__(self, bs, beam_width, eos, elens, max_len_ratio, min_len_ratio, device):
+
+        super(BatchBeamSearch, self).__init__()
+
+        self.bs = bs
+        self.beam_width = beam_width
+        self.eos = eos
+        self.device = device
+        self.n_hyps = bs * beam_width
+
+        elens = [int(elen) for elen in elens]
+        self.ymax = [math.ceil(elen * max_len_ratio) for elen in elens]
+        self.min_lens = torch.tensor([elen * min_len_ratio for elen in elens],
+                                     device=device).unsqueeze(1).repeat([1, beam_width]).view(-1)
+
+        # token sequences including <sos>
+        self.ys = torch.zeros((self.n_hyps, 1), dtype=torch.int64, device=device).fill_(eos)
+        # accumulated scores of each component
+        self.score_att = torch.zeros(self.n_hyps, device=device)
+        self.score_lm = torch.zeros(self.n_hyps, device=device)
+        self.score_ctc = torch.zeros(self.n_hyps, device=device)
+        # total score used for pruning
+        self.score = torch.zeros(self.n_hyps, device=device)
+        # only the first hypothesis of each utterance is expanded at the first step
+        self.alive = torch.zeros(self.n_hyps, dtype=torch.bool, device=device)
+        self.alive[::beam_width] = True
+        self.aws = None  # `[B * beam_width, H, L, T]`
+        self.ctc_states = None  # `[B * beam_width, T, 2]`
+        self.utt_index = torch.arange(bs, device=device).unsqueeze(1).repeat([1, beam_width]).view(-1)
+
+        self.end_hyps = [[] for _ in range(bs)]
+        self.active_hyps = [[] for _ in range(bs)]
+        self.finished = [False] * bs
+        self.offsets = torch.arange(bs, device=device).unsqueeze(1) * beam_width  # `[B, 1]`
+
+    @property
+    def is_finish(self):
+        return all(self.finished)
+
+    @property
+    def n_steps(self):
+        return max(self.ymax)
+
+    def expand(self, x, dim=0):
+        """Repeat utterance-level tensors for all hypotheses.
+
+        Args:
+            x (Tensor): `[B, ...]` (`dim=0`)
+        Returns:
+            x (Tensor): `[B * beam_width, ...]` (`dim=0`)
+
+        """
+        index = torch.arange(x.size(dim), device=x.device).unsqueeze(1).repeat([1, self.beam_width]).view(-1)
+        return x.index_select(dim, index)
+
+    def init_ctc_states(self, ctc_prefix_scorer):
+        self.ctc_states = ctc_prefix_scorer.initial_state(self.utt_index)
+
+    def coverage_penalty(self, aw, cp_threshold, gnmt_decoding, n_heads):
+        """Compute coverage penalty for each hypothesis.
+
+        Args:
+            aw (FloatTensor): attention weights at the current step `[B * beam_width, H, 1, T]`
+            cp_threshold (float): threshold for coverage penalty
+            gnmt_decoding (bool): use GNMT-style coverage penalty
+            n_heads (int): number of attention heads
+        Returns:
+            cp (FloatTensor): `[B * beam_width]`
+
+        """
+        aw_mat = aw if self.aws is None else torch.cat([self.aws, aw], dim=2)
+        aw_mat = aw_mat[:, 0]  # `[B * beam_width, L, T]`
+        if gnmt_decoding:
+            aw_mat = torch.log(aw_mat.sum(-1))
+            cp = torch.where(aw_mat < 0, aw_mat, aw_mat.new_zeros(aw_mat.size())).sum(-1)
+        else:
+            if cp_threshold > 0:
+                aw_mat = torch.where(aw_mat > cp_threshold, aw_mat, aw_mat.new_zeros(aw_mat.size()))
+            cp = aw_mat.sum(-1).sum(-1) / n_heads
+        return cp
+
+    def _add_ctc_score(self, topk_ids, ctc_prefix_scorer, peaks=None):
+        """Compute CTC prefix scores of the top-K candidates of all hypotheses."""
+        ctc_scores, ctc_states = ctc_prefix_scorer(self.ys, topk_ids, self.ctc_states,
+                                                   index=self.utt_index, peaks=peaks)
+        return ctc_scores.to(self.device), ctc_states
+
+    def step(self, scores_att, scores_lm=None, lm_weight=0., lm_before_topk=False,
+             lp_weight=0., gnmt_decoding=False, cp=None, cp_weight=0.,
+             ctc_prefix_scorer=None, ctc_weight=0., ctc_peaks=None, length_norm=False,
+             eos_threshold=1.0, aws=None):
+        """Expand all hypotheses by one token.
+
+        Args:
+            scores_att (FloatTensor): `[B * beam_width, vocab]`
+            scores_lm (FloatTensor): `[B * beam_width, vocab]`
+            lm_weight (float): weight of LM score
+            lm_before_topk (bool): add LM scores before the local top-K selection
+            lp_weight (float): weight of length penalty
+            gnmt_decoding (bool): use GNMT-style length penalty
+            cp (FloatTensor): coverage penalty `[B * beam_width]`
+            cp_weight (float): weight of coverage penalty
+            ctc_prefix_scorer (CTCPrefixScoreTH): CTC prefix scorer over all utterances
+            ctc_weight (float): weight of CTC score
+            ctc_peaks (LongTensor): attention peaks for windowed CTC scoring `[B * beam_width]`
+            length_norm (bool): normalize scores by hypothesis length
+            eos_threshold (float): threshold to emit <eos>
+            aws (FloatTensor): attention weights at the current step `[B * beam_width, H, 1, T]`
+        Returns:
+            index (LongTensor): parent hypothesis index for each new hypothesis `[B * beam_width]`
+
+        """
+        W = self.beam_width
+        i = self.ys.size(1) - 1  # number of output tokens so far
+
+        # Attention scores
+        total_scores_att = self.score_att.unsqueeze(1) + scores_att
+        total_scores = total_scores_att * (1 - ctc_weight)
+        if scores_lm is not None and lm_before_topk:
+            total_scores_lm = self.score_lm.unsqueeze(1) + scores_lm
+            total_scores = total_scores + total_scores_lm * lm_weight
+
+        # Local pruning per hypothesis
+        total_scores_topk, topk_ids = torch.topk(total_scores, k=W, dim=1, largest=True, sorted=True)
+
+        # Add LM score <after> top-K selection
+        if scores_lm is None:
+            total_scores_lm_topk = total_scores_topk.new_zeros(total_scores_topk.size())
+        elif lm_before_topk:
+            total_scores_lm_topk = total_scores_lm.gather(1, topk_ids)
+        else:
+            total_scores_lm_topk = self.score_lm.unsqueeze(1) + scores_lm.gather(1, topk_ids)
+            total_scores_topk += total_scores_lm_topk * lm_weight
+
+        # Add length penalty
+        if lp_weight > 0:
+            if gnmt_decoding:
+                total_scores_topk /= math.pow(6 + i, lp_weight) / math.pow(6, lp_weight)
+            else:
+                total_scores_topk += (i + 1) * lp_weight
+
+        # Add coverage penalty
+        if cp is not None and cp_weight > 0:
+            total_scores_topk += cp.unsqueeze(1) * cp_weight
+
+        # Add CTC score
+        total_scores_ctc_topk = total_scores_topk.new_zeros(total_scores_topk.size())
+        new_ctc_states = None
+        if ctc_prefix_scorer is not None:
+            total_scores_ctc_topk, new_ctc_states = self._add_ctc_score(topk_ids, ctc_prefix_scorer, ctc_peaks)
+            total_scores_topk += total_scores_ctc_topk * ctc_weight
+
+        if length_norm:
+            total_scores_topk /= (i + 1)
+
+        # Exclude short hypotheses and <eos> below the threshold
+        is_eos = topk_ids == self.eos
+        too_short = i < self.min_lens
+        scores_no_eos = scores_att.clone()
+        scores_no_eos[:, self.eos] = float('-inf')
+        max_score_no_eos = scores_no_eos.max(1)[0]
+        below_threshold = scores_att[:, self.eos] <= eos_threshold * max_score_no_eos
+        invalid = is_eos & (too_short | below_threshold).unsqueeze(1)
+        invalid |= ~self.alive.unsqueeze(1)
+        total_scores_topk = total_scores_topk.masked_fill(invalid, float('-inf'))
+
+        # Global pruning per utterance
+        total_scores_topk = total_scores_topk.view(self.bs, W * W)
+        best_scores, best_ids = torch.topk(total_scores_topk, k=W, dim=1, largest=True, sorted=True)
+        index = (best_ids // W + self.offsets).view(-1)  # `[B * beam_width]`
+        cand_ids = (best_ids + self.offsets * W).view(-1)
+        new_tokens = topk_ids.view(-1)[cand_ids]
+        best_scores = best_scores.view(-1)
+
+        # Update hypotheses
+        self.ys = torch.cat([self.ys[index], new_tokens.unsqueeze(1)], dim=1)
+        self.score_att = total_scores_att[index, new_tokens]
+        self.score_lm = total_scores_lm_topk.view(-1)[cand_ids]
+        self.score_ctc = total_scores_ctc_topk.view(-1)[cand_ids]
+        self.score = best_scores
+        if new_ctc_states is not None:
+            self.ctc_states = new_ctc_states.view(-1, *new_ctc_states.size()[2:])[cand_ids]
+        if aws is not None:
+            aws = aws[index]
+            self.aws = aws if self.aws is None else torch.cat([self.aws[index], aws], dim=2)
+
+        # Remove complete hypotheses
+        valid = best_scores != float('-inf')
+        is_end = valid & (new_tokens == self.eos)
+        self.alive = valid & (new_tokens != self.eos)
+        for j in is_end.nonzero().view(-1).tolist():
+            b = j // W
+            if self.finished[b]:
+                continue
+            self.end_hyps[b].append(self._hyp(j))
+        alive = self.alive.view(self.bs, W).sum(1).tolist()
+        for b in range(self.bs):
+            if self.finished[b]:
+                continue
+            if len(self.end_hyps[b]) >= W:
+                self.end_hyps[b] = self.end_hyps[b][:W]
+                self._finish(b)
+            elif alive[b] == 0 or i + 1 >= self.ymax[b]:
+                self._finish(b)
+
+        return index
+
+    def _finish(self, b):
+        """Stop expanding hypotheses of the b-th utterance."""
+        W = self.beam_width
+        # active hypotheses are already sorted by score
+        self.active_hyps[b] = [self._hyp(j) for j in range(b * W, (b + 1) * W) if self.alive[j].item()]
+        self.alive[b * W:(b + 1) * W] = False
+        self.finished[b] = True
+
+    def _hyp(self, j):
+        return {'hyp': self.ys[j].tolist(),
+                'score': self.score[j].item(),
+                'score_att': self.score_att[j].item(),
+                'score_ctc': self.score_ctc[j].item(),
+                'score_lm': self.score_lm[j].item(),
+                'aws': self.aws[j] if self.aws is not None else None}
+
+    def finalize(self, nbest=1):
+        """Collect N-best hypotheses of each utterance.
+
+        Args:
+            nbest (int): number of N-best hypotheses
+        Returns:
+            end_hyps (list): length `B`, each of which contains a list of dicts
+
+        """
+        end_hyps = []
+        for b in range(self.bs):
+            if not self.finished[b]:
+                self._finish(b)
+            end_hyps_b = self.end_hyps[b][:]
+            active_b = self.active_hyps[b]
+            if len(end_hyps_b) == 0:
+                end_hyps_b = active_b
+            elif len(end_hyps_b) < nbest and nbest > 1:
+                end_hyps_b.extend(active_b[:nbest - len(end_hyps_b)])
+            end_hyps.append(end_hyps_b)
+        return end_hyps
@@ -7,13 +7,13 @@
 """CTC decoder."""
 
 from collections import OrderedDict
-from itertools import groupby
 import logging
 import numpy as np
 import random
 import torch
 import torch.nn as nn
 
+from neural_sp.models.criterion import float32_loss
 from neural_sp.models.criterion import kldiv_lsm_ctc
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import make_pad_mask
@@ -126,6 +126,7 @@ class CTC(DecoderBase):
 
         return loss, trigger_points
 
+    @float32_loss
     def loss_fn(self, logits, ys_ctc, elens, ylens):
         loss = self.warpctc_loss(logits.transpose(1, 0),  # time-major
                                  ys_ctc, elens.cpu(), ylens).to(self.device)
@@ -140,69 +141,35 @@ class CTC(DecoderBase):
             eouts (FloatTensor): `[B, T, enc_n_units]`
             elens (IntTensor): `[B]`
         Returns:
-            hyps (IntTensor): `[B, L]`
+            trigger_points (IntTensor): `[B, L]`
 
         """
-        bs, xmax, _ = eouts.size()
-        log_probs = torch.log_softmax(self.output(eouts), dim=-1)
-        best_paths = log_probs.argmax(-1)  # `[B, L]`
-
-        hyps = []
-        for b in range(bs):
-            indices = [best_paths[b, t].item() for t in range(elens[b])]
-
-            # Step 1. Collapse repeated labels
-            collapsed_indices = [x[0] for x in groupby(indices)]
-
-            # Step 2. Remove all blank labels
-            best_hyp = [x for x in filter(lambda x: x != self.blank, collapsed_indices)]
-            hyps.append(best_hyp)
-
-        ymax = max([len(h) for h in hyps])
-
-        # pick up trigger points
-        trigger_points = log_probs.new_zeros((bs, ymax + 1), dtype=torch.int32)  # +1 for <eos>
-        for b in range(bs):
-            n_triggers = 0
-            for t in range(elens[b]):
-                token_idx = best_paths[b, t]
-
-                if token_idx == self.blank:
-                    continue
-                if not (t == 0 or token_idx != best_paths[b, t - 1]):
-                    continue
-
-                # NOTE: select the most left trigger points
-                trigger_points[b, n_triggers] = t
-                n_triggers += 1
-
+        bs = eouts.size(0)
+        best_paths = self.output(eouts).argmax(-1)  # `[B, T]`
+        emitted = _emission_mask(best_paths, elens, self.blank)
+        b_idx, t_idx = emitted.nonzero(as_tuple=True)
+        positions = emitted.cumsum(1)[b_idx, t_idx] - 1
+        ymax = int(emitted.sum(1).max())
+
+        # NOTE: select the most left trigger points
+        trigger_points = eouts.new_zeros((bs, ymax + 1), dtype=torch.int32)  # +1 for <eos>
+        trigger_points[b_idx, positions] = t_idx.int()
         return trigger_points
 
-    def greedy(self, eouts, elens):
+    def greedy(self, eouts, elens, return_timestamps=False):
         """Greedy decoding.
 
         Args:
             eouts (FloatTensor): `[B, T, enc_n_units]`
             elens (np.ndarray): `[B]`
+            return_timestamps (bool): return encoder frame indices of emitted tokens
         Returns:
-            hyps (np.ndarray): Best path hypothesis. `[B, L]`
+            hyps (list): A list of length `[B]`, which contains arrays of size `[L]`
+            timestamps (list): A list of length `[B]`, which contains arrays of size `[L]`
 
         """
         log_probs = torch.log_softmax(self.output(eouts), dim=-1)
-        best_paths = log_probs.argmax(-1)  # `[B, L]`
-
-        hyps = []
-        for b in range(eouts.size(0)):
-            indices = [best_paths[b, t].item() for t in range(elens[b])]
-
-            # Step 1. Collapse repeated labels
-            collapsed_indices = [x[0] for x in groupby(indices)]
-
-            # Step 2. Remove all blank labels
-            best_hyp = [x for x in filter(lambda x: x != self.blank, collapsed_indices)]
-            hyps.append(np.array(best_hyp))
-
-        return np.array(hyps)
+        return ctc_greedy_decode(log_probs, elens, self.blank, return_timestamps)
 
     def beam_search(self, eouts, elens, params, idx2token,
                     lm=None, lm_second=None, lm_second_rev=None,
@@ -230,12 +197,11 @@ class CTC(DecoderBase):
             best_hyps (list): Best path hypothesis. `[B, L]`
 
         """
-        bs = eouts.size(0)
-
         beam_width = params['recog_beam_width']
         lp_weight = params['recog_length_penalty']
         lm_weight = params['recog_lm_weight']
         lm_weight_second = params['recog_lm_second_weight']
+        lm_weight_second_rev = params['recog_lm_bwd_weight']
 
         if lm is not None:
             assert lm_weight > 0
@@ -243,111 +209,27 @@ class CTC(DecoderBase):
         if lm_second is not None:
             assert lm_weight_second > 0
             lm_second.eval()
+        if lm_second_rev is not None:
+            assert lm_weight_second_rev > 0
+            lm_second_rev.eval()
 
-        best_hyps = []
         log_probs = torch.log_softmax(self.output(eouts), dim=-1)
-        for b in range(bs):
-            # Elements in the beam are (prefix, (p_b, p_no_blank))
-            # Initialize the beam with the empty sequence, a probability of
-            # 1 for ending in blank and zero for ending in non-blank (in log space).
-            beam = [{'hyp': [self.eos],  # <eos> is used for LM
-                     'p_b': LOG_1,
-                     'p_nb': LOG_0,
-                     'score_lm': LOG_1,
-                     'lmstate': None}]
+        end_hyps = ctc_prefix_beam_search(log_probs, elens, self.blank, self.eos, beam_width,
+                                          lp_weight, lm, lm_weight)
 
-            for t in range(elens[b]):
-                new_beam = []
-
-                # Pick up the top-k scores
-                log_probs_topk, topk_ids = torch.topk(
-                    log_probs[b:b + 1, t], k=min(beam_width, self.vocab), dim=-1, largest=True, sorted=True)
-
-                for i_beam in range(len(beam)):
-                    hyp = beam[i_beam]['hyp'][:]
-                    p_b = beam[i_beam]['p_b']
-                    p_nb = beam[i_beam]['p_nb']
-                    score_lm = beam[i_beam]['score_lm']
-
-                    # case 1. hyp is not extended
-                    new_p_b = np.logaddexp(p_b + log_probs[b, t, self.blank].item(),
-                                           p_nb + log_probs[b, t, self.blank].item())
-                    if len(hyp) > 1:
-                        new_p_nb = p_nb + log_probs[b, t, hyp[-1]].item()
-                    else:
-                        new_p_nb = LOG_0
-                    score_ctc = np.logaddexp(new_p_b, new_p_nb)
-                    score_lp = len(hyp[1:]) * lp_weight
-                    new_beam.append({'hyp': hyp,
-                                     'score': score_ctc + score_lm + score_lp,
-                                     'p_b': new_p_b,
-                                     'p_nb': new_p_nb,
-                                     'score_ctc': score_ctc,
-                                     'score_lm': score_lm,
-                                     'score_lp': score_lp,
-                                     'lmstate': beam[i_beam]['lmstate']})
-
-                    # Update LM states for shallow fusion
-                    if lm is not None:
-                        _, lmstate, lm_log_probs = lm.predict(
-                            eouts.new_zeros(1, 1).fill_(hyp[-1]), beam[i_beam]['lmstate'])
-                    else:
-                        lmstate = None
-
-                    # case 2. hyp is extended
-                    new_p_b = LOG_0
-                    for c in tensor2np(topk_ids)[0]:
-                        p_t = log_probs[b, t, c].item()
-
-                        if c == self.blank:
-                            continue
-
-                        c_prev = hyp[-1] if len(hyp) > 1 else None
-                        if c == c_prev:
-                            new_p_nb = p_b + p_t
-                            # TODO(hirofumi): apply character LM here
-                        else:
-                            new_p_nb = np.logaddexp(p_b + p_t, p_nb + p_t)
-                            # TODO(hirofumi): apply character LM here
-                            if c == self.space:
-                                pass
-                                # TODO(hirofumi): apply word LM here
-
-                        score_ctc = np.logaddexp(new_p_b, new_p_nb)
-                        score_lp = (len(hyp[1:]) + 1) * lp_weight
-                        if lm_weight > 0 and lm is not None:
-                            local_score_lm = lm_log_probs[0, 0, c].item() * lm_weight
-                            score_lm += local_score_lm
-                        new_beam.append({'hyp': hyp + [c],
-                                         'score': score_ctc + score_lm + score_lp,
-                                         'p_b': new_p_b,
-                                         'p_nb': new_p_nb,
-                                         'score_ctc': score_ctc,
-                                         'score_lm': score_lm,
-                                         'score_lp': score_lp,
-                                         'lmstate': lmstate})
-
-                # Pruning
-                beam = sorted(new_beam, key=lambda x: x['score'], reverse=True)[:beam_width]
-
-            # Rescoing alignments
-            if lm_second is not None:
-                new_beam = []
-                for i_beam in range(len(beam)):
-                    ys = [np2tensor(np.fromiter(beam[i_beam]['hyp'], dtype=np.int64), self.device)]
-                    ys_pad = pad_list(ys, lm_second.pad)
-                    _, _, lm_log_probs = lm_second.predict(ys_pad, None)
-                    score_ctc = np.logaddexp(beam[i_beam]['p_b'], beam[i_beam]['p_nb'])
-                    score_lm = lm_log_probs.sum() * lm_weight_second
-                    score_lp = len(beam[i_beam]['hyp'][1:]) * lp_weight
-                    new_beam.append({'hyp': beam[i_beam]['hyp'],
-                                     'score': score_ctc + score_lm + score_lp,
-                                     'score_ctc': score_ctc,
-                                     'score_lp': score_lp,
-                                     'score_lm': score_lm})
-                beam = sorted(new_beam, key=lambda x: x['score'], reverse=True)
-
-            best_hyps.append(np.array(beam[0]['hyp'][1:]))
+        # Rescoing alignments (all utterances at once)
+        if lm_second is not None:
+            self.lm_rescoring([h for beam in end_hyps for h in beam],
+                              lm_second, lm_weight_second, tag='second')
+        if lm_second_rev is not None:
+            self.lm_rescoring([h for beam in end_hyps for h in beam],
+                              lm_second_rev, lm_weight_second_rev, reverse=True, tag='second_rev')
+
+        best_hyps = []
+        for b in range(len(end_hyps)):
+            beam = sorted(end_hyps[b], key=lambda x: x['score'], reverse=True)
+
+            best_hyps.append(np.array(beam[0]['hyp'][1:-1]))
 
             if idx2token is not None:
                 if utt_ids is not None:
@@ -357,7 +239,7 @@ class CTC(DecoderBase):
                 for k in range(len(beam)):
                     if refs_id is not None:
                         logger.info('Ref: %s' % idx2token(refs_id[b]))
-                    logger.info('Hyp: %s' % idx2token(beam[k]['hyp'][1:]))
+                    logger.info('Hyp: %s' % idx2token(beam[k]['hyp'][1:-1]))
                     logger.info('log prob (hyp): %.7f' % beam[k]['score'])
                     logger.info('log prob (hyp, ctc): %.7f' % (beam[k]['score_ctc']))
                     logger.info('log prob (hyp, lp): %.7f' % (beam[k]['score_lp'] * lp_weight))
@@ -366,9 +248,245 @@ class CTC(DecoderBase):
                     if lm_second is not None:
                         logger.info('log prob (hyp, second-path lm): %.7f' %
                                     (beam[k]['score_lm_second'] * lm_weight_second))
+                    if lm_second_rev is not None:
+                        logger.info('log prob (hyp, second-path lm, reverse): %.7f' %
+                                    (beam[k]['score_lm_second_rev'] * lm_weight_second_rev))
                     logger.info('-' * 50)
 
-        return np.array(best_hyps)
+        return best_hyps
+
+
+def _emission_mask(best_paths, elens, blank):
+    """Mark frames where a token is emitted in best paths.
+
+    Args:
+        best_paths (LongTensor): `[B, T]`
+        elens (IntTensor/np.ndarray/list): `[B]`
+        blank (int): index for <blank>
+    Returns:
+        emitted (BoolTensor): `[B, T]`, True for the first frame of each
+            non-blank run within the valid length
+
+    """
+    device = best_paths.device
+    elens = torch.as_tensor(elens, device=device)
+    emitted = best_paths != blank
+    emitted[:, 1:] &= best_paths[:, 1:] != best_paths[:, :-1]  # collapse repeated labels
+    emitted &= torch.arange(best_paths.size(1), device=device).unsqueeze(0) < elens.unsqueeze(1)
+    return emitted
+
+
+def ctc_greedy_decode(log_probs, elens, blank, return_timestamps=False):
+    """Greedy decoding over all utterances in a mini-batch at once.
+
+    Tokens are packed on the device and copied to host memory with
+    a single transfer per mini-batch.
+
+    Args:
+        log_probs (FloatTensor): `[B, T, vocab]`
+        elens (IntTensor/np.ndarray/list): `[B]`
+        blank (int): index for <blank>
+        return_timestamps (bool): return frame indices of emitted tokens
+    Returns:
+        hyps (list): A list of length `[B]`, which contains arrays of size `[L]`
+        timestamps (list): A list of length `[B]`, which contains arrays of size `[L]`
+
+    """
+    best_paths = log_probs.argmax(-1)  # `[B, T]`
+    emitted = _emission_mask(best_paths, elens, blank)
+    n_tokens = emitted.sum(1)
+    b_idx, t_idx = emitted.nonzero(as_tuple=True)  # in the order of (utterance, frame)
+    packed = torch.cat([n_tokens, best_paths[b_idx, t_idx], t_idx])
+    packed = tensor2np(packed)
+
+    bs = best_paths.size(0)
+    n_tokens, tokens, frames = np.split(packed, [bs, bs + len(b_idx)])
+    offsets = np.cumsum(n_tokens)[:-1]
+    hyps = np.split(tokens, offsets)
+    if return_timestamps:
+        return hyps, np.split(frames, offsets)
+    return hyps
+
+
+# moduli and bases of the double rolling hash to identify prefixes in the beam
+HASH_MODULI = (2147483647, 2147483629)
+HASH_BASES = (1000003, 999983)
+
+
+def ctc_prefix_beam_search(log_probs, elens, blank, eos, beam_width, lp_weight=0.,
+                           lm=None, lm_weight=0.):
+    """CTC prefix beam search over all utterances in a mini-batch at once.
+
+    Probabilities of each prefix ending in blank and non-blank are kept in
+    `[B, beam_width]` tensors. At every frame, each prefix is extended by the
+    top-K tokens of the posteriors, extensions identical to a prefix already
+    in the beam are merged into it, and the best `beam_width` prefixes are
+    kept per utterance. Prefixes are identified by rolling hashes, and token
+    sequences are recovered from back-pointers at the end.
+    For shallow fusion, the LM is called once per frame for all prefixes.
+
+    Args:
+        log_probs (FloatTensor): CTC log probabilities `[B, T, vocab]`
+        elens (IntTensor or list): `[B]`
+        blank (int): index for <blank>
+        eos (int): index for <eos> (used as <sos> for LM)
+        beam_width (int): size of beam
+        lp_weight (float): weight of length penalty (per token)
+        lm (RNNLM or TransformerLM): LM for shallow fusion
+        lm_weight (float): weight of LM score
+    Returns:
+        end_hyps (list): length `B`, each of which contains a list of dicts
+            (hyp, score, score_ctc, score_lm, score_lp) sorted by score.
+            hyp is a list of token indices starting and ending with <eos>.
+
+    """
+    bs, xmax, vocab = log_probs.size()
+    device = log_probs.device
+    W = beam_width
+    K = min(beam_width, vocab - 1)
+    NEG_INF = float('-inf')
+    log_probs = log_probs.float()
+    elens = torch.as_tensor([int(elen) for elen in elens], device=device)
+
+    # log probabilities of prefixes ending in blank/non-blank
+    p_b = log_probs.new_full((bs, W), NEG_INF)
+    p_b[:, 0] = LOG_1  # only the empty prefix is valid at first
+    p_nb = log_probs.new_full((bs, W), NEG_INF)
+    ylens = torch.zeros((bs, W), dtype=torch.int64, device=device)  # excluding <sos>
+    last = torch.zeros((bs, W), dtype=torch.int64, device=device).fill_(eos)
+    moduli = torch.tensor(HASH_MODULI, device=device)
+    bases = torch.tensor(HASH_BASES, device=device)
+    hashes = torch.zeros((bs, W, 2), dtype=torch.int64, device=device)
+    hashes_parent = torch.zeros((bs, W, 2), dtype=torch.int64, device=device) - 1
+    parents, tokens = [], []  # back-pointers
+
+    # LM states of all prefixes `[B * W]`
+    score_lm = log_probs.new_zeros(bs, W)
+    scores_lm = None
+    if lm is not None:
+        lm_state_dict = None
+        ys_lm = None
+        y = last.new_zeros(bs * W, 1).fill_(eos)
+        _, lm_state, scores_lm = lm.predict(y, None)
+        scores_lm = scores_lm[:, -1].float().view(bs, W, -1)
+        if isinstance(lm_state, dict):  # RNNLM
+            lm_state_dict = lm_state
+        else:
+            ys_lm = y  # prefixes including <sos> for TransformerLM
+
+    offsets = torch.arange(bs, device=device).unsqueeze(1) * W  # `[B, 1]`
+    beam_ids = torch.arange(W, device=device).unsqueeze(0).repeat([bs, 1])
+    for t in range(int(elens.max())):
+        lp = log_probs[:, t]  # `[B, vocab]`
+        nonempty = ylens > 0
+        p_total = torch.logaddexp(p_b, p_nb)
+
+        # case 1. prefix is not extended
+        stay_p_b = p_total + lp[:, blank:blank + 1]
+        stay_p_nb = torch.where(nonempty, p_nb + lp.gather(1, last), p_nb.new_full(p_nb.size(), NEG_INF))
+
+        # case 2. prefix is extended by one of the top-K tokens
+        lp_no_blank = lp.clone()
+        lp_no_blank[:, blank] = NEG_INF
+        lp_topk, topk_ids = torch.topk(lp_no_blank, k=K, dim=1)  # `[B, K]`
+        is_repeat = (topk_ids.unsqueeze(1) == last.unsqueeze(2)) & nonempty.unsqueeze(2)  # `[B, W, K]`
+        ext_p_nb = torch.where(is_repeat, p_b.unsqueeze(2), p_total.unsqueeze(2)) + lp_topk.unsqueeze(1)
+
+        # Merge extensions of the i-th prefix into the j-th prefix when j = i + [last_j]
+        is_parent = (hashes_parent.unsqueeze(2) == hashes.unsqueeze(1)).all(-1)  # `[B, W (j), W (i)]`
+        is_parent &= (ylens.unsqueeze(2) == ylens.unsqueeze(1) + 1) & (p_total > NEG_INF).unsqueeze(2)
+        is_repeat_ji = (last.unsqueeze(2) == last.unsqueeze(1)) & nonempty.unsqueeze(1)
+        merged_p_nb = torch.where(is_repeat_ji, p_b.unsqueeze(1), p_total.unsqueeze(1)) + \
+            lp.gather(1, last).unsqueeze(2)
+        merged_p_nb = merged_p_nb.masked_fill(~is_parent, NEG_INF).logsumexp(dim=2)
+        stay_p_nb = torch.logaddexp(stay_p_nb, merged_p_nb)
+        is_dup = (is_parent.unsqueeze(3) & (last.unsqueeze(2) == topk_ids.unsqueeze(1)).unsqueeze(2)).any(1)
+        ext_p_nb = ext_p_nb.masked_fill(is_dup, NEG_INF)
+
+        # Scoring
+        ext_score_lm = score_lm.unsqueeze(2)
+        if lm is not None:
+            ext_score_lm = ext_score_lm + scores_lm.gather(2, topk_ids.unsqueeze(1).repeat([1, W, 1]))
+        stay_score = torch.logaddexp(stay_p_b, stay_p_nb) + score_lm * lm_weight + ylens * lp_weight
+        ext_score = ext_p_nb + ext_score_lm * lm_weight + (ylens + 1).unsqueeze(2) * lp_weight
+        scores = torch.cat([stay_score, ext_score.view(bs, W * K)], dim=1)  # `[B, W * (K + 1)]`
+
+        # Pruning (finished utterances are kept as they are)
+        _, best_ids = torch.topk(scores, k=W, dim=1)
+        active = (t < elens).unsqueeze(1)
+        best_ids = torch.where(active, best_ids, beam_ids)
+        is_ext = best_ids >= W
+        ext_ids = (best_ids - W).clamp(min=0)  # index in `[W * K]`
+        parent = torch.where(is_ext, ext_ids // K, best_ids)
+        token = torch.where(is_ext, topk_ids.gather(1, ext_ids % K), torch.full_like(best_ids, -1))
+
+        p_b = torch.where(active, torch.where(is_ext, p_b.new_full(p_b.size(), NEG_INF),
+                                              stay_p_b.gather(1, parent)), p_b)
+        p_nb = torch.where(active, torch.where(is_ext, ext_p_nb.view(bs, -1).gather(1, ext_ids),
+                                               stay_p_nb.gather(1, parent)), p_nb)
+        score_lm = torch.where(is_ext, ext_score_lm.expand(bs, W, K).reshape(bs, -1).gather(1, ext_ids),
+                               score_lm.gather(1, parent))
+        hashes_prev = hashes.gather(1, parent.unsqueeze(2).repeat([1, 1, 2]))
+        hashes = torch.where(is_ext.unsqueeze(2), (hashes_prev * bases + token.unsqueeze(2) + 1) % moduli, hashes_prev)
+        hashes_parent = torch.where(is_ext.unsqueeze(2), hashes_prev,
+                                    hashes_parent.gather(1, parent.unsqueeze(2).repeat([1, 1, 2])))
+        ylens = ylens.gather(1, parent) + is_ext.long()
+        last = torch.where(is_ext, token, last.gather(1, parent))
+        parents.append(parent)
+        tokens.append(token)
+
+        # Update LM states of extended prefixes
+        if lm is not None:
+            index = (parent + offsets).view(-1)
+            scores_lm = scores_lm.view(bs * W, -1)[index]
+            if lm_state_dict is not None:
+                lm_state_dict = {k: v.index_select(1, index) if v is not None else None
+                                 for k, v in lm_state_dict.items()}
+                _, lm_state, scores_lm_new = lm.predict(last.view(-1, 1), lm_state_dict)
+                is_ext_flat = is_ext.view(1, -1, 1)
+                lm_state_dict = {k: torch.where(is_ext_flat, v, lm_state_dict[k]) if v is not None else None
+                                 for k, v in lm_state.items()}
+                scores_lm = torch.where(is_ext.view(-1, 1), scores_lm_new[:, -1].float(), scores_lm)
+            else:
+                ys_lm = torch.cat([ys_lm[index], ys_lm.new_zeros(bs * W, 1).fill_(lm.pad)], dim=1)
+                positions = torch.where(is_ext, ylens, ys_lm.size(1) - 1)
+                ys_lm.scatter_(1, positions.view(-1, 1), torch.where(is_ext, token, lm.pad).view(-1, 1))
+                # NOTE: padded tokens are never attended due to the causal mask
+                rows = is_ext.view(-1).nonzero().view(-1)
+                if rows.numel() > 0:
+                    ymax = int(ylens.view(-1)[rows].max()) + 1
+                    _, _, scores_lm_new = lm.predict(ys_lm[rows, :ymax], None)
+                    scores_lm_new = scores_lm_new[torch.arange(rows.numel(), device=device), ylens.view(-1)[rows]]
+                    scores_lm[rows] = scores_lm_new.float()
+            scores_lm = scores_lm.view(bs, W, -1)
+
+    # Recover token sequences from back-pointers with a single host transfer
+    scores_ctc = torch.logaddexp(p_b, p_nb)
+    scores = scores_ctc + score_lm * lm_weight + ylens * lp_weight
+    if len(parents) > 0:
+        parents = torch.stack(parents).tolist()
+        tokens = torch.stack(tokens).tolist()
+    scores, scores_ctc, score_lm, ylens = scores.tolist(), scores_ctc.tolist(), score_lm.tolist(), ylens.tolist()
+
+    end_hyps = []
+    for b in range(bs):
+        hyps = []
+        for j in range(W):
+            if scores[b][j] == NEG_INF and len(hyps) > 0:
+                continue
+            hyp = []
+            k = j
+            for t in range(len(parents) - 1, -1, -1):
+                if tokens[t][b][k] >= 0:
+                    hyp.append(tokens[t][b][k])
+                k = parents[t][b][k]
+            hyps.append({'hyp': [eos] + hyp[::-1] + [eos],
+                         'score': scores[b][j],
+                         'score_ctc': scores_ctc[b][j],
+                         'score_lm': score_lm[b][j],
+                         'score_lp': ylens[b][j]})
+        end_hyps.append(sorted(hyps, key=lambda x: x['score'], reverse=True))
+    return end_hyps
 
 
 def _label_to_path(labels, blank):
@@ -588,7 +706,7 @@ class CTCPrefixScore(object):
     def __init__(self, log_probs, blank, eos, truncate=False):
         """
         Args:
-            log_probs (np.ndarray):
+            log_probs (np.ndarray): CTC states are computed in the same precision
             blank (int): index of <blank>
             eos (int): index of <eos>
             truncate (bool): restart prefix search from the previous CTC spike
@@ -614,7 +732,7 @@ class CTCPrefixScore(object):
         # initial CTC state is made of a frame x 2 tensor that corresponds to
         # r_t^n(<sos>) and r_t^b(<sos>), where 0 and 1 of axis=1 represent
         # superscripts n and b (non-blank and blank), respectively.
-        r = np.full((self.xlen, 2), self.log0, dtype=np.float32)
+        r = np.full((self.xlen, 2), self.log0, dtype=self.log_probs.dtype)
         r[0, 1] = self.log_probs[0, self.blank]
         for i in range(1, self.xlen):
             r[i, 1] = r[i - 1, 1] + self.log_probs[i, self.blank]
@@ -643,7 +761,7 @@ class CTCPrefixScore(object):
         ylen = len(hyp) - 1  # ignore sos
         # new CTC states are prepared as a frame x (n or b) x n_labels tensor
         # that corresponds to r_t^n(h) and r_t^b(h).
-        r = np.ndarray((self.xlen, 2, beam_width), dtype=np.float32)
+        r = np.ndarray((self.xlen, 2, beam_width), dtype=self.log_probs.dtype)
         xs = self.log_probs[:, cs]
         if ylen == 0:
             r[0, 0] = xs[0]
@@ -654,7 +772,7 @@ class CTCPrefixScore(object):
         # Initialize CTC state for the new chunk
         if new_chunk and self.xlen_prev > 0:
             xlen_prev = r_prev.shape[0]
-            r_new = np.full((self.xlen - xlen_prev, 2), self.log0, dtype=np.float32)
+            r_new = np.full((self.xlen - xlen_prev, 2), self.log0, dtype=self.log_probs.dtype)
             r_new[0, 1] = r_prev[xlen_prev - 1, 1] + self.log_probs[xlen_prev, self.blank]
             for i in range(xlen_prev + 1, self.xlen):
                 r_new[i - xlen_prev, 1] = r_new[i - xlen_prev - 1, 1] + self.log_probs[i, self.blank]
@@ -664,7 +782,7 @@ class CTCPrefixScore(object):
         r_sum = np.logaddexp(r_prev[:, 0], r_prev[:, 1])  # log(r_t^n(g) + r_t^b(g))
         last = hyp[-1]
         if ylen > 0 and last in cs:
-            log_phi = np.ndarray((self.xlen, beam_width), dtype=np.float32)
+            log_phi = np.ndarray((self.xlen, beam_width), dtype=self.log_probs.dtype)
             for k in range(beam_width):
                 log_phi[:, k] = r_sum if cs[k] != last else r_prev[:, 1]
         else:
@@ -689,3 +807,172 @@ class CTCPrefixScore(object):
         # return the log prefix probability and CTC states, where the label axis
         # of the CTC states is moved to the first axis to slice it easily
         return log_psi, np.rollaxis(r, 2)
+
+
+class CTCPrefixScoreTH(object):
+    """Compute CTC label sequence scores of multiple hypotheses in parallel.
+
+    This is a batched torch version of CTCPrefixScore. Prefix scores of all
+    hypotheses (of all utterances in a mini-batch) and all of their candidate
+    labels are computed at once. The forward recursion over time is linear in
+    the probability domain, so it is solved with cumulative sums and
+    cumulative log-sum-exp operations instead of a loop over frames.
+
+    Args:
+        log_probs (FloatTensor): `[B, T, vocab]`
+        xlens (IntTensor or list): `[B]`
+        blank (int): index of <blank>
+        eos (int): index of <eos>
+        margin (int): restrict prefix scoring to frames within this margin
+            around the attention peak of each hypothesis (0: disabled)
+        backward (bool): flip each input sequence along the time axis
+
+    """
+
+    def __init__(self, log_probs, xlens, blank, eos, margin=0, backward=False):
+
+        self.blank = blank
+        self.eos = eos
+        self.margin = margin
+        self.log0 = LOG_0
+        self.device = log_probs.device
+
+        xlens = torch.as_tensor(xlens, dtype=torch.int64, device=self.device)
+        if backward:
+            log_probs = _flip_label_probability(log_probs.transpose(1, 0), xlens.cpu()).transpose(1, 0)
+        # NOTE: the recursion is computed in double precision because cumulative sums
+        # over long sequences lose precision in float32
+        self.log_probs = log_probs.double()  # `[B, T, vocab]`
+        self.xlens = xlens
+        self.dtype = log_probs.dtype
+
+    @property
+    def xmax(self):
+        return self.log_probs.size(1)
+
+    def _index(self, n_hyps, index):
+        if index is None:
+            return torch.zeros(n_hyps, dtype=torch.int64, device=self.device)
+        return index.to(self.device)
+
+    def initial_state(self, index=None):
+        """Obtain initial CTC states.
+
+        Args:
+            index (LongTensor): utterance index of each hypothesis `[N]`
+        Returns:
+            ctc_states (FloatTensor): `[N, T, 2]`
+
+        """
+        index = self._index(1, index)
+        # initial CTC state is made of a frame x 2 tensor that corresponds to
+        # r_t^n(<sos>) and r_t^b(<sos>), where 0 and 1 of the last axis represent
+        # superscripts n and b (non-blank and blank), respectively.
+        r_b = torch.cumsum(self.log_probs[index, :, self.blank], dim=1)
+        r_n = r_b.new_full(r_b.size(), self.log0)
+        return torch.stack([r_n, r_b], dim=-1)
+
+    def extend(self, log_probs_chunk):
+        """Append log probabilities of a new chunk for streaming decoding.
+
+        CTC states computed on the previous chunks are extended to the new frames
+        when they are fed to __call__.
+
+        Args:
+            log_probs_chunk (FloatTensor): `[B, T_chunk, vocab]`
+
+        """
+        self.log_probs = torch.cat([self.log_probs, log_probs_chunk.double()], dim=1)
+        self.xlens = self.xlens + log_probs_chunk.size(1)
+
+    def _extend_state(self, r_prev, index):
+        """Extend CTC states to frames appended after they were computed."""
+        xlen_prev = r_prev.size(1)
+        if xlen_prev == self.xmax:
+            return r_prev
+        r_b = r_prev[:, -1:, 1] + torch.cumsum(self.log_probs[index, xlen_prev:, self.blank], dim=1)
+        r_n = r_b.new_full(r_b.size(), self.log0)
+        return torch.cat([r_prev, torch.stack([r_n, r_b], dim=-1)], dim=1)
+
+    def __call__(self, hyps, cs, r_prev, index=None, peaks=None):
+        """Compute CTC prefix scores for next labels.
+
+        Args:
+            hyps (list or LongTensor): prefix label sequences including <sos>.
+                A list of length `N` or a LongTensor of size `[N, L]`
+            cs (LongTensor): next labels of each hypothesis `[N, K]`
+            r_prev (FloatTensor): previous CTC states `[N, T, 2]`
+            index (LongTensor): utterance index of each hypothesis `[N]`
+            peaks (LongTensor): attention peak of each hypothesis `[N]`
+        Returns:
+            log_psi (FloatTensor): `[N, K]`
+            ctc_states (FloatTensor): `[N, K, T, 2]`
+
+        """
+        n_hyps, k = cs.size()
+        xmax = self.xmax
+        index = self._index(n_hyps, index)
+        cs = cs.to(self.device)
+        if torch.is_tensor(hyps):
+            ylens = hyps.new_full((n_hyps,), hyps.size(1) - 1)  # ignore sos
+            last = hyps[:, -1]
+        else:
+            ylens = torch.tensor([len(hyp) - 1 for hyp in hyps], dtype=torch.int64)
+            last = torch.tensor([hyp[-1] for hyp in hyps], dtype=torch.int64)
+        ylens, last = ylens.to(self.device), last.to(self.device)
+        r_prev = self._extend_state(r_prev.double(), index)
+        xlens = self.xlens[index]
+
+        # frames to be computed
+        start = ylens.clamp(min=1)
+        end = xlens
+        if self.margin > 0 and peaks is not None:
+            peaks = peaks.to(self.device)
+            start = torch.max(start, peaks - self.margin)
+            end = torch.min(end, peaks + self.margin + 1)
+        t = torch.arange(xmax, device=self.device)
+        valid = (t >= start[:, None]) & (t < end[:, None])  # `[N, T]`
+        is_init = t == (start - 1)[:, None]  # `[N, T]`
+
+        xs = self.log_probs[index[:, None, None], t[None, None, :], cs[:, :, None]]  # `[N, K, T]`
+        xs_blank = self.log_probs[index, :, self.blank]  # `[N, T]`
+
+        # prepare forward probabilities for the last label
+        r_sum = torch.logsumexp(r_prev, dim=-1)  # log(r_t^n(g) + r_t^b(g)), `[N, T]`
+        same = ((cs == last[:, None]) & (ylens > 0)[:, None]).unsqueeze(2)  # `[N, K, 1]`
+        log_phi = torch.where(same, r_prev[:, None, :, 1], r_sum[:, None, :])  # `[N, K, T]`
+        log_phi_prev = torch.cat([log_phi.new_full((n_hyps, k, 1), self.log0), log_phi[:, :, :-1]], dim=2)
+
+        # initial states at the (start - 1)-th frame
+        r_init = xs.new_full((n_hyps, k), self.log0)
+        first = (ylens == 0) & (start == 1)
+        r_init[first] = xs[first, :, 0]
+
+        # compute forward probabilities log(r_t^n(h)), log(r_t^b(h)) in closed form:
+        #   r_t^n(h) = x_t * (r_{t-1}^n(h) + phi_{t-1})
+        #   r_t^b(h) = x_t^b * (r_{t-1}^n(h) + r_{t-1}^b(h))
+        NEG_INF = float('-inf')
+        cx = torch.cumsum(xs.masked_fill(~valid[:, None], 0), dim=2)
+        cx_prev = torch.cat([cx.new_zeros(n_hyps, k, 1), cx[:, :, :-1]], dim=2)
+        a = (log_phi_prev - cx_prev).masked_fill(~valid[:, None], NEG_INF)
+        a = torch.where(is_init[:, None], r_init[:, :, None], a)
+        r_n = cx + torch.logcumsumexp(a, dim=2)
+        r_n = r_n.masked_fill(~(valid | is_init)[:, None], self.log0)
+
+        cb = torch.cumsum(xs_blank.masked_fill(~valid, 0), dim=1)[:, None]
+        cb_prev = torch.cat([cb.new_zeros(n_hyps, 1, 1), cb[:, :, :-1]], dim=2)
+        r_n_prev = torch.cat([r_n.new_full((n_hyps, k, 1), self.log0), r_n[:, :, :-1]], dim=2)
+        b = (r_n_prev - cb_prev).masked_fill(~valid[:, None], NEG_INF)
+        b = b.masked_fill(is_init[:, None], self.log0)
+        r_b = cb + torch.logcumsumexp(b, dim=2)
+        r_b = r_b.masked_fill(~(valid | is_init)[:, None], self.log0)
+
+        # compute log prefix probabilites log(psi)
+        log_psi = torch.logsumexp((log_phi_prev + xs).masked_fill(~valid[:, None], NEG_INF), dim=2)
+        log_psi = torch.logaddexp(log_psi, r_init)
+
+        # get P(...eos|X) that ends with the prefix itself
+        r_sum_last = r_sum.gather(1, (xlens - 1)[:, None])  # log(r_T^n(g) + r_T^b(g)), `[N, 1]`
+        log_psi = torch.where(cs == self.eos, r_sum_last, log_psi)
+
+        return log_psi.to(self.dtype), torch.stack([r_n, r_b], dim=-1)
@@ -7,17 +7,13 @@
 """Base class for decoders."""
 
 import logging
-import numpy as np
-import os
 import torch
-import shutil
 
 from neural_sp.models.base import ModelBase
-from neural_sp.models.torch_utils import np2tensor
-from neural_sp.models.torch_utils import pad_list
-
-import matplotlib
-matplotlib.use('Agg')
+from neural_sp.models.seq2seq.decoders.lm_rescoring import score_sequences
+from neural_sp.trainers.report_worker import plot_attention_heads
+from neural_sp.trainers.report_worker import plot_ctc_posteriors
+from neural_sp.trainers.report_worker import submit
 
 logger = logging.getLogger(__name__)
 
@@ -40,88 +36,38 @@ class DecoderBase(ModelBase):
     def beam_search(self, eouts, elens, params, idx2token):
         raise NotImplementedError
 
-    def _plot_attention(self, save_path=None, n_cols=2):
+    def _plot_attention(self, save_path=None, n_cols=2, worker=None):
         """Plot attention for each head in all decoder layers."""
         if getattr(self, 'att_weight', 0) == 0 and getattr(self, 'rnnt_weight', 0) == 0:
             return
-        if not hasattr(self, 'aws_dict'):
+        if not hasattr(self, 'aws_dict') or len(self.aws_dict) == 0 or save_path is None:
             return
-        from matplotlib import pyplot as plt
-        from matplotlib.ticker import MaxNLocator
-
-        # Clean directory
-        if save_path is not None and os.path.isdir(save_path):
-            shutil.rmtree(save_path)
-            os.mkdir(save_path)
 
         elens = self.data_dict['elens']
         ylens = self.data_dict['ylens']
         # ys = self.data_dict['ys']
 
+        # NOTE: show the last utterance in a mini-batch
+        aws = {}
         for k, aw in self.aws_dict.items():
-            plt.clf()
-            n_heads = aw.shape[1]
-            n_cols_tmp = 1 if n_heads == 1 else n_cols * max(1, n_heads // 4)
-            fig, axes = plt.subplots(max(1, n_heads // n_cols_tmp), n_cols_tmp,
-                                     figsize=(20 * max(1, n_heads // 4), 8), squeeze=False)
-            for h in range(n_heads):
-                ax = axes[h // n_cols_tmp, h % n_cols_tmp]
-                if 'yy' in k:
-                    ax.imshow(aw[-1, h, :ylens[-1], :ylens[-1]], aspect="auto")
-                else:
-                    ax.imshow(aw[-1, h, :ylens[-1], :elens[-1]], aspect="auto")
-                # NOTE: show the last utterance in a mini-batch
-                ax.grid(False)
-                ax.set_xlabel("Input (head%d)" % h)
-                ax.set_ylabel("Output (head%d)" % h)
-                ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-                ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-                # ax.set_yticks(np.linspace(0, ylens[-1] - 1, ylens[-1]))
-                # ax.set_yticks(np.linspace(0, ylens[-1] - 1, 1), minor=True)
-                # ax.set_yticklabels(ys + [''])
-
-            fig.tight_layout()
-            if save_path is not None:
-                fig.savefig(os.path.join(save_path, '%s.png' % k), dvi=500)
-            plt.close()
-
-    def _plot_ctc(self, save_path=None, topk=10):
+            if 'yy' in k:
+                aws[k] = aw[-1, :, :ylens[-1], :ylens[-1]].copy()
+            else:
+                aws[k] = aw[-1, :, :ylens[-1], :elens[-1]].copy()
+        n_heads = next(iter(aws.values())).shape[0]
+        n_cols_tmp = 1 if n_heads == 1 else n_cols * max(1, n_heads // 4)
+        submit(worker, save_path, plot_attention_heads, save_path, aws,
+               n_cols_tmp, (20 * max(1, n_heads // 4), 8))
+
+    def _plot_ctc(self, save_path=None, topk=10, worker=None):
         """Plot CTC posteriors."""
-        if self.ctc_weight == 0:
+        if self.ctc_weight == 0 or save_path is None:
             return
-        from matplotlib import pyplot as plt
-
-        # Clean directory
-        if save_path is not None and os.path.isdir(save_path):
-            shutil.rmtree(save_path)
-            os.mkdir(save_path)
 
         elen = self.ctc.data_dict['elens'][-1]
-        probs = self.ctc.prob_dict['probs'][-1, :elen]  # `[T, vocab]`
+        probs = self.ctc.prob_dict['probs'][-1, :elen].copy()  # `[T, vocab]`
         # NOTE: show the last utterance in a mini-batch
-
-        topk_ids = np.argsort(probs, axis=1)
-
-        plt.clf()
-        n_frames = probs.shape[0]
-        times_probs = np.arange(n_frames)
-        plt.figure(figsize=(20, 8))
-
-        # NOTE: index 0 is reserved for blank
-        for idx in set(topk_ids.reshape(-1).tolist()):
-            if idx == 0:
-                plt.plot(times_probs, probs[:, 0], ':', label='<blank>', color='grey')
-            else:
-                plt.plot(times_probs, probs[:, idx])
-        plt.xlabel(u'Time [frame]', fontsize=12)
-        plt.ylabel('Posteriors', fontsize=12)
-        plt.xticks(list(range(0, int(n_frames) + 1, 10)))
-        plt.yticks(list(range(0, 2, 1)))
-
-        plt.tight_layout()
-        if save_path is not None:
-            plt.savefig(os.path.join(save_path, 'prob.png'), dvi=500)
-        plt.close()
+        submit(worker, save_path, plot_ctc_posteriors, save_path, probs)
 
     def decode_ctc(self, eouts, elens, params, idx2token,
                    lm=None, lm_second=None, lm_second_bwd=None,
@@ -195,18 +141,20 @@ class DecoderBase(ModelBase):
         return probs, topk_ids
 
     def lm_rescoring(self, hyps, lm, lm_weight, reverse=False, tag=''):
-        for i in range(len(hyps)):
-            ys = hyps[i]['hyp']  # include <sos>
-            if reverse:
-                ys = ys[::-1]
+        """Rescore N-best hypotheses with a second path LM in place.
 
-            ys = [np2tensor(np.fromiter(ys, dtype=np.int64), self.device)]
-            ys_in = pad_list([y[:-1] for y in ys], -1)  # `[1, L-1]`
-            ys_out = pad_list([y[1:] for y in ys], -1)  # `[1, L-1]`
-
-            lmout, lmstate, scores_lm = lm.predict(ys_in, None)
-            score_lm = sum([scores_lm[0, t, ys_out[0, t]] for t in range(ys_out.size(1))])
-            score_lm /= ys_out.size(1)
+        Args:
+            hyps (list): dicts containing `hyp` (including <sos>) and `score`.
+                N-best hypotheses of multiple utterances can be concatenated
+                so that they are scored in a single batch.
+            lm (LMBase): second path LM
+            lm_weight (float): weight of LM scores
+            reverse (bool): score reversed hypotheses (for a backward LM)
+            tag (str): LM scores are stored in `score_lm_[tag]`
 
-            hyps[i]['score'] += score_lm * lm_weight
-            hyps[i]['score_lm_' + tag] = score_lm
+        """
+        seqs = [h['hyp'][::-1] if reverse else h['hyp'] for h in hyps]
+        scores_lm = score_sequences(lm, seqs, self.device)
+        for h, score_lm in zip(hyps, scores_lm):
+            h['score'] += score_lm * lm_weight
+            h['score_lm_' + tag] = score_lm
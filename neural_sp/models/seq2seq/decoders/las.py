@@ -14,7 +14,7 @@ import random
 import torch
 import torch.nn as nn
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.edit_distance import compute_wer_batch
 from neural_sp.models.criterion import cross_entropy_lsm
 from neural_sp.models.criterion import distillation
 from neural_sp.models.criterion import MBR
@@ -27,9 +27,10 @@ from neural_sp.models.modules.gmm_attention import GMMAttention
 from neural_sp.models.modules.initialization import init_with_uniform
 from neural_sp.models.modules.mocha import MoChA
 from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism
+from neural_sp.models.seq2seq.decoders.beam_search import BatchBeamSearch
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
 from neural_sp.models.seq2seq.decoders.ctc import CTC
-from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScore
+from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScoreTH
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import append_sos_eos
 from neural_sp.models.torch_utils import compute_accuracy
@@ -175,6 +176,7 @@ class RNNDecoder(DecoderBase):
         self.lmmemory = None
 
         # for attention plot
+        self.attn_capture = None
         self.aws_dict = {}
         self.data_dict = {}
 
@@ -484,9 +486,10 @@ class RNNDecoder(DecoderBase):
 
                 # 2. calculate expected WER
                 wers_b = np2tensor(np.array([
-                    compute_wer(ref=idx2token(ys[b]).split(' '),
-                                hyp=idx2token(nbest_hyps_id_b[n]).split(' '))[0] / 100
-                    for n in range(N_best)], dtype=np.float32), self.device)
+                    wer / 100 for wer, _, _, _ in compute_wer_batch(
+                        refs=[idx2token(ys[b]).split(' ')] * N_best,
+                        hyps=[idx2token(nbest_hyps_id_b[n]).split(' ') for n in range(N_best)])],
+                    dtype=np.float32), self.device)
                 exp_wer_b = (scores_b_norm * wers_b).sum()
                 grad_b = (scores_b_norm * (wers_b - exp_wer_b)).sum()
                 # print(wers_b)
@@ -582,22 +585,34 @@ class RNNDecoder(DecoderBase):
             logits.append(attn_v)
 
         # for attention plot
-        with torch.no_grad():
-            aws = torch.cat(aws, dim=2)  # `[B, H, L, T]`
-            self.data_dict['elens'] = tensor2np(elens)
-            self.data_dict['ylens'] = tensor2np(ylens)
-            self.data_dict['ys'] = tensor2np(ys_out)
-            self.aws_dict['xy_aws'] = tensor2np(aws)
-            if len(betas) > 0:
-                betas = torch.cat(betas, dim=2)  # `[B, H, L, T]`
-                self.aws_dict['xy_aws_beta'] = tensor2np(betas)
-            if len(p_chooses) > 0:
-                p_chooses = torch.cat(p_chooses, dim=2)  # `[B, H, L, T]`
-                self.aws_dict['xy_aws_p_choose'] = tensor2np(p_chooses)
+        if self.attn_capture is not None:
+            with torch.no_grad():
+                self.record_attention(elens, ylens, ys_out, aws, betas, p_chooses)
 
         logits = self.output(torch.cat(logits, dim=1))
         return logits
 
+    def record_attention(self, elens, ylens, ys_out, aws, betas, p_chooses):
+        """Record attention weights selected by `attn_capture` for plotting.
+
+        Args:
+            elens (IntTensor): `[B]`
+            ylens (IntTensor): `[B]`
+            ys_out (LongTensor): `[B, L]`
+            aws (list): length `L`, each of which contains FloatTensor of size `[B, H, 1, T]`
+            betas (list): same as aws (MoChA only)
+            p_chooses (list): same as aws (MoChA only)
+
+        """
+        self.data_dict['elens'] = self.attn_capture.select_batch(elens)
+        self.data_dict['ylens'] = self.attn_capture.select_batch(ylens)
+        self.data_dict['ys'] = self.attn_capture.select_batch(ys_out)
+        self.aws_dict['xy_aws'] = self.attn_capture.select(torch.cat(aws, dim=2))
+        if len(betas) > 0:
+            self.aws_dict['xy_aws_beta'] = self.attn_capture.select(torch.cat(betas, dim=2))
+        if len(p_chooses) > 0:
+            self.aws_dict['xy_aws_p_choose'] = self.attn_capture.select(torch.cat(p_chooses, dim=2))
+
     def forward_att(self, eouts, elens, ys,
                     return_logits=False, teacher_logits=None, trigger_points=None):
         """Compute XE loss for the attention-based decoder.
@@ -687,18 +702,9 @@ class RNNDecoder(DecoderBase):
             return logits
 
         # for attention plot
+        if self.attn_capture is not None:
+            self.record_attention(elens, ylens, ys_out, aws, betas, p_chooses)
         aws = torch.cat(aws, dim=2)  # `[B, H, L, T]`
-        if not self.training:
-            self.data_dict['elens'] = tensor2np(elens)
-            self.data_dict['ylens'] = tensor2np(ylens)
-            self.data_dict['ys'] = tensor2np(ys_out)
-            self.aws_dict['xy_aws'] = tensor2np(aws)
-            if len(betas) > 0:
-                betas = torch.cat(betas, dim=2)  # `[B, H, L, T]`
-                self.aws_dict['xy_aws_beta'] = tensor2np(betas)
-            if len(p_chooses) > 0:
-                p_chooses = torch.cat(p_chooses, dim=2)  # `[B, H, L, T]`
-                self.aws_dict['xy_p_choose'] = tensor2np(p_chooses)
 
         n_heads = aws.size(1)  # mono
 
@@ -1037,6 +1043,7 @@ class RNNDecoder(DecoderBase):
         lm_weight_second_bwd = params['recog_lm_bwd_weight']
         gnmt_decoding = params['recog_gnmt_decoding']
         eos_threshold = params['recog_eos_threshold']
+        ctc_window = params['recog_ctc_window']
         asr_state_CO = params['recog_asr_state_carry_over']
         lm_state_CO = params['recog_lm_state_carry_over']
         softmax_smoothing = params['recog_softmax_smoothing']
@@ -1054,7 +1061,6 @@ class RNNDecoder(DecoderBase):
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
 
         nbest_hyps_idx, aws, scores = [], [], []
         eos_flags = []
@@ -1068,10 +1074,8 @@ class RNNDecoder(DecoderBase):
             # For joint CTC-Attention decoding
             ctc_prefix_scorer = None
             if ctc_log_probs is not None:
-                if self.bwd:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b][::-1], self.blank, self.eos)
-                else:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
+                ctc_prefix_scorer = CTCPrefixScoreTH(ctc_log_probs[b:b + 1], elens[b:b + 1], self.blank, self.eos,
+                                                     margin=ctc_window, backward=self.bwd)
 
             # Ensemble initialization
             ensmbl_dstate, ensmbl_cv = [], []
@@ -1120,14 +1124,14 @@ class RNNDecoder(DecoderBase):
                      'ensmbl_dstate': ensmbl_dstate,
                      'ensmbl_cv': ensmbl_cv,
                      'ensmbl_aws':[[None]] * (n_models - 1),
-                     'ctc_state': ctc_prefix_scorer.initial_state() if ctc_prefix_scorer is not None else None}]
+                     'ctc_state': ctc_prefix_scorer.initial_state()[0] if ctc_prefix_scorer is not None else None}]
             ymax = math.ceil(elens[b] * max_len_ratio)
             for i in range(ymax):
                 # batchfy all hypotheses for batch decoding
                 y = eouts.new_zeros((len(hyps), 1), dtype=torch.int64)
                 for j, beam in enumerate(hyps):
                     if self.replace_sos and i == 0:
-                        prev_idx = refs_id[0][0]
+                        prev_idx = refs_id[b][0]
                     else:
                         prev_idx = beam['hyp'][-1]
                     y[j, 0] = prev_idx
@@ -1169,7 +1173,7 @@ class RNNDecoder(DecoderBase):
 
                 # for the main model
                 dstates, cv, aw, attn_v, _, _ = self.decode_step(
-                    eouts[b:b + 1, :elens[b]].repeat([cv.size(0), 1, 1]),
+                    eouts[b:b + 1, :elens[b]].expand(cv.size(0), -1, -1),
                     dstates, cv, self.dropout_emb(self.embed(y)), None, aw, lmout)
                 probs = torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
 
@@ -1184,7 +1188,7 @@ class RNNDecoder(DecoderBase):
                     dstates_e = {'dstate': (hxs_e, cxs_e)}
 
                     dstates_e, cv_e, aw_e, attn_v_e, _, _ = dec.decode_step(
-                        ensmbl_eouts[i_e][b:b + 1, :ensmbl_elens[i_e][b]].repeat([cv_e.size(0), 1, 1]),
+                        ensmbl_eouts[i_e][b:b + 1, :ensmbl_elens[i_e][b]].expand(cv_e.size(0), -1, -1),
                         dstates_e, cv_e, dec.dropout_emb(dec.embed(y)), None, aw_e, lmout)
 
                     ensmbl_dstate += [{'dstate': (dstates_e['dstate'][0][:, j:j + 1],
@@ -1197,7 +1201,7 @@ class RNNDecoder(DecoderBase):
                 # Ensemble
                 scores_att = torch.log(probs / n_models)
 
-                new_hyps = []
+                cands, topk_ids_all, total_scores_topk_all = [], [], []
                 for j, beam in enumerate(hyps):
                     # Attention scores
                     total_scores_att = beam['score_att'] + scores_att[j:j + 1]
@@ -1239,16 +1243,26 @@ class RNNDecoder(DecoderBase):
                             total_scores_topk += cp * cp_weight
                     else:
                         cp = 0.
+                    cands.append((total_scores_att, total_scores_lm, cp))
+                    topk_ids_all.append(topk_ids)
+                    total_scores_topk_all.append(total_scores_topk)
+                topk_ids = torch.cat(topk_ids_all, dim=0)
+                total_scores_topk = torch.cat(total_scores_topk_all, dim=0)
 
-                    # Add CTC score
-                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                        beam['hyp'], topk_ids, beam['ctc_state'],
-                        total_scores_topk, ctc_prefix_scorer)
+                # Add CTC scores of all hypotheses at once
+                new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
+                    [beam['hyp'] for beam in hyps], topk_ids,
+                    torch.stack([beam['ctc_state'] for beam in hyps]) if ctc_prefix_scorer is not None else None,
+                    total_scores_topk, ctc_prefix_scorer,
+                    peaks=aw[:, :, -1].sum(1).argmax(-1) if ctc_window > 0 else None)
 
+                new_hyps = []
+                for j, beam in enumerate(hyps):
+                    total_scores_att, total_scores_lm, cp = cands[j]
                     for k in range(beam_width):
-                        idx = topk_ids[0, k].item()
+                        idx = topk_ids[j, k].item()
                         length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
-                        total_score = total_scores_topk[0, k].item() / length_norm_factor
+                        total_score = total_scores_topk[j, k].item() / length_norm_factor
 
                         if idx == self.eos:
                             # Exclude short hypotheses
@@ -1278,14 +1292,14 @@ class RNNDecoder(DecoderBase):
                              'score': total_score,
                              'score_att': total_scores_att[0, idx].item(),
                              'score_cp': cp,
-                             'score_ctc': total_scores_ctc[k].item(),
+                             'score_ctc': total_scores_ctc[j, k].item(),
                              'score_lm': total_scores_lm[k].item(),
                              'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1],
                                                     dstates['dstate'][1][:, j:j + 1])},
                              'cv': cv[j:j + 1],
                              'aws': beam['aws'] + [aw[j:j + 1]],
                              'lmstate': new_lmstate,
-                             'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
+                             'ctc_state': new_ctc_states[j, k] if ctc_prefix_scorer is not None else None,
                              'ensmbl_dstate': ensmbl_dstate,
                              'ensmbl_cv': ensmbl_cv,
                              'ensmbl_aws': ensmbl_aws})
@@ -1387,6 +1401,213 @@ class RNNDecoder(DecoderBase):
 
         return nbest_hyps_idx, aws, scores
 
+    def beam_search_batch(self, eouts, elens, params, idx2token=None,
+                          lm=None, lm_second=None, lm_second_bwd=None, ctc_log_probs=None,
+                          nbest=1, exclude_eos=False,
+                          refs_id=None, utt_ids=None, speakers=None, cache_states=True):
+        """Batch beam search decoding over all utterances in a mini-batch.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            params (dict): hyperparameters for decoding
+            idx2token (): converter from index to token
+            lm: firsh path LM
+            lm_second: second path LM
+            lm_second_bwd: secoding path backward LM
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            nbest (int): number of N-best list
+            exclude_eos (bool): exclude <eos> from hypothesis
+            refs_id (list): reference list
+            utt_ids (list): utterance id list
+            speakers (list): speaker list
+            cache_states (bool): cache TransformerLM states for fast decoding
+        Returns:
+            nbest_hyps_idx (list): length `B`, each of which contains list of N hypotheses
+            aws (list): length `B`, each of which contains arrays of size `[H, L, T]`
+            scores (list):
+
+        """
+        # NOTE: fall back to utterance-level beam search for configurations with stateful attention
+        # or state carry over across utterances
+        if self.attn_type in ['mocha', 'gmm', 'triggered_attention'] or \
+                params['recog_asr_state_carry_over'] or params['recog_lm_state_carry_over'] or \
+                isinstance(lm, TransformerXL):
+            return self.beam_search(eouts, elens, params, idx2token,
+                                    lm, lm_second, lm_second_bwd, ctc_log_probs,
+                                    nbest, exclude_eos, refs_id, utt_ids, speakers,
+                                    cache_states=cache_states)
+
+        bs = eouts.size(0)
+
+        beam_width = params['recog_beam_width']
+        assert 1 <= nbest <= beam_width
+        ctc_weight = params['recog_ctc_weight']
+        max_len_ratio = params['recog_max_len_ratio']
+        min_len_ratio = params['recog_min_len_ratio']
+        lp_weight = params['recog_length_penalty']
+        cp_weight = params['recog_coverage_penalty']
+        cp_threshold = params['recog_coverage_threshold']
+        length_norm = params['recog_length_norm']
+        lm_weight = params['recog_lm_weight']
+        lm_weight_second = params['recog_lm_second_weight']
+        lm_weight_second_bwd = params['recog_lm_bwd_weight']
+        gnmt_decoding = params['recog_gnmt_decoding']
+        eos_threshold = params['recog_eos_threshold']
+        ctc_window = params['recog_ctc_window']
+        softmax_smoothing = params['recog_softmax_smoothing']
+
+        if lm is not None:
+            assert lm_weight > 0
+            lm.eval()
+        if lm_second is not None:
+            assert lm_weight_second > 0
+            lm_second.eval()
+        if lm_second_bwd is not None:
+            assert lm_weight_second_bwd > 0
+            lm_second_bwd.eval()
+        trfm_lm = isinstance(lm, TransformerLM)
+
+        helper = BatchBeamSearch(bs, beam_width, self.eos, elens, max_len_ratio, min_len_ratio, self.device)
+
+        # For joint CTC-Attention decoding
+        ctc_prefix_scorer = None
+        if ctc_log_probs is not None:
+            assert ctc_weight > 0
+            ctc_prefix_scorer = CTCPrefixScoreTH(ctc_log_probs, elens, self.blank, self.eos,
+                                                 margin=ctc_window, backward=self.bwd)
+            helper.init_ctc_states(ctc_prefix_scorer)
+
+        # Initialization for all hypotheses
+        self.score.reset()
+        # NOTE: encoder outputs and their key projection are shared among hypotheses of the same
+        # utterance and broadcasted inside the attention, instead of being copied beam_width times
+        src_mask = make_pad_mask(elens.to(self.device)).unsqueeze(1)  # `[B, 1, T]`
+        dstates = self.zero_state(helper.n_hyps)
+        cv = eouts.new_zeros(helper.n_hyps, 1, self.enc_n_units)
+        aw = None
+        lmstate = None
+
+        for i in range(helper.n_steps):
+            if self.replace_sos and i == 0:
+                # <sos> is replaced with the special token of each utterance
+                y = torch.tensor([refs_id[b][0] for b in range(bs)], dtype=torch.int64, device=self.device)
+                y = y.repeat_interleave(beam_width).unsqueeze(1)  # `[B * beam_width, 1]`
+            else:
+                y = helper.ys[:, -1:]
+
+            # Update LM states for LM fusion
+            lmout, scores_lm = None, None
+            if lm is not None or self.lm is not None:
+                y_lm = helper.ys if trfm_lm else y
+                if self.lm is not None:  # cold/deep fusion
+                    lmout, lmstate, scores_lm = self.lm.predict(y_lm, lmstate)
+                elif lm is not None:  # shallow fusion
+                    lmout, lmstate, scores_lm = lm.predict(y_lm, lmstate,
+                                                           cache=lmstate if cache_states and trfm_lm else None)
+
+            # Recurrency -> Score -> Generate
+            dstates, cv, aw, attn_v, _, _ = self.decode_step(
+                eouts, dstates, cv, self.dropout_emb(self.embed(y)), src_mask, aw, lmout)
+            scores_att = torch.log_softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
+
+            # Coverage penalty
+            cp = None
+            if cp_weight > 0:
+                cp = helper.coverage_penalty(aw, cp_threshold, gnmt_decoding, self.score.n_heads)
+
+            index = helper.step(scores_att,
+                                scores_lm=scores_lm[:, -1] if lm is not None else None,
+                                lm_weight=lm_weight,
+                                lm_before_topk=False,
+                                lp_weight=lp_weight,
+                                gnmt_decoding=gnmt_decoding,
+                                cp=cp,
+                                cp_weight=cp_weight,
+                                ctc_prefix_scorer=ctc_prefix_scorer,
+                                ctc_weight=ctc_weight,
+                                ctc_peaks=aw[:, :, -1].sum(1).argmax(-1) if ctc_window > 0 else None,
+                                length_norm=length_norm,
+                                eos_threshold=eos_threshold,
+                                aws=aw)
+            if helper.is_finish:
+                break
+
+            # Reorder states by the surviving hypotheses
+            hxs, cxs = dstates['dstate']
+            dstates = {'dstate': (hxs.index_select(1, index),
+                                  cxs.index_select(1, index) if cxs is not None else None)}
+            cv = cv.index_select(0, index)
+            aw = aw.index_select(0, index)
+            if lmstate is not None:
+                if trfm_lm:
+                    lmstate = [lmstate_l.index_select(0, index) for lmstate_l in lmstate]
+                else:
+                    lmstate = {'hxs': lmstate['hxs'].index_select(1, index),
+                               'cxs': lmstate['cxs'].index_select(1, index) if lmstate['cxs'] is not None else None}
+
+        nbest_end_hyps = helper.finalize(nbest)
+        # forward second path LM rescoring (all utterances at once)
+        if lm_second is not None:
+            self.lm_rescoring([h for end_hyps in nbest_end_hyps for h in end_hyps],
+                              lm_second, lm_weight_second, tag='second')
+
+        # backward secodn path LM rescoring
+        if lm_second_bwd is not None:
+            self.lm_rescoring([h for end_hyps in nbest_end_hyps for h in end_hyps],
+                              lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
+
+        nbest_hyps_idx, aws, scores = [], [], []
+        for b, end_hyps in enumerate(nbest_end_hyps):
+            # Sort by score
+            end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+
+            if idx2token is not None:
+                if utt_ids is not None:
+                    logger.info('Utt-id: %s' % utt_ids[b])
+                assert self.vocab == idx2token.vocab
+                logger.info('=' * 200)
+                for k in range(len(end_hyps)):
+                    if refs_id is not None:
+                        logger.info('Ref: %s' % idx2token(refs_id[b]))
+                    logger.info('Hyp: %s' % idx2token(
+                        end_hyps[k]['hyp'][1:][::-1] if self.bwd else end_hyps[k]['hyp'][1:]))
+                    logger.info('log prob (hyp): %.7f' % end_hyps[k]['score'])
+                    logger.info('log prob (hyp, att): %.7f' % (end_hyps[k]['score_att'] * (1 - ctc_weight)))
+                    if ctc_prefix_scorer is not None:
+                        logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc'] * ctc_weight))
+                    if lm is not None:
+                        logger.info('log prob (hyp, first-path lm): %.7f' % (end_hyps[k]['score_lm'] * lm_weight))
+                    logger.info('-' * 50)
+
+            # N-best list (fewer hypotheses can be found than nbest, e.g., for short inputs)
+            n_hyps = min(nbest, len(end_hyps))
+            elen = int(elens[b])
+            if self.bwd:
+                # Reverse the order
+                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:][::-1]) for n in range(n_hyps)]]
+                aws += [[tensor2np(end_hyps[n]['aws'].flip(1)[:, :, :elen]) for n in range(n_hyps)]]
+            else:
+                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(n_hyps)]]
+                aws += [[tensor2np(end_hyps[n]['aws'][:, :, :elen]) for n in range(n_hyps)]]
+            if length_norm:
+                scores += [[end_hyps[n]['score_att'] / len(end_hyps[n]['hyp'][1:]) for n in range(n_hyps)]]
+            else:
+                scores += [[end_hyps[n]['score_att'] for n in range(n_hyps)]]
+
+        # Exclude <eos> (<sos> in case of the backward decoder)
+        if exclude_eos:
+            for b in range(bs):
+                for n in range(len(nbest_hyps_idx[b])):
+                    if self.bwd and len(nbest_hyps_idx[b][n]) > 0 and nbest_hyps_idx[b][n][0] == self.eos:
+                        nbest_hyps_idx[b][n] = nbest_hyps_idx[b][n][1:]
+                        aws[b][n] = aws[b][n][:, 1:]
+                    elif not self.bwd and len(nbest_hyps_idx[b][n]) > 0 and nbest_hyps_idx[b][n][-1] == self.eos:
+                        nbest_hyps_idx[b][n] = nbest_hyps_idx[b][n][:-1]
+                        aws[b][n] = aws[b][n][:, :-1]
+
+        return nbest_hyps_idx, aws, scores
+
     def beam_search_chunk_sync(self, eouts_c, params, idx2token,
                                lm=None, ctc_log_probs=None,
                                hyps=False, state_carry_over=False, ignore_eos=False):
@@ -1413,16 +1634,18 @@ class RNNDecoder(DecoderBase):
         ctc_state = None
 
         # For joint CTC-Attention decoding
-        self.ctc_prefix_scorer = None
+        if hyps is None:
+            self.ctc_prefix_scorer = None
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
             if hyps is None:
                 # first chunk
-                self.ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[0], self.blank, self.eos)
+                self.ctc_prefix_scorer = CTCPrefixScoreTH(ctc_log_probs[0:1], [ctc_log_probs.size(1)],
+                                                          self.blank, self.eos)
             else:
-                self.ctc_prefix_scorer.register_new_chunk(ctc_log_probs[0])
-            ctc_state = self.ctc_prefix_scorer.initial_state()
+                # NOTE: CTC states of hypotheses are extended to the new chunk on the fly
+                self.ctc_prefix_scorer.extend(ctc_log_probs[0:1])
+            ctc_state = self.ctc_prefix_scorer.initial_state()[0]
         # TODO: add truncated version
 
         if state_carry_over:
@@ -1489,7 +1712,7 @@ class RNNDecoder(DecoderBase):
                 self.lm if self.lm is not None else lm, hyps, y)
 
             dstates, cv, aw, attn_v, _, _ = self.decode_step(
-                eouts_c[0:1].repeat([cv.size(0), 1, 1]),
+                eouts_c[0:1].expand(cv.size(0), -1, -1),
                 dstates, cv, self.dropout_emb(self.embed(y)), None, aw, lmout, cache=False)
             scores_att = torch.log_softmax(self.output(attn_v).squeeze(1), dim=1)
 
@@ -1520,8 +1743,9 @@ class RNNDecoder(DecoderBase):
 
                 # Add CTC score
                 new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                    beam['hyp'], topk_ids, beam['ctc_state'],
-                    total_scores_topk, self.ctc_prefix_scorer, new_chunk=(i == 0))
+                    [beam['hyp']], topk_ids,
+                    beam['ctc_state'].unsqueeze(0) if self.ctc_prefix_scorer is not None else None,
+                    total_scores_topk, self.ctc_prefix_scorer)
 
                 for k in range(beam_width):
                     idx = topk_ids[0, k].item()
@@ -1548,14 +1772,14 @@ class RNNDecoder(DecoderBase):
                         {'hyp': beam['hyp'] + [idx],
                          'score': total_score,
                          'score_att': total_scores_att[0, idx].item(),
-                         'score_ctc': total_scores_ctc[k].item(),
+                         'score_ctc': total_scores_ctc[0, k].item(),
                          'score_lm': total_scores_lm[k].item(),
                          'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1], dstates['dstate'][1][:, j:j + 1])},
                          'cv': cv[j:j + 1],
                          'aws': beam['aws'] + [aw[j:j + 1]],
                          'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
                                      'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                         'ctc_state': new_ctc_states[k] if self.ctc_prefix_scorer is not None else None,
+                         'ctc_state': new_ctc_states[0, k] if self.ctc_prefix_scorer is not None else None,
                          'no_boundary': no_boundary})
 
             # Local pruning
@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Batched N-best rescoring with language models.
+
+   Token sequences of all hypotheses are inserted into a prefix trie, and the
+   LM is run over the trie level by level. All prefixes of the same length are
+   fed to the LM at once, each of which is computed only once from the state
+   of its parent prefix: RNNLM states are forked to the children, and
+   TransformerLM/TransformerXL reuse the cached outputs of the parent prefix
+   so that only the last position is computed. Hypotheses sharing a prefix
+   (e.g., the same hypothesis with and without <eos>, or duplicates) share
+   the computation of the prefix.
+"""
+
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def _build_prefix_trie(seqs):
+    """Build a prefix trie of token sequences.
+
+    Args:
+        seqs (list): token sequences
+    Returns:
+        parents (list): index of the parent node of each node (-1 for the root)
+        tokens (list): token of each node (-1 for the root)
+        levels (list): indices of nodes at each depth
+        is_leaf (list): whether each node has no children
+        ends (list): index of the node where each sequence ends
+
+    """
+    children = [{}]
+    parents, tokens, levels = [-1], [-1], [[0]]
+    ends = []
+    for seq in seqs:
+        node, depth = 0, 0
+        for token in seq:
+            depth += 1
+            child = children[node].get(token)
+            if child is None:
+                child = len(tokens)
+                children[node][token] = child
+                children.append({})
+                parents.append(node)
+                tokens.append(token)
+                if depth == len(levels):
+                    levels.append([])
+                levels[depth].append(child)
+            node = child
+        ends.append(node)
+    is_leaf = [len(c) == 0 for c in children]
+    return parents, tokens, levels, is_leaf, ends
+
+
+def _select_state(state, index):
+    """Select LM states of the given prefixes.
+
+    Args:
+        state (dict or list): RNNLM states, or cached outputs of TransformerLM/TransformerXL
+        index (LongTensor): `[N]`
+    Returns:
+        state (dict or list):
+
+    """
+    if isinstance(state, dict):  # RNNLM
+        return {k: v.index_select(1, index) if v is not None else None for k, v in state.items()}
+    return [c.index_select(0, index) for c in state]
+
+
+def _cat_states(states):
+    """Concatenate LM states computed in chunks."""
+    if len(states) == 1:
+        return states[0]
+    if isinstance(states[0], dict):  # RNNLM
+        return {k: torch.cat([s[k] for s in states], dim=1) if states[0][k] is not None else None
+                for k in states[0].keys()}
+    return [torch.cat([s[lth] for s in states], dim=0) for lth in range(len(states[0]))]
+
+
+def score_sequences(lm, seqs, device, batch_size=0):
+    """Compute length-normalized log-likelihoods of token sequences.
+
+    Args:
+        lm (LMBase): RNNLM/TransformerLM etc.
+        seqs (list): token sequences including <sos>
+        device (torch.device):
+        batch_size (int): maximum number of prefixes fed to the LM at once (0: all)
+    Returns:
+        scores (list): average log probabilities per token (0 for sequences of length <= 1)
+
+    """
+    scores = [0.] * len(seqs)
+    seq_ids = [i for i, seq in enumerate(seqs) if len(seq) > 1]
+    if len(seq_ids) == 0:
+        return scores
+
+    parents, tokens, levels, is_leaf, ends = _build_prefix_trie([seqs[i] for i in seq_ids])
+    parents = torch.tensor(parents, device=device)
+    tokens = torch.tensor(tokens, device=device)
+    cum_scores = torch.zeros(len(is_leaf), device=device)  # log probabilities of all prefixes
+    rows = torch.zeros(len(is_leaf), dtype=torch.int64, device=device)  # index in LM states of each level
+
+    state_prev, ys_prev = None, None
+    for depth in range(1, len(levels) - 1):
+        # prefixes having children at this level
+        nodes = torch.tensor([n for n in levels[depth] if not is_leaf[n]], device=device)
+        rows[nodes] = torch.arange(nodes.numel(), device=device)
+
+        bs = batch_size if batch_size > 0 else nodes.numel()
+        states, ys_all, log_probs = [], [], []
+        for s in range(0, nodes.numel(), bs):
+            nodes_s = nodes[s:s + bs]
+            y = tokens[nodes_s].unsqueeze(1)  # `[N, 1]`
+            if depth == 1:
+                ys = y
+                _, state, log_probs_s = lm.predict(y, None)
+            else:
+                index = rows[parents[nodes_s]]
+                ys = torch.cat([ys_prev[index], y], dim=1)  # `[N, depth]`
+                state = _select_state(state_prev, index)
+                if isinstance(state, dict):  # RNNLM
+                    _, state, log_probs_s = lm.predict(y, state)
+                else:
+                    # only the last position is computed from the cached outputs of the parent prefix
+                    _, state, log_probs_s = lm.predict(ys, None, cache=state)
+            states.append(state)
+            ys_all.append(ys)
+            log_probs.append(log_probs_s[:, -1].float())
+        state_prev = _cat_states(states)
+        ys_prev = torch.cat(ys_all, dim=0)
+        log_probs = torch.cat(log_probs, dim=0)  # `[N, vocab]`
+
+        # scores of the next tokens
+        children = torch.tensor(levels[depth + 1], device=device)
+        parents_c = parents[children]
+        cum_scores[children] = cum_scores[parents_c] + log_probs[rows[parents_c], tokens[children]]
+
+    ends = torch.tensor(ends, device=device)
+    ylens = torch.tensor([len(seqs[i]) - 1 for i in seq_ids], device=device)
+    scores_lm = (cum_scores[ends] / ylens).tolist()
+    for i, score_lm in zip(seq_ids, scores_lm):
+        scores[i] = score_lm
+    return scores
@@ -13,15 +13,14 @@ import random
 import torch
 import torch.nn as nn
 
+from neural_sp.models.criterion import float32_loss
 from neural_sp.models.lm.rnnlm import RNNLM
-from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
 from neural_sp.models.seq2seq.decoders.ctc import CTC
-from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScore
+from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScoreTH
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
 from neural_sp.models.torch_utils import repeat
-from neural_sp.models.torch_utils import tensor2np
 from neural_sp.models.torch_utils import tensor2scalar
 
 random.seed(1)
@@ -250,6 +249,12 @@ class RNNTransducer(DecoderBase):
         logits = self.joint(eouts, dout)
 
         # Compute Transducer loss
+        loss = self.loss_fn(logits, ys_out, elens, ylens)
+
+        return loss
+
+    @float32_loss
+    def loss_fn(self, logits, ys_out, elens, ylens):
         log_probs = torch.log_softmax(logits, dim=-1)
         assert log_probs.size(2) == ys_out.size(1) + 1
         if self.device_id >= 0:
@@ -267,7 +272,6 @@ class RNNTransducer(DecoderBase):
             loss = self.warprnnt_loss(log_probs, ys_out.int(), elens, ylens)
             # NOTE: Transducer loss has already been normalized by bs
             # NOTE: index 0 is reserved for blank in warprnnt_pytorch
-
         return loss
 
     def joint(self, eouts, douts):
@@ -400,7 +404,14 @@ class RNNTransducer(DecoderBase):
                     nbest=1, exclude_eos=False,
                     refs_id=None, utt_ids=None, speakers=None,
                     ensmbl_eouts=None, ensmbl_elens=None, ensmbl_decs=[]):
-        """Beam search decoding.
+        """Time-synchronous beam search decoding.
+
+        Up to `recog_max_symbols_per_frame` non-blank labels can be emitted at
+        each frame. Outputs of the prediction network (and the LM) are memoized
+        by label prefix in `self.state_cache`, so that each prefix is computed
+        only once in a batch with other new prefixes, and the joint network is
+        computed for all hypotheses at once. After each frame, prefixes that
+        do not extend any hypothesis in the beam are evicted from the cache.
 
         Args:
             eouts (FloatTensor): `[B, T, enc_n_units]`
@@ -433,6 +444,7 @@ class RNNTransducer(DecoderBase):
         lm_weight = params['recog_lm_weight']
         lm_weight_second = params['recog_lm_second_weight']
         lm_weight_second_bwd = params['recog_lm_bwd_weight']
+        max_sym = params['recog_max_symbols_per_frame']
         # asr_state_carry_over = params['recog_asr_state_carry_over']
         lm_state_carry_over = params['recog_lm_state_carry_over']
 
@@ -448,154 +460,69 @@ class RNNTransducer(DecoderBase):
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
 
         nbest_hyps_idx = []
         eos_flags = []
         for b in range(bs):
             # Initialization per utterance
-            y = eouts.new_zeros(bs, 1).fill_(self.eos).long()
-            y_emb = self.dropout_emb(self.embed(y))
-            dout, dstate = self.recurrency(y_emb, None)
             lmstate = None
-
-            # For joint CTC-Attention decoding
-            ctc_prefix_scorer = None
-            if ctc_log_probs is not None:
-                ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
-
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
                     if lm_state_carry_over and isinstance(lm, RNNLM):
                         lmstate = self.lmstate_final
                 self.prev_spk = speakers[b]
 
-            helper = BeamSearch(beam_width, self.eos, ctc_weight, self.device)
-
-            end_hyps = []
-            hyps = [{'hyp': [self.eos],
-                     'ys': [self.eos],
-                     'score': 0.,
-                     'score_rnnt': 0.,
-                     'score_lm': 0.,
-                     'score_ctc': 0.,
-                     'dout': dout,
-                     'dstate': dstate,
-                     'lmstate': lmstate,
-                     'ctc_state': ctc_prefix_scorer.initial_state() if ctc_prefix_scorer is not None else None}]
-            for t in range(elens[b]):
-                # preprocess for batch decoding
-                douts = torch.cat([beam['dout'] for beam in hyps], dim=0)
-                outs = self.joint(eouts[b:b + 1, t:t + 1].repeat([douts.size(0), 1, 1]), douts)
-                scores_rnnt = torch.log_softmax(outs.squeeze(2).squeeze(1), dim=-1)
-
-                # Update LM states for shallow fusion
-                y = eouts.new_zeros(len(hyps), 1).long()
-                for j, beam in enumerate(hyps):
-                    y[j, 0] = beam['hyp'][-1]
-                lmstate, scores_lm = None, None
-                if lm is not None:
-                    if hyps[0]['lmstate'] is not None:
-                        lm_hxs = torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1)
-                        lm_cxs = torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)
-                        lmstate = {'hxs': lm_hxs, 'cxs': lm_cxs}
-                    lmout, lmstate, scores_lm = lm.predict(y, lmstate)
-
-                new_hyps = []
-                for j, beam in enumerate(hyps):
-                    dout = douts[j:j + 1]
-                    dstate = beam['dstate']
-                    lmstate = beam['lmstate']
-
-                    # Attention scores
-                    total_scores_rnnt = beam['score_rnnt'] + scores_rnnt[j:j + 1]
-                    total_scores = total_scores_rnnt * (1 - ctc_weight)
-
-                    # Add LM score <after> top-K selection
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=-1, largest=True, sorted=True)
-                    if lm is not None:
-                        total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
-                        total_scores_topk += total_scores_lm * lm_weight
-                    else:
-                        total_scores_lm = eouts.new_zeros(beam_width)
-
-                    # Add CTC score
-                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                        beam['hyp'], topk_ids, beam['ctc_state'],
-                        total_scores_topk, ctc_prefix_scorer)
-
-                    for k in range(beam_width):
-                        idx = topk_ids[0, k].item()
-
-                        if idx == self.blank:
-                            beam['score'] = total_scores_topk[0, k].item()
-                            beam['score_rnnt'] = total_scores_topk[0, k].item()
-                            new_hyps.append(beam.copy())
-                            continue
-
-                        # skip blank-dominant frames
-                        # if total_scores_topk[0, self.blank].item() > 0.7:
-                        #     continue
-
-                        # Update prediction network only when predicting non-blank labels
-                        hyp_id = beam['hyp'] + [idx]
-                        hyp_str = ' '.join(list(map(str, hyp_id)))
-                        # if hyp_str in self.state_cache.keys():
-                        #     # from cache
-                        #     dout = self.state_cache[hyp_str]['dout']
-                        #     new_dstate = self.state_cache[hyp_str]['dstate']
-                        #     lmstate = self.state_cache[hyp_str]['lmstate']
-                        # else:
-                        y = eouts.new_zeros(1, 1).fill_(idx).long()
-                        y_emb = self.dropout_emb(self.embed(y))
-                        dout, new_dstate = self.recurrency(y_emb, dstate)
-
-                        # store in cache
-                        self.state_cache[hyp_str] = {
-                            'dout': dout,
-                            'dstate': new_dstate,
-                            'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                        'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                        }
-
-                        new_hyps.append({'hyp': hyp_id,
-                                         'score': total_scores_topk[0, k].item(),
-                                         'score_rnnt': total_scores_rnnt[0, idx].item(),
-                                         'score_ctc': total_scores_ctc[k].item(),
-                                         'score_lm': total_scores_lm[k].item(),
-                                         'dout': dout,
-                                         'dstate': new_dstate,
-                                         'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                                     'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                                         'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None})
-
-                # Merge hypotheses having the same token sequences
-                new_hyps_merged = {}
-                for beam in new_hyps:
-                    hyp_str = ' '.join(list(map(str, beam['hyp'])))
-                    if hyp_str not in new_hyps_merged.keys():
-                        new_hyps_merged[hyp_str] = beam
-                    elif hyp_str in new_hyps_merged.keys():
-                        if beam['score'] > new_hyps_merged[hyp_str]['score']:
-                            new_hyps_merged[hyp_str] = beam
-                new_hyps = [v for v in new_hyps_merged.values()]
-
-                # Local pruning
-                new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
-
-                # Remove complete hypotheses
-                new_hyps, end_hyps, is_finish = helper.remove_complete_hyp(new_hyps_sorted, end_hyps)
-                hyps = new_hyps[:]
-                if is_finish:
-                    break
-
-            # Global pruning
-            if len(end_hyps) == 0:
-                end_hyps = hyps[:]
-            elif len(end_hyps) < nbest and nbest > 1:
-                end_hyps.extend(hyps[:nbest - len(end_hyps)])
+            # For joint CTC-Transducer decoding
+            ctc_prefix_scorer = None
+            if ctc_log_probs is not None:
+                ctc_prefix_scorer = CTCPrefixScoreTH(ctc_log_probs[b:b + 1], elens[b:b + 1], self.blank, self.eos)
+
+            # Reset state cache, and cache outputs of the prediction network (and LM) for <sos>
+            self.state_cache = OrderedDict()
+            self._cache_root((self.eos,), eouts, lm, lmstate)
 
+            hyps = {'hyp': [(self.eos,)],
+                    'score_rnnt': eouts.new_zeros(1),
+                    'score_lm': eouts.new_zeros(1),
+                    'score_ctc': eouts.new_zeros(1),
+                    'ctc_state': ctc_prefix_scorer.initial_state() if ctc_prefix_scorer is not None else None}
+            for t in range(elens[b]):
+                eout_t = eouts[b:b + 1, t:t + 1]
+                hyps_C = hyps
+                hyps_D = []  # hypotheses consuming the t-th frame with blank
+                for v in range(max_sym + 1):
+                    douts, scores_lm = self._predict_batch(hyps_C['hyp'], lm)
+                    outs = self.joint(eout_t.repeat([douts.size(0), 1, 1]), douts)
+                    scores_rnnt = torch.log_softmax(outs.squeeze(2).squeeze(1), dim=-1)  # `[N, vocab]`
+
+                    # Emit blank and move to the next frame
+                    hyps_blank = dict(hyps_C)
+                    hyps_blank['score_rnnt'] = hyps_C['score_rnnt'] + scores_rnnt[:, self.blank]
+                    hyps_D.append(hyps_blank)
+                    if v == max_sym:
+                        break
+
+                    # Emit non-blank labels without moving to the next frame
+                    hyps_C = self._expand(hyps_C, scores_rnnt, scores_lm, beam_width,
+                                          ctc_weight, lm_weight, ctc_prefix_scorer)
+
+                # Merge hypotheses having the same token sequences, then prune
+                hyps = self._merge_hyps(hyps_D, ctc_weight, lm_weight)
+                scores = self._total_score(hyps, ctc_weight, lm_weight)
+                topk_ids = torch.topk(scores, k=min(beam_width, scores.size(0)), dim=0)[1]
+                hyps = self._select_hyps(hyps, topk_ids)
+                self._prune_cache(hyps['hyp'], max_sym)
+
+            scores = self._total_score(hyps, ctc_weight, lm_weight)
+            end_hyps = [{'hyp': list(hyps['hyp'][j]),
+                         'score': scores[j].item(),
+                         'score_rnnt': hyps['score_rnnt'][j].item(),
+                         'score_lm': hyps['score_lm'][j].item(),
+                         'score_ctc': hyps['score_ctc'][j].item()} for j in range(len(hyps['hyp']))]
+            if lm is not None and isinstance(lm, RNNLM):
+                best = hyps['hyp'][scores.argmax().item()]
+                self.lmstate_final = {'hxs': self.state_cache[best]['lm_hxs'].unsqueeze(1),
+                                      'cxs': self.state_cache[best]['lm_cxs'].unsqueeze(1)}
             # forward second path LM rescoring
             if lm_second is not None:
                 self.lm_rescoring(end_hyps, lm_second, lm_weight_second, tag='second')
@@ -607,9 +534,6 @@ class RNNTransducer(DecoderBase):
             # Sort by score
             end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
 
-            # Reset state cache
-            self.state_cache = OrderedDict()
-
             if idx2token is not None:
                 if utt_ids is not None:
                     logger.info('Utt-id: %s' % utt_ids[b])
@@ -632,10 +556,181 @@ class RNNTransducer(DecoderBase):
                                     (end_hyps[k]['score_lm_second_rev'] * lm_weight_second_bwd))
                     logger.info('-' * 50)
 
-            # N-best list
-            nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
+            # N-best list (fewer hypotheses can be found than nbest, e.g., for short inputs)
+            n_hyps = min(nbest, len(end_hyps))
+            nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(n_hyps)]]
 
             # Check <eos>
-            eos_flags.append([(end_hyps[n]['hyp'][-1] == self.eos) for n in range(nbest)])
+            eos_flags.append([(end_hyps[n]['hyp'][-1] == self.eos) for n in range(n_hyps)])
 
         return nbest_hyps_idx, None, None
+
+    def _cache_root(self, prefix, eouts, lm, lmstate):
+        """Cache outputs of the prediction network and LM for the initial prefix."""
+        y = eouts.new_zeros(1, 1).fill_(prefix[-1]).long()
+        dout, dstate = self.recurrency(self.dropout_emb(self.embed(y)), None)
+        scores_lm = None
+        if lm is not None:
+            _, lmstate, scores_lm = lm.predict(y, lmstate)
+            scores_lm = scores_lm[:, -1]
+        self._store_cache([prefix], dout[:, -1], dstate, lmstate, scores_lm)
+
+    def _store_cache(self, prefixes, douts, dstate, lmstate, scores_lm):
+        """Store states of new prefixes computed in a batch.
+
+        Args:
+            prefixes (list): length `M`, each of which is a tuple of labels including <sos>
+            douts (FloatTensor): `[M, dec_n_units]`
+            dstate (dict): states of the prediction network
+            lmstate (dict): states of RNNLM
+            scores_lm (FloatTensor): `[M, vocab]` LM log probabilities of the next label
+
+        """
+        for i, prefix in enumerate(prefixes):
+            self.state_cache[prefix] = {
+                'dout': douts[i],
+                'hxs': dstate['hxs'][:, i],
+                'cxs': dstate['cxs'][:, i] if dstate['cxs'] is not None else None,
+                'lm_hxs': lmstate['hxs'][:, i] if lmstate is not None else None,
+                'lm_cxs': lmstate['cxs'][:, i] if lmstate is not None else None,
+                'lm_scores': scores_lm[i] if scores_lm is not None else None,
+            }
+
+    def _prune_cache(self, prefixes, max_sym):
+        """Evict states of prefixes that do not extend any hypothesis in the beam.
+
+        Since new prefixes are always expanded from those in the beam, the other
+        prefixes are never looked up again. Up to `max_sym` labels are emitted
+        per frame, so the cache size depends on the beam width and the vocabulary
+        size, but not on the utterance length.
+
+        Args:
+            prefixes (list): tuples of labels including <sos> in the beam
+            max_sym (int): maximum number of labels emitted per frame
+
+        """
+        beam = set(prefixes)
+        self.state_cache = OrderedDict(
+            (prefix, cache) for prefix, cache in self.state_cache.items()
+            if any(prefix[:len(prefix) - i] in beam for i in range(min(max_sym, len(prefix) - 1) + 1)))
+
+    def _predict_batch(self, prefixes, lm=None):
+        """Compute outputs of the prediction network (and LM) for label prefixes.
+
+        Only prefixes that are not in the cache are computed, in a single batch
+        from the cached states of their parent prefixes.
+
+        Args:
+            prefixes (list): length `N`, each of which is a tuple of labels including <sos>
+            lm (RNNLM): first path LM
+        Returns:
+            douts (FloatTensor): `[N, 1, dec_n_units]`
+            scores_lm (FloatTensor): `[N, vocab]`
+
+        """
+        new_prefixes = [prefix for prefix in OrderedDict.fromkeys(prefixes)
+                        if prefix not in self.state_cache]
+        if len(new_prefixes) > 0:
+            parents = [self.state_cache[prefix[:-1]] for prefix in new_prefixes]
+            y = torch.tensor([[prefix[-1]] for prefix in new_prefixes], dtype=torch.int64, device=self.device)
+            dstate = {'hxs': torch.stack([c['hxs'] for c in parents], dim=1), 'cxs': None}
+            if self.rnn_type == 'lstm_transducer':
+                dstate['cxs'] = torch.stack([c['cxs'] for c in parents], dim=1)
+            douts, dstate = self.recurrency(self.dropout_emb(self.embed(y)), dstate)
+
+            lmstate, scores_lm = None, None
+            if lm is not None:
+                lmstate = {'hxs': torch.stack([c['lm_hxs'] for c in parents], dim=1),
+                           'cxs': torch.stack([c['lm_cxs'] for c in parents], dim=1)}
+                _, lmstate, scores_lm = lm.predict(y, lmstate)
+                scores_lm = scores_lm[:, -1]
+            self._store_cache(new_prefixes, douts[:, -1], dstate, lmstate, scores_lm)
+
+        caches = [self.state_cache[prefix] for prefix in prefixes]
+        douts = torch.stack([c['dout'] for c in caches], dim=0).unsqueeze(1)
+        scores_lm = torch.stack([c['lm_scores'] for c in caches], dim=0) if lm is not None else None
+        return douts, scores_lm
+
+    def _expand(self, hyps, scores_rnnt, scores_lm, beam_width, ctc_weight, lm_weight,
+                ctc_prefix_scorer):
+        """Expand hypotheses by one non-blank label and prune them to the beam width.
+
+        Args:
+            hyps (dict): hypotheses
+            scores_rnnt (FloatTensor): `[N, vocab]`
+            scores_lm (FloatTensor): `[N, vocab]`
+            beam_width (int): size of beam
+            ctc_weight (float): weight of CTC prefix score
+            lm_weight (float): weight of LM score
+            ctc_prefix_scorer (CTCPrefixScoreTH): CTC prefix scorer
+        Returns:
+            new_hyps (dict): hypotheses
+
+        """
+        n_hyps, vocab = scores_rnnt.size()
+        total_scores_rnnt = hyps['score_rnnt'].unsqueeze(1) + scores_rnnt
+        total_scores = total_scores_rnnt * (1 - ctc_weight)
+        total_scores_lm = None
+        if scores_lm is not None:
+            total_scores_lm = hyps['score_lm'].unsqueeze(1) + scores_lm
+            total_scores = total_scores + total_scores_lm * lm_weight
+        total_scores[:, self.blank] = LOG_0
+
+        # Pre-selection per hypothesis, then add CTC score
+        k = min(beam_width, vocab - 1)
+        total_scores_topk, topk_ids = torch.topk(total_scores, k=k, dim=1, largest=True, sorted=True)
+        total_scores_ctc = total_scores_topk.new_zeros(n_hyps, k)
+        new_ctc_states = None
+        if ctc_prefix_scorer is not None:
+            total_scores_ctc, new_ctc_states = ctc_prefix_scorer(
+                [list(prefix) for prefix in hyps['hyp']], topk_ids, hyps['ctc_state'])
+            total_scores_ctc = total_scores_ctc.to(self.device)
+            total_scores_topk = total_scores_topk + total_scores_ctc * ctc_weight
+
+        # Pruning over all hypotheses
+        total_scores_topk = total_scores_topk.view(-1)
+        index = torch.topk(total_scores_topk, k=min(beam_width, n_hyps * k), dim=0)[1]
+        hyp_ids = index // k
+        token_ids = topk_ids.view(-1)[index]
+        return {'hyp': [hyps['hyp'][j] + (idx,) for j, idx in zip(hyp_ids.tolist(), token_ids.tolist())],
+                'score_rnnt': total_scores_rnnt[hyp_ids, token_ids],
+                'score_lm': total_scores_lm[hyp_ids, token_ids] if total_scores_lm is not None else hyps['score_lm'][hyp_ids],
+                'score_ctc': total_scores_ctc.view(-1)[index],
+                'ctc_state': new_ctc_states.view(n_hyps * k, *new_ctc_states.size()[2:])[index] if new_ctc_states is not None else None}
+
+    @staticmethod
+    def _total_score(hyps, ctc_weight, lm_weight):
+        return hyps['score_rnnt'] * (1 - ctc_weight) + hyps['score_lm'] * lm_weight + hyps['score_ctc'] * ctc_weight
+
+    @staticmethod
+    def _select_hyps(hyps, index):
+        return {'hyp': [hyps['hyp'][j] for j in index.tolist()],
+                'score_rnnt': hyps['score_rnnt'][index],
+                'score_lm': hyps['score_lm'][index],
+                'score_ctc': hyps['score_ctc'][index],
+                'ctc_state': hyps['ctc_state'][index] if hyps['ctc_state'] is not None else None}
+
+    def _merge_hyps(self, hyps_list, ctc_weight, lm_weight):
+        """Merge hypotheses having the same token sequences by keeping the best one.
+
+        Args:
+            hyps_list (list): list of hypotheses (dict)
+        Returns:
+            hyps (dict): merged hypotheses
+
+        """
+        hyps = {'hyp': sum([h['hyp'] for h in hyps_list], [])}
+        for k in ['score_rnnt', 'score_lm', 'score_ctc', 'ctc_state']:
+            hyps[k] = torch.cat([h[k] for h in hyps_list], dim=0) if hyps_list[0][k] is not None else None
+        prefix_ids = {}
+        ids = torch.tensor([prefix_ids.setdefault(prefix, len(prefix_ids)) for prefix in hyps['hyp']],
+                           device=self.device)
+        scores = self._total_score(hyps, ctc_weight, lm_weight)
+
+        # the first hypothesis of each prefix in descending order of scores
+        order = torch.argsort(scores, descending=True, stable=True)
+        _, inverse = torch.unique(ids[order], return_inverse=True)
+        positions = torch.arange(order.size(0), device=self.device)
+        first = positions.new_full((int(inverse.max()) + 1,), order.size(0)).scatter_reduce(
+            0, inverse, positions, reduce='amin')
+        return self._select_hyps(hyps, order[first])
@@ -17,11 +17,15 @@ import torch.nn as nn
 
 from neural_sp.models.criterion import cross_entropy_lsm
 from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.lm.transformerlm import TransformerLM
+from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.modules.multihead_attention import KVCache
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
+from neural_sp.models.seq2seq.decoders.beam_search import BatchBeamSearch
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
 from neural_sp.models.seq2seq.decoders.ctc import CTC
-from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScore
+from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScoreTH
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import append_sos_eos
 from neural_sp.models.torch_utils import compute_accuracy
@@ -125,6 +129,7 @@ class TransformerDecoder(DecoderBase):
         self.lmstate_final = None
 
         # for attention plot
+        self.attn_capture = None
         self.aws_dict = {}
         self.data_dict = {}
 
@@ -384,10 +389,10 @@ class TransformerDecoder(DecoderBase):
 
         # Append <sos> and <eos>
         ys_in, ys_out, ylens = append_sos_eos(ys, self.eos, self.eos, self.pad, self.device, self.bwd)
-        if not self.training:
-            self.data_dict['elens'] = tensor2np(elens)
-            self.data_dict['ylens'] = tensor2np(ylens)
-            self.data_dict['ys'] = tensor2np(ys_out)
+        if self.attn_capture is not None:
+            self.data_dict['elens'] = self.attn_capture.select_batch(elens)
+            self.data_dict['ylens'] = self.attn_capture.select_batch(ylens)
+            self.data_dict['ys'] = self.attn_capture.select_batch(ys_out)
 
         # Create target self-attention mask
         xmax = eouts.size(1)
@@ -420,17 +425,17 @@ class TransformerDecoder(DecoderBase):
                 xy_aws_masked = xy_aws.masked_fill_(tgt_mask_v2.repeat([1, xy_aws.size(1), 1, xmax]) == 0, 0)
                 # NOTE: attention padding is quite effective for quantity loss
                 xy_aws_layers.append(xy_aws_masked.clone())
-            if not self.training:
+            if self.attn_capture is not None and lth in self.attn_capture:
                 if layer.yy_aws is not None:
-                    self.aws_dict['yy_aws_layer%d' % lth] = tensor2np(layer.yy_aws)
+                    self.aws_dict['yy_aws_layer%d' % lth] = self.attn_capture.select(layer.yy_aws)
                 if layer.xy_aws is not None:
-                    self.aws_dict['xy_aws_layer%d' % lth] = tensor2np(layer.xy_aws)
+                    self.aws_dict['xy_aws_layer%d' % lth] = self.attn_capture.select(layer.xy_aws)
                 if layer.xy_aws_beta is not None:
-                    self.aws_dict['xy_aws_beta_layer%d' % lth] = tensor2np(layer.xy_aws_beta)
+                    self.aws_dict['xy_aws_beta_layer%d' % lth] = self.attn_capture.select(layer.xy_aws_beta)
                 if layer.xy_aws_p_choose is not None:
-                    self.aws_dict['xy_aws_p_choose%d' % lth] = tensor2np(layer.xy_aws_p_choose)
+                    self.aws_dict['xy_aws_p_choose%d' % lth] = self.attn_capture.select(layer.xy_aws_p_choose)
                 if layer.yy_aws_lm is not None:
-                    self.aws_dict['yy_aws_lm_layer%d' % lth] = tensor2np(layer.yy_aws_lm)
+                    self.aws_dict['yy_aws_lm_layer%d' % lth] = self.attn_capture.select(layer.yy_aws_lm)
         logits = self.output(self.norm_out(out))
 
         # Compute XE loss (+ label smoothing)
@@ -475,29 +480,30 @@ class TransformerDecoder(DecoderBase):
         bs, xmax = eouts.size()[:2]
         ys = eouts.new_zeros((bs, 1), dtype=torch.int64).fill_(self.eos)
 
-        cache = [None] * self.n_layers
-
         hyps_batch = []
         ylens = torch.zeros(bs).int()
         eos_flags = [False] * bs
         xy_aws_layers_steps = []
         ymax = math.ceil(xmax * max_len_ratio)
+        kv_caches = [KVCache(max_len=ymax) if cache_states else None for _ in range(self.n_layers)]
+        for layer in self.layers:
+            layer.reset()
         for i in range(ymax):
-            causal_mask = eouts.new_ones(i + 1, i + 1).byte()
-            causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([bs, 1, 1])
+            out = self.pos_enc(self.embed(ys))  # scaled + dropout
+            if cache_states:
+                # feed the last token only and attend to cached keys/values
+                out = out[:, -1:]
+                causal_mask = None
+            else:
+                causal_mask = eouts.new_ones(i + 1, i + 1).byte()
+                causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([bs, 1, 1])
 
-            new_cache = [None] * self.n_layers
             xy_aws_layers = []
-            out = self.pos_enc(self.embed(ys))  # scaled + dropout
             for lth, layer in enumerate(self.layers):
-                out = layer(out, causal_mask, eouts, None, cache=cache[lth])
-                new_cache[lth] = out
+                out = layer(out, causal_mask, eouts, None, kv_cache=kv_caches[lth], src_cache=cache_states)
                 if layer.xy_aws is not None:
                     xy_aws_layers.append(layer.xy_aws[:, :, -1:])
 
-            if cache_states:
-                cache = new_cache[:]
-
             # Pick up 1-best
             y = self.output(self.norm_out(out))[:, -1:].argmax(-1)
             hyps_batch += [y]
@@ -606,6 +612,7 @@ class TransformerDecoder(DecoderBase):
         lm_state_carry_over = params['recog_lm_state_carry_over']
         softmax_smoothing = params['recog_softmax_smoothing']
         eps_wait = params['recog_mma_delay_threshold']
+        ctc_window = params['recog_ctc_window']
 
         if lm is not None:
             assert lm_weight > 0
@@ -619,7 +626,6 @@ class TransformerDecoder(DecoderBase):
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
 
         nbest_hyps_idx, aws, scores = [], [], []
         eos_flags = []
@@ -631,10 +637,8 @@ class TransformerDecoder(DecoderBase):
             # For joint CTC-Attention decoding
             ctc_prefix_scorer = None
             if ctc_log_probs is not None:
-                if self.bwd:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b][::-1], self.blank, self.eos)
-                else:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
+                ctc_prefix_scorer = CTCPrefixScoreTH(ctc_log_probs[b:b + 1], elens[b:b + 1], self.blank, self.eos,
+                                                     margin=ctc_window, backward=self.bwd)
 
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
@@ -647,26 +651,38 @@ class TransformerDecoder(DecoderBase):
             end_hyps = []
             hyps = [{'hyp': [self.eos],
                      'ys': ys,
-                     'cache': None,
+                     'cache_id': 0,
                      'score': 0.,
                      'score_att': 0.,
                      'score_ctc': 0.,
                      'score_lm': 0.,
                      'aws': [None],
                      'lmstate': lmstate,
-                     'ensmbl_cache': [[None] * dec.n_layers for dec in ensmbl_decs] if n_models > 1 else None,
-                     'ctc_state': ctc_prefix_scorer.initial_state() if ctc_prefix_scorer is not None else None,
+                     'ctc_state': ctc_prefix_scorer.initial_state()[0] if ctc_prefix_scorer is not None else None,
                      'quantity_rate': 1.,
                      'streamable': True,
                      'streaming_failed_point': 1000}]
             streamable_global = True
             ymax = math.ceil(elens[b] * max_len_ratio)
+            kv_caches = [KVCache(max_len=ymax) if cache_states else None for _ in range(self.n_layers)]
+            ensmbl_kv_caches = [[KVCache(max_len=ymax) if cache_states else None for _ in range(dec.n_layers)]
+                                for dec in ensmbl_decs]
+            for layer in self.layers:
+                layer.reset()
+            for dec in ensmbl_decs:
+                for layer in dec.layers:
+                    layer.reset()
+
+            # NOTE: encoder outputs are shared among hypotheses except for MMA
+            eouts_b = eouts[b:b + 1, :elens[b]]
+            ensmbl_eouts_b = [ensmbl_eouts[i_e][b:b + 1, :elens[b]] for i_e in range(len(ensmbl_decs))]
             for i in range(ymax):
                 # batchfy all hypotheses for batch decoding
-                cache = [None] * self.n_layers
                 if cache_states and i > 0:
-                    for lth in range(self.n_layers):
-                        cache[lth] = torch.cat([beam['cache'][lth] for beam in hyps], dim=0)
+                    # reorder cached keys/values by the parent hypotheses
+                    cache_ids = eouts.new_tensor([beam['cache_id'] for beam in hyps], dtype=torch.int64)
+                    for kv_cache in kv_caches + sum(ensmbl_kv_caches, []):
+                        kv_cache.index_select(cache_ids)
                 ys = eouts.new_zeros((len(hyps), i + 1), dtype=torch.int64)
                 for j, beam in enumerate(hyps):
                     ys[j, :] = beam['ys']
@@ -680,46 +696,44 @@ class TransformerDecoder(DecoderBase):
                 _, lmstate, scores_lm = helper.update_rnnlm_state_batch(lm, hyps, y_lm)
 
                 # for the main model
-                causal_mask = eouts.new_ones(i + 1, i + 1).byte()
-                causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([ys.size(0), 1, 1])
+                causal_mask = None
+                if not cache_states:
+                    causal_mask = eouts.new_ones(i + 1, i + 1).byte()
+                    causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([ys.size(0), 1, 1])
 
                 out = self.pos_enc(self.embed(ys))  # scaled + dropout
+                if cache_states:
+                    # feed the last token only and attend to cached keys/values
+                    out = out[:, -1:]
 
                 n_heads_total = 0
-                eouts_b = eouts[b:b + 1, :elens[b]].repeat([ys.size(0), 1, 1])
-                new_cache = [None] * self.n_layers
                 xy_aws_layers = []
                 lth_s = self.mocha_first_layer - 1
                 for lth, layer in enumerate(self.layers):
                     out = layer(
-                        out, causal_mask, eouts_b, None,
-                        cache=cache[lth],
+                        out, causal_mask,
+                        eouts_b.repeat([ys.size(0), 1, 1]) if self.attn_type == 'mocha' else eouts_b, None,
                         xy_aws_prev=xy_aws_prev[:, lth - lth_s] if lth >= lth_s and i > 0 else None,
-                        eps_wait=eps_wait)
+                        eps_wait=eps_wait,
+                        kv_cache=kv_caches[lth], src_cache=cache_states)
 
-                    new_cache[lth] = out
                     if layer.xy_aws is not None:
                         xy_aws_layers.append(layer.xy_aws)
                 logits = self.output(self.norm_out(out))
                 probs = torch.softmax(logits[:, -1] * softmax_smoothing, dim=1)
                 xy_aws_layers = torch.stack(xy_aws_layers, dim=1)  # `[B, H, n_layers, L, T]`
 
-                # Ensemble initialization
-                ensmbl_cache = [[None] * dec.n_layers for dec in ensmbl_decs]
-                if n_models > 1 and cache_states and i > 0:
-                    for i_e, dec in enumerate(ensmbl_decs):
-                        for lth in range(dec.n_layers):
-                            ensmbl_cache[i_e][lth] = torch.cat([beam['ensmbl_cache'][i_e][lth] for beam in hyps], dim=0)
-
                 # for the ensemble
-                ensmbl_new_cache = [[None] * dec.n_layers for dec in ensmbl_decs]
                 for i_e, dec in enumerate(ensmbl_decs):
                     out_e = dec.pos_enc(dec.embed(ys))  # scaled + dropout
-                    eouts_e = ensmbl_eouts[i_e][b:b + 1, :elens[b]].repeat([ys.size(0), 1, 1])
+                    if cache_states:
+                        out_e = out_e[:, -1:]
+                    eouts_e = ensmbl_eouts_b[i_e]
+                    if dec.attn_type == 'mocha':
+                        eouts_e = eouts_e.repeat([ys.size(0), 1, 1])
                     for lth in range(dec.n_layers):
                         out_e = dec.layers[lth](out_e, causal_mask, eouts_e, None,
-                                                cache=ensmbl_cache[i_e][lth])
-                        ensmbl_new_cache[i_e][lth] = out_e
+                                                kv_cache=ensmbl_kv_caches[i_e][lth], src_cache=cache_states)
                     logits_e = dec.output(dec.norm_out(out_e))
                     probs += torch.softmax(logits_e[:, -1] * softmax_smoothing, dim=1)
                     # NOTE: sum in the probability scale (not log-scale)
@@ -727,7 +741,7 @@ class TransformerDecoder(DecoderBase):
                 # Ensemble
                 scores_att = torch.log(probs / n_models)
 
-                new_hyps = []
+                cands, topk_ids_all, total_scores_topk_all = [], [], []
                 for j, beam in enumerate(hyps):
                     # Attention scores
                     total_scores_att = beam['score_att'] + scores_att[j:j + 1]
@@ -746,21 +760,31 @@ class TransformerDecoder(DecoderBase):
                     # Add length penalty
                     if lp_weight > 0:
                         total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
+                    cands.append((total_scores_att, total_scores_lm))
+                    topk_ids_all.append(topk_ids)
+                    total_scores_topk_all.append(total_scores_topk)
+                topk_ids = torch.cat(topk_ids_all, dim=0)
+                total_scores_topk = torch.cat(total_scores_topk_all, dim=0)
+
+                # Add CTC scores of all hypotheses at once
+                new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
+                    [beam['hyp'] for beam in hyps], topk_ids,
+                    torch.stack([beam['ctc_state'] for beam in hyps]) if ctc_prefix_scorer is not None else None,
+                    total_scores_topk, ctc_prefix_scorer,
+                    peaks=xy_aws_layers[:, -1, :, -1].sum(1).argmax(-1) if ctc_window > 0 else None)
 
-                    # Add CTC score
-                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                        beam['hyp'], topk_ids, beam['ctc_state'],
-                        total_scores_topk, ctc_prefix_scorer)
-
+                new_hyps = []
+                for j, beam in enumerate(hyps):
+                    total_scores_att, total_scores_lm = cands[j]
                     new_aws = beam['aws'] + [xy_aws_layers[j:j + 1, :, :, -1:]]
                     aws_j = torch.cat(new_aws[1:], dim=3)  # `[1, H, n_layers, L, T]`
                     streaming_failed_point = beam['streaming_failed_point']
 
                     # forward direction
                     for k in range(beam_width):
-                        idx = topk_ids[0, k].item()
+                        idx = topk_ids[j, k].item()
                         length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
-                        total_score = total_scores_topk[0, k].item() / length_norm_factor
+                        total_score = total_scores_topk[j, k].item() / length_norm_factor
 
                         if idx == self.eos:
                             # Exclude short hypotheses
@@ -795,16 +819,15 @@ class TransformerDecoder(DecoderBase):
                         new_hyps.append(
                             {'hyp': beam['hyp'] + [idx],
                              'ys': torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1),
-                             'cache': [new_cache_l[j:j + 1] for new_cache_l in new_cache] if cache_states else cache,
+                             'cache_id': j,
                              'score': total_score,
                              'score_att': total_scores_att[0, idx].item(),
-                             'score_ctc': total_scores_ctc[k].item(),
+                             'score_ctc': total_scores_ctc[j, k].item(),
                              'score_lm': total_scores_lm[0, idx].item(),
                              'aws': new_aws,
                              'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
                                          'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                             'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
-                             'ensmbl_cache': [[new_cache_e_l[j:j + 1] for new_cache_e_l in new_cache_e] for new_cache_e in ensmbl_new_cache] if cache_states else None,
+                             'ctc_state': new_ctc_states[j, k] if ctc_prefix_scorer is not None else None,
                              'streamable': streamable_global,
                              'streaming_failed_point': streaming_failed_point,
                              'quantity_rate': quantity_rate})
@@ -911,3 +934,198 @@ class TransformerDecoder(DecoderBase):
             self.lmstate_final = end_hyps[0]['lmstate']
 
         return nbest_hyps_idx, aws, scores
+
+    def beam_search_batch(self, eouts, elens, params, idx2token=None,
+                          lm=None, lm_second=None, lm_second_bwd=None, ctc_log_probs=None,
+                          nbest=1, exclude_eos=False,
+                          refs_id=None, utt_ids=None, speakers=None, cache_states=True):
+        """Beam search decoding over all utterances in a mini-batch at once.
+
+        Args:
+            eouts (FloatTensor): `[B, T, d_model]`
+            elens (IntTensor): `[B]`
+            params (dict): hyperparameters for decoding
+            idx2token (): converter from index to token
+            lm: firsh path LM
+            lm_second: second path LM
+            lm_second_bwd: secoding path backward LM
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            nbest (int): number of N-best list
+            exclude_eos (bool): exclude <eos> from hypothesis
+            refs_id (list): reference list
+            utt_ids (list): utterance id list
+            speakers (list): speaker list
+            cache_states (bool): cache decoder states for fast decoding
+        Returns:
+            nbest_hyps_idx (list): length `B`, each of which contains list of N hypotheses
+            aws (list): length `B`, each of which contains arrays of size `[H, L, T]`
+            scores (list):
+
+        """
+        # NOTE: fall back to utterance-level beam search for MMA or LM state carry over across utterances
+        if self.attn_type == 'mocha' or params['recog_lm_state_carry_over']:
+            return self.beam_search(eouts, elens, params, idx2token,
+                                    lm, lm_second, lm_second_bwd, ctc_log_probs,
+                                    nbest, exclude_eos, refs_id, utt_ids, speakers,
+                                    cache_states=cache_states)
+
+        bs = eouts.size(0)
+
+        beam_width = params['recog_beam_width']
+        assert 1 <= nbest <= beam_width
+        ctc_weight = params['recog_ctc_weight']
+        max_len_ratio = params['recog_max_len_ratio']
+        min_len_ratio = params['recog_min_len_ratio']
+        lp_weight = params['recog_length_penalty']
+        length_norm = params['recog_length_norm']
+        lm_weight = params['recog_lm_weight']
+        lm_weight_second = params['recog_lm_second_weight']
+        lm_weight_second_bwd = params['recog_lm_bwd_weight']
+        eos_threshold = params['recog_eos_threshold']
+        softmax_smoothing = params['recog_softmax_smoothing']
+        ctc_window = params['recog_ctc_window']
+
+        if lm is not None:
+            assert lm_weight > 0
+            lm.eval()
+        if lm_second is not None:
+            assert lm_weight_second > 0
+            lm_second.eval()
+        if lm_second_bwd is not None:
+            assert lm_weight_second_bwd > 0
+            lm_second_bwd.eval()
+        trfm_lm = isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL)
+
+        helper = BatchBeamSearch(bs, beam_width, self.eos, elens, max_len_ratio, min_len_ratio, self.device)
+
+        # For joint CTC-Attention decoding
+        ctc_prefix_scorer = None
+        if ctc_log_probs is not None:
+            assert ctc_weight > 0
+            ctc_prefix_scorer = CTCPrefixScoreTH(ctc_log_probs, elens, self.blank, self.eos,
+                                                 margin=ctc_window, backward=self.bwd)
+            helper.init_ctc_states(ctc_prefix_scorer)
+
+        # Initialization for all hypotheses
+        # NOTE: encoder outputs are shared among hypotheses of the same utterance
+        xy_mask = make_pad_mask(elens.to(self.device)).unsqueeze(1)  # `[B, 1, T]`
+        for layer in self.layers:
+            layer.reset()
+        kv_caches = [KVCache(max_len=helper.n_steps) if cache_states else None for _ in range(self.n_layers)]
+        lmstate = None
+
+        for i in range(helper.n_steps):
+            ys = helper.ys
+
+            # Update LM states for shallow fusion
+            scores_lm = None
+            if lm is not None:
+                # NOTE: TransformerLM/TransformerXL take all previous tokens and cache outputs of each layer
+                y_lm = ys if trfm_lm else ys[:, -1:]
+                _, lmstate, scores_lm = lm.predict(y_lm, lmstate,
+                                                   cache=lmstate if cache_states and trfm_lm else None)
+
+            out = self.pos_enc(self.embed(ys))  # scaled + dropout
+            if cache_states:
+                # feed the last token only and attend to cached keys/values
+                out = out[:, -1:]
+                causal_mask = None
+            else:
+                causal_mask = eouts.new_ones(i + 1, i + 1).byte()
+                causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([ys.size(0), 1, 1])
+
+            xy_aws_layers = []
+            for lth, layer in enumerate(self.layers):
+                out = layer(out, causal_mask, eouts, xy_mask.repeat([1, out.size(1), 1]),
+                            kv_cache=kv_caches[lth], src_cache=cache_states)
+                if layer.xy_aws is not None:
+                    xy_aws_layers.append(layer.xy_aws[:, :, -1:])
+            logits = self.output(self.norm_out(out))
+            scores_att = torch.log_softmax(logits[:, -1] * softmax_smoothing, dim=1)
+            xy_aws_layers = torch.stack(xy_aws_layers, dim=1)  # `[B * beam_width, n_layers, H, 1, T]`
+            aw = xy_aws_layers.view(ys.size(0), -1, 1, xy_aws_layers.size(-1))
+
+            index = helper.step(scores_att,
+                                scores_lm=scores_lm[:, -1] if lm is not None else None,
+                                lm_weight=lm_weight,
+                                lm_before_topk=True,
+                                lp_weight=lp_weight,
+                                ctc_prefix_scorer=ctc_prefix_scorer,
+                                ctc_weight=ctc_weight,
+                                ctc_peaks=xy_aws_layers[:, -1, :, -1].sum(1).argmax(-1) if ctc_window > 0 else None,
+                                length_norm=length_norm,
+                                eos_threshold=eos_threshold,
+                                aws=aw)
+            if helper.is_finish:
+                break
+
+            # Reorder states by the surviving hypotheses
+            if cache_states:
+                for kv_cache in kv_caches:
+                    kv_cache.index_select(index)
+            if lmstate is not None:
+                if trfm_lm:
+                    lmstate = [lmstate_l.index_select(0, index) for lmstate_l in lmstate]
+                else:
+                    lmstate = {'hxs': lmstate['hxs'].index_select(1, index),
+                               'cxs': lmstate['cxs'].index_select(1, index) if lmstate['cxs'] is not None else None}
+
+        nbest_end_hyps = helper.finalize(nbest)
+        # forward second path LM rescoring (all utterances at once)
+        if lm_second is not None:
+            self.lm_rescoring([h for end_hyps in nbest_end_hyps for h in end_hyps],
+                              lm_second, lm_weight_second, tag='second')
+
+        # backward secodn path LM rescoring
+        if lm_second_bwd is not None:
+            self.lm_rescoring([h for end_hyps in nbest_end_hyps for h in end_hyps],
+                              lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
+
+        nbest_hyps_idx, aws, scores = [], [], []
+        for b, end_hyps in enumerate(nbest_end_hyps):
+            # Sort by score
+            end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+
+            if idx2token is not None:
+                if utt_ids is not None:
+                    logger.info('Utt-id: %s' % utt_ids[b])
+                assert self.vocab == idx2token.vocab
+                logger.info('=' * 200)
+                for k in range(len(end_hyps)):
+                    if refs_id is not None:
+                        logger.info('Ref: %s' % idx2token(refs_id[b]))
+                    logger.info('Hyp: %s' % idx2token(
+                        end_hyps[k]['hyp'][1:][::-1] if self.bwd else end_hyps[k]['hyp'][1:]))
+                    logger.info('num tokens (hyp): %d' % len(end_hyps[k]['hyp'][1:]))
+                    logger.info('log prob (hyp): %.7f' % end_hyps[k]['score'])
+                    logger.info('log prob (hyp, att): %.7f' % (end_hyps[k]['score_att'] * (1 - ctc_weight)))
+                    if ctc_prefix_scorer is not None:
+                        logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc'] * ctc_weight))
+                    if lm is not None:
+                        logger.info('log prob (hyp, first-path lm): %.7f' % (end_hyps[k]['score_lm'] * lm_weight))
+                    logger.info('-' * 50)
+
+            # N-best list (fewer hypotheses can be found than nbest, e.g., for short inputs)
+            n_hyps = min(nbest, len(end_hyps))
+            elen = int(elens[b])
+            if self.bwd:
+                # Reverse the order
+                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:][::-1]) for n in range(n_hyps)]]
+                aws += [[tensor2np(end_hyps[n]['aws'].flip(1)[:, :, :elen]) for n in range(n_hyps)]]
+            else:
+                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(n_hyps)]]
+                aws += [[tensor2np(end_hyps[n]['aws'][:, :, :elen]) for n in range(n_hyps)]]
+            scores += [[end_hyps[n]['score_att'] for n in range(n_hyps)]]
+
+        # Exclude <eos> (<sos> in case of the backward decoder)
+        if exclude_eos:
+            for b in range(bs):
+                for n in range(len(nbest_hyps_idx[b])):
+                    if self.bwd and len(nbest_hyps_idx[b][n]) > 0 and nbest_hyps_idx[b][n][0] == self.eos:
+                        nbest_hyps_idx[b][n] = nbest_hyps_idx[b][n][1:]
+                        aws[b][n] = aws[b][n][:, 1:]
+                    elif not self.bwd and len(nbest_hyps_idx[b][n]) > 0 and nbest_hyps_idx[b][n][-1] == self.eos:
+                        nbest_hyps_idx[b][n] = nbest_hyps_idx[b][n][:-1]
+                        aws[b][n] = aws[b][n][:, :-1]
+
+        return nbest_hyps_idx, aws, scores
@@ -14,6 +14,7 @@ import random
 import torch
 import torch.nn as nn
 
+from neural_sp.models.modules.attention_capture import chunks_to_center
 from neural_sp.models.modules.conformer_convolution import ConformerConvBlock
 from neural_sp.models.modules.positional_embedding import XLPositionalEmbedding
 from neural_sp.models.modules.positionwise_feed_forward import PositionwiseFeedForward as FFN
@@ -28,7 +29,6 @@ from neural_sp.models.seq2seq.encoders.subsampling import MaxpoolSubsampler
 from neural_sp.models.seq2seq.encoders.transformer import time_restricted_mask
 from neural_sp.models.seq2seq.encoders.utils import chunkwise
 from neural_sp.models.torch_utils import make_pad_mask
-from neural_sp.models.torch_utils import tensor2np
 
 random.seed(1)
 
@@ -137,6 +137,7 @@ class ConformerEncoder(EncoderBase):
         self.bridge_sub2 = None
 
         # for attention plot
+        self.attn_capture = None
         self.aws_dict = {}
         self.data_dict = {}
 
@@ -330,6 +331,111 @@ class ConformerEncoder(EncoderBase):
                 nn.init.xavier_uniform_(self.u_bias)
                 nn.init.xavier_uniform_(self.v_bias)
 
+    def reset_cache(self):
+        """Reset buffers of each layer for stateful streaming inference."""
+        self.stream_bufs = [None] * self.n_layers  # inputs of each layer
+        self.stream_buf_offsets = [0] * self.n_layers  # global index of the first frame in each buffer
+        self.stream_n_outputs = [0] * self.n_layers  # number of frames already output by each layer
+
+    def streaming_chunk_sizes(self):
+        """Chunk sizes after subsampling by CNN blocks.
+
+        Returns:
+            N_l (int): number of frames for left context
+            N_c (int): number of frames for current context
+            N_r (int): number of frames for right context
+
+        """
+        factor = self.conv.subsampling_factor if self.conv is not None else 1
+        return (self.chunk_size_left // factor, self.chunk_size_current // factor,
+                self.chunk_size_right // factor)
+
+    def embed_chunk(self, xs, xlens, offset=0):
+        """Embed a chunk of input frames for stateful streaming inference.
+
+        Args:
+            xs (FloatTensor): `[B, chunk_size_current, input_dim]`
+            xlens (IntTensor): `[B]` (on CPU) number of valid frames in the chunk
+            offset (int): dummy interface for TransformerEncoder
+        Returns:
+            xs (FloatTensor): `[B, T_chunk, d_model]`
+
+        """
+        assert self.latency_controlled and self.streaming_type == 'mask'
+        if self.conv is None:
+            xs = self.embed(xs)
+        else:
+            xs, xlens = self.conv(xs, xlens)
+        xs = xs[:, :xlens.max().item()]
+        return xs * self.scale
+
+    def encode_stream(self, xs, is_final=False):
+        """Encode embedded frames incrementally for stateful streaming inference.
+
+        This is equivalent to the forward pass with the time-restricted masks
+        (streaming_type='mask'). Each layer encodes a chunk as soon as its
+        input frames in the right context are available: N_r frames for
+        self-attention in the first layer, and (kernel_size - 1) // 2 frames
+        for the depthwise convolution in every layer. N_l frames of the left
+        context and (kernel_size - 1) // 2 frames for the convolution are kept
+        in the buffer of each layer. Call `reset_cache` at the beginning of
+        each session.
+        NOTE: relative positional embeddings are created for the frames used by
+        each chunk. They are not identical to those in the forward pass, where
+        positional terms depend on the length of the whole input.
+
+        Args:
+            xs (FloatTensor): `[B, T_in, d_model]` output of `embed_chunk`
+            is_final (bool): flush all buffered frames at the end of the session
+        Returns:
+            xs (FloatTensor): `[B, T_out, d_model]` newly encoded frames
+
+        """
+        assert self.subsample is None
+        N_l, N_c, N_r = self.streaming_chunk_sizes()
+        bs = xs.size(0)
+
+        for lth, layer in enumerate(self.layers):
+            if self.stream_bufs[lth] is None:
+                self.stream_bufs[lth] = xs
+            else:
+                self.stream_bufs[lth] = torch.cat([self.stream_bufs[lth], xs], dim=1)
+            buf = self.stream_bufs[lth]
+            offset = self.stream_buf_offsets[lth]
+            n_frames = offset + buf.size(1)  # number of frames received by this layer
+            n_right = N_r if lth == 0 else 0
+            pad = layer.conv.depthwise_conv.padding[0]
+
+            xs = []
+            while self.stream_n_outputs[lth] < n_frames:
+                start = self.stream_n_outputs[lth]
+                if not is_final and start + N_c + n_right + pad > n_frames:
+                    break  # wait for the right context
+                end = min(start + N_c, n_frames)
+                # frames used as keys, and frames for the convolution of keys
+                key_start, key_end = max(0, start - N_l), min(end + n_right, n_frames)
+                win_start, win_end = max(0, key_start - pad), min(key_end + pad, n_frames)
+                xs_win = buf[:, win_start - offset:win_end - offset]
+                xx_mask = torch.zeros(bs, xs_win.size(1), xs_win.size(1), dtype=torch.bool, device=xs_win.device)
+                xx_mask[:, :, key_start - win_start:key_end - win_start] = 1
+                pos_embs = self.pos_emb(xs_win, zero_center_offset=True)
+                xs_win = layer(xs_win, xx_mask, pos_embs=pos_embs, u_bias=self.u_bias, v_bias=self.v_bias)
+                xs.append(xs_win[:, start - win_start:end - win_start])
+                self.stream_n_outputs[lth] = end
+
+            # Discard frames out of the left context of the next chunk
+            offset_next = max(0, self.stream_n_outputs[lth] - N_l - pad)
+            self.stream_bufs[lth] = buf[:, offset_next - offset:]
+            self.stream_buf_offsets[lth] = offset_next
+            xs = torch.cat(xs, dim=1) if len(xs) > 0 else buf[:, :0]
+
+        xs = self.norm_out(xs)
+
+        # Bridge layer
+        if self.bridge is not None:
+            xs = self.bridge(xs)
+        return xs
+
     def forward(self, xs, xlens, task, streaming=False, lookback=False, lookahead=False):
         """Forward pass.
 
@@ -396,21 +502,13 @@ class ConformerEncoder(EncoderBase):
             for lth, layer in enumerate(self.layers):
                 xs = layer(xs, xx_mask if lth >= 1 else xx_mask_first,
                            pos_embs=pos_embs, u_bias=self.u_bias, v_bias=self.v_bias)
-                if not self.training:
+                if self.attn_capture is not None and lth in self.attn_capture:
                     if self.streaming_type == 'reshape':
-                        n_heads = layer.xx_aws.size(1)
-                        xx_aws = layer.xx_aws[:, :, N_l:N_l + N_c, N_l:N_l + N_c]
-                        xx_aws = xx_aws.view(bs, n_chunks, n_heads, N_c, N_c)
-                        xx_aws_center = xx_aws.new_zeros(bs, n_heads, emax, emax)
-                        for chunk_idx in range(n_chunks):
-                            offset = chunk_idx * N_c
-                            emax_chunk = xx_aws_center[:, :, offset:offset + N_c].size(2)
-                            xx_aws_chunk = xx_aws[:, chunk_idx, :, :emax_chunk, :emax_chunk]
-                            xx_aws_center[:, :, offset:offset + N_c, offset:offset + N_c] = xx_aws_chunk
-                        self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(xx_aws_center)
+                        xx_aws = chunks_to_center(layer.xx_aws, bs, n_chunks, N_l, N_c, emax)
                     elif self.streaming_type == 'mask':
-                        self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(layer.xx_aws)
-                    self.data_dict['elens%d' % lth] = tensor2np(xlens)
+                        xx_aws = layer.xx_aws
+                    self.aws_dict['xx_aws_layer%d' % lth] = self.attn_capture.select(xx_aws)
+                    self.data_dict['elens%d' % lth] = self.attn_capture.select_batch(xlens)
 
                 if self.subsample is not None:
                     xs, xlens = self.subsample[lth](xs, xlens)
@@ -439,9 +537,9 @@ class ConformerEncoder(EncoderBase):
 
             for lth, layer in enumerate(self.layers):
                 xs = layer(xs, xx_mask, pos_embs=pos_embs, u_bias=self.u_bias, v_bias=self.v_bias)
-                if not self.training:
-                    self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(layer.xx_aws)
-                    self.data_dict['elens%d' % lth] = tensor2np(xlens)
+                if self.attn_capture is not None and lth in self.attn_capture:
+                    self.aws_dict['xx_aws_layer%d' % lth] = self.attn_capture.select(layer.xx_aws)
+                    self.data_dict['elens%d' % lth] = self.attn_capture.select_batch(xlens)
 
                 # Pick up outputs in the sub task before the projection layer
                 if lth == self.n_layers_sub1 - 1:
@@ -485,8 +583,9 @@ class ConformerEncoder(EncoderBase):
         xs_sub = getattr(self, 'norm_out_' + module)(xs_sub)
         if getattr(self, 'bridge_' + module) is not None:
             xs_sub = getattr(self, 'bridge_' + module)(xs_sub)
-        if not self.training:
-            self.aws_dict['xx_aws_%s_layer%d' % (module, lth)] = tensor2np(getattr(self, 'layer_' + module).xx_aws)
+        if self.attn_capture is not None and self.task_specific_layer and lth in self.attn_capture:
+            self.aws_dict['xx_aws_%s_layer%d' % (module, lth)] = self.attn_capture.select(
+                getattr(self, 'layer_' + module).xx_aws)
         return xs_sub
 
 
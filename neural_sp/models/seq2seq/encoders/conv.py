@@ -429,8 +429,7 @@ def update_lens_1d(seq_lens, layer):
 
 def _update_1d(seq_len, layer):
     if type(layer) == nn.MaxPool1d and layer.ceil_mode:
-        return math.ceil(
-            (seq_len + 1 + 2 * layer.padding - (layer.kernel_size - 1) - 1) / layer.stride + 1)
+        return _ceil_pool_len(seq_len, layer.kernel_size, layer.stride, layer.padding)
     else:
         return math.floor(
             (seq_len + 2 * layer.padding[0] - (layer.kernel_size[0] - 1) - 1) / layer.stride[0] + 1)
@@ -459,13 +458,21 @@ def update_lens_2d(seq_lens, layer, dim=0):
 
 def _update_2d(seq_len, layer, dim):
     if type(layer) == nn.MaxPool2d and layer.ceil_mode:
-        return math.ceil(
-            (seq_len + 1 + 2 * layer.padding[dim] - (layer.kernel_size[dim] - 1) - 1) / layer.stride[dim] + 1)
+        return _ceil_pool_len(seq_len, layer.kernel_size[dim], layer.stride[dim], layer.padding[dim])
     else:
         return math.floor(
             (seq_len + 2 * layer.padding[dim] - (layer.kernel_size[dim] - 1) - 1) / layer.stride[dim] + 1)
 
 
+def _ceil_pool_len(seq_len, kernel_size, stride, padding):
+    """Output length of max-pooling with ceil_mode=True (same as PyTorch)."""
+    out_len = math.ceil((seq_len + 2 * padding - (kernel_size - 1) - 1) / stride) + 1
+    # NOTE: the last pooling window must start inside the input or the left padding
+    if (out_len - 1) * stride >= seq_len + padding:
+        out_len -= 1
+    return out_len
+
+
 def parse_cnn_config(channels, kernel_sizes, strides, poolings):
     _channels, _kernel_sizes, _strides, _poolings = [], [], [], []
     is_1dconv = '(' not in kernel_sizes
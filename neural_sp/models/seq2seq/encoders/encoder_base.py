@@ -7,14 +7,11 @@
 """Base class for encoders."""
 
 import logging
-import os
-import shutil
 import torch
 
 from neural_sp.models.base import ModelBase
-
-import matplotlib
-matplotlib.use('Agg')
+from neural_sp.trainers.report_worker import plot_attention_heads
+from neural_sp.trainers.report_worker import submit
 
 logger = logging.getLogger(__name__)
 
@@ -59,38 +56,15 @@ class EncoderBase(ModelBase):
                 else:
                     self.turn_off_ceil_mode(module)
 
-    def _plot_attention(self, save_path=None, n_cols=2):
+    def _plot_attention(self, save_path=None, n_cols=2, worker=None):
         """Plot attention for each head in all encoder layers."""
-        from matplotlib import pyplot as plt
-        from matplotlib.ticker import MaxNLocator
-
-        # Clean directory
-        if save_path is not None and os.path.isdir(save_path):
-            shutil.rmtree(save_path)
-            os.mkdir(save_path)
-
-        if not hasattr(self, 'aws_dict'):
+        if not hasattr(self, 'aws_dict') or len(self.aws_dict) == 0 or save_path is None:
             return
 
+        # NOTE: show the last utterance in a mini-batch
+        aws = {}
         for k, aw in self.aws_dict.items():
             lth = k.split('_')[-1].replace('layer', '')
             elens_l = self.data_dict['elens' + lth]
-
-            plt.clf()
-            n_heads = aw.shape[1]
-            n_cols_tmp = 1 if n_heads == 1 else n_cols
-            fig, axes = plt.subplots(max(1, n_heads // n_cols_tmp), n_cols_tmp,
-                                     figsize=(20, 8), squeeze=False)
-            for h in range(n_heads):
-                ax = axes[h // n_cols_tmp, h % n_cols_tmp]
-                ax.imshow(aw[-1, h, :elens_l[-1], :elens_l[-1]], aspect="auto")
-                ax.grid(False)
-                ax.set_xlabel("Input (head%d)" % h)
-                ax.set_ylabel("Output (head%d)" % h)
-                ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-                ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-
-            fig.tight_layout()
-            if save_path is not None:
-                fig.savefig(os.path.join(save_path, '%s.png' % k), dvi=500)
-            plt.close()
+            aws[k] = aw[-1, :, :elens_l[-1], :elens_l[-1]].copy()
+        submit(worker, save_path, plot_attention_heads, save_path, aws, n_cols)
@@ -14,6 +14,8 @@ import random
 import torch
 import torch.nn as nn
 
+from neural_sp.models.modules.attention_capture import chunks_to_center
+from neural_sp.models.modules.multihead_attention import KVCache
 from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism as MHA
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.positional_embedding import XLPositionalEmbedding
@@ -28,7 +30,6 @@ from neural_sp.models.seq2seq.encoders.subsampling import DropSubsampler
 from neural_sp.models.seq2seq.encoders.subsampling import MaxpoolSubsampler
 from neural_sp.models.seq2seq.encoders.utils import chunkwise
 from neural_sp.models.torch_utils import make_pad_mask
-from neural_sp.models.torch_utils import tensor2np
 
 random.seed(1)
 
@@ -124,6 +125,7 @@ class TransformerEncoder(EncoderBase):
         if self.latency_controlled:
             assert n_layers_sub1 == 0
             assert n_layers_sub2 == 0
+        self.kv_caches = [None] * n_layers  # for stateful streaming inference
 
         # for hierarchical encoder
         self.n_layers_sub1 = n_layers_sub1
@@ -136,6 +138,7 @@ class TransformerEncoder(EncoderBase):
         self.bridge_sub2 = None
 
         # for attention plot
+        self.attn_capture = None
         self.aws_dict = {}
         self.data_dict = {}
 
@@ -329,6 +332,72 @@ class TransformerEncoder(EncoderBase):
                 nn.init.xavier_uniform_(self.u_bias)
                 nn.init.xavier_uniform_(self.v_bias)
 
+    def reset_cache(self):
+        """Reset key/value memories of the left context for stateful streaming inference."""
+        self.kv_caches = [KVCache(max_len=self.chunk_size_left + self.chunk_size_current + self.chunk_size_right)
+                          for _ in range(self.n_layers)]
+
+    def streaming_chunk_sizes(self):
+        """Chunk sizes after subsampling by CNN blocks.
+
+        Returns:
+            N_l (int): number of frames for left context
+            N_c (int): number of frames for current context
+            N_r (int): number of frames for right context
+
+        """
+        factor = self.conv.subsampling_factor if self.conv is not None else 1
+        return (self.chunk_size_left // factor, self.chunk_size_current // factor,
+                self.chunk_size_right // factor)
+
+    def embed_chunk(self, xs, xlens, offset):
+        """Embed a chunk of input frames for stateful streaming inference.
+
+        Args:
+            xs (FloatTensor): `[B, chunk_size_current, input_dim]`
+            xlens (IntTensor): `[B]` (on CPU) number of valid frames in the chunk
+            offset (int): number of frames already embedded in the session (after subsampling)
+        Returns:
+            xs (FloatTensor): `[B, T_chunk, d_model]`
+
+        """
+        assert self.latency_controlled and self.streaming_type == 'mask'
+        if self.conv is None:
+            xs = self.embed(xs)
+        else:
+            xs, xlens = self.conv(xs, xlens)
+        xs = xs[:, :xlens.max().item()]
+        return self.pos_enc(xs, scale=True, offset=offset)
+
+    def encode_chunk(self, xs, xs_lookahead=None):
+        """Encode a chunk with cached key/value memories of the left context.
+
+        This is equivalent to the forward pass with the time-restricted masks
+        (streaming_type='mask'), but only frames in the current chunk are used
+        as queries. Call `reset_cache` at the beginning of each session.
+
+        Args:
+            xs (FloatTensor): `[B, T_chunk, d_model]` output of `embed_chunk`
+            xs_lookahead (FloatTensor): `[B, T_r, d_model]` output of `embed_chunk`
+                for the right context of the first layer
+        Returns:
+            xs (FloatTensor): `[B, T_chunk, d_model]`
+
+        """
+        assert self.subsample is None
+        N_l = self.streaming_chunk_sizes()[0]
+        for lth, layer in enumerate(self.layers):
+            xs = layer(xs, kv_cache=self.kv_caches[lth],
+                       lookahead=xs_lookahead if lth == 0 else None)
+            self.kv_caches[lth].keep_last(N_l)
+
+        xs = self.norm_out(xs)
+
+        # Bridge layer
+        if self.bridge is not None:
+            xs = self.bridge(xs)
+        return xs
+
     def forward(self, xs, xlens, task, streaming=False, lookback=False, lookahead=False):
         """Forward pass.
 
@@ -399,21 +468,13 @@ class TransformerEncoder(EncoderBase):
             for lth, layer in enumerate(self.layers):
                 xs = layer(xs, xx_mask if lth >= 1 else xx_mask_first,
                            pos_embs=pos_embs, u_bias=self.u_bias, v_bias=self.v_bias)
-                if not self.training:
+                if self.attn_capture is not None and lth in self.attn_capture:
                     if self.streaming_type == 'reshape':
-                        n_heads = layer.xx_aws.size(1)
-                        xx_aws = layer.xx_aws[:, :, N_l:N_l + N_c, N_l:N_l + N_c]
-                        xx_aws = xx_aws.view(bs, n_chunks, n_heads, N_c, N_c)
-                        xx_aws_center = xx_aws.new_zeros(bs, n_heads, emax, emax)
-                        for chunk_idx in range(n_chunks):
-                            offset = chunk_idx * N_c
-                            emax_chunk = xx_aws_center[:, :, offset:offset + N_c].size(2)
-                            xx_aws_chunk = xx_aws[:, chunk_idx, :, :emax_chunk, :emax_chunk]
-                            xx_aws_center[:, :, offset:offset + N_c, offset:offset + N_c] = xx_aws_chunk
-                        self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(xx_aws_center)
+                        xx_aws = chunks_to_center(layer.xx_aws, bs, n_chunks, N_l, N_c, emax)
                     elif self.streaming_type == 'mask':
-                        self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(layer.xx_aws)
-                    self.data_dict['elens%d' % lth] = tensor2np(xlens)
+                        xx_aws = layer.xx_aws
+                    self.aws_dict['xx_aws_layer%d' % lth] = self.attn_capture.select(xx_aws)
+                    self.data_dict['elens%d' % lth] = self.attn_capture.select_batch(xlens)
 
                 if self.subsample is not None:
                     xs, xlens = self.subsample[lth](xs, xlens)
@@ -447,9 +508,9 @@ class TransformerEncoder(EncoderBase):
 
             for lth, layer in enumerate(self.layers):
                 xs = layer(xs, xx_mask, pos_embs=pos_embs, u_bias=self.u_bias, v_bias=self.v_bias)
-                if not self.training:
-                    self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(layer.xx_aws)
-                    self.data_dict['elens%d' % lth] = tensor2np(xlens)
+                if self.attn_capture is not None and lth in self.attn_capture:
+                    self.aws_dict['xx_aws_layer%d' % lth] = self.attn_capture.select(layer.xx_aws)
+                    self.data_dict['elens%d' % lth] = self.attn_capture.select_batch(xlens)
 
                 # Pick up outputs in the sub task before the projection layer
                 if lth == self.n_layers_sub1 - 1:
@@ -494,8 +555,9 @@ class TransformerEncoder(EncoderBase):
         xs_sub = getattr(self, 'norm_out_' + module)(xs_sub)
         if getattr(self, 'bridge_' + module) is not None:
             xs_sub = getattr(self, 'bridge_' + module)(xs_sub)
-        if not self.training:
-            self.aws_dict['xx_aws_%s_layer%d' % (module, lth)] = tensor2np(getattr(self, 'layer_' + module).xx_aws)
+        if self.attn_capture is not None and self.task_specific_layer and lth in self.attn_capture:
+            self.aws_dict['xx_aws_%s_layer%d' % (module, lth)] = self.attn_capture.select(
+                getattr(self, 'layer_' + module).xx_aws)
         return xs_sub
 
 
@@ -555,7 +617,8 @@ class TransformerEncoderBlock(nn.Module):
     def reset_visualization(self):
         self._xx_aws = None
 
-    def forward(self, xs, xx_mask=None, pos_embs=None, u_bias=None, v_bias=None):
+    def forward(self, xs, xx_mask=None, pos_embs=None, u_bias=None, v_bias=None,
+                kv_cache=None, lookahead=None):
         """Transformer encoder layer definition.
 
         Args:
@@ -564,6 +627,8 @@ class TransformerEncoderBlock(nn.Module):
             pos_embs (LongTensor): `[L, 1, d_model]`
             u_bias (FloatTensor): global parameter for relative positional encoding
             v_bias (FloatTensor): global parameter for relative positional encoding
+            kv_cache (KVCache): key/value memory of the left context for streaming inference
+            lookahead (FloatTensor): `[B, T_r, d_model]` right context used as keys only
         Returns:
             xs (FloatTensor): `[B, T, d_model]`
 
@@ -577,7 +642,12 @@ class TransformerEncoderBlock(nn.Module):
         # self-attention
         residual = xs
         xs = self.norm1(xs)
-        if self.relative_attention:
+        if kv_cache is not None:
+            kv = xs if lookahead is None else torch.cat([xs, self.norm1(lookahead)], dim=1)
+            xs, self._xx_aws = self.self_attn(kv, kv, xs, mask=None, kv_cache=kv_cache)[:2]  # k/v/q
+            if lookahead is not None:
+                kv_cache.drop_last(lookahead.size(1))  # right context is not memorized
+        elif self.relative_attention:
             xs, self._xx_aws = self.self_attn(xs, xs, pos_embs, xx_mask, u_bias, v_bias)  # k/q/m
         else:
             xs, self._xx_aws = self.self_attn(xs, xs, xs, mask=xx_mask)[:2]  # k/v/q
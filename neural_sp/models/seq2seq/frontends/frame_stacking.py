@@ -7,6 +7,8 @@
 """Frame stacking."""
 
 import numpy as np
+import torch
+import torch.nn.functional as F
 
 
 def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
@@ -18,7 +20,7 @@ def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
            arXiv preprint arXiv:1507.06947 (2015).
 
     Args:
-        feat (list): `[T, input_dim]`
+        feat (np.ndarray): `[T, input_dim]`
         n_stacks (int): the number of frames to stack
         n_skips (int): the number of frames to skip
         dtype ():
@@ -33,39 +35,63 @@ def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
         raise ValueError('n_skips must be less than n_stacks.')
 
     T, input_dim = feat.shape
-    T_new = T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
-
-    stacked_feat = np.zeros((T_new, input_dim * n_stacks), dtype=dtype)
-    stack_count = 0
-    stack = []
-    for t, frame_t in enumerate(feat):
-        if t == len(feat) - 1:  # final frame
-            # Stack the final frame
-            stack.append(frame_t)
-
-            while stack_count != int(T_new):
-                # Concatenate stacked frames
-                for i in range(len(stack)):
-                    stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
-                stack_count += 1
-
-                # Delete some frames to skip
-                for _ in range(n_skips):
-                    if len(stack) != 0:
-                        stack.pop(0)
-
-        elif len(stack) < n_stacks:  # first & middle frames
-            # Stack some frames until stack is filled
-            stack.append(frame_t)
-
-        if len(stack) == n_stacks:
-            # Concatenate stacked frames
-            for i in range(n_stacks):
-                stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
-            stack_count += 1
-
-            # Delete some frames to skip
-            for _ in range(n_skips):
-                stack.pop(0)
-
-    return stacked_feat
+    T_new = stacked_length(T, n_stacks, n_skips)
+
+    # the k-th output frame consists of input frames [k * n_skips, k * n_skips + n_stacks),
+    # where frames after the last one are filled with zeros
+    indices = np.arange(T_new)[:, None] * n_skips + np.arange(n_stacks)[None, :]
+    feat_pad = np.zeros((max(T, (T_new - 1) * n_skips + n_stacks), input_dim), dtype=dtype)
+    feat_pad[:T] = feat
+    return feat_pad[indices].reshape(T_new, input_dim * n_stacks)
+
+
+def stacked_length(T, n_stacks, n_skips):
+    """Number of frames after frame stacking.
+
+    Args:
+        T (int or torch.Tensor): number of input frames
+        n_stacks (int): the number of frames to stack
+        n_skips (int): the number of frames to skip
+    Returns:
+        T_new (int or torch.Tensor): number of output frames
+
+    """
+    return T // n_skips + (T % n_stacks != 0)
+
+
+def stack_frame_batch(xs, xlens, n_stacks, n_skips):
+    """Stack & skip frames of padded utterances at once.
+
+    The output is identical to padding outputs of `stack_frame` for each utterance.
+
+    Args:
+        xs (FloatTensor): `[B, T, input_dim]`
+        xlens (IntTensor): `[B]` (on CPU)
+        n_stacks (int): the number of frames to stack
+        n_skips (int): the number of frames to skip
+    Returns:
+        xs (FloatTensor): `[B, T_new, input_dim * n_stacks]`
+        xlens (IntTensor): `[B]`
+
+    """
+    if n_stacks == 1:
+        return xs, xlens
+
+    if n_stacks < n_skips:
+        raise ValueError('n_skips must be less than n_stacks.')
+
+    bs, xmax, input_dim = xs.size()
+    xlens_new = torch.IntTensor([stacked_length(int(xlen), n_stacks, n_skips) for xlen in xlens])
+    T_new = int(xlens_new.max())
+    xs = xs.masked_fill(~_time_mask(xlens, xmax, xs.device), 0.)
+    # pad zero frames so that the last window fits
+    xs = F.pad(xs, (0, 0, 0, max(0, (T_new - 1) * n_skips + n_stacks - xmax)))
+    xs = xs.unfold(1, n_stacks, n_skips)[:, :T_new]  # `[B, T_new, input_dim, n_stacks]`
+    xs = xs.transpose(2, 3).reshape(bs, T_new, input_dim * n_stacks)
+    xs = xs.masked_fill(~_time_mask(xlens_new, T_new, xs.device), 0.)
+    return xs, xlens_new
+
+
+def _time_mask(xlens, xmax, device):
+    """`[B, xmax, 1]` mask of valid frames."""
+    return (torch.arange(xmax, device=device)[None, :] < xlens.to(device)[:, None]).unsqueeze(2)
@@ -4,10 +4,14 @@
 # Copyright 2019 Kyoto University (Hirofumi Inaguma)
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
-"""SpecAugment data augmentation."""
+"""SpecAugment data augmentation.
+
+   Masks and warping are sampled independently for each utterance with the
+   torch RNG, and applied to a padded mini-batch on its device at once.
+"""
 
 import logging
-import numpy as np
+import torch
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +24,7 @@ class SpecAugment(object):
         T (int): parameter for time masking
         n_freq_masks (int): number of frequency masks
         n_time_masks (int): number of time masks
-        W (int): parameter for time warping
+        W (int): parameter for time warping (disabled if 0)
         p (float): parameter for upperbound of the time mask
         adaptive_number_ratio (float): adaptive multiplicity ratio for time masking
         adaptive_size_ratio (float): adaptive size ratio for time masking
@@ -28,7 +32,7 @@ class SpecAugment(object):
 
     """
 
-    def __init__(self, F, T, n_freq_masks, n_time_masks, p=1.0, W=40,
+    def __init__(self, F, T, n_freq_masks, n_time_masks, p=1.0, W=0,
                  adaptive_number_ratio=0, adaptive_size_ratio=0,
                  max_n_time_masks=20):
 
@@ -96,48 +100,130 @@ class SpecAugment(object):
     def time_mask(self):
         return self._time_mask
 
-    def __call__(self, xs):
-        """
+    def __call__(self, xs, xlens=None):
+        """Apply augmentation independently to each utterance.
+
         Args:
             xs (FloatTensor): `[B, T, F]`
+            xlens (IntTensor): `[B]` (all frames are valid if None)
         Returns:
             xs (FloatTensor): `[B, T, F]`
 
         """
-        # xs = self.time_warp(xs)
+        if xlens is None:
+            xlens = torch.full((xs.size(0),), xs.size(1), dtype=torch.int32)
+        xlens = xlens.to(xs.device).long()
+        if self.W > 0:
+            xs = self.time_warp(xs, xlens)
         xs = self.mask_freq(xs)
-        xs = self.mask_time(xs)
+        xs = self.mask_time(xs, xlens)
         return xs
 
-    def time_warp(xs, W=40):
-        raise NotImplementedError
+    def time_warp(self, xs, xlens):
+        """Warp each utterance along the time axis.
+
+        A random point `w_0` in `[W, xlen - 1 - W)` is moved to `w_0 + w` (`w` in `[-W, W]`),
+        and the two segments are linearly stretched by interpolation between frames.
+        The first and last frames are fixed. Utterances not longer than `2 * W + 1`
+        are left unchanged.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+            xlens (LongTensor): `[B]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
+
+        """
+        bs, xmax, n_bins = xs.size()
+        W = self.W
+        device = xs.device
+        valid = xlens > 2 * W + 1
+        w_0 = W + (torch.rand(bs, device=device) * (xlens - 1 - 2 * W).clamp(min=1)).long()
+        w = (torch.rand(bs, device=device) * (2 * W + 1)).long() - W
+        w_1 = (w_0 + w).unsqueeze(1).float()  # destination of w_0
+        w_0 = w_0.unsqueeze(1).float()
+        last = (xlens - 1).unsqueeze(1).float()
+
+        # source position of each output frame
+        t = torch.arange(xmax, device=device).float().unsqueeze(0)  # `[1, T]`
+        src = torch.where(t < w_1,
+                          t * w_0 / w_1,
+                          w_0 + (t - w_1) * (last - w_0) / (last - w_1))
+        src = torch.where(valid.unsqueeze(1) & (t <= last), src, t)  # keep padding
+        src_l = src.floor().long().clamp(min=0, max=xmax - 1)
+        src_r = (src_l + 1).clamp(max=xmax - 1)
+        src_r = torch.min(src_r, (xlens - 1).clamp(min=0).unsqueeze(1))  # do not read padding
+        frac = (src - src_l.float()).unsqueeze(2).to(xs.dtype)
+
+        xs_l = xs.gather(1, src_l.unsqueeze(2).expand(bs, xmax, n_bins))
+        xs_r = xs.gather(1, src_r.unsqueeze(2).expand(bs, xmax, n_bins))
+        xs_warp = xs_l + (xs_r - xs_l) * frac
+        return torch.where(valid[:, None, None], xs_warp, xs)
 
     def mask_freq(self, xs, replace_with_zero=False):
-        n_bins = xs.size(-1)
-        for i in range(0, self.n_freq_masks):
-            f = int(np.random.uniform(low=0, high=self.F))
-            f_0 = int(np.random.uniform(low=0, high=n_bins - f))
-            xs[:, :, f_0:f_0 + f] = 0
-            assert f_0 <= f_0 + f
-            self._freq_mask = (f_0, f_0 + f)
-        return xs
+        """Mask frequency bins with masks sampled for each utterance.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
 
-    def mask_time(self, xs, replace_with_zero=False):
-        n_frames = xs.size(1)
+        """
+        if self.n_freq_masks == 0:
+            return xs
+        bs, _, n_bins = xs.size()
+        device = xs.device
+        f = (torch.rand(bs, self.n_freq_masks, device=device) * self.F).long()
+        f_0 = (torch.rand(bs, self.n_freq_masks, device=device) * (n_bins - f).float()).long()
+        self._freq_mask = (f_0, f_0 + f)
+        mask = _range_mask(f_0, f_0 + f, n_bins)  # `[B, F]`
+        return xs.masked_fill(mask.unsqueeze(1), 0)
+
+    def mask_time(self, xs, xlens, replace_with_zero=False):
+        """Mask frames with masks sampled for each utterance within its length.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+            xlens (LongTensor): `[B]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
+
+        """
+        bs, xmax, _ = xs.size()
+        device = xs.device
+        n_frames = xlens.float()
         if self.adaptive_number_ratio > 0:
-            n_masks = int(n_frames * self.adaptive_number_ratio)
-            n_masks = min(n_masks, self.max_n_time_masks)
+            n_masks = (n_frames * self.adaptive_number_ratio).long().clamp(max=self.max_n_time_masks)
         else:
-            n_masks = self.n_time_masks
+            n_masks = xlens.new_full((bs,), self.n_time_masks)
+        max_n_masks = int(n_masks.max()) if bs > 0 else 0
+        if max_n_masks == 0:
+            return xs
         if self.adaptive_size_ratio > 0:
             T = self.adaptive_size_ratio * n_frames
         else:
-            T = self.T
-        for i in range(n_masks):
-            t = int(np.random.uniform(low=0, high=T))
-            t = min(t, int(n_frames * self.p))
-            t_0 = int(np.random.uniform(low=0, high=n_frames - t))
-            xs[:, t_0:t_0 + t] = 0
-            assert t_0 <= t_0 + t
-            self._time_mask = (t_0, t_0 + t)
-        return xs
+            T = n_frames.new_full((bs,), self.T)
+
+        t = (torch.rand(bs, max_n_masks, device=device) * T.unsqueeze(1)).long()
+        t = torch.min(t, (n_frames * self.p).long().unsqueeze(1))
+        t_0 = (torch.rand(bs, max_n_masks, device=device) * (xlens.unsqueeze(1) - t).float()).long()
+        # disable masks beyond the number of masks of each utterance
+        t = t.masked_fill(torch.arange(max_n_masks, device=device).unsqueeze(0) >= n_masks.unsqueeze(1), 0)
+        self._time_mask = (t_0, t_0 + t)
+        mask = _range_mask(t_0, t_0 + t, xmax)  # `[B, T]`
+        return xs.masked_fill(mask.unsqueeze(2), 0)
+
+
+def _range_mask(start, end, size):
+    """Union of ranges.
+
+    Args:
+        start (LongTensor): `[B, n_masks]`
+        end (LongTensor): `[B, n_masks]`
+        size (int): length of the axis
+    Returns:
+        mask (BoolTensor): `[B, size]`
+
+    """
+    pos = torch.arange(size, device=start.device).view(1, 1, size)
+    return ((start.unsqueeze(2) <= pos) & (pos < end.unsqueeze(2))).any(dim=1)
@@ -7,6 +7,7 @@
 """Splice data."""
 
 import numpy as np
+import torch
 
 
 def splice(feat, n_splices=1, n_stacks=1, dtype=np.float32):
@@ -34,31 +35,69 @@ def splice(feat, n_splices=1, n_stacks=1, dtype=np.float32):
 
     max_xlen, input_dim = feat.shape
     freq = (input_dim // 3) // n_stacks
-    feat_splice = np.zeros((max_xlen, freq * (n_splices * n_stacks) * 3), dtype=dtype)
+    src, slots, stack_idx = _splice_indices(n_splices, n_stacks)
+    src = np.clip(np.arange(max_xlen)[:, None] + src[None, :], 0, max_xlen - 1)  # `[T, n_slots]`
 
-    for i_time in range(max_xlen):
-        spliced_frames = np.zeros((n_splices * n_stacks, freq, 3))
-        for i_splice in range(0, n_splices, 1):
-            if i_time <= n_splices - 1 and i_splice < n_splices - i_time:
-                # copy the first frame to left side (padding left frames)
-                copy_frame = feat[0]
-            elif max_xlen - n_splices <= i_time and i_time + (i_splice - n_splices) > max_xlen - 1:
-                # copy the last frame to right side (padding right frames)
-                copy_frame = feat[-1]
-            else:
-                copy_frame = feat[i_time + (i_splice - n_splices)]
+    # `[T, freq * 3 * n_stacks]` -> `[T, freq, 3, n_stacks]`
+    feat = feat.reshape((max_xlen, freq, 3, n_stacks))
+    feat_splice = np.zeros((max_xlen, freq, n_splices * n_stacks, 3), dtype=dtype)
+    # `[T, n_slots, freq, 3]` -> `[T, freq, n_slots, 3]`
+    feat_splice[:, :, slots] = feat[src, :, :, stack_idx[None, :]].transpose((0, 2, 1, 3))
+    return feat_splice.reshape((max_xlen, freq * (n_splices * n_stacks) * 3))
 
-            # `[freq * 3 * n_stacks]` -> `[freq, 3, n_stacks]`
-            copy_frame = copy_frame.reshape((freq, 3, n_stacks))
 
-            # `[freq, 3, n_stacks]` -> `[n_stacks, freq, 3]`
-            copy_frame = np.transpose(copy_frame, (2, 0, 1))
+def _splice_indices(n_splices, n_stacks):
+    """Source frames of slots in a spliced frame.
 
-            spliced_frames[i_splice: i_splice + n_stacks] = copy_frame
+    Each of `n_splices` preceding frames is written into `n_stacks` consecutive slots
+    (`[n_stacks, freq, 3]`), and is partially overwritten by the next frame.
+    Slots which are never written are left as zeros.
 
-        # `[n_splices * n_stacks, freq, 3] -> `[freq, n_splices * n_stacks, 3]`
-        spliced_frames = np.transpose(spliced_frames, (1, 0, 2))
+    Args:
+        n_splices (int): frames to n_splices
+        n_stacks (int): the number of frames to stack
+    Returns:
+        src (np.ndarray): `[n_slots]` relative position of the source frame of each slot
+        slots (np.ndarray): `[n_slots]` indices of written slots
+        stack_idx (np.ndarray): `[n_slots]` index of the stacked frame in the source frame
+
+    """
+    slots = np.arange(n_splices + n_stacks - 1)
+    i_splice = np.minimum(slots, n_splices - 1)  # the last writer of each slot
+    return i_splice - n_splices, slots, slots - i_splice
+
+
+def splice_batch(xs, xlens, n_splices=1, n_stacks=1):
+    """Splice frames of padded utterances at once.
+
+    The output is identical to padding outputs of `splice` for each utterance.
 
-        feat_splice[i_time] = spliced_frames.reshape((freq * (n_splices * n_stacks) * 3))
+    Args:
+        xs (FloatTensor): `[B, T, input_dim (freq * 3 * n_stacks)]`
+        xlens (IntTensor): `[B]`
+        n_splices (int): frames to n_splices
+        n_stacks (int): the number of frames to stack
+    Returns:
+        xs (FloatTensor): `[B, T, freq * (n_splices * n_stacks) * 3]`
+
+    """
+    assert xs.size(-1) % 3 == 0
+
+    if n_splices == 1:
+        return xs
 
-    return feat_splice
+    bs, xmax, input_dim = xs.size()
+    freq = (input_dim // 3) // n_stacks
+    src, slots, stack_idx = _splice_indices(n_splices, n_stacks)
+    src = np.maximum(np.arange(xmax)[:, None] + src[None, :], 0)  # `[T, n_slots]`
+    # NOTE: source frames always precede the current frame
+
+    xs = xs.view(bs, xmax, freq, 3, n_stacks)
+    xs_splice = xs.new_zeros(bs, xmax, freq, n_splices * n_stacks, 3)
+    src = torch.from_numpy(src).to(xs.device)
+    stack_idx = torch.from_numpy(stack_idx).to(xs.device)
+    # `[B, T, n_slots, freq, 3]` -> `[B, T, freq, n_slots, 3]`
+    xs_splice[:, :, :, :len(slots)] = xs[:, src, :, :, stack_idx[None, :]].permute(2, 0, 3, 1, 4)
+    xs_splice = xs_splice.view(bs, xmax, -1)
+    mask = torch.arange(xmax, device=xs.device)[None, :] < xlens.to(xs.device)[:, None]
+    return xs_splice.masked_fill(~mask.unsqueeze(2), 0.)
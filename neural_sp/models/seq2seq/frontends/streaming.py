@@ -6,8 +6,15 @@
 
 """Streaming encoding interface."""
 
+import numpy as np
 import torch
 
+from neural_sp.models.seq2seq.encoders.conformer import ConformerEncoder
+from neural_sp.models.seq2seq.encoders.rnn import RNNEncoder
+from neural_sp.models.seq2seq.encoders.transformer import TransformerEncoder
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import tensor2np
+
 
 class Streaming(object):
     """Streaming encoding interface."""
@@ -166,3 +173,215 @@ class Streaming(object):
                 print('Back %d frames (%d -> %d)' %
                       (x_chunk[(self.bd_offset + 1) * self.factor:self.N_l].shape[0],
                        offset_prev, self.offset))
+
+
+class StreamingSession(object):
+    """Stateful streaming inference session.
+
+    Input features are fed incrementally with `accept`, and encoder outputs
+    are emitted as soon as each chunk and its right context arrive. Encoder
+    states of the left context are carried over between chunks instead of
+    re-encoding the left context: key/value memories of each layer for the
+    Transformer encoder (streaming_type='mask'), input frames of each layer
+    in the left context and the kernel of the depthwise convolution for the
+    Conformer encoder (streaming_type='mask'), and hidden states of the
+    forward RNNs (`hx_fwd`) for the (latency-controlled) RNN encoder.
+    A partial hypothesis is updated by greedy CTC decoding, or by
+    chunk-synchronous beam search if `recog_chunk_sync` is set.
+
+    Args:
+        model (Speech2Text): ASR model
+        params (dict): hyperparameters for decoding
+        idx2token (): converter from index to token
+
+    """
+
+    def __init__(self, model, params, idx2token=None):
+
+        super(StreamingSession, self).__init__()
+
+        self.model = model
+        self.encoder = model.enc
+        self.params = params
+        self.idx2token = idx2token
+        assert model.input_type == 'speech'
+        assert model.ssn is None
+
+        if isinstance(self.encoder, TransformerEncoder):
+            assert self.encoder.latency_controlled and self.encoder.streaming_type == 'mask'
+            assert self.encoder.pe_type in ['add', 'none']
+            assert self.encoder.subsample is None
+            assert model.n_stacks == 1 and model.n_splices == 1
+            self.chunk_size = self.encoder.chunk_size_current  # before subsampling
+            self.N_r = self.encoder.streaming_chunk_sizes()[2]
+        elif isinstance(self.encoder, ConformerEncoder):
+            assert self.encoder.latency_controlled and self.encoder.streaming_type == 'mask'
+            assert self.encoder.subsample is None
+            assert model.n_stacks == 1 and model.n_splices == 1
+            self.chunk_size = self.encoder.chunk_size_current  # before subsampling
+        elif isinstance(self.encoder, RNNEncoder):
+            if self.encoder.conv is not None:
+                self.encoder.turn_off_ceil_mode(self.encoder)
+            self.N_l = self.encoder.chunk_size_left
+            self.N_r = self.encoder.chunk_size_right
+            if self.N_l == 0 and self.N_r == 0:
+                self.N_l = 40  # for unidirectional encoder
+            self.context = self.encoder.conv.n_frames_context if self.encoder.conv is not None else 0
+        else:
+            raise NotImplementedError(self.encoder.__class__.__name__)
+
+        self.model.eval()
+        self.reset()
+
+    def reset(self):
+        """Start a new session."""
+        self.encoder.reset_cache()
+        self.x_buffer = None
+        self.n_frames = 0  # number of received input frames
+        self.buffer_offset = 0  # global index of the first frame in x_buffer
+        self.offset = 0  # global index of the first frame in the next chunk
+        self.emb_chunks = []  # for Transformer
+        self.n_embedded = 0  # for Transformer/Conformer
+        self.eout_chunks = []
+        self.hyp = []
+        self.hyps = None  # for chunk-synchronous beam search
+        self.prev_token = None  # for greedy CTC decoding
+        self.is_finalized = False
+
+    @property
+    def hypothesis(self):
+        """Token indices of the current best (partial) hypothesis."""
+        return list(self.hyp)
+
+    @property
+    def text(self):
+        return self.idx2token(self.hypothesis)
+
+    def accept(self, xs):
+        """Feed input features.
+
+        Args:
+            xs (np.ndarray or FloatTensor): `[T, input_dim]`
+        Returns:
+            eout (FloatTensor): `[1, T_out, enc_dim]` newly emitted encoder outputs
+
+        """
+        assert not self.is_finalized
+        if isinstance(xs, torch.Tensor):
+            xs = tensor2np(xs)
+        self.x_buffer = xs if self.x_buffer is None else np.concatenate([self.x_buffer, xs], axis=0)
+        self.n_frames += len(xs)
+        with torch.no_grad():
+            return self._encode(is_final=False)
+
+    def finalize(self):
+        """Flush the rest of input features at the end of the session.
+
+        Returns:
+            eout (FloatTensor): `[1, T_out, enc_dim]` newly emitted encoder outputs
+
+        """
+        self.is_finalized = True
+        with torch.no_grad():
+            return self._encode(is_final=True)
+
+    def _encode(self, is_final):
+        if isinstance(self.encoder, TransformerEncoder):
+            eouts = self._encode_transformer(is_final)
+        elif isinstance(self.encoder, ConformerEncoder):
+            eouts = self._encode_conformer(is_final)
+        else:
+            eouts = self._encode_rnn(is_final)
+        for eout in eouts:
+            self._decode(eout)
+        self.eout_chunks += eouts
+        if len(eouts) == 0:
+            return torch.zeros(1, 0, self.encoder.output_dim, device=self.model.device)
+        return torch.cat(eouts, dim=1)
+
+    def _has_chunk(self, is_final):
+        """Whether a complete chunk (or the last incomplete chunk) is buffered."""
+        if self.x_buffer is None or len(self.x_buffer) == 0:
+            return False
+        return is_final or len(self.x_buffer) >= self.chunk_size
+
+    def _embed_chunks(self, is_final):
+        """Embed every complete chunk (or the last incomplete chunk) only once."""
+        embs = []
+        while self._has_chunk(is_final):
+            x_chunk = self.x_buffer[:self.chunk_size]
+            xlen = len(x_chunk)
+            if xlen < self.chunk_size:
+                x_chunk = np.pad(x_chunk, [(0, self.chunk_size - xlen), (0, 0)], mode='constant')
+            emb = self.encoder.embed_chunk(np2tensor(x_chunk, self.model.device).float().unsqueeze(0),
+                                           torch.IntTensor([xlen]), self.n_embedded)
+            embs.append(emb)
+            self.n_embedded += emb.size(1)
+            self.x_buffer = self.x_buffer[self.chunk_size:]
+        return embs
+
+    def _encode_transformer(self, is_final):
+        self.emb_chunks += self._embed_chunks(is_final)
+
+        # Encode chunks whose right context is available
+        eouts = []
+        while len(self.emb_chunks) > 0:
+            n_lookahead = sum([emb.size(1) for emb in self.emb_chunks[1:]])
+            if not is_final and n_lookahead < self.N_r:
+                break
+            xs_lookahead = None
+            if self.N_r > 0 and n_lookahead > 0:
+                xs_lookahead = torch.cat(self.emb_chunks[1:], dim=1)[:, :self.N_r]
+            eouts.append(self.encoder.encode_chunk(self.emb_chunks.pop(0), xs_lookahead))
+        return eouts
+
+    def _encode_conformer(self, is_final):
+        embs = self._embed_chunks(is_final)
+        if len(embs) == 0:
+            embs = [torch.zeros(1, 0, self.encoder.d_model, device=self.model.device)]
+        # NOTE: each layer holds back frames until its right context is available
+        eout = self.encoder.encode_stream(torch.cat(embs, dim=1), is_final)
+        return [eout] if eout.size(1) > 0 else []
+
+    def _encode_rnn(self, is_final):
+        eouts = []
+        while self.offset < self.n_frames:
+            j = self.offset
+            end = j + self.N_l + self.N_r + self.context
+            if not is_final and end >= self.n_frames:
+                break  # wait for the right context
+            start = max(0, j - self.context)
+            x_chunk = self.x_buffer[start - self.buffer_offset:end - self.buffer_offset]
+            eout = self.model.encode([x_chunk], 'ys', streaming=True,
+                                     lookback=j - self.context >= 0,
+                                     lookahead=end <= self.n_frames - 1)['ys']['xs']
+            eouts.append(eout)
+            self.offset += self.N_l
+
+            # Discard frames out of the left context
+            start_next = max(0, self.offset - self.context)
+            self.x_buffer = self.x_buffer[start_next - self.buffer_offset:]
+            self.buffer_offset = start_next
+        return eouts
+
+    def _decode(self, eout):
+        """Update the partial hypothesis with encoder outputs of a new chunk."""
+        if eout.size(1) == 0:
+            return
+        dec = self.model.dec_fwd
+        if self.params.get('recog_chunk_sync', False):
+            ctc_log_probs = None
+            if self.params['recog_ctc_weight'] > 0:
+                ctc_log_probs = torch.log(dec.ctc_probs(eout))
+            end_hyps, self.hyps, _ = dec.beam_search_chunk_sync(
+                eout, self.params, self.idx2token, getattr(self.model, 'lm_fwd', None),
+                ctc_log_probs=ctc_log_probs, hyps=self.hyps, state_carry_over=False,
+                ignore_eos=self.encoder.enc_type in ['lstm', 'conv_lstm'])
+            merged_hyps = sorted(end_hyps + self.hyps, key=lambda x: x['score'], reverse=True)
+            self.hyp = [int(y) for y in merged_hyps[0]['hyp'][1:] if y != self.model.eos]
+        elif self.model.ctc_weight > 0:
+            best_ids = dec.ctc_probs(eout).argmax(-1)[0].tolist()
+            for token in best_ids:
+                if token != dec.blank and token != self.prev_token:
+                    self.hyp.append(token)
+                self.prev_token = token
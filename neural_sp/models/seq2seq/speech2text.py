@@ -20,11 +20,12 @@ from neural_sp.models.seq2seq.decoders.build import build_decoder
 from neural_sp.models.seq2seq.decoders.fwd_bwd_attention import fwd_bwd_attention
 from neural_sp.models.seq2seq.decoders.rnn_transducer import RNNTransducer
 from neural_sp.models.seq2seq.encoders.build import build_encoder
-from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame
+from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame_batch
 from neural_sp.models.seq2seq.frontends.input_noise import add_input_noise
 from neural_sp.models.seq2seq.frontends.sequence_summary import SequenceSummaryNetwork
 from neural_sp.models.seq2seq.frontends.spec_augment import SpecAugment
-from neural_sp.models.seq2seq.frontends.splicing import splice
+from neural_sp.models.seq2seq.frontends.splicing import splice_batch
+from neural_sp.models.torch_utils import autocast
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import tensor2np
 from neural_sp.models.torch_utils import pad_list
@@ -98,7 +99,7 @@ class Speech2Text(ModelBase):
         self.n_splices = args.n_splices
         self.weight_noise_std = args.weight_noise_std
         self.specaug = None
-        if args.n_freq_masks > 0 or args.n_time_masks > 0:
+        if args.n_freq_masks > 0 or args.n_time_masks > 0 or args.time_warp_width > 0:
             assert args.n_stacks == 1 and args.n_skips == 1
             assert args.n_splices == 1
             self.specaug = SpecAugment(F=args.freq_width,
@@ -106,6 +107,7 @@ class Speech2Text(ModelBase):
                                        n_freq_masks=args.n_freq_masks,
                                        n_time_masks=args.n_time_masks,
                                        p=args.time_width_upper,
+                                       W=args.time_warp_width,
                                        adaptive_number_ratio=args.adaptive_number_ratio,
                                        adaptive_size_ratio=args.adaptive_size_ratio,
                                        max_n_time_masks=args.max_n_time_masks)
@@ -361,20 +363,20 @@ class Speech2Text(ModelBase):
 
         """
         if self.input_type == 'speech':
+            xlens = torch.IntTensor([len(x) for x in xs])
+            xs = pad_list([np2tensor(x, self.device).float() for x in xs], 0.)
+
             # Frame stacking
             if self.n_stacks > 1:
-                xs = [stack_frame(x, self.n_stacks, self.n_skips) for x in xs]
+                xs, xlens = stack_frame_batch(xs, xlens, self.n_stacks, self.n_skips)
 
             # Splicing
             if self.n_splices > 1:
-                xs = [splice(x, self.n_splices, self.n_stacks) for x in xs]
-
-            xlens = torch.IntTensor([len(x) for x in xs])
-            xs = pad_list([np2tensor(x, self.device).float() for x in xs], 0.)
+                xs = splice_batch(xs, xlens, self.n_splices, self.n_stacks)
 
             # SpecAugment
             if self.specaug is not None and self.training:
-                xs = self.specaug(xs)
+                xs = self.specaug(xs, xlens)
 
             # Weight noise injection
             if self.weight_noise_std > 0:
@@ -425,24 +427,34 @@ class Speech2Text(ModelBase):
                 eout_dict[task]['xs'], temperature, topk)
             return tensor2np(ctc_probs), tensor2np(indices_topk), eout_dict[task]['xlens']
 
-    def plot_attention(self):
-        """Plot attention weights during training."""
+    def plot_attention(self, worker=None):
+        """Plot attention weights during training.
+
+        Args:
+            worker (ReportWorker): background worker for plotting (None: plot here)
+
+        """
         # encoder
-        self.enc._plot_attention(mkdir_join(self.save_path, 'enc_att_weights'))
+        self.enc._plot_attention(mkdir_join(self.save_path, 'enc_att_weights'), worker=worker)
         # decoder
-        self.dec_fwd._plot_attention(mkdir_join(self.save_path, 'dec_att_weights'))
+        self.dec_fwd._plot_attention(mkdir_join(self.save_path, 'dec_att_weights'), worker=worker)
         if getattr(self, 'dec_fwd_sub1', None) is not None:
-            self.dec_fwd_sub1._plot_attention(mkdir_join(self.save_path, 'dec_att_weights_sub1'))
+            self.dec_fwd_sub1._plot_attention(mkdir_join(self.save_path, 'dec_att_weights_sub1'), worker=worker)
         if getattr(self, 'dec_fwd_sub2', None) is not None:
-            self.dec_fwd_sub2._plot_attention(mkdir_join(self.save_path, 'dec_att_weights_sub2'))
+            self.dec_fwd_sub2._plot_attention(mkdir_join(self.save_path, 'dec_att_weights_sub2'), worker=worker)
+
+    def plot_ctc(self, worker=None):
+        """Plot CTC posteriors during training.
 
-    def plot_ctc(self):
-        """Plot CTC posteriors during training."""
-        self.dec_fwd._plot_ctc(mkdir_join(self.save_path, 'ctc'))
+        Args:
+            worker (ReportWorker): background worker for plotting (None: plot here)
+
+        """
+        self.dec_fwd._plot_ctc(mkdir_join(self.save_path, 'ctc'), worker=worker)
         if getattr(self, 'dec_fwd_sub1', None) is not None:
-            self.dec_fwd_sub1._plot_ctc(mkdir_join(self.save_path, 'ctc_sub1'))
+            self.dec_fwd_sub1._plot_ctc(mkdir_join(self.save_path, 'ctc_sub1'), worker=worker)
         if getattr(self, 'dec_fwd_sub2', None) is not None:
-            self.dec_fwd_sub2._plot_ctc(mkdir_join(self.save_path, 'ctc_sub2'))
+            self.dec_fwd_sub2._plot_ctc(mkdir_join(self.save_path, 'ctc_sub2'), worker=worker)
 
     def decode_streaming(self, xs, params, idx2token, exclude_eos=False, task='ys'):
         from neural_sp.models.seq2seq.frontends.streaming import Streaming
@@ -609,6 +621,7 @@ class Speech2Text(ModelBase):
                 lm_weight (float): the weight of RNNLM score
                 resolving_unk (bool): not used (to make compatible)
                 fwd_bwd_attention (bool):
+                dtype (str): data type of autocast (float32/float16/bfloat16)
             idx2token (): converter from index to token
             exclude_eos (bool): exclude <eos> from best_hyps_id
             refs_id (list): gold token IDs to compute log likelihood
@@ -637,7 +650,7 @@ class Speech2Text(ModelBase):
             self.utt_id_prev = utt_ids[0]
 
         self.eval()
-        with torch.no_grad():
+        with torch.no_grad(), autocast(self.device, params.get('recog_dtype', 'float32')):
             # Encode input features
             if self.input_type == 'speech' and self.mtl_per_batch and 'bwd' in dir:
                 eout_dict = self.encode(xs, task)
@@ -662,8 +675,6 @@ class Speech2Text(ModelBase):
                     params['recog_max_len_ratio'], idx2token,
                     exclude_eos, refs_id, utt_ids, speakers)
             else:
-                assert params['recog_batch_size'] == 1
-
                 ctc_log_probs = None
                 if params['recog_ctc_weight'] > 0:
                     ctc_log_probs = self.dec_fwd.ctc_log_probs(eout_dict[task]['xs'])
@@ -710,11 +721,19 @@ class Speech2Text(ModelBase):
                     lm_second = getattr(self, 'lm_second', None)
                     lm_bwd = getattr(self, 'lm_bwd' if dir == 'fwd' else 'lm_bwd', None)
 
-                    nbest_hyps_id, aws, scores = getattr(self, 'dec_' + dir).beam_search(
-                        eout_dict[task]['xs'], eout_dict[task]['xlens'],
-                        params, idx2token, lm, lm_second, lm_bwd, ctc_log_probs,
-                        1, exclude_eos, refs_id, utt_ids, speakers,
-                        ensmbl_eouts, ensmbl_elens, ensmbl_decs)
+                    dec = getattr(self, 'dec_' + dir)
+                    if len(xs) > 1 and len(ensemble_models) == 0 and hasattr(dec, 'beam_search_batch'):
+                        # decode all utterances in the mini-batch at once
+                        nbest_hyps_id, aws, scores = dec.beam_search_batch(
+                            eout_dict[task]['xs'], eout_dict[task]['xlens'],
+                            params, idx2token, lm, lm_second, lm_bwd, ctc_log_probs,
+                            1, exclude_eos, refs_id, utt_ids, speakers)
+                    else:
+                        nbest_hyps_id, aws, scores = dec.beam_search(
+                            eout_dict[task]['xs'], eout_dict[task]['xlens'],
+                            params, idx2token, lm, lm_second, lm_bwd, ctc_log_probs,
+                            1, exclude_eos, refs_id, utt_ids, speakers,
+                            ensmbl_eouts, ensmbl_elens, ensmbl_decs)
                     best_hyps_id = [hyp[0] for hyp in nbest_hyps_id]
 
             return best_hyps_id, aws
@@ -6,6 +6,7 @@
 
 """Utility functions."""
 
+import contextlib
 import copy
 import numpy as np
 import torch
@@ -24,6 +25,8 @@ def tensor2np(x):
         np.ndarray
 
     """
+    if x.dtype == torch.bfloat16:
+        x = x.float()  # not supported by numpy
     return x.cpu().detach().numpy()
 
 
@@ -39,15 +42,35 @@ def tensor2scalar(x):
     return x.cpu().detach().item()
 
 
+def autocast(device_type, dtype='float32'):
+    """Context of automatic mixed precision.
+
+    Args:
+        device_type (str or torch.device): cuda/cpu
+        dtype (str): float32/float16/bfloat16 (float32 disables autocast)
+    Returns:
+        context manager
+
+    """
+    if isinstance(device_type, torch.device):
+        device_type = device_type.type
+    if dtype in [None, False, 'float32']:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type, dtype=getattr(torch, dtype))
+
+
 def np2tensor(array, device=None):
     """Convert form np.ndarray to torch.Tensor.
 
     Args:
-        array (np.ndarray): A tensor of any sizes
+        array (np.ndarray or torch.Tensor): A tensor of any sizes
     Returns:
         tensor (torch.Tensor):
 
     """
+    if isinstance(array, torch.Tensor):
+        # e.g., pinned memory created by the data loader
+        return array.to(device, non_blocking=array.is_pinned())
     tensor = torch.from_numpy(array).to(device)
     return tensor
 
@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Checkpoint writer.
+
+   Checkpoints are written to a hidden temporary file, flushed to the disk and
+   renamed, so that a checkpoint file is never observed half-written.
+   In the asynchronous mode, tensors are copied to host memory on the training
+   thread and serialization is done in a background thread. Write jobs are
+   processed in order together with removal of old checkpoints.
+"""
+
+import atexit
+import copy
+from glob import glob
+import logging
+import os
+import queue
+import threading
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def optimizer_checkpoint_path(model_path):
+    """Path to optimizer states saved separately from the model."""
+    dir_name, base_name = os.path.split(model_path)
+    return os.path.join(dir_name, base_name.replace('model.', 'optimizer.', 1))
+
+
+def snapshot(obj):
+    """Copy tensors in nested containers to host memory.
+
+    Containers are also copied so that later updates during training
+    (e.g., in-place parameter updates, appending to topk_list) do not
+    affect the snapshot.
+
+    Args:
+        obj: tensor, dict, list, tuple or any other immutable object
+    Returns:
+        obj: copy of the input
+
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        obj_copy = copy.copy(obj)  # keep the class and attributes (e.g., _metadata of state_dict)
+        for k, v in obj.items():
+            obj_copy[k] = snapshot(v)
+        return obj_copy
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def save_atomic(obj, path):
+    """Save an object by writing a temporary file and renaming it.
+
+    Args:
+        obj: object to be saved by torch.save
+        path (str): path to the file
+
+    """
+    dir_name, base_name = os.path.split(path)
+    tmp_path = os.path.join(dir_name, '.' + base_name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def remove_old_checkpoints(save_path, keep_epochs):
+    """Remove checkpoints except for those of the specified epochs.
+
+    Args:
+        save_path (str): path to the directory of checkpoints
+        keep_epochs (list): epochs of checkpoints to be kept
+
+    """
+    for path in glob(os.path.join(save_path, 'model.epoch-*')) + \
+            glob(os.path.join(save_path, 'optimizer.epoch-*')):
+        if 'model.epoch-avg' in path:
+            continue
+        epoch = int(path.split('-')[-1])
+        if epoch not in keep_epochs:
+            os.remove(path)
+
+
+class CheckpointWriter(object):
+    """Write checkpoints synchronously or in a background thread.
+
+    Args:
+        asynchronous (bool): write checkpoints in a background thread
+        max_in_flight (int): maximum number of checkpoints being written.
+            Saving blocks the training thread when exceeded, which bounds
+            the host memory used by snapshots.
+        split_optimizer (bool): save optimizer states in `optimizer.epoch-*`
+            separately from model parameters in `model.epoch-*`
+
+    """
+
+    def __init__(self, asynchronous=False, max_in_flight=1, split_optimizer=False):
+        assert max_in_flight >= 1
+        self.asynchronous = asynchronous
+        self.split_optimizer = split_optimizer
+        self.queue = queue.Queue(maxsize=max_in_flight)
+        self.thread = None
+        self.error = None
+
+    def save(self, checkpoint, model_path, keep_epochs=None):
+        """Save a checkpoint.
+
+        Args:
+            checkpoint (dict): model_state_dict, optimizer_state_dict etc.
+            model_path (str): path to the checkpoint (model.epoch-*)
+            keep_epochs (list): remove checkpoints of the other epochs after saving
+                (None: do not remove any checkpoints)
+
+        """
+        files = [(model_path, checkpoint)]
+        if self.split_optimizer:
+            checkpoint_model = {k: v for k, v in checkpoint.items() if k == 'model_state_dict'}
+            checkpoint_model['topk_list'] = checkpoint['optimizer_state_dict'].get('topk_list', [])
+            checkpoint_optimizer = {k: v for k, v in checkpoint.items() if k != 'model_state_dict'}
+            files = [(optimizer_checkpoint_path(model_path), checkpoint_optimizer),
+                     (model_path, checkpoint_model)]
+            # NOTE: the model is written last for resumption from the latest complete pair
+        job = (files, model_path, keep_epochs)
+
+        if not self.asynchronous:
+            self._write(*job)
+            return
+
+        self._raise_error()
+        job = (snapshot(files), model_path, None if keep_epochs is None else list(keep_epochs))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        self.queue.put(job)  # block if too many checkpoints are in flight
+
+    def _write(self, files, model_path, keep_epochs):
+        for path, obj in files:
+            save_atomic(obj, path)
+        if keep_epochs is not None:
+            remove_old_checkpoints(os.path.dirname(model_path), keep_epochs)
+        logger.info("=> Saved checkpoint: %s" % model_path)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    break
+                if self.error is None:
+                    self._write(*job)
+            except Exception as e:
+                logger.error('Failed to save checkpoint %s: %s' % (job[1], e))
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        """Wait until all checkpoints are written."""
+        if self.thread is not None:
+            self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Write all pending checkpoints and stop the background thread."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self._raise_error()
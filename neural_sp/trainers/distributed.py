@@ -0,0 +1,164 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Utilities for multi-process distributed training.
+
+   One process is launched per device (e.g., by `python -m torch.distributed.run`),
+   and gradients are all-reduced in buckets by DistributedDataParallel.
+   Every process samples the same sequence of global mini-batches and takes its
+   own shard of them, while reporting, checkpointing and evaluation on the whole
+   dev set are done only in the main process (rank 0).
+"""
+
+import datetime
+import logging
+import os
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+logger = logging.getLogger(__name__)
+
+
+def init_distributed(backend=False, init_method='env://', world_size=None, rank=None,
+                     timeout_min=180):
+    """Initialize the default process group.
+
+    Args:
+        backend (str): nccl/gloo. If False, nccl is used when GPUs are available.
+        init_method (str): URL to initialize the process group (env:// or file://...)
+        world_size (int): number of processes. Read from $WORLD_SIZE if None.
+        rank (int): rank of this process. Read from $RANK if None.
+        timeout_min (int): timeout of collective operations in minutes.
+            This must be longer than evaluation in the main process.
+    Returns:
+        rank (int): rank of this process
+        world_size (int): number of processes
+
+    """
+    if not backend:
+        backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+    if world_size is None:
+        world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if rank is None:
+        rank = int(os.environ.get('RANK', 0))
+    dist.init_process_group(backend, init_method=init_method,
+                            world_size=world_size, rank=rank,
+                            timeout=datetime.timedelta(minutes=timeout_min))
+    logger.info('Initialized process group (backend:%s, rank:%d/%d)' % (backend, rank, world_size))
+    return rank, world_size
+
+
+def is_initialized():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_initialized() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_initialized() else 1
+
+
+def get_local_rank():
+    """Index of the device used by this process on the node."""
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_initialized():
+        dist.barrier()
+
+
+def broadcast_object(obj, src=0):
+    """Broadcast a picklable object from the src process.
+
+    Args:
+        obj: object to be sent (ignored in the other processes)
+        src (int): rank of the sender
+    Returns:
+        obj: object received from the src process
+
+    """
+    if not is_initialized():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+# keys of observations agreed by all processes (updated collectively)
+_observation_keys = []
+
+
+def reduce_observation(observation, device=None):
+    """Average observations (loss, accuracy, etc.) over processes.
+
+    All processes reduce over the same list of keys, which is extended
+    collectively when any process observes a new key. None is sent as 0
+    together with a count, so that processes can have None in different keys.
+
+    Args:
+        observation (dict): values (None if not observed in this process)
+        device (torch.device): device for communication (cuda for nccl)
+    Returns:
+        observation (dict): values averaged over processes where they are observed
+            (None if observed in no process)
+
+    """
+    global _observation_keys
+    if not is_initialized():
+        return observation
+    has_new_key = any(k not in _observation_keys for k in observation)
+    values, counts, n_new_keys = _reduce_values(observation, _observation_keys, has_new_key, device)
+    if n_new_keys > 0:
+        # NOTE: every process enters here since the flag is summed over processes
+        keys_all = [None] * get_world_size()
+        dist.all_gather_object(keys_all, sorted(observation.keys()))
+        _observation_keys = sorted(set(_observation_keys).union(*keys_all))
+        values, counts, _ = _reduce_values(observation, _observation_keys, False, device)
+
+    observation = dict(observation)
+    for k, v, n in zip(_observation_keys, values, counts):
+        observation[k] = v / n if n > 0 else None
+    return observation
+
+
+def _reduce_values(observation, keys, flag, device):
+    values = [observation.get(k) for k in keys]
+    sums = [float(v) if v is not None else 0. for v in values]
+    counts = [float(v is not None) for v in values]
+    buffer = torch.tensor(sums + counts + [float(flag)], dtype=torch.float64, device=device)
+    dist.all_reduce(buffer)
+    buffer = buffer.tolist()
+    return buffer[:len(keys)], buffer[len(keys):-1], buffer[-1]
+
+
+def wrap_ddp(model, device_id=None, bucket_cap_mb=25, find_unused_parameters=True):
+    """Wrap a model by DistributedDataParallel.
+
+    Parameters of the main process are broadcast to all processes here.
+
+    Args:
+        model (torch.nn.Module): model placed on the device of this process
+        device_id (int): index of GPU (None for CPU)
+        bucket_cap_mb (int): size of gradient buckets all-reduced at once in MB
+        find_unused_parameters (bool): allow parameters without gradients in
+            some steps (e.g., task-specific branches)
+    Returns:
+        model (DistributedDataParallel):
+
+    """
+    return DistributedDataParallel(model,
+                                   device_ids=None if device_id is None else [device_id],
+                                   output_device=device_id,
+                                   bucket_cap_mb=bucket_cap_mb,
+                                   find_unused_parameters=find_unused_parameters)
@@ -6,11 +6,11 @@
 
 """Learning rate scheduler."""
 
-from glob import glob
 import logging
 import os
 import torch
 
+from neural_sp.trainers.checkpoint import CheckpointWriter
 from neural_sp.trainers.optimizer import set_optimizer
 
 logger = logging.getLogger(__name__)
@@ -99,9 +99,12 @@ class LRScheduler(object):
     def is_early_stop(self):
         return self.not_improved_n_epochs >= self.early_stop_patient_n_epochs
 
-    def step(self):
+    def step(self, amp=None):
         self._step += 1
-        self.optimizer.step()
+        if amp is not None:
+            amp.step(self.optimizer)  # skipped if gradients overflow
+        else:
+            self.optimizer.step()
         if self.noam:
             self._noam_lr()
         else:
@@ -179,7 +182,7 @@ class LRScheduler(object):
                 param_group['lr'] = self.lr
 
     def save_checkpoint(self, model, save_path, remove_old=True, amp=None,
-                        epoch_detail=None):
+                        epoch_detail=None, writer=None, dataset=None):
         """Save checkpoint.
 
         Args:
@@ -188,23 +191,16 @@ class LRScheduler(object):
             optimizer (LRScheduler): optimizer wrapped by LRScheduler class
             remove_old (bool): if True, all checkpoints
                 worse than the top-k ones are deleted
-            amp ():
+            amp (): state of mixed precision training (apex or MixedPrecision)
             epoch_detail (float): fine-grained epoch (used for MBR training)
+            writer (CheckpointWriter): writer of checkpoints (synchronous if None)
+            dataset (Dataset): training set whose sampling state is saved for resumption
 
         """
         if epoch_detail is None:
             epoch_detail = self.n_epochs
         model_path = os.path.join(save_path, 'model.epoch-' + str(epoch_detail))
 
-        # Remove old checkpoints
-        if remove_old:
-            for path in glob(os.path.join(save_path, 'model.epoch-*')):
-                if 'model.epoch-avg' in path:
-                    continue
-                epoch = int(path.split('-')[-1])
-                if epoch not in [ep for (ep, v) in self.topk_list]:
-                    os.remove(path)
-
         # Save parameters, optimizer, step index etc.
         checkpoint = {
             "model_state_dict": model.module.state_dict(),
@@ -212,18 +208,27 @@ class LRScheduler(object):
         }
         if amp is not None:
             checkpoint['amp_state_dict'] = amp.state_dict()
-        torch.save(checkpoint, model_path)
+        if dataset is not None:
+            checkpoint['dataset_state_dict'] = dataset.state_dict()
+
+        # Remove old checkpoints after saving
+        keep_epochs = None
+        if remove_old:
+            keep_epochs = [ep for (ep, v) in self.topk_list] + [epoch_detail]
 
-        logger.info("=> Saved checkpoint (epoch:%s): %s" % (str(epoch_detail), model_path))
+        if writer is None:
+            writer = CheckpointWriter()
+        writer.save(checkpoint, model_path, keep_epochs)
 
     def state_dict(self):
         """Returns the state of the scheduler as a :class:`dict`.
 
         It contains an entry for every variable in self.__dict__ which
-        is not the optimizer.
+        is not the optimizer. The state of the optimizer is stored as
+        its state_dict.
 
         """
-        dict = {key: value for key, value in self.__dict__.items()}
+        dict = {key: value for key, value in self.__dict__.items() if key != 'optimizer'}
         dict['optimizer_state_dict'] = self.optimizer.state_dict()
         return dict
 
@@ -235,7 +240,8 @@ class LRScheduler(object):
                 from a call to :meth:`state_dict`.
 
         """
-        self.__dict__.update({k: v for k, v in state_dict.items() if k != 'optimizer_state_dict'})
+        # NOTE: the optimizer object pickled in old checkpoints is not restored
+        self.__dict__.update({k: v for k, v in state_dict.items() if k not in ['optimizer', 'optimizer_state_dict']})
         self.optimizer.load_state_dict(state_dict['optimizer_state_dict'])
 
     def convert_to_sgd(self, model, lr, weight_decay, decay_type, decay_rate):
@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Native automatic mixed precision training.
+
+   Forward passes run under `torch.autocast`, where parameters are kept in float32
+   and matmul-like operations are computed in float16/bfloat16. Losses are computed
+   in float32 (see `neural_sp.models.criterion`). Loss scaling by GradScaler is used
+   for float16 only, since bfloat16 has the same exponent range as float32.
+"""
+
+import logging
+import torch
+
+from neural_sp.models.torch_utils import autocast
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
+
+class MixedPrecision(object):
+    """Autocast and loss scaling for mixed precision training.
+
+    Args:
+        dtype (str): float16/bfloat16
+        device_type (str): cuda/cpu
+        init_scale (float): initial loss scale (float16 only)
+        growth_interval (int): number of steps without overflow to double the loss scale
+
+    """
+
+    def __init__(self, dtype, device_type, init_scale=65536., growth_interval=2000):
+        assert dtype in DTYPES, dtype
+        self.dtype = dtype
+        self.device_type = device_type
+        self.scaler = torch.amp.GradScaler(device_type,
+                                           init_scale=init_scale,
+                                           growth_interval=growth_interval,
+                                           enabled=dtype == 'float16')
+        logger.info('Mixed precision training (%s on %s)' % (dtype, device_type))
+
+    def autocast(self):
+        return autocast(self.device_type, self.dtype)
+
+    def backward(self, loss):
+        """Back-propagate the (scaled) loss."""
+        self.scaler.scale(loss).backward()
+
+    def unscale_(self, optimizer):
+        """Unscale gradients in place before clipping them."""
+        self.scaler.unscale_(optimizer)
+
+    def step(self, optimizer):
+        """Update parameters unless gradients overflow, and then update the loss scale.
+
+        Args:
+            optimizer (torch.optim.Optimizer):
+
+        """
+        self.scaler.step(optimizer)
+        self.scaler.update()
+
+    @property
+    def scale(self):
+        return self.scaler.get_scale() if self.scaler.is_enabled() else 1.
+
+    def state_dict(self):
+        return {'dtype': self.dtype, 'scaler_state_dict': self.scaler.state_dict()}
+
+    def load_state_dict(self, state_dict):
+        if not self.scaler.is_enabled():
+            return
+        if state_dict.get('dtype') != self.dtype:
+            logger.warning('Loss scaling state is not loaded (%s -> %s).' % (state_dict.get('dtype'), self.dtype))
+            return
+        self.scaler.load_state_dict(state_dict['scaler_state_dict'])
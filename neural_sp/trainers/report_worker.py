@@ -0,0 +1,206 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Background worker for plotting during training.
+
+   Figures are rendered from numpy payloads by the functions in this module.
+   In the asynchronous mode, they run in a separate process so that matplotlib
+   does not block the training loop (and does not hold its GIL). Plots of the
+   same key are rate-limited, and new jobs are dropped while the worker is busy,
+   since every payload contains the whole content of a figure.
+"""
+
+import logging
+import multiprocessing
+import numpy as np
+import os
+import queue
+import shutil
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt  # noqa: E402
+from matplotlib.ticker import MaxNLocator  # noqa: E402
+
+plt.style.use('ggplot')
+
+logger = logging.getLogger(__name__)
+
+
+def clean_dir(save_path):
+    if os.path.isdir(save_path):
+        shutil.rmtree(save_path)
+    os.makedirs(save_path)
+
+
+def plot_curves(path, xs, curves, xlabel, ylabel, upper):
+    """Plot learning curves.
+
+    Args:
+        path (str): path to the figure
+        xs (list): x-axis values (steps or epochs)
+        curves (list): tuples of (ys, color, label, linestyle)
+        xlabel (str):
+        ylabel (str):
+        upper (float): upper limit of y-axis
+
+    """
+    plt.clf()
+    for ys, color, label, linestyle in curves:
+        plt.plot(xs[-len(ys):], ys, color, label=label, linestyle=linestyle)
+    plt.xlabel(xlabel, fontsize=12)
+    plt.ylabel(ylabel, fontsize=12)
+    plt.ylim([0, upper])
+    plt.legend(loc="upper right", fontsize=12)
+    if os.path.isfile(path):
+        os.remove(path)
+    plt.savefig(path)
+
+
+def plot_attention_heads(save_path, aws, n_cols, figsize=(20, 8)):
+    """Plot attention weights for each head.
+
+    Args:
+        save_path (str): directory to save figures (cleaned before plotting)
+        aws (dict): attention weights of an utterance for each name,
+            each of which is of size `[n_heads, qlen, klen]`
+        n_cols (int): number of columns of subplots
+        figsize (tuple): size of each figure
+
+    """
+    clean_dir(save_path)
+    for k, aw in aws.items():
+        plt.clf()
+        n_heads = aw.shape[0]
+        n_cols_tmp = min(n_cols, n_heads)
+        fig, axes = plt.subplots(max(1, n_heads // n_cols_tmp), n_cols_tmp,
+                                 figsize=figsize, squeeze=False)
+        for h in range(n_heads):
+            ax = axes[h // n_cols_tmp, h % n_cols_tmp]
+            ax.imshow(aw[h], aspect="auto")
+            ax.grid(False)
+            ax.set_xlabel("Input (head%d)" % h)
+            ax.set_ylabel("Output (head%d)" % h)
+            ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+            ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+
+        fig.tight_layout()
+        fig.savefig(os.path.join(save_path, '%s.png' % k))
+        plt.close()
+
+
+def plot_ctc_posteriors(save_path, probs):
+    """Plot CTC posteriors.
+
+    Args:
+        save_path (str): directory to save a figure (cleaned before plotting)
+        probs (np.ndarray): `[T, vocab]` posteriors of an utterance
+
+    """
+    clean_dir(save_path)
+    topk_ids = np.argsort(probs, axis=1)
+
+    plt.clf()
+    n_frames = probs.shape[0]
+    times_probs = np.arange(n_frames)
+    plt.figure(figsize=(20, 8))
+
+    # NOTE: index 0 is reserved for blank
+    for idx in set(topk_ids.reshape(-1).tolist()):
+        if idx == 0:
+            plt.plot(times_probs, probs[:, 0], ':', label='<blank>', color='grey')
+        else:
+            plt.plot(times_probs, probs[:, idx])
+    plt.xlabel(u'Time [frame]', fontsize=12)
+    plt.ylabel('Posteriors', fontsize=12)
+    plt.xticks(list(range(0, int(n_frames) + 1, 10)))
+    plt.yticks(list(range(0, 2, 1)))
+
+    plt.tight_layout()
+    plt.savefig(os.path.join(save_path, 'prob.png'))
+    plt.close()
+
+
+def submit(worker, key, func, *args):
+    """Run a plotting function by the worker, or immediately if worker is None."""
+    if worker is None:
+        func(*args)
+        return True
+    return worker.submit(key, func, *args)
+
+
+def _run(jobs):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        key, func, args = job
+        try:
+            func(*args)
+        except Exception as e:
+            logger.warning('Failed to plot %s: %s' % (key, e))
+
+
+class ReportWorker(object):
+    """Run plotting functions in a background process.
+
+    Args:
+        asynchronous (bool): if False, functions are run in the calling process
+        min_interval (float): minimum interval between plots of the same key in seconds
+        max_pending (int): maximum number of pending jobs (new jobs are dropped if exceeded)
+
+    """
+
+    def __init__(self, asynchronous=True, min_interval=0., max_pending=8):
+        self.asynchronous = asynchronous
+        self.min_interval = min_interval
+        self.last_time = {}
+        self.n_dropped = 0
+
+        self.process = None
+        if asynchronous:
+            # NOTE: spawn not to inherit CUDA contexts and threads
+            ctx = multiprocessing.get_context('spawn')
+            self.jobs = ctx.Queue(maxsize=max_pending)
+            self.process = ctx.Process(target=_run, args=(self.jobs,), daemon=True)
+            self.process.start()
+
+    def submit(self, key, func, *args, force=False):
+        """Submit a plotting job.
+
+        Args:
+            key (str): identifier of a figure for rate limiting
+            func (callable): module-level plotting function
+            args: numpy payloads etc.
+            force (bool): ignore the rate limit and wait for a free slot
+        Returns:
+            submitted (bool): False if the job was skipped
+
+        """
+        now = time.time()
+        if not force and now - self.last_time.get(key, -np.inf) < self.min_interval:
+            return False
+        if not self.asynchronous:
+            func(*args)
+        else:
+            try:
+                self.jobs.put((key, func, args), block=force)
+            except queue.Full:
+                self.n_dropped += 1
+                logger.debug('Skip plotting %s (the worker is busy).' % key)
+                return False
+        self.last_time[key] = now
+        return True
+
+    def close(self):
+        """Finish all pending jobs and stop the worker."""
+        if self.process is not None:
+            self.jobs.put(None)
+            self.process.join()
+            self.process = None
+            if self.n_dropped > 0:
+                logger.info('%d plots were skipped in the background worker.' % self.n_dropped)
@@ -9,12 +9,11 @@
 from tensorboardX import SummaryWriter
 import os
 import numpy as np
-from matplotlib import pyplot as plt
 import logging
-import matplotlib
-matplotlib.use('Agg')
 
-plt.style.use('ggplot')
+from neural_sp.trainers.report_worker import plot_curves
+from neural_sp.trainers.report_worker import ReportWorker
+
 grey = '#878f99'
 blue = '#4682B4'
 orange = '#D2691E'
@@ -28,14 +27,24 @@ class Reporter(object):
 
     Args:
         save_path (str):
+        enabled (bool): if False, nothing is recorded or written
+            (for non-main processes in distributed training)
+        asynchronous (bool): render figures in a background process
+        min_interval (float): minimum interval between renderings of the same figure in seconds
 
     """
 
-    def __init__(self, save_path):
+    def __init__(self, save_path, enabled=True, asynchronous=False, min_interval=0.):
         self.save_path = save_path
+        self.enabled = enabled
 
         # tensorboard
-        self.tf_writer = SummaryWriter(save_path)
+        self.tf_writer = SummaryWriter(save_path) if enabled else None
+
+        # plotting (also used for attention weights and CTC posteriors)
+        self.worker = ReportWorker(asynchronous, min_interval) if enabled else None
+        self._updated = set()  # metrics to be re-rendered
+        self._n_rows_csv = {}  # number of rows written to each csv file
 
         # report per step
         self._step = 0
@@ -57,6 +66,8 @@ class Reporter(object):
             is_eval (bool):
 
         """
+        if not self.enabled:
+            return
         for k, v in observation.items():
             if v is None:
                 continue
@@ -82,6 +93,7 @@ class Reporter(object):
                     self.obsv_dev[metric][name] = []
                 self.obsv_dev[metric][name].append(v)
                 logger.info('%s (dev): %.3f' % (k, v))
+                self._updated.add(metric)
 
             if is_eval:
                 self.add_tensorboard_scalar('train' + '/' + metric + '/' + name, v)
@@ -90,10 +102,14 @@ class Reporter(object):
 
     def add_tensorboard_scalar(self, key, value):
         """Add scalar value to tensorboard."""
+        if not self.enabled:
+            return
         self.tf_writer.add_scalar(key, value, self._step)
 
     def add_tensorboard_histogram(self, key, value):
         """Add histogram value to tensorboard."""
+        if not self.enabled:
+            return
         self.tf_writer.add_histogram(key, value, self._step)
 
     def step(self, is_eval=False):
@@ -106,61 +122,75 @@ class Reporter(object):
 
     def epoch(self, metric=None, name='wer'):
         self._epoch += 1
-        if metric is None:
+        if metric is None or not self.enabled:
             return
         self.epochs.append(self._epoch)
 
         # register
         self.obsv_eval.append(metric)
 
-        plt.clf()
         upper = 0.1
-        plt.plot(self.epochs, self.obsv_eval, orange,
-                 label='dev', linestyle='-')
-        plt.xlabel('epoch', fontsize=12)
-        plt.ylabel(name, fontsize=12)
         if max(self.obsv_eval) > 1:
             upper = min(100, max(self.obsv_eval) + 1)
         else:
             upper = min(upper, max(self.obsv_eval))
-        plt.ylim([0, upper])
-        plt.legend(loc="upper right", fontsize=12)
-        if os.path.isfile(os.path.join(self.save_path, name + ".png")):
-            os.remove(os.path.join(self.save_path, name + ".png"))
-        plt.savefig(os.path.join(self.save_path, name + ".png"), dvi=500)
+        self.worker.submit(name, plot_curves, os.path.join(self.save_path, name + ".png"),
+                           list(self.epochs), [(list(self.obsv_eval), orange, 'dev', '-')],
+                           'epoch', name, upper, force=True)
+
+    def snapshot(self, force=False):
+        """Save learning curves of metrics updated since the last snapshot.
 
-    def snapshot(self):
+        Args:
+            force (bool): ignore the rate limit of the worker
+
+        """
+        if not self.enabled:
+            return
         # linestyles = ['solid', 'dashed', 'dotted', 'dashdotdotted']
         linestyles = ['-', '--', '-.', ':', ':', ':', ':', ':', ':', ':', ':', ':']
-        for metric in self.obsv_train.keys():
-            plt.clf()
+        for metric in sorted(self._updated):
+            curves = []
             upper = 0.1
             for i, (k, v) in enumerate(sorted(self.obsv_train[metric].items())):
                 # skip non-observed values
                 if np.mean(self.obsv_train[metric][k]) == 0:
                     continue
 
-                plt.plot(self.steps, self.obsv_train[metric][k], blue,
-                         label=k + " (train)", linestyle=linestyles[i])
-                plt.plot(self.steps, self.obsv_dev[metric][k], orange,
-                         label=k + " (dev)", linestyle=linestyles[i])
+                curves.append((list(self.obsv_train[metric][k]), blue, k + " (train)", linestyles[i]))
+                curves.append((list(self.obsv_dev[metric][k]), orange, k + " (dev)", linestyles[i]))
                 upper = max(upper, max(self.obsv_train[metric][k]))
                 upper = max(upper, max(self.obsv_dev[metric][k]))
 
                 # Save as csv file
-                if os.path.isfile(os.path.join(self.save_path, metric + '-' + k + ".csv")):
-                    os.remove(os.path.join(self.save_path, metric + '-' + k + ".csv"))
-                loss_graph = np.column_stack(
-                    (self.steps, self.obsv_train[metric][k], self.obsv_dev[metric][k]))
-                np.savetxt(os.path.join(self.save_path, metric + '-' + k + ".csv"), loss_graph, delimiter=",")
+                self._append_csv(metric, k)
 
             if upper > 1:
                 upper = min(upper + 10, 300)  # for CE, CTC loss
 
-            plt.xlabel('step', fontsize=12)
-            plt.ylabel(metric, fontsize=12)
-            plt.ylim([0, upper])
-            plt.legend(loc="upper right", fontsize=12)
-            if os.path.isfile(os.path.join(self.save_path, metric + ".png")):
-                os.remove(os.path.join(self.save_path, metric + ".png"))
-            plt.savefig(os.path.join(self.save_path, metric + ".png"), dvi=500)
+            if self.worker.submit(metric, plot_curves, os.path.join(self.save_path, metric + ".png"),
+                                  list(self.steps), curves, 'step', metric, upper, force=force):
+                self._updated.discard(metric)
+
+    def _append_csv(self, metric, k):
+        """Append rows observed since the last snapshot to the csv file."""
+        path = os.path.join(self.save_path, metric + '-' + k + ".csv")
+        n_rows = self._n_rows_csv.get(path, 0)
+        if n_rows == 0 and os.path.isfile(path):
+            os.remove(path)
+        obsv_train = self.obsv_train[metric][k]
+        steps = self.steps[len(self.steps) - len(obsv_train):]
+        loss_graph = np.column_stack(
+            (steps[n_rows:], obsv_train[n_rows:], self.obsv_dev[metric][k][n_rows:]))
+        if len(loss_graph) == 0:
+            return
+        with open(path, 'ab') as f:
+            np.savetxt(f, loss_graph, delimiter=",")
+        self._n_rows_csv[path] = len(obsv_train)
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.snapshot(force=True)
+        self.worker.close()
+        self.tf_writer.close()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for CPU benchmark suite."""
+
+import copy
+import importlib
+import json
+import pytest
+import sys
+
+
+def make_opts(monkeypatch, **kwargs):
+    module = importlib.import_module('neural_sp.bin.benchmark')
+    args = dict(xmax=41, input_dim=8, vocab=20, lm_seq_len=10, n_utts=8,
+                n_iters=2, n_warmup=0, isolate=0)
+    args.update(kwargs)
+    argv = []
+    for k, v in args.items():
+        argv += ['--' + k, str(v)]
+    monkeypatch.setattr(sys, 'argv', ['benchmark.py'] + argv)
+    return module.parse()
+
+
+@pytest.mark.parametrize(
+    "configs, stages",
+    [
+        ('blstm_las', ['encode', 'search_greedy', 'search_beam5']),
+        ('transformerlm', ['score', 'generate']),
+        ('dataset*', ['epoch']),
+    ]
+)
+def test_run_benchmarks(configs, stages, monkeypatch):
+    module = importlib.import_module('neural_sp.bin.benchmark')
+    opts = make_opts(monkeypatch, configs=configs)
+    names = module.select_configs(opts.configs)
+    report = module.run_benchmarks(names, opts)
+    json.dumps(report)  # serializable
+
+    assert report['options']['xmax'] == 41
+    assert [r['config'] for r in report['results']] == [n for n in names for _ in stages]
+    for r in report['results']:
+        assert r['stage'] in stages
+        assert r['n_iters'] == opts.n_iters
+        assert 0 < r['latency_ms']['p50'] <= r['latency_ms']['p90'] <= r['latency_ms']['p99']
+        assert r['peak_rss_mb'] > 0
+
+
+def test_isolate(monkeypatch):
+    module = importlib.import_module('neural_sp.bin.benchmark')
+    opts = make_opts(monkeypatch, isolate=1)
+    results = module.run_benchmarks(['dataset'], opts)['results']
+    assert len(results) == 1
+    assert results[0]['frames_per_sec'] > 0
+
+
+def test_compare(monkeypatch):
+    module = importlib.import_module('neural_sp.bin.benchmark')
+    opts = make_opts(monkeypatch)
+    baseline = module.run_benchmarks(['dataset'], opts)
+    report = copy.deepcopy(baseline)
+    comparisons, regressions = module.compare(report, baseline, tolerance=0.1)
+    assert len(comparisons) == 1
+    assert len(regressions) == 0
+
+    report['results'][0]['latency_ms']['p50'] *= 1.5
+    comparisons, regressions = module.compare(report, baseline, tolerance=0.1)
+    assert len(regressions) == 1
+    assert regressions[0]['ratio'] == pytest.approx(1.5)
+
+    with pytest.raises(ValueError):
+        module.select_configs('unknown')
@@ -0,0 +1,269 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for ASR dataset."""
+
+import codecs
+import importlib
+import kaldiio
+import numpy as np
+import os
+import pytest
+
+N_UTTS = 23
+INPUT_DIM = 8
+VOCAB = 10
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmpdir_factory):
+    dir_path = str(tmpdir_factory.mktemp('data'))
+    rng = np.random.RandomState(0)
+
+    # features
+    feats = {'utt%03d' % i: rng.randn(rng.randint(40, 100), INPUT_DIM).astype(np.float32)
+             for i in range(N_UTTS)}
+    ark_path = os.path.join(dir_path, 'feats.ark')
+    scp_path = os.path.join(dir_path, 'feats.scp')
+    kaldiio.save_ark(ark_path, feats, scp=scp_path)
+    feat_paths = {}
+    with codecs.open(scp_path, 'r', 'utf-8') as f:
+        for line in f:
+            utt_id, feat_path = line.strip().split(' ')
+            feat_paths[utt_id] = feat_path
+
+    # dictionary
+    dict_path = os.path.join(dir_path, 'dict.txt')
+    with codecs.open(dict_path, 'w', 'utf-8') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, VOCAB):
+            f.write('%s %d\n' % (chr(ord('a') + i), i))
+
+    # tsv
+    tsv_path = os.path.join(dir_path, 'train.tsv')
+    with codecs.open(tsv_path, 'w', 'utf-8') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        for utt_id, feat in feats.items():
+            token_id = rng.randint(4, VOCAB, size=rng.randint(1, 10))
+            text = ''.join([chr(ord('a') + i) for i in token_id])
+            f.write('\t'.join([utt_id, utt_id[:4], feat_paths[utt_id], str(len(feat)), str(INPUT_DIM),
+                               text, ' '.join(map(str, token_id)), str(len(token_id)), str(VOCAB)]) + '\n')
+    return dir_path
+
+
+def make_args(dir_path, **kwargs):
+    args = dict(
+        tsv_path=os.path.join(dir_path, 'train.tsv'),
+        dict_path=os.path.join(dir_path, 'dict.txt'),
+        unit='char',
+        batch_size=4,
+        n_epochs=3,
+        min_n_frames=40,
+        max_n_frames=2000,
+        sort_by='input',
+        short2long=True,
+        shuffle_bucket=False,
+        sort_stop_epoch=2,
+    )
+    args.update(kwargs)
+    return args
+
+
+def iterate(dataset):
+    outputs = []
+    for batch, is_new_epoch in dataset:
+        outputs.append((batch, is_new_epoch, dataset.epoch, dataset.epoch_detail))
+    return outputs
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_workers': 1}),
+        ({'n_workers': 2}),
+        ({'n_workers': 2, 'n_prefetch': 1}),
+        ({'n_workers': 2, 'shuffle_bucket': True}),
+        ({'n_workers': 2, 'pin_memory': True}),
+        ({'n_workers': 2, 'frame_budget': 300, 'shuffle_bucket': True}),
+    ]
+)
+def test_async(data_dir, args):
+    module = importlib.import_module('neural_sp.datasets.asr')
+
+    module.np.random.seed(1)
+    dataset = module.Dataset(**make_args(data_dir, **{k: v for k, v in args.items()
+                                                      if k not in ['n_workers', 'n_prefetch', 'pin_memory']}))
+    outputs = iterate(dataset)
+
+    module.np.random.seed(1)
+    dataset_async = module.Dataset(**make_args(data_dir, **args))
+    outputs_async = iterate(dataset_async)
+    dataset_async.close()
+
+    assert len(outputs) == len(outputs_async)
+    for (batch, is_new_epoch, epoch, epoch_detail), (batch_async, is_new_epoch_async, epoch_async, epoch_detail_async) in zip(
+            outputs, outputs_async):
+        assert batch['utt_ids'] == batch_async['utt_ids']
+        assert batch['ys'] == batch_async['ys']
+        assert batch['xlens'] == batch_async['xlens']
+        for x, x_async in zip(batch['xs'], batch_async['xs']):
+            assert np.array_equal(x, np.asarray(x_async))
+        assert is_new_epoch == is_new_epoch_async
+        assert epoch == epoch_async
+        assert epoch_detail == epoch_detail_async
+
+
+def test_reset(data_dir):
+    module = importlib.import_module('neural_sp.datasets.asr')
+    dataset = module.Dataset(**make_args(data_dir, n_workers=2))
+
+    # change batch size in the middle of an epoch
+    batch, _ = dataset.next(4)
+    batch, _ = dataset.next(2)
+    assert len(batch['utt_ids']) == 2
+    assert dataset.epoch_detail == 6 / len(dataset)
+
+    # prefetched mini-batches are discarded
+    dataset.reset()
+    assert dataset.epoch_detail == 0
+    utt_ids = []
+    while True:
+        batch, is_new_epoch = dataset.next(4)
+        utt_ids += batch['utt_ids']
+        if is_new_epoch:
+            break
+    assert sorted(utt_ids) == sorted(dataset.df['utt_id'])
+    dataset.close()
+
+
+@pytest.mark.parametrize(
+    "frame_budget, token_budget, shuffle_bucket",
+    [
+        (300, 0, False),
+        (300, 0, True),
+        (0, 20, True),
+        (300, 20, True),
+        (50, 0, True),
+    ]
+)
+def test_budget(data_dir, frame_budget, token_budget, shuffle_bucket):
+    module = importlib.import_module('neural_sp.datasets.asr')
+    dataset = module.Dataset(**make_args(data_dir, n_epochs=2, shuffle_bucket=shuffle_bucket,
+                                         frame_budget=frame_budget, token_budget=token_budget))
+
+    utt_ids = []
+    for batch, is_new_epoch in dataset:
+        n_utts = len(batch['utt_ids'])
+        if n_utts > 1:
+            if frame_budget > 0:
+                assert n_utts * max(batch['xlens']) <= frame_budget
+            if token_budget > 0:
+                assert n_utts * max([len(y) for y in batch['ys']]) <= token_budget
+        utt_ids += batch['utt_ids']
+        assert 0 < dataset.padding_efficiency <= 1
+        if is_new_epoch:
+            # all utterances are used once per epoch
+            assert sorted(utt_ids) == sorted(dataset.df['utt_id'])
+            utt_ids = []
+    assert dataset.epoch == 2
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({}),
+        ({'dynamic_batching': True}),
+        ({'sort_by': 'shuffle'}),
+        ({'shuffle_bucket': True}),
+        ({'frame_budget': 300, 'shuffle_bucket': True}),
+        ({'n_workers': 2}),
+    ]
+)
+def test_seed(data_dir, args):
+    module = importlib.import_module('neural_sp.datasets.asr')
+
+    outputs = []
+    for seed in [1, 1, 2]:
+        module.np.random.seed(seed)  # should not be used
+        dataset = module.Dataset(**make_args(data_dir, seed=1, **args))
+        outputs.append([batch['utt_ids'] for batch, _ in dataset])
+        dataset.close()
+    assert outputs[0] == outputs[1]
+    assert outputs[0] == outputs[2]
+
+
+@pytest.mark.parametrize(
+    "args, n_steps",
+    [
+        ({}, 3),
+        ({}, 14),  # after sort_stop_epoch
+        ({'sort_by': 'shuffle'}, 7),
+        ({'shuffle_bucket': True}, 3),
+        ({'shuffle_bucket': True}, 13),
+        ({'frame_budget': 300, 'shuffle_bucket': True}, 9),
+        ({'n_workers': 2}, 4),
+    ]
+)
+def test_resume(data_dir, args, n_steps):
+    module = importlib.import_module('neural_sp.datasets.asr')
+
+    dataset = module.Dataset(**make_args(data_dir, seed=1, **args))
+    outputs = iterate(dataset)
+    dataset.close()
+
+    dataset = module.Dataset(**make_args(data_dir, seed=1, **args))
+    for _ in range(n_steps):
+        next(dataset)
+    state = dataset.state_dict()
+    epoch_detail = dataset.epoch_detail
+    dataset.close()
+
+    # resume with a different seed
+    dataset_resume = module.Dataset(**make_args(data_dir, seed=2, **args))
+    dataset_resume.load_state_dict(state)
+    assert dataset_resume.epoch_detail == epoch_detail
+    outputs_resume = iterate(dataset_resume)
+    dataset_resume.close()
+
+    assert len(outputs_resume) == len(outputs) - n_steps
+    for (batch, is_new_epoch, epoch, epoch_detail), (batch_resume, is_new_epoch_resume, epoch_resume, epoch_detail_resume) in zip(
+            outputs[n_steps:], outputs_resume):
+        assert batch['utt_ids'] == batch_resume['utt_ids']
+        assert is_new_epoch == is_new_epoch_resume
+        assert epoch == epoch_resume
+        assert epoch_detail == epoch_detail_resume
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({}),
+        ({'dynamic_batching': True}),
+        ({'sort_by': 'shuffle'}),
+        ({'frame_budget': 300, 'shuffle_bucket': True}),
+        ({'n_workers': 2}),
+    ]
+)
+def test_distributed(data_dir, args):
+    module = importlib.import_module('neural_sp.datasets.asr')
+    world_size = 2
+
+    dataset = module.Dataset(**make_args(data_dir, seed=1, **args))
+    outputs = iterate(dataset)
+    dataset.close()
+
+    outputs_ranks = []
+    for rank in range(world_size):
+        dataset = module.Dataset(**make_args(data_dir, seed=1, rank=rank, world_size=world_size, **args))
+        outputs_ranks.append(iterate(dataset))
+        dataset.close()
+
+    # the same number of steps in all processes, and shards cover global mini-batches
+    assert len(outputs_ranks[0]) == len(outputs_ranks[1]) == len(outputs)
+    for (batch, is_new_epoch, epoch, _), *outputs_step in zip(outputs, *outputs_ranks):
+        utt_ids = sum([batch_rank['utt_ids'] for batch_rank, _, _, _ in outputs_step], [])
+        assert sorted(set(utt_ids)) == sorted(batch['utt_ids'])
+        assert len(utt_ids) == max(len(batch['utt_ids']), world_size)
+        for _, is_new_epoch_rank, epoch_rank, _ in outputs_step:
+            assert is_new_epoch_rank == is_new_epoch
+            assert epoch_rank == epoch
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for packed feature shards."""
+
+import codecs
+import importlib
+import kaldiio
+import numpy as np
+import os
+import pytest
+
+INPUT_DIM = 8
+
+
+def make_feats(n_utts=10):
+    rng = np.random.RandomState(0)
+    return {'utt%03d' % i: rng.randn(rng.randint(40, 100), INPUT_DIM).astype(np.float32)
+            for i in range(n_utts)}
+
+
+@pytest.mark.parametrize(
+    "dtype, max_shard_size",
+    [
+        ('float32', 2 ** 30),
+        ('float32', 4000),
+        ('float16', 4000),
+    ]
+)
+def test_read_write(tmpdir, dtype, max_shard_size):
+    module = importlib.import_module('neural_sp.datasets.feat_shard')
+    feats = make_feats()
+
+    feat_paths = {}
+    with module.FeatShardWriter(str(tmpdir.join('feats')), dtype=dtype,
+                                max_shard_size=max_shard_size) as writer:
+        for utt_id, feat in feats.items():
+            feat_paths[utt_id] = writer.write(feat)
+    n_shards = len(set(p.rsplit(':', 1)[0] for p in feat_paths.values()))
+    assert n_shards == writer.n_shards
+    if max_shard_size < 2 ** 30:
+        assert n_shards > 1
+
+    for utt_id, feat_path in feat_paths.items():
+        assert module.is_shard_path(feat_path)
+        feat = module.load_feat(feat_path)
+        assert feat.dtype == np.dtype(dtype)
+        assert isinstance(feat.base, np.memmap)  # zero-copy
+        if dtype == 'float32':
+            assert np.array_equal(feat, feats[utt_id])
+        else:
+            assert np.allclose(feat, feats[utt_id], atol=1e-2)
+
+    # in the original order
+    utt_ids = list(feat_paths.keys())[::-1]
+    for utt_id, feat in zip(utt_ids, module.load_feats([feat_paths[u] for u in utt_ids])):
+        assert feat.shape == feats[utt_id].shape
+
+
+def test_dataset(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.feat_shard')
+    module_asr = importlib.import_module('neural_sp.datasets.asr')
+    feats = make_feats(n_utts=15)
+
+    ark_path = str(tmpdir.join('feats.ark'))
+    scp_path = str(tmpdir.join('feats.scp'))
+    kaldiio.save_ark(ark_path, feats, scp=scp_path)
+    feat_paths_ark = dict(line.strip().split(' ') for line in codecs.open(scp_path, 'r', 'utf-8'))
+    feat_paths_shard = {}
+    with module.FeatShardWriter(str(tmpdir.join('feats')), max_shard_size=4000) as writer:
+        for utt_id, feat in kaldiio.load_scp_sequential(scp_path):
+            feat_paths_shard[utt_id] = writer.write(feat)
+
+    dict_path = str(tmpdir.join('dict.txt'))
+    with codecs.open(dict_path, 'w', 'utf-8') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\na 4\n')
+
+    outputs = []
+    for feat_paths in [feat_paths_ark, feat_paths_shard]:
+        tsv_path = str(tmpdir.join('train%d.tsv' % len(outputs)))
+        with codecs.open(tsv_path, 'w', 'utf-8') as f:
+            f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+            for utt_id, feat in feats.items():
+                f.write('%s\tspk\t%s\t%d\t%d\ta\t4\t1\t5\n' % (utt_id, feat_paths[utt_id], len(feat), INPUT_DIM))
+        module_asr.np.random.seed(1)
+        dataset = module_asr.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='char',
+                                     batch_size=4, n_epochs=1, sort_by='input')
+        assert dataset.input_dim == INPUT_DIM
+        outputs.append([batch for batch in dataset])
+
+    assert len(outputs[0]) == len(outputs[1])
+    for (batch_ark, is_new_epoch_ark), (batch_shard, is_new_epoch_shard) in zip(*outputs):
+        assert batch_ark['utt_ids'] == batch_shard['utt_ids']
+        assert is_new_epoch_ark == is_new_epoch_shard
+        for x_ark, x_shard in zip(batch_ark['xs'], batch_shard['xs']):
+            assert np.array_equal(x_ark, x_shard)
+    assert os.path.isfile(str(tmpdir.join('feats.0.index.npz')))
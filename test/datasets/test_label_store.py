@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for pre-tokenized label store."""
+
+import importlib
+import numpy as np
+import pytest
+
+
+def make_token_ids(n_utts=30):
+    rng = np.random.RandomState(0)
+    token_ids = [' '.join(map(str, rng.randint(0, 10000, size=rng.randint(0, 20)))) for _ in range(n_utts)]
+    token_ids[3] = np.nan  # missing value
+    token_ids[4] = '7'
+    return token_ids
+
+
+def parse(token_id):
+    return [] if not isinstance(token_id, str) else list(map(int, token_id.split()))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 10000])
+def test_from_strings(chunk_size):
+    module = importlib.import_module('neural_sp.datasets.label_store')
+    token_ids = make_token_ids()
+    store = module.LabelStore.from_strings(token_ids, chunk_size=chunk_size)
+    assert store.tokens.dtype == np.int32
+    assert len(store) == len(token_ids)
+    for i, token_id in enumerate(token_ids):
+        assert store[i].tolist() == parse(token_id)
+        assert store.lengths[i] == len(parse(token_id))
+        assert store[i].base is not None  # zero-copy
+
+    assert len(module.LabelStore.from_strings([]).tokens) == 0
+    assert len(module.LabelStore.from_strings(['', '']).tokens) == 0
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 10000])
+def test_from_tsv(tmpdir, chunk_size):
+    module = importlib.import_module('neural_sp.datasets.label_store')
+    token_ids = make_token_ids()
+    tsv_path = str(tmpdir.join('train.tsv'))
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\ttoken_id\tylen\n')
+        for i, token_id in enumerate(token_ids):
+            f.write('utt%d\t%s\t%d\n' % (i, token_id if isinstance(token_id, str) else '', len(parse(token_id))))
+    prefix = str(tmpdir.join('train.labels'))
+    store = module.LabelStore.from_tsv(tsv_path, prefix, chunk_size=chunk_size)
+    assert isinstance(store.tokens, np.memmap)
+    store_ref = module.LabelStore.from_strings(token_ids)
+    assert np.array_equal(store.tokens, store_ref.tokens)
+    assert np.array_equal(store.offsets, store_ref.offsets)
+    assert len(tmpdir.listdir()) == 3  # tsv, tokens and offsets
+
+
+@pytest.mark.parametrize("backward", [False, True])
+def test_concat(backward):
+    module = importlib.import_module('neural_sp.datasets.label_store')
+    token_ids = make_token_ids()
+    store = module.LabelStore.from_strings(token_ids)
+    rows = np.random.RandomState(1).permutation(len(token_ids))
+    if backward:
+        rows = rows[::-1]
+
+    concat_ids = []
+    for i in rows:
+        concat_ids += [2] + parse(token_ids[i])
+    concat_ids += [2]
+    assert store.concat(rows, sep=2).tolist() == concat_ids
+
+
+def test_save_load(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.label_store')
+    token_ids = make_token_ids()
+    prefix = str(tmpdir.join('train.labels0'))
+
+    store = module.load_label_store(token_ids, prefix)
+    assert isinstance(store.tokens, np.memmap)
+    store_loaded = module.LabelStore.load(prefix, mmap_mode=None)
+    assert np.array_equal(store.tokens, store_loaded.tokens)
+    assert np.array_equal(store.offsets, store_loaded.offsets)
+
+    # re-created if inconsistent
+    store = module.load_label_store(token_ids[:10], prefix)
+    assert len(store) == 10
+    assert store[4].tolist() == [7]
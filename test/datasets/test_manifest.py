@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for dataset manifest loading."""
+
+import codecs
+import importlib
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+N_UTTS = 50
+
+
+def write_tsv(tsv_path, seed=0):
+    rng = np.random.RandomState(seed)
+    with codecs.open(tsv_path, 'w', 'utf-8') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        for i in range(N_UTTS):
+            xlen = rng.randint(10, 120)
+            ylen = rng.randint(0, 30)
+            token_id = ' '.join(map(str, rng.randint(4, 10, size=ylen)))
+            text = 'text%d' % i if ylen > 0 else ''  # empty text is read as NaN
+            f.write('\t'.join(['utt%03d' % i, 'spk%d' % (i % 3), 'feats.ark:%d' % i,
+                               str(xlen), '8', text, token_id, str(ylen), '10']) + '\n')
+
+
+def filter_asr_naive(df, df_subs, min_n_frames, max_n_frames, ctc, subsample_factor,
+                     ctc_subs, subsample_factor_subs):
+    # row-wise filtering in the original implementation
+    df = df[df.apply(lambda x: min_n_frames <= x['xlen'] <= max_n_frames, axis=1)]
+    df = df[df.apply(lambda x: x['ylen'] > 0, axis=1)]
+    if ctc and subsample_factor > 1:
+        df = df[df.apply(lambda x: x['ylen'] <= (x['xlen'] // subsample_factor), axis=1)]
+    for i in range(len(df_subs)):
+        df_sub = df_subs[i]
+        if ctc_subs[i] and subsample_factor_subs[i] > 1:
+            df_sub = df_sub[df_sub.apply(lambda x: x['ylen'] <= (x['xlen'] // subsample_factor_subs[i]), axis=1)]
+        if len(df) != len(df_sub):
+            df = df.drop(df.index.difference(df_sub.index))
+            for j in range(i + 1):
+                df_subs[j] = df_subs[j].drop(df_subs[j].index.difference(df.index))
+    return df, df_subs
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        ({}),
+        ({'min_n_frames': 20, 'max_n_frames': 100}),
+        ({'ctc': True, 'subsample_factor': 4}),
+        ({'ctc': True, 'subsample_factor': 4, 'ctc_sub1': True, 'subsample_factor_sub1': 8}),
+        ({'ctc': True, 'subsample_factor': 2, 'ctc_sub1': True, 'subsample_factor_sub1': 4,
+          'ctc_sub2': True, 'subsample_factor_sub2': 8}),
+    ]
+)
+def test_filter_asr(tmpdir, params):
+    module = importlib.import_module('neural_sp.datasets.manifest')
+    tsv_paths = [str(tmpdir.join('train%d.tsv' % i)) for i in range(3)]
+    for i, tsv_path in enumerate(tsv_paths):
+        write_tsv(tsv_path, seed=i)
+    df, df_sub1, df_sub2 = [module.read_tsv(p) for p in tsv_paths]
+
+    df_f, df_sub1_f, df_sub2_f = module.filter_asr(df, df_sub1, df_sub2, **params)
+    df_ref, (df_sub1_ref, df_sub2_ref) = filter_asr_naive(
+        df, [df_sub1, df_sub2],
+        params.get('min_n_frames', 40), params.get('max_n_frames', 2000),
+        params.get('ctc', False), params.get('subsample_factor', 1),
+        [params.get('ctc_sub1', False), params.get('ctc_sub2', False)],
+        [params.get('subsample_factor_sub1', 1), params.get('subsample_factor_sub2', 1)])
+    pd.testing.assert_frame_equal(df_f, df_ref)
+    pd.testing.assert_frame_equal(df_sub1_f, df_sub1_ref)
+    pd.testing.assert_frame_equal(df_sub2_f, df_sub2_ref)
+
+
+def test_filter_lm(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.manifest')
+    tsv_path = str(tmpdir.join('train.tsv'))
+    write_tsv(tsv_path)
+    df = module.read_tsv(tsv_path)
+    assert (module.filter_lm(df, min_n_tokens=10)['ylen'] >= 10).all()
+    assert (module.filter_lm(df, is_test=True)['ylen'] > 0).all()
+
+
+def test_cache(tmpdir, monkeypatch):
+    module = importlib.import_module('neural_sp.datasets.manifest')
+    tsv_path = str(tmpdir.join('train.tsv'))
+    tsv_path_sub1 = str(tmpdir.join('train_sub1.tsv'))
+    write_tsv(tsv_path)
+    write_tsv(tsv_path_sub1, seed=1)
+    cache_dir = str(tmpdir.join('cache'))
+    tsv_paths = [tsv_path, tsv_path_sub1, False]
+    params = {'ctc': True, 'subsample_factor': 4, 'ctc_sub1': True, 'subsample_factor_sub1': 8,
+              'is_test': True}  # keep empty utterances in the cache
+
+    dfs = module.load_manifests(tsv_paths, module.filter_asr, params, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert dfs[2] is None
+
+    # load the cache without parsing tsv files
+    read_tsv = module.read_tsv
+    monkeypatch.setattr(module, 'read_tsv', None)
+    dfs_cached = module.load_manifests(tsv_paths, module.filter_asr, params, cache_dir=cache_dir)
+    assert dfs_cached[2] is None
+    for df, df_cached in zip(dfs[:2], dfs_cached[:2]):
+        pd.testing.assert_frame_equal(df, df_cached)
+    assert df_cached['text'].isnull().any()
+    monkeypatch.setattr(module, 'read_tsv', read_tsv)
+
+    # different parameters
+    module.load_manifests(tsv_paths, module.filter_asr, dict(params, subsample_factor=2), cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # modified tsv file
+    write_tsv(tsv_path, seed=2)
+    module.load_manifests(tsv_paths, module.filter_asr, params, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 3
+
+    # label stores next to the cached manifest
+    dfs, stores = module.load_manifests(tsv_paths, module.filter_asr, params, cache_dir=cache_dir, labels=True)
+    assert len(os.listdir(cache_dir)) == 3 + 4
+    assert stores[2] is None
+    for df, store in zip(dfs[:2], stores[:2]):
+        assert len(store) == len(df)
+        for token_id, tokens in zip(df['token_id'], [store[i] for i in range(len(store))]):
+            assert tokens.tolist() == ([] if pd.isnull(token_id) else list(map(int, token_id.split())))
+
+
+def test_string_columns(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.manifest')
+    strings = ['', 'a', '音声認識', 'x' * 1000, 'é b']
+    buffer, offsets = module.encode_strings(strings)
+    assert buffer.dtype == np.uint8 and offsets.dtype == np.int64
+    assert module.decode_strings(buffer, offsets).tolist() == strings
+
+    # a long value does not pad the other values
+    df = pd.DataFrame({'text': ['短い'] * 1000 + ['y' * 10000, np.nan], 'ylen': np.arange(1002)})
+    cache_path = str(tmpdir.join('train' + module.CACHE_SUFFIX))
+    module.save_cache(cache_path, [df, None])
+    assert os.path.getsize(cache_path) < 100000  # 40MB in fixed-width unicode
+    df_cached, none = module.load_cache(cache_path)
+    assert none is None
+    pd.testing.assert_frame_equal(df, df_cached)
+
+
+@pytest.mark.parametrize("task", ['asr', 'lm'])
+def test_dataset(tmpdir, task):
+    module = importlib.import_module('neural_sp.datasets.' + task)
+    tsv_path = str(tmpdir.join('train.tsv'))
+    write_tsv(tsv_path)
+    dict_path = str(tmpdir.join('dict.txt'))
+    with codecs.open(dict_path, 'w', 'utf-8') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, 10):
+            f.write('%s %d\n' % (chr(ord('a') + i), i))
+    if task == 'asr':
+        # NOTE: input_dim is read from the first feature
+        kaldiio = importlib.import_module('kaldiio')
+        df = pd.read_csv(tsv_path, delimiter='\t')
+        feats = {utt_id: np.zeros((xlen, 8), dtype=np.float32) for utt_id, xlen in zip(df['utt_id'], df['xlen'])}
+        kaldiio.save_ark(str(tmpdir.join('feats.ark')), feats, scp=str(tmpdir.join('feats.scp')))
+        feat_paths = dict(line.strip().split(' ') for line in codecs.open(str(tmpdir.join('feats.scp')), 'r', 'utf-8'))
+        df['feat_path'] = [feat_paths[utt_id] for utt_id in df['utt_id']]
+        df.to_csv(tsv_path, sep='\t', index=False)
+        kwargs = dict(unit='char', batch_size=4, sort_by='input', seed=1, n_epochs=1)
+    else:
+        kwargs = dict(unit='char', batch_size=2, bptt=5, n_epochs=1)
+
+    outputs = []
+    for cache_dir in [False, str(tmpdir.join('cache')), str(tmpdir.join('cache'))]:
+        dataset = module.Dataset(tsv_path=tsv_path, dict_path=dict_path,
+                                 manifest_cache_dir=cache_dir, **kwargs)
+        if task == 'asr':
+            outputs.append([(batch['utt_ids'], batch['ys']) for batch, _ in dataset])
+        else:
+            outputs.append([ys.tolist() for ys, _ in dataset])
+    assert outputs[0] == outputs[1] == outputs[2]
+    if task == 'asr':
+        token_ids = dict(zip(df['utt_id'], df['token_id']))
+        for utt_ids, ys in outputs[0]:
+            for utt_id, y in zip(utt_ids, ys):
+                assert y == list(map(int, token_ids[utt_id].split()))
+    assert len(os.listdir(str(tmpdir.join('cache')))) == 3  # manifest and label store
@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for epoch sampler."""
+
+import importlib
+import numpy as np
+
+
+def test_sequential():
+    module = importlib.import_module('neural_sp.datasets.sampler')
+    sampler = module.EpochSampler(seed=1)
+    sampler.set_order(np.arange(10)[::-1])
+    assert not sampler.bucketing
+    assert sampler.peek() == 9
+    assert sampler.take(4).tolist() == [9, 8, 7, 6]
+    assert sampler.n_remaining == 6
+
+    state = sampler.state_dict()
+    assert sampler.take(4).tolist() == [5, 4, 3, 2]
+    assert sampler.take(4).tolist() == [1, 0]
+    assert sampler.is_exhausted()
+
+    sampler.load_state_dict(state)
+    assert sampler.cursor == 4
+    assert sampler.take(4).tolist() == [5, 4, 3, 2]
+    sampler.skip()
+    assert sampler.is_exhausted()
+
+
+def test_buckets():
+    module = importlib.import_module('neural_sp.datasets.sampler')
+    sampler = module.EpochSampler(seed=1)
+    buckets = [[0, 1, 2], [3], [4, 5]]
+    sampler.set_buckets(buckets)
+    assert sampler.bucketing
+    assert sampler.n_buckets == 3
+    assert sampler.next_bucket().tolist() == [0, 1, 2]
+    assert sampler.cursor == 3
+
+    state = sampler.state_dict()
+    perm = sampler.permutation(10)
+    assert sampler.next_bucket().tolist() == [3]
+    assert sampler.next_bucket().tolist() == [4, 5]
+    assert sampler.is_exhausted()
+
+    sampler.load_state_dict(state)
+    assert np.array_equal(sampler.permutation(10), perm)  # RNG is restored
+    assert sampler.next_bucket().tolist() == [3]
+
+    shuffled = sampler.shuffle(buckets[:])
+    assert sorted(shuffled) == sorted(buckets)
+
+
+def test_seed():
+    module = importlib.import_module('neural_sp.datasets.sampler')
+    perms = [module.EpochSampler(seed=seed).permutation(100) for seed in [1, 1, 2]]
+    assert np.array_equal(perms[0], perms[1])
+    assert not np.array_equal(perms[0], perms[2])
+
+
+def test_shard():
+    module = importlib.import_module('neural_sp.datasets.sampler')
+    samplers = [module.EpochSampler(seed=1, rank=rank, world_size=3) for rank in range(3)]
+    indices = np.arange(10, 17)
+    shards = [sampler.shard(indices) for sampler in samplers]
+    assert sorted(np.concatenate(shards).tolist()) == indices.tolist()
+
+    # every process receives data from a small mini-batch
+    shards = [sampler.shard(np.array([5, 6])) for sampler in samplers]
+    assert [s.tolist() for s in shards] == [[5], [6], [5]]
+    assert module.EpochSampler(seed=1).shard(indices) is indices
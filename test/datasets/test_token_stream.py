@@ -0,0 +1,202 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for memory-mapped token stream for LM."""
+
+import codecs
+import importlib
+import numpy as np
+import os
+import pytest
+
+N_UTTS = 60
+
+
+def make_store():
+    module = importlib.import_module('neural_sp.datasets.label_store')
+    rng = np.random.RandomState(0)
+    token_ids = [' '.join(map(str, rng.randint(4, 10, size=rng.randint(1, 20)))) for _ in range(N_UTTS)]
+    return module.LabelStore.from_strings(token_ids)
+
+
+def write_dataset(tmpdir):
+    tsv_path = str(tmpdir.join('train.tsv'))
+    rng = np.random.RandomState(1)
+    with codecs.open(tsv_path, 'w', 'utf-8') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        for i in range(N_UTTS):
+            ylen = rng.randint(1, 20)
+            token_id = ' '.join(map(str, rng.randint(4, 10, size=ylen)))
+            f.write('\t'.join(['utt%03d' % i, 'spk', 'feats.ark:%d' % i,
+                               '100', '8', 'text%d' % i, token_id, str(ylen), '10']) + '\n')
+    dict_path = str(tmpdir.join('dict.txt'))
+    with codecs.open(dict_path, 'w', 'utf-8') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, 10):
+            f.write('%s %d\n' % (chr(ord('a') + i), i))
+    return tsv_path, dict_path
+
+
+@pytest.mark.parametrize("block_size", [1, 10, 50, 10000])
+def test_token_stream(tmpdir, block_size):
+    module = importlib.import_module('neural_sp.datasets.token_stream')
+    store = make_store()
+    rows = np.random.RandomState(1).permutation(N_UTTS)
+    concat_ids = store.concat(rows, sep=2)
+
+    stream = module.TokenStream.build(store, rows, 2, block_size, tmpdir=str(tmpdir))
+    assert len(tmpdir.listdir()) == 0  # removed after mapping
+    assert len(stream) == len(concat_ids)
+    assert np.array_equal(stream[np.arange(len(stream))], concat_ids)
+    if block_size == 10000:
+        assert stream.n_blocks == 1
+
+    # blocks are aligned with utterances
+    assert (concat_ids[stream.boundaries[:-1]] == 2).all()
+    lengths = np.diff(stream.boundaries)
+    assert (lengths[:-1] >= block_size).all()
+
+    # permuted stream
+    perm = np.random.RandomState(2).permutation(stream.n_blocks)
+    stream.permute(perm)
+    ref = np.concatenate([concat_ids[stream.boundaries[k]:stream.boundaries[k + 1]] for k in perm])
+    positions = np.random.RandomState(3).randint(0, len(stream), size=(4, 7))
+    assert np.array_equal(stream[positions], ref[positions])
+    assert stream[positions].dtype == np.int64
+
+    # the last separator is kept at the end
+    tokens = stream[np.arange(len(stream))]
+    assert np.array_equal(tokens[:-1], ref)
+    assert tokens[0] == tokens[-1] == 2
+    assert not ((tokens[1:] == 2) & (tokens[:-1] == 2)).any()
+    assert np.array_equal(np.bincount(tokens), np.bincount(concat_ids))
+
+
+def test_token_stream_cache(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.token_stream')
+    store = make_store()
+    rows = np.arange(N_UTTS)
+    path = str(tmpdir.join('train.stream.npy'))
+    stream = module.TokenStream.build(store, rows, 2, 10, path=path)
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['train.stream.boundaries.npy', 'train.stream.npy']
+    mtime = os.path.getmtime(path)
+
+    stream_cached = module.TokenStream.build(store, rows, 2, 10, path=path)
+    assert os.path.getmtime(path) == mtime
+    assert np.array_equal(stream_cached.boundaries, stream.boundaries)
+    assert np.array_equal(stream_cached[np.arange(len(stream))], store.concat(rows, sep=2))
+
+
+@pytest.mark.parametrize("backward", [False, True])
+def test_streaming_dataset(tmpdir, backward):
+    module = importlib.import_module('neural_sp.datasets.lm')
+    tsv_path, dict_path = write_dataset(tmpdir)
+    kwargs = dict(tsv_path=tsv_path, dict_path=dict_path, unit='char',
+                  batch_size=3, bptt=7, n_epochs=2, backward=backward)
+    dataset = module.Dataset(**kwargs)
+    dataset_stream = module.Dataset(streaming=True, stream_block_size=20, **kwargs)
+    assert len(dataset) == len(dataset_stream)
+
+    for (ys, is_new_epoch), (ys_stream, is_new_epoch_stream) in zip(dataset, dataset_stream):
+        assert np.array_equal(ys, ys_stream)
+        assert is_new_epoch == is_new_epoch_stream
+
+    # evaluation with a different batch size
+    dataset = module.Dataset(is_test=True, **kwargs)
+    dataset_stream = module.Dataset(is_test=True, streaming=True, **kwargs)
+    for _ in range(5):
+        assert np.array_equal(dataset.next(1, 5)[0], dataset_stream.next(1, 5)[0])
+
+
+def test_streaming_shuffle(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.lm')
+    tsv_path, dict_path = write_dataset(tmpdir)
+    dataset = module.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='char',
+                             batch_size=1, bptt=11, n_epochs=2, shuffle=True,
+                             streaming=True, stream_block_size=30)
+    epochs = [[]]
+    for ys, is_new_epoch in dataset:
+        epochs[-1].append(ys[0, :-1])
+        if is_new_epoch:
+            epochs[-1] = np.concatenate(epochs[-1] + [ys[0, -1:]])
+            epochs.append([])
+    epochs = epochs[:-1]
+    assert len(epochs) == 2
+    assert not np.array_equal(epochs[0], epochs[1])
+    # all tokens are seen in every epoch
+    for tokens in epochs:
+        assert np.array_equal(np.bincount(tokens, minlength=10), np.bincount(epochs[0], minlength=10))
+
+
+def test_streaming_cache(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.lm')
+    tsv_path, dict_path = write_dataset(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    kwargs = dict(tsv_path=tsv_path, dict_path=dict_path, unit='char', batch_size=3, bptt=7,
+                  n_epochs=1, streaming=True, stream_block_size=20)
+    outputs = [list(module.Dataset(**kwargs))]
+    for _ in range(2):
+        dataset = module.Dataset(manifest_cache_dir=cache_dir, **kwargs)
+        assert 'token_id' not in dataset.df.columns and 'text' not in dataset.df.columns
+        outputs.append(list(dataset))
+        # manifest, label store (tokens and offsets) and token stream (tokens and boundaries)
+        assert len(os.listdir(cache_dir)) == 5
+    for output in outputs[1:]:
+        for (ys, is_new_epoch), (ys_ref, is_new_epoch_ref) in zip(output, outputs[0]):
+            assert np.array_equal(ys, ys_ref)
+            assert is_new_epoch == is_new_epoch_ref
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_seed_and_resume(tmpdir, streaming):
+    module = importlib.import_module('neural_sp.datasets.lm')
+    tsv_path, dict_path = write_dataset(tmpdir)
+    kwargs = dict(tsv_path=tsv_path, dict_path=dict_path, unit='char', batch_size=2, bptt=10,
+                  n_epochs=3, shuffle=True, variable_bptt=True, seed=3,
+                  streaming=streaming, stream_block_size=20)
+    outputs = [ys for ys, _ in module.Dataset(**kwargs)]
+    np.random.seed(0)  # not affected by the global random state
+    assert all(np.array_equal(a, b) for a, b in zip(outputs, [ys for ys, _ in module.Dataset(**kwargs)]))
+
+    # resume from the middle of the 2nd epoch
+    dataset = module.Dataset(**kwargs)
+    n_steps = 0
+    while dataset.epoch < 1 or dataset.epoch_detail < 0.5:
+        next(dataset)
+        n_steps += 1
+    state = dataset.state_dict()
+    dataset_resumed = module.Dataset(**dict(kwargs, seed=4))
+    dataset_resumed.load_state_dict(state)
+    outputs_resumed = [ys for ys, _ in dataset_resumed]
+    assert len(outputs_resumed) == len(outputs) - n_steps
+    assert all(np.array_equal(a, b) for a, b in zip(outputs[n_steps:], outputs_resumed))
+
+
+def test_variable_bptt(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.lm')
+    tsv_path, dict_path = write_dataset(tmpdir)
+    dataset = module.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='char',
+                             batch_size=2, bptt=20, n_epochs=1, variable_bptt=True,
+                             streaming=True)
+    widths = [ys.shape[1] for ys, _ in dataset]
+    assert len(set(widths)) > 1
+    assert min(widths) >= 2
+
+    # fixed length if specified
+    dataset.epoch = 0
+    assert dataset.next(bptt=5)[0].shape[1] == 5
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_distributed(tmpdir, streaming):
+    module = importlib.import_module('neural_sp.datasets.lm')
+    tsv_path, dict_path = write_dataset(tmpdir)
+    kwargs = dict(tsv_path=tsv_path, dict_path=dict_path, unit='char',
+                  batch_size=4, bptt=7, n_epochs=1, streaming=streaming)
+    outputs = list(module.Dataset(**kwargs))
+    outputs_ranks = [list(module.Dataset(rank=rank, world_size=2, **kwargs)) for rank in range(2)]
+    assert len(outputs_ranks[0]) == len(outputs_ranks[1]) == len(outputs)
+    for (ys, is_new_epoch), (ys_0, is_new_epoch_0), (ys_1, is_new_epoch_1) in zip(outputs, *outputs_ranks):
+        assert np.array_equal(ys[0::2], ys_0)
+        assert np.array_equal(ys[1::2], ys_1)
+        assert is_new_epoch == is_new_epoch_0 == is_new_epoch_1
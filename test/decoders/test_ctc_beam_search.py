@@ -0,0 +1,175 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for batched CTC prefix beam search."""
+
+import argparse
+import importlib
+import itertools
+import numpy as np
+import pytest
+import torch
+
+VOCAB = 5
+BLANK = 0
+EOS = 2
+
+
+def make_log_probs(xlens, vocab=VOCAB, seed=1):
+    torch.manual_seed(seed)
+    return torch.log_softmax(torch.randn(len(xlens), max(xlens), vocab) * 2, dim=-1)
+
+
+def make_lm(lm_type):
+    if lm_type == 'lstm':
+        args = dict(lm_type='lstm', n_units=16, n_projs=0, n_layers=2, residual=False,
+                    use_glu=False, n_units_null_context=0, bottleneck_dim=16, emb_dim=16,
+                    vocab=VOCAB, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+                    param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+        module = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module.RNNLM(argparse.Namespace(**args))
+    else:
+        args = dict(lm_type='transformer', transformer_attn_type='scaled_dot', transformer_n_heads=2,
+                    n_layers=2, transformer_d_model=16, transformer_d_ff=32, transformer_layer_norm_eps=1e-12,
+                    transformer_ffn_activation='relu', transformer_pe_type='add', vocab=VOCAB,
+                    dropout_in=0.1, dropout_hidden=0.1, dropout_att=0.1, dropout_layer=0.0, lsm_prob=0.0,
+                    transformer_param_init='xavier_uniform', mem_len=0, recog_mem_len=0,
+                    adaptive_softmax=False, tie_embedding=False)
+        module = importlib.import_module('neural_sp.models.lm.transformerlm')
+        lm = module.TransformerLM(argparse.Namespace(**args))
+    lm.eval()
+    return lm
+
+
+def ctc_marginals(log_probs):
+    """Exact log probabilities of all label sequences by enumerating paths."""
+    xlen, vocab = log_probs.shape
+    marginals = {}
+    for path in itertools.product(range(vocab), repeat=xlen):
+        labels = tuple(k for k, _ in itertools.groupby(path) if k != BLANK)
+        score = sum(log_probs[t, k] for t, k in enumerate(path))
+        marginals[labels] = np.logaddexp(marginals.get(labels, -np.inf), score)
+    return marginals
+
+
+def lm_score(lm, labels):
+    ys = torch.LongTensor([[EOS] + list(labels)])
+    _, _, log_probs = lm.predict(ys, None)
+    return sum(log_probs[0, i, y].item() for i, y in enumerate(labels))
+
+
+def prefix_beam_search_ref(log_probs, beam_width, lp_weight=0.):
+    """Per-utterance prefix beam search with dictionaries."""
+    vocab = log_probs.shape[1]
+    K = min(beam_width, vocab - 1)
+    beam = {(): (0., -np.inf)}
+    for lp in log_probs:
+        topk_ids = [k for k in np.argsort(-lp) if k != BLANK][:K]
+        new_beam = {}
+
+        def add(prefix, p_b, p_nb):
+            p_b_prev, p_nb_prev = new_beam.get(prefix, (-np.inf, -np.inf))
+            new_beam[prefix] = (np.logaddexp(p_b_prev, p_b), np.logaddexp(p_nb_prev, p_nb))
+
+        for prefix, (p_b, p_nb) in beam.items():
+            add(prefix, np.logaddexp(p_b, p_nb) + lp[BLANK],
+                p_nb + lp[prefix[-1]] if len(prefix) > 0 else -np.inf)
+            for c in range(vocab):
+                if c == BLANK:
+                    continue
+                prefix_new = prefix + (c,)
+                if c not in topk_ids and prefix_new not in beam:
+                    continue
+                p = p_b + lp[c] if len(prefix) > 0 and c == prefix[-1] else np.logaddexp(p_b, p_nb) + lp[c]
+                add(prefix_new, -np.inf, p)
+        beam = dict(sorted(new_beam.items(),
+                           key=lambda x: np.logaddexp(*x[1]) + len(x[0]) * lp_weight, reverse=True)[:beam_width])
+    return [(list(prefix), np.logaddexp(*p)) for prefix, p in beam.items()]
+
+
+@pytest.mark.parametrize("xlen", [1, 2, 3])
+def test_exact(xlen):
+    """Exhaustive beam search gives exact CTC probabilities of all label sequences."""
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    log_probs = make_log_probs([xlen])
+    end_hyps = module.ctc_prefix_beam_search(log_probs, [xlen], BLANK, EOS, beam_width=128)[0]
+
+    marginals = ctc_marginals(log_probs[0].numpy().astype(np.float64))
+    assert len(end_hyps) == len(marginals)
+    for hyp in end_hyps:
+        assert hyp['hyp'][0] == hyp['hyp'][-1] == EOS
+        assert np.allclose(hyp['score_ctc'], marginals[tuple(hyp['hyp'][1:-1])], atol=1e-4)
+    assert tuple(end_hyps[0]['hyp'][1:-1]) == max(marginals, key=marginals.get)
+
+
+@pytest.mark.parametrize(
+    "xlens, beam_width, lp_weight",
+    [
+        ([20], 1, 0.),
+        ([20], 4, 0.),
+        ([20, 13, 7, 1], 4, 0.),
+        ([20, 13, 7, 1], 8, 0.5),
+        ([9, 20], 3, 0.),
+    ]
+)
+def test_batch(xlens, beam_width, lp_weight):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    log_probs = make_log_probs(xlens, vocab=8)
+    end_hyps = module.ctc_prefix_beam_search(log_probs, xlens, BLANK, EOS, beam_width, lp_weight)
+    assert len(end_hyps) == len(xlens)
+
+    for b, xlen in enumerate(xlens):
+        # independent of the other utterances in the mini-batch
+        end_hyps_b = module.ctc_prefix_beam_search(log_probs[b:b + 1, :xlen], [xlen], BLANK, EOS,
+                                                   beam_width, lp_weight)[0]
+        assert [h['hyp'] for h in end_hyps[b]] == [h['hyp'] for h in end_hyps_b]
+        assert np.allclose([h['score'] for h in end_hyps[b]], [h['score'] for h in end_hyps_b], atol=1e-5)
+
+        # same as the reference implementation
+        ref = prefix_beam_search_ref(log_probs[b, :xlen].numpy().astype(np.float64), beam_width, lp_weight)
+        ref = {tuple(prefix): score for prefix, score in ref}
+        assert len(end_hyps[b]) == len(ref)
+        for hyp in end_hyps[b]:
+            assert np.allclose(hyp['score_ctc'], ref[tuple(hyp['hyp'][1:-1])], atol=1e-4)
+
+        # no duplicated prefixes
+        assert len(set(tuple(h['hyp']) for h in end_hyps[b])) == len(end_hyps[b])
+
+
+@pytest.mark.parametrize("lm_type", ['lstm', 'transformer'])
+def test_shallow_fusion(lm_type):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    torch.manual_seed(0)
+    lm = make_lm(lm_type)
+    xlens = [3, 2]
+    log_probs = make_log_probs(xlens)
+    lm_weight = 0.3
+    with torch.no_grad():
+        end_hyps = module.ctc_prefix_beam_search(log_probs, xlens, BLANK, EOS, beam_width=128,
+                                                 lm=lm, lm_weight=lm_weight)
+        for b, xlen in enumerate(xlens):
+            marginals = ctc_marginals(log_probs[b, :xlen].numpy().astype(np.float64))
+            assert len(end_hyps[b]) == len(marginals)
+            for hyp in end_hyps[b]:
+                labels = tuple(hyp['hyp'][1:-1])
+                assert np.allclose(hyp['score_ctc'], marginals[labels], atol=1e-4)
+                assert np.allclose(hyp['score_lm'], lm_score(lm, labels), atol=1e-4)
+                assert np.allclose(hyp['score'], hyp['score_ctc'] + hyp['score_lm'] * lm_weight, atol=1e-4)
+
+
+@pytest.mark.parametrize("lm_type", ['lstm', 'transformer'])
+def test_shallow_fusion_batch(lm_type):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    torch.manual_seed(0)
+    lm = make_lm(lm_type)
+    xlens = [15, 9, 12]
+    log_probs = make_log_probs(xlens)
+    with torch.no_grad():
+        end_hyps = module.ctc_prefix_beam_search(log_probs, xlens, BLANK, EOS, beam_width=3,
+                                                 lm=lm, lm_weight=0.5)
+        for b, xlen in enumerate(xlens):
+            end_hyps_b = module.ctc_prefix_beam_search(log_probs[b:b + 1, :xlen], [xlen], BLANK, EOS,
+                                                       beam_width=3, lm=lm, lm_weight=0.5)[0]
+            assert [h['hyp'] for h in end_hyps[b]] == [h['hyp'] for h in end_hyps_b]
+            for hyp in end_hyps[b]:
+                assert np.allclose(hyp['score_lm'], lm_score(lm, hyp['hyp'][1:-1]), atol=1e-4)
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for batched CTC greedy decoding."""
+
+import importlib
+from itertools import groupby
+import numpy as np
+import pytest
+import torch
+
+VOCAB = 6
+BLANK = 0
+
+
+def reference(log_probs, elens, blank):
+    """Collapse repeated labels and remove blanks frame by frame."""
+    best_paths = log_probs.argmax(-1)
+    hyps, timestamps = [], []
+    for b in range(log_probs.size(0)):
+        indices = [best_paths[b, t].item() for t in range(elens[b])]
+        hyp, frames = [], []
+        t = 0
+        for k, group in groupby(indices):
+            if k != blank:
+                hyp.append(k)
+                frames.append(t)
+            t += len(list(group))
+        hyps.append(hyp)
+        timestamps.append(frames)
+    return hyps, timestamps
+
+
+@pytest.mark.parametrize(
+    "xlens, elens_type",
+    [
+        ([20], 'list'),
+        ([20, 15, 7, 1], 'list'),
+        ([20, 15, 7, 1], 'np'),
+        ([20, 15, 7, 1], 'tensor'),
+        ([1, 30, 30], 'list'),
+    ]
+)
+def test_decoding(xlens, elens_type):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+
+    torch.manual_seed(1)
+    log_probs = torch.log_softmax(torch.randn(len(xlens), max(xlens), VOCAB), dim=-1)
+    # long runs of repeated labels
+    log_probs = log_probs.repeat_interleave(2, dim=1)[:, :max(xlens)]
+    elens = xlens
+    if elens_type == 'np':
+        elens = np.array(xlens, dtype=np.int32)
+    elif elens_type == 'tensor':
+        elens = torch.IntTensor(xlens)
+
+    hyps_ref, timestamps_ref = reference(log_probs, xlens, BLANK)
+    hyps = module.ctc_greedy_decode(log_probs, elens, BLANK)
+    assert len(hyps) == len(xlens)
+    for hyp, hyp_ref in zip(hyps, hyps_ref):
+        assert hyp.tolist() == hyp_ref
+
+    hyps, timestamps = module.ctc_greedy_decode(log_probs, elens, BLANK, return_timestamps=True)
+    for hyp, hyp_ref, frames, frames_ref in zip(hyps, hyps_ref, timestamps, timestamps_ref):
+        assert hyp.tolist() == hyp_ref
+        assert frames.tolist() == frames_ref
+
+
+def test_blank_only():
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+
+    log_probs = torch.full((2, 5, VOCAB), -10.)
+    log_probs[:, :, BLANK] = 0.
+    log_probs[1, 4, 3] = 1.  # beyond the length
+    hyps, timestamps = module.ctc_greedy_decode(log_probs, [5, 4], BLANK, return_timestamps=True)
+    assert [len(hyp) for hyp in hyps] == [0, 0]
+    assert [len(frames) for frames in timestamps] == [0, 0]
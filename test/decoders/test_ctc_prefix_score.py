@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for batched CTC prefix scorer."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+VOCAB = 12
+BLANK = 0
+EOS = 2
+
+
+def make_inputs(xlens):
+    torch.manual_seed(1)
+    log_probs = torch.log_softmax(torch.randn(len(xlens), max(xlens), VOCAB) * 3, dim=-1)
+    return log_probs
+
+
+def assert_close(ref, hyp, log0):
+    # both must agree on infeasible labels
+    mask = ref > log0 / 2
+    assert ((hyp > log0 / 2) == mask).all()
+    assert np.allclose(ref[mask], hyp[mask], atol=1e-3)
+
+
+@pytest.mark.parametrize(
+    "xlens, backward",
+    [
+        ([40], False),
+        ([40, 31, 25], False),
+        ([40, 31, 25], True),
+    ]
+)
+def test_prefix_score(xlens, backward):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    log_probs = make_inputs(xlens)
+    scorer = module.CTCPrefixScoreTH(log_probs, xlens, BLANK, EOS, backward=backward)
+
+    bs = len(xlens)
+    index = torch.arange(bs)
+    cs = torch.LongTensor([[1, 3, 4, 5, EOS, BLANK, 6, 7]]).repeat([bs, 1])
+    r_th = scorer.initial_state(index)
+    assert r_th.size() == (bs, max(xlens), 2)
+
+    scorers_ref, r_ref = [], []
+    for b in range(bs):
+        log_probs_b = log_probs[b, :xlens[b]].numpy()
+        scorers_ref.append(module.CTCPrefixScore(log_probs_b[::-1] if backward else log_probs_b, BLANK, EOS))
+        r_ref.append(scorers_ref[b].initial_state())
+
+    ys = torch.LongTensor([[EOS]] * bs)
+    for step in range(6):
+        log_psi, states = scorer(ys, cs, r_th, index=index)
+        assert log_psi.size() == (bs, cs.size(1))
+        assert states.size() == (bs, cs.size(1), max(xlens), 2)
+
+        # alternately repeat the last label and emit a new label
+        k = 6 if step % 2 == 0 else 0
+        for b in range(bs):
+            log_psi_ref, states_ref = scorers_ref[b](ys[b].tolist(), cs[b].numpy(), r_ref[b])
+            assert_close(log_psi_ref, log_psi[b].numpy(), module.LOG_0)
+            r_ref[b] = states_ref[k]
+        r_th = states[:, k]
+        ys = torch.cat([ys, cs[:, k:k + 1]], dim=1)
+        cs[:, 6] = cs[:, k]
+
+
+def test_chunk():
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    log_probs = make_inputs([30])
+    chunk_size = 10
+
+    scorer_ref = module.CTCPrefixScore(log_probs[0, :chunk_size].numpy(), BLANK, EOS)
+    scorer = module.CTCPrefixScoreTH(log_probs[:, :chunk_size], [chunk_size], BLANK, EOS)
+    _, states_ref = scorer_ref([EOS], np.array([3]), scorer_ref.initial_state())
+    _, states = scorer([[EOS]], torch.LongTensor([[3]]), scorer.initial_state())
+
+    cs = np.array([1, 3, 4, EOS])
+    for c in range(1, 3):
+        scorer_ref.register_new_chunk(log_probs[0, c * chunk_size:(c + 1) * chunk_size].numpy())
+        scorer.extend(log_probs[:, c * chunk_size:(c + 1) * chunk_size])
+    # states computed on the first chunk are extended to the new frames
+    log_psi_ref, _ = scorer_ref([EOS, 3], cs, states_ref[0], new_chunk=True)
+    log_psi, states_new = scorer([[EOS, 3]], torch.from_numpy(cs).unsqueeze(0), states[:, 0])
+    assert states_new.size() == (1, len(cs), 3 * chunk_size, 2)
+    assert_close(log_psi_ref, log_psi[0].numpy(), module.LOG_0)
+
+
+@pytest.mark.parametrize("margin", [3, 100])
+def test_window(margin):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    xlens = [40, 31]
+    log_probs = make_inputs(xlens)
+    scorer = module.CTCPrefixScoreTH(log_probs, xlens, BLANK, EOS, margin=margin)
+    scorer_full = module.CTCPrefixScoreTH(log_probs, xlens, BLANK, EOS)
+
+    index = torch.arange(len(xlens))
+    ys = torch.LongTensor([[EOS, 3], [EOS, 4]])
+    cs = torch.LongTensor([[1, 3, 5], [4, 5, 6]])
+    r_prev = scorer_full([[EOS]] * 2, ys[:, 1:], scorer_full.initial_state(index), index=index)[1][:, 0]
+    peaks = torch.LongTensor([10, 20])
+    log_psi, states = scorer(ys, cs, r_prev, index=index, peaks=peaks)
+    log_psi_full, _ = scorer_full(ys, cs, r_prev, index=index)
+    if margin >= max(xlens):
+        assert torch.allclose(log_psi, log_psi_full)
+    else:
+        # prefix probabilities are accumulated over a subset of frames
+        assert (log_psi <= log_psi_full + 1e-4).all()
+        assert (states[0, :, peaks[0] + margin + 1:] == module.LOG_0).all()
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+def test_long_input(dtype):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    xlen = 1500
+    torch.manual_seed(1)
+    logits = torch.randn(1, xlen, VOCAB) * 10
+    logits[:, :, BLANK] += 10  # peaky posteriors dominated by blank
+    log_probs = torch.log_softmax(logits, dim=-1).to(dtype)
+    scorer = module.CTCPrefixScoreTH(log_probs, [xlen], BLANK, EOS)
+    # reference in double precision
+    scorer_ref = module.CTCPrefixScore(log_probs[0].double().numpy(), BLANK, EOS)
+
+    cs = torch.LongTensor([[1, 3, EOS, 5, 6, 7]])
+    r_th = scorer.initial_state()
+    r_ref = scorer_ref.initial_state()
+    ys = [EOS]
+    for step in range(10):
+        log_psi, states = scorer([ys], cs, r_th)
+        assert log_psi.dtype == dtype
+        log_psi_ref, states_ref = scorer_ref(ys, cs[0].numpy(), r_ref)
+        mask = log_psi_ref > module.LOG_0 / 2
+        # errors must not be accumulated over frames beyond the output precision
+        rtol = 2 * torch.finfo(dtype).eps
+        assert np.allclose(log_psi_ref[mask], log_psi[0].double().numpy()[mask], rtol=rtol, atol=1e-6)
+
+        k = [0, 1, 3][step % 3]
+        r_th = states[:, k]
+        r_ref = states_ref[k]
+        ys = ys + [cs[0, k].item()]
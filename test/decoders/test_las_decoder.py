@@ -169,6 +169,7 @@ def make_decode_params(**kwargs):
         recog_batch_size=1,
         recog_beam_width=1,
         recog_ctc_weight=0.0,
+        recog_ctc_window=0,
         recog_lm_weight=0.0,
         recog_lm_second_weight=0.0,
         recog_lm_bwd_weight=0.0,
@@ -229,6 +230,7 @@ def make_args_rnnlm(**kwargs):
         (False, '', {'recog_beam_width': 4, 'nbest': 4}),
         (False, '', {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (False, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (False, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_ctc_window': 5}),
         # length penalty
         (False, '', {'recog_length_penalty': 0.1}),
         (False, '', {'recog_length_penalty': 0.1, 'recog_gnmt_decoding': True}),
@@ -256,6 +258,7 @@ def make_args_rnnlm(**kwargs):
         (True, '', {'recog_beam_width': 4, 'nbest': 4}),
         (True, '', {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (True, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (True, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_ctc_window': 5}),
         # length penalty
         (True, '', {'recog_length_penalty': 0.1}),
         (True, '', {'recog_length_penalty': 0.1, 'recog_gnmt_decoding': True}),
@@ -372,3 +375,115 @@ def test_decoding(backward, lm_fusion, params):
             assert isinstance(scores, list)
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
+
+
+@pytest.mark.parametrize(
+    "args, params",
+    [
+        ({}, {'recog_beam_width': 4}),
+        ({}, {'recog_beam_width': 4, 'exclude_eos': True}),
+        ({}, {'recog_beam_width': 4, 'nbest': 4}),
+        ({}, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_max_len_ratio': 0.3}),
+        ({}, {'recog_beam_width': 4, 'recog_length_penalty': 0.1}),
+        ({}, {'recog_beam_width': 4, 'recog_length_penalty': 0.1, 'recog_gnmt_decoding': True}),
+        ({}, {'recog_beam_width': 4, 'recog_length_norm': True}),
+        ({}, {'recog_beam_width': 4, 'recog_coverage_penalty': 0.1}),
+        ({}, {'recog_beam_width': 4, 'recog_lm_weight': 0.1}),
+        ({'attn_type': 'add', 'attn_n_heads': 4}, {'recog_beam_width': 4}),
+        ({'backward': True}, {'recog_beam_width': 4, 'nbest': 2}),
+        ({'replace_sos': True}, {'recog_beam_width': 4}),
+    ]
+)
+def test_decoding_batch(args, params):
+    args = make_args(**args)
+    params = make_decode_params(**params)
+
+    elens = [40, 33, 25, 38]
+    batch_size = len(elens)
+    device = "cpu"
+
+    eouts = pad_list([np2tensor(np.random.randn(elen, ENC_N_UNITS).astype(np.float32), device)
+                      for elen in elens], 0.)
+    elens = torch.IntTensor(elens)
+    ctc_log_probs = None
+    if params['recog_ctc_weight'] > 0:
+        ctc_log_probs = torch.log_softmax(torch.randn(batch_size, eouts.size(1), VOCAB), dim=-1)
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        module = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module.RNNLM(make_args_rnnlm()).to(device)
+    refs_id = None
+    if args['replace_sos']:
+        # a different special token (e.g., language ID) for each utterance
+        refs_id = [[VOCAB - 1 - b, 4, 5] for b in range(batch_size)]
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec = dec.to(device)
+
+    # record inputs to the embedding layer
+    ys_in = []
+    dec.embed.register_forward_hook(lambda module, inputs, outputs: ys_in.append(inputs[0].clone()))
+    # record batch sizes of inputs to the key projection
+    key_bs = []
+    if hasattr(dec.score, 'w_key'):
+        dec.score.w_key.register_forward_hook(lambda module, inputs, outputs: key_bs.append(inputs[0].size(0)))
+
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps, aws, scores = dec.beam_search_batch(
+            eouts, elens, params, idx2token=None, lm=lm,
+            ctc_log_probs=ctc_log_probs,
+            nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+            refs_id=refs_id)
+        assert len(nbest_hyps) == batch_size
+        # encoder outputs are projected once per utterance, not per hypothesis
+        assert all(n == batch_size for n in key_bs)
+        if refs_id is not None:
+            # each hypothesis starts from the special token of its utterance
+            sos = [refs_id[b][0] for b in range(batch_size) for _ in range(params['recog_beam_width'])]
+            assert ys_in[0].view(-1).tolist() == sos
+
+        # must be identical to utterance-level beam search
+        for b in range(batch_size):
+            elen = elens[b].item()
+            nbest_hyps_b, aws_b, scores_b = dec.beam_search(
+                eouts[b:b + 1, :elen], elens[b:b + 1], params, idx2token=None, lm=lm,
+                ctc_log_probs=ctc_log_probs[b:b + 1, :elen] if ctc_log_probs is not None else None,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                refs_id=refs_id[b:b + 1] if refs_id is not None else None)
+            assert len(nbest_hyps[b]) == params['nbest']
+            for n in range(params['nbest']):
+                # NOTE: compare scores since hypotheses can be swapped by numerical ties
+                assert abs(scores[b][n] - scores_b[0][n]) < 1e-3
+            assert aws[b][0].shape == (aws_b[0][0].shape[0], len(nbest_hyps[b][0]), elen)
+
+
+@pytest.mark.parametrize(
+    "backward, params",
+    [
+        (False, {'recog_beam_width': 4, 'nbest': 4}),
+        (True, {'recog_beam_width': 4, 'nbest': 4}),
+        (False, {'recog_beam_width': 2, 'nbest': 2, 'exclude_eos': True}),
+    ]
+)
+def test_decoding_batch_short_input(backward, params):
+    args = make_args(backward=backward)
+    params = make_decode_params(**params)
+
+    elens = [1, 1, 20]
+    eouts = pad_list([np2tensor(np.random.randn(elen, ENC_N_UNITS).astype(np.float32), "cpu")
+                      for elen in elens], 0.)
+    elens = torch.IntTensor(elens)
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        # fewer hypotheses than nbest can be found
+        nbest_hyps, aws, scores = dec.beam_search_batch(
+            eouts, elens, params, idx2token=None,
+            nbest=params['nbest'], exclude_eos=params['exclude_eos'])
+    assert len(nbest_hyps) == len(elens)
+    for b in range(len(elens)):
+        assert 1 <= len(nbest_hyps[b]) <= params['nbest']
+        assert len(nbest_hyps[b]) == len(aws[b]) == len(scores[b])
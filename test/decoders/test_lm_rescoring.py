@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for batched N-best LM rescoring."""
+
+import argparse
+import importlib
+import pytest
+import torch
+
+VOCAB = 8
+EOS = 2
+
+
+def make_lm(lm_type):
+    if lm_type == 'lstm':
+        args = dict(lm_type='lstm', n_units=16, n_projs=0, n_layers=2, residual=False,
+                    use_glu=False, n_units_null_context=0, bottleneck_dim=16, emb_dim=16,
+                    vocab=VOCAB, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+                    param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+        module = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module.RNNLM(argparse.Namespace(**args))
+    else:
+        args = dict(lm_type='transformer', transformer_attn_type='scaled_dot', transformer_n_heads=2,
+                    n_layers=2, transformer_d_model=16, transformer_d_ff=32, transformer_layer_norm_eps=1e-12,
+                    transformer_ffn_activation='relu', transformer_pe_type='add', vocab=VOCAB,
+                    dropout_in=0.1, dropout_hidden=0.1, dropout_att=0.1, dropout_layer=0.0, lsm_prob=0.0,
+                    transformer_param_init='xavier_uniform', mem_len=0, recog_mem_len=0,
+                    adaptive_softmax=False, tie_embedding=False)
+        module = importlib.import_module('neural_sp.models.lm.transformerlm')
+        lm = module.TransformerLM(argparse.Namespace(**args))
+    lm.eval()
+    return lm
+
+
+def reference(lm, seq):
+    """Score a hypothesis alone."""
+    if len(seq) <= 1:
+        return 0.
+    ys = torch.tensor([seq], dtype=torch.int64)
+    _, _, log_probs = lm.predict(ys[:, :-1], None)
+    return sum(log_probs[0, t, seq[t + 1]].item() for t in range(len(seq) - 1)) / (len(seq) - 1)
+
+
+SEQS = [
+    [EOS, 3, 4, 5, EOS],
+    [EOS, 3, 4, 5],  # prefix of the above
+    [EOS, 3, 4, 6, 7, 3, EOS],  # shared prefix
+    [EOS, 3, 4, 5, EOS],  # duplicate
+    [EOS],  # empty
+    [EOS, 7],
+    [EOS, 1, 1, 1, 1, 1, 1, 1, 1, EOS],
+]
+
+
+def test_prefix_trie():
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.lm_rescoring')
+
+    seqs = [seq for seq in SEQS if len(seq) > 1]
+    parents, tokens, levels, is_leaf, ends = module._build_prefix_trie(seqs)
+    # one node per distinct prefix (and the root)
+    prefixes = set(tuple(seq[:i]) for seq in seqs for i in range(1, len(seq) + 1))
+    assert len(tokens) == len(prefixes) + 1
+    for seq, node in zip(seqs, ends):
+        path = []
+        while node > 0:
+            path.append(tokens[node])
+            node = parents[node]
+        assert path[::-1] == seq
+    for depth, nodes in enumerate(levels[1:], 1):
+        for node in nodes:
+            assert levels[depth - 1].count(parents[node]) == 1
+    assert sum(is_leaf) == 4
+
+
+@pytest.mark.parametrize("lm_type", ['lstm', 'transformer'])
+@pytest.mark.parametrize("batch_size", [0, 1, 3])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_score_sequences(lm_type, batch_size, reverse):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.lm_rescoring')
+
+    torch.manual_seed(1)
+    lm = make_lm(lm_type)
+    seqs = [seq[::-1] if reverse else seq for seq in SEQS]
+
+    # count the number of new positions computed by the LM
+    n_computed = [0]
+    predict = lm.predict
+
+    def predict_counted(ys, state, cache=None):
+        n_computed[0] += ys.size(0) * (ys.size(1) if cache is None else 1)
+        return predict(ys, state, cache=cache)
+    lm.predict = predict_counted
+
+    with torch.no_grad():
+        scores = module.score_sequences(lm, seqs, torch.device('cpu'), batch_size=batch_size)
+        lm.predict = predict
+        scores_ref = [reference(lm, seq) for seq in seqs]
+    assert len(scores) == len(seqs)
+    for score, score_ref in zip(scores, scores_ref):
+        assert abs(score - score_ref) < 1e-5
+    assert scores[0] == scores[3]
+    assert scores[4] == 0.
+
+    # each shared prefix is computed only once
+    prefixes = set(tuple(seq[:i]) for seq in seqs for i in range(1, len(seq)))
+    assert n_computed[0] == len(prefixes)
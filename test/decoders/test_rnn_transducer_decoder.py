@@ -4,6 +4,7 @@
 """Test for RNN Transducer."""
 
 import argparse
+from collections import OrderedDict
 import importlib
 import numpy as np
 import pytest
@@ -88,11 +89,13 @@ def make_decode_params(**kwargs):
         recog_batch_size=1,
         recog_beam_width=1,
         recog_ctc_weight=0.0,
+        recog_ctc_window=0,
         recog_lm_weight=0.0,
         recog_lm_second_weight=0.0,
         recog_lm_bwd_weight=0.0,
         recog_max_len_ratio=1.0,
         recog_lm_state_carry_over=False,
+        recog_max_symbols_per_frame=3,
         nbest=1,
     )
     args.update(kwargs)
@@ -133,6 +136,7 @@ def make_args_rnnlm(**kwargs):
         ({'recog_beam_width': 4, 'nbest': 2}),
         ({'recog_beam_width': 4, 'nbest': 4}),
         ({'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        ({'recog_beam_width': 4, 'recog_max_symbols_per_frame': 1}),
         # shallow fusion
         ({'recog_beam_width': 4, 'recog_lm_weight': 0.1}),
         # rescoring
@@ -203,3 +207,122 @@ def test_decoding(params):
             assert len(nbest_hyps[0]) == params['nbest']
             assert aws is None
             assert scores is None
+
+
+@pytest.mark.parametrize(
+    "rnn_type, params",
+    [
+        ('lstm_transducer', {'recog_beam_width': 4}),
+        ('gru_transducer', {'recog_beam_width': 4}),
+        ('lstm_transducer', {'recog_beam_width': 4, 'recog_max_symbols_per_frame': 1}),
+        ('lstm_transducer', {'recog_beam_width': 8, 'nbest': 4}),
+        ('lstm_transducer', {'recog_beam_width': 4, 'recog_lm_weight': 0.1}),
+    ]
+)
+def test_beam_search_cache(rnn_type, params):
+    args = make_args(rnn_type=rnn_type, ctc_weight=0.0)
+    params = make_decode_params(**params)
+    emax = 20
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        module_lm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_lm.RNNLM(make_args_rnnlm())
+        lm.eval()
+
+    # count the number of prefixes computed by the prediction network
+    n_computed = [0]
+    recurrency = dec.recurrency
+    stored = []
+    store_cache = dec._store_cache
+    n_evicted = [0]
+    prune_cache = dec._prune_cache
+
+    def recurrency_counted(ys_emb, dstate):
+        n_computed[0] += ys_emb.size(0)
+        return recurrency(ys_emb, dstate)
+
+    def store_cache_logged(prefixes, *args):
+        stored.extend(prefixes)
+        return store_cache(prefixes, *args)
+
+    def prune_cache_checked(prefixes, max_sym):
+        n_cached = len(dec.state_cache)
+        prune_cache(prefixes, max_sym)
+        n_evicted[0] += n_cached - len(dec.state_cache)
+        for prefix in prefixes:
+            assert prefix in dec.state_cache
+        # every remaining prefix extends a hypothesis in the beam by up to max_sym labels
+        for prefix in dec.state_cache:
+            assert any(prefix[:len(prefix) - i] in prefixes for i in range(max_sym + 1))
+    dec.recurrency = recurrency_counted
+    dec._store_cache = store_cache_logged
+    dec._prune_cache = prune_cache_checked
+
+    eouts = torch.randn(1, emax, ENC_N_UNITS)
+    elens = torch.IntTensor([emax])
+    with torch.no_grad():
+        nbest_hyps, _, _ = dec.beam_search(eouts, elens, params, lm=lm, nbest=params['nbest'])
+    assert len(nbest_hyps[0]) == params['nbest']
+    for hyp in nbest_hyps[0]:
+        assert len(hyp) <= emax * params['recog_max_symbols_per_frame']
+
+    # each prefix is computed only once
+    assert n_computed[0] == len(stored)
+    assert len(set(stored)) == len(stored)
+
+    # evicted prefixes are never computed again
+    assert len(dec.state_cache) + n_evicted[0] == len(stored)
+
+    # cached outputs are identical to those computed from scratch
+    with torch.no_grad():
+        for prefix, cache in dec.state_cache.items():
+            ys = torch.LongTensor([prefix])
+            dout, _ = recurrency(dec.embed(ys), None)
+            assert torch.allclose(cache['dout'], dout[0, -1], atol=1e-5)
+            if lm is not None:
+                _, _, scores_lm = lm.predict(ys, None)
+                assert torch.allclose(cache['lm_scores'], scores_lm[0, -1], atol=1e-5)
+
+
+def test_prune_cache():
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**make_args(ctc_weight=0.0))
+
+    prefixes = [(2,), (2, 4), (2, 5), (2, 4, 6), (2, 4, 6, 7), (2, 4, 6, 7, 8), (2, 5, 9), (2, 5, 9, 4)]
+    dec.state_cache = OrderedDict((prefix, {}) for prefix in prefixes)
+    dec._prune_cache([(2, 4), (2, 4, 6)], max_sym=2)
+    assert list(dec.state_cache) == [(2, 4), (2, 4, 6), (2, 4, 6, 7), (2, 4, 6, 7, 8)]
+    dec._prune_cache([(2, 4, 6, 7)], max_sym=1)
+    assert list(dec.state_cache) == [(2, 4, 6, 7), (2, 4, 6, 7, 8)]
+    dec._prune_cache([(2, 4, 6, 7, 8)], max_sym=0)
+    assert list(dec.state_cache) == [(2, 4, 6, 7, 8)]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        ({'recog_beam_width': 4, 'nbest': 4}),
+        ({'recog_beam_width': 4, 'nbest': 4, 'recog_max_symbols_per_frame': 0}),
+        ({'recog_beam_width': 2, 'nbest': 2, 'recog_max_symbols_per_frame': 0}),
+    ]
+)
+def test_beam_search_short_input(params):
+    args = make_args(ctc_weight=0.0)
+    params = make_decode_params(**params)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+
+    # fewer hypotheses than nbest can be found for a one-frame input (or without label emission)
+    eouts = torch.randn(3, 20, ENC_N_UNITS)
+    elens = torch.IntTensor([1, 1, 20])
+    with torch.no_grad():
+        nbest_hyps, _, _ = dec.beam_search(eouts, elens, params, nbest=params['nbest'])
+    assert len(nbest_hyps) == 3
+    for hyps in nbest_hyps:
+        assert 1 <= len(hyps) <= params['nbest']
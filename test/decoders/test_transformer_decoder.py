@@ -144,6 +144,7 @@ def make_decode_params(**kwargs):
         recog_batch_size=1,
         recog_beam_width=1,
         recog_ctc_weight=0.0,
+        recog_ctc_window=0,
         recog_lm_weight=0.0,
         recog_lm_second_weight=0.0,
         recog_lm_bwd_weight=0.0,
@@ -189,6 +190,34 @@ def make_args_rnnlm(**kwargs):
     return argparse.Namespace(**args)
 
 
+def make_args_transformerlm(**kwargs):
+    args = dict(
+        lm_type='transformer',
+        transformer_attn_type='scaled_dot',
+        transformer_n_heads=2,
+        n_layers=2,
+        transformer_d_model=16,
+        transformer_d_ff=32,
+        transformer_layer_norm_eps=1e-12,
+        transformer_ffn_activation='relu',
+        transformer_pe_type='add',
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        dropout_att=0.1,
+        dropout_layer=0.0,
+        lsm_prob=0.0,
+        transformer_param_init='xavier_uniform',
+        mem_len=0,
+        recog_mem_len=0,
+        zero_center_offset=False,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
 @pytest.mark.parametrize(
     "backward, params",
     [
@@ -206,6 +235,7 @@ def make_args_rnnlm(**kwargs):
         (False, {'recog_beam_width': 4, 'nbest': 4}),
         (False, {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (False, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (False, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_ctc_window': 5}),
         # length penalty
         (False, {'recog_length_penalty': 0.1}),
         (False, {'recog_length_norm': True}),
@@ -228,6 +258,7 @@ def make_args_rnnlm(**kwargs):
         (True, {'recog_beam_width': 4, 'nbest': 4}),
         (True, {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (True, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (True, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_ctc_window': 5}),
     ]
 )
 def test_decoding(backward, params):
@@ -329,3 +360,171 @@ def test_decoding(backward, params):
             assert isinstance(scores, list)
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
+
+
+@pytest.mark.parametrize(
+    "backward, params",
+    [
+        (False, {'recog_beam_width': 4}),
+        (False, {'recog_beam_width': 4, 'cache_states': False}),
+        (False, {'recog_beam_width': 4, 'exclude_eos': True}),
+        (False, {'recog_beam_width': 4, 'nbest': 4}),
+        (False, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_max_len_ratio': 0.3}),
+        (False, {'recog_beam_width': 4, 'recog_length_penalty': 0.1}),
+        (False, {'recog_beam_width': 4, 'recog_length_norm': True}),
+        (False, {'recog_beam_width': 4, 'recog_lm_weight': 0.1}),
+        (True, {'recog_beam_width': 4}),
+        (True, {'recog_beam_width': 4, 'nbest': 2}),
+    ]
+)
+def test_decoding_batch(backward, params):
+    args = make_args(backward=backward)
+    params = make_decode_params(**params)
+
+    elens = [40, 33, 25, 38]
+    batch_size = len(elens)
+    device = "cpu"
+
+    eouts = pad_list([np2tensor(np.random.randn(elen, ENC_N_UNITS).astype(np.float32), device)
+                      for elen in elens], 0.)
+    elens = torch.IntTensor(elens)
+    ctc_log_probs = None
+    if params['recog_ctc_weight'] > 0:
+        ctc_log_probs = torch.log_softmax(torch.randn(batch_size, eouts.size(1), VOCAB), dim=-1)
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        module = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module.RNNLM(make_args_rnnlm()).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps, aws, scores = dec.beam_search_batch(
+            eouts, elens, params, idx2token=None, lm=lm,
+            ctc_log_probs=ctc_log_probs,
+            nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+            cache_states=params['cache_states'])
+        assert len(nbest_hyps) == batch_size
+
+        # must be identical to utterance-level beam search
+        for b in range(batch_size):
+            elen = elens[b].item()
+            nbest_hyps_b, aws_b, scores_b = dec.beam_search(
+                eouts[b:b + 1, :elen], elens[b:b + 1], params, idx2token=None, lm=lm,
+                ctc_log_probs=ctc_log_probs[b:b + 1, :elen] if ctc_log_probs is not None else None,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                cache_states=params['cache_states'])
+            assert len(nbest_hyps[b]) == params['nbest']
+            for n in range(params['nbest']):
+                # NOTE: compare scores since hypotheses can be swapped by numerical ties
+                assert abs(scores[b][n] - scores_b[0][n]) < 1e-3
+            assert aws[b][0].shape == (args['n_heads'] * args['n_layers'], len(nbest_hyps[b][0]), elen)
+
+
+@pytest.mark.parametrize("lm_type", ['transformer', 'transformer_xl'])
+def test_decoding_batch_transformer_lm(lm_type):
+    args = make_args()
+    params = make_decode_params(recog_beam_width=4, nbest=2, recog_lm_weight=0.5)
+
+    elens = [40, 33, 25, 38]
+    batch_size = len(elens)
+    torch.manual_seed(1)
+    eouts = pad_list([torch.randn(elen, ENC_N_UNITS) for elen in elens], 0.)
+    elens = torch.IntTensor(elens)
+    if lm_type == 'transformer':
+        module = importlib.import_module('neural_sp.models.lm.transformerlm')
+        lm = module.TransformerLM(make_args_transformerlm())
+    else:
+        module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+        lm = module.TransformerXL(make_args_transformerlm(bptt=200))
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps, _, scores = dec.beam_search_batch(eouts, elens, params, lm=lm, nbest=params['nbest'])
+        # LM states are identical with and without caching outputs of each layer
+        _, _, scores_nocache = dec.beam_search_batch(eouts, elens, params, lm=lm, nbest=params['nbest'],
+                                                     cache_states=False)
+        for b in range(batch_size):
+            assert np.allclose(scores[b], scores_nocache[b], atol=1e-3)
+
+            # LM states are reordered within each utterance
+            elen = elens[b].item()
+            nbest_hyps_b, _, scores_b = dec.beam_search_batch(
+                eouts[b:b + 1, :elen], elens[b:b + 1], params, lm=lm, nbest=params['nbest'])
+            assert np.allclose(scores[b], scores_b[0], atol=1e-3)
+
+
+@pytest.mark.parametrize(
+    "backward, params",
+    [
+        (False, {'recog_beam_width': 4, 'nbest': 4}),
+        (True, {'recog_beam_width': 4, 'nbest': 4}),
+        (False, {'recog_beam_width': 2, 'nbest': 2, 'exclude_eos': True}),
+    ]
+)
+def test_decoding_batch_short_input(backward, params):
+    args = make_args(backward=backward)
+    params = make_decode_params(**params)
+
+    elens = [1, 1, 20]
+    eouts = pad_list([np2tensor(np.random.randn(elen, ENC_N_UNITS).astype(np.float32), "cpu")
+                      for elen in elens], 0.)
+    elens = torch.IntTensor(elens)
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        # fewer hypotheses than nbest can be found
+        nbest_hyps, aws, scores = dec.beam_search_batch(
+            eouts, elens, params, idx2token=None,
+            nbest=params['nbest'], exclude_eos=params['exclude_eos'])
+    assert len(nbest_hyps) == len(elens)
+    for b in range(len(elens)):
+        assert 1 <= len(nbest_hyps[b]) <= params['nbest']
+        assert len(nbest_hyps[b]) == len(aws[b]) == len(scores[b])
+
+
+@pytest.mark.parametrize(
+    "backward, params",
+    [
+        (False, {'recog_beam_width': 1}),
+        (False, {'recog_beam_width': 4}),
+        (True, {'recog_beam_width': 4, 'nbest': 2}),
+    ]
+)
+def test_decoding_cache(backward, params):
+    args = make_args(backward=backward)
+    params = make_decode_params(**params)
+
+    batch_size = 1
+    emax = 40
+    device = "cpu"
+
+    eouts = torch.randn(batch_size, emax, ENC_N_UNITS, device=device)
+    elens = torch.IntTensor([emax] * batch_size)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec = dec.to(device)
+
+    # incremental decoding with key/value cache must be identical to decoding without cache
+    dec.eval()
+    with torch.no_grad():
+        if params['recog_beam_width'] == 1:
+            hyps, aws = dec.greedy(eouts, elens, max_len_ratio=1.0, idx2token=None, cache_states=True)
+            hyps_nocache, aws_nocache = dec.greedy(eouts, elens, max_len_ratio=1.0, idx2token=None,
+                                                   cache_states=False)
+            assert list(hyps[0]) == list(hyps_nocache[0])
+            assert np.allclose(aws[0], aws_nocache[0], atol=1e-5)
+        else:
+            nbest_hyps, _, scores = dec.beam_search(eouts, elens, params, nbest=params['nbest'],
+                                                    cache_states=True)
+            nbest_hyps_nocache, _, scores_nocache = dec.beam_search(eouts, elens, params, nbest=params['nbest'],
+                                                                    cache_states=False)
+            for n in range(params['nbest']):
+                assert abs(scores[0][n] - scores_nocache[0][n]) < 1e-3
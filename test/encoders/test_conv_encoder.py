@@ -161,3 +161,26 @@ def test_forward_1d(args):
         xs, xlens = enc(xs, xlens)
         assert xs.size(0) == batch_size
         assert xs.size(1) == xlens.max(), (xs.size(), xlens)
+
+
+@pytest.mark.parametrize("kernel_size, stride, padding",
+                         [(2, 2, 0), (3, 2, 0), (3, 2, 1), (2, 1, 0), (3, 3, 1), (5, 3, 2)])
+def test_ceil_pool_len(kernel_size, stride, padding):
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.conv')
+    seq_lens = list(range(max(kernel_size - 2 * padding, 1), 20))  # odd and even lengths
+
+    # 1d
+    layer = torch.nn.MaxPool1d(kernel_size, stride=stride, padding=padding, ceil_mode=True)
+    out_lens = module.update_lens_1d(torch.IntTensor(seq_lens), layer)
+    for seq_len, out_len in zip(seq_lens, out_lens.tolist()):
+        assert layer(torch.zeros(1, 1, seq_len)).size(2) == out_len
+        assert module._ceil_pool_len(seq_len, kernel_size, stride, padding) == out_len
+
+    # 2d
+    layer = torch.nn.MaxPool2d((kernel_size, 2), stride=(stride, 2), padding=(padding, 0), ceil_mode=True)
+    out_lens = module.update_lens_2d(torch.IntTensor(seq_lens), layer, dim=0)
+    out_lens_freq = module.update_lens_2d(torch.IntTensor(seq_lens), layer, dim=1)
+    for seq_len, out_len, out_len_freq in zip(seq_lens, out_lens.tolist(), out_lens_freq.tolist()):
+        out = layer(torch.zeros(1, 1, seq_len, seq_len))
+        assert out.size(2) == out_len
+        assert out.size(3) == out_len_freq
@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for stateful streaming inference session."""
+
+import importlib
+import numpy as np
+import pytest
+import sys
+import torch
+
+INPUT_DIM = 8
+
+
+def make_args(**kwargs):
+    args = dict(
+        enc_type='conv_transformer',
+        dec_type='lstm',
+        enc_n_layers=2,
+        dec_n_units=16,
+        emb_dim=16,
+        attn_dim=16,
+        subsample='1_1',
+        ctc_weight=0.0,
+    )
+    if 'conv' in kwargs.get('enc_type', args['enc_type']):
+        args.update(dict(
+            conv_channels='4_4',
+            conv_kernel_sizes='(3,3)_(3,3)',
+            conv_strides='(1,1)_(1,1)',
+            conv_poolings='(2,2)_(2,2)',
+        ))
+    args.update(kwargs)
+    return args
+
+
+def build_model(args, monkeypatch):
+    module_args = importlib.import_module('neural_sp.bin.args_asr')
+    module_s2t = importlib.import_module('neural_sp.models.seq2seq.speech2text')
+    argv = []
+    for k, v in args.items():
+        argv += ['--' + k, str(v)]
+    monkeypatch.setattr(sys, 'argv', ['train.py'] + argv)
+    args = module_args.parse_args_train(argv)
+    if 'conv' not in args.enc_type:
+        # NOTE: CNN arguments are required to build encoders
+        module_conv = importlib.import_module('neural_sp.models.seq2seq.encoders.conv')
+        parser = module_conv.ConvEncoder.add_args(module_args.build_parser(), args)
+        for k, v in vars(parser.parse_known_args([])[0]).items():
+            if not hasattr(args, k):
+                setattr(args, k, v)
+    args.input_dim = INPUT_DIM
+    args.vocab = 10
+    args.vocab_sub1 = -1
+    args.vocab_sub2 = -1
+    return module_s2t.Speech2Text(args)
+
+
+def reference_rnn(model, x, params):
+    """Chunkwise encoding by the Streaming interface with the whole input."""
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.streaming')
+    streaming = module.Streaming(x, params, model.enc, None)
+    model.enc.reset_cache()
+    eouts = []
+    while True:
+        x_chunk, is_last_chunk, lookback, lookahead = streaming.extract_feature()
+        eout = model.encode([x_chunk], 'ys', streaming=True,
+                            lookback=lookback, lookahead=lookahead)['ys']['xs']
+        eouts.append(eout)
+        streaming.next_chunk()
+        if is_last_chunk:
+            break
+    return torch.cat(eouts, dim=1)
+
+
+@pytest.mark.parametrize(
+    "args, feed_sizes",
+    [
+        # Transformer
+        ({'enc_type': 'transformer', 'transformer_enc_pe_type': 'add', 'lc_chunk_size_left': 8,
+          'lc_chunk_size_current': 8, 'lc_chunk_size_right': 4}, [1, 7, 20]),
+        ({'transformer_enc_pe_type': 'add', 'lc_chunk_size_left': 16,
+          'lc_chunk_size_current': 16, 'lc_chunk_size_right': 8}, [5, 16, 100]),
+        ({'transformer_enc_pe_type': 'none', 'lc_chunk_size_left': 16,
+          'lc_chunk_size_current': 16, 'lc_chunk_size_right': 0}, [5, 33]),
+        ({'transformer_enc_pe_type': 'add', 'lc_chunk_size_left': 32,
+          'lc_chunk_size_current': 16, 'lc_chunk_size_right': 16}, [3, 16]),
+        # Conformer
+        ({'enc_type': 'conformer', 'transformer_enc_pe_type': 'relative_xl', 'conformer_kernel_size': 5,
+          'lc_chunk_size_left': 8, 'lc_chunk_size_current': 8, 'lc_chunk_size_right': 4}, [1, 7, 20]),
+        ({'enc_type': 'conv_conformer', 'transformer_enc_pe_type': 'relative_xl', 'conformer_kernel_size': 3,
+          'lc_chunk_size_left': 16, 'lc_chunk_size_current': 16, 'lc_chunk_size_right': 8}, [5, 16, 100]),
+        ({'enc_type': 'conformer', 'transformer_enc_pe_type': 'relative_xl', 'conformer_kernel_size': 7,
+          'lc_chunk_size_left': 16, 'lc_chunk_size_current': 8, 'lc_chunk_size_right': 0}, [5, 33]),
+        # RNN
+        ({'enc_type': 'conv_blstm', 'enc_n_units': 16, 'lc_chunk_size_left': 8,
+          'lc_chunk_size_right': 8}, [1, 7, 20]),
+        ({'enc_type': 'blstm', 'enc_n_units': 16, 'lc_chunk_size_left': 12,
+          'lc_chunk_size_right': 4}, [5, 100]),
+        ({'enc_type': 'lstm', 'enc_n_units': 16}, [5, 100]),
+    ]
+)
+def test_streaming_session(args, feed_sizes, monkeypatch):
+    args = make_args(**args)
+    if 'former' in args['enc_type']:
+        args.update({'transformer_d_model': 16, 'transformer_d_ff': 32, 'transformer_n_heads': 2})
+    model = build_model(args, monkeypatch)
+    model.eval()
+    if 'conformer' in args['enc_type']:
+        # NOTE: positional terms in the forward pass depend on the length of the whole input
+        for layer in model.enc.layers:
+            torch.nn.init.zeros_(layer.self_attn.w_pos.weight)
+    params = {'recog_ctc_vad': False,
+              'recog_ctc_vad_blank_threshold': 40,
+              'recog_ctc_vad_spike_threshold': 0.1,
+              'recog_ctc_vad_n_accum_frames': 1600}
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.streaming')
+    session = module.StreamingSession(model, params)
+
+    # NOTE: avoid too short last chunks for CNN in the RNN encoder
+    xmaxs = [57, 75, 131] if 'former' in args['enc_type'] else [60, 78, 134]
+    for xmax in xmaxs:
+        x = np.random.randn(xmax, INPUT_DIM).astype(np.float32)
+        with torch.no_grad():
+            if 'former' in args['enc_type']:
+                eout_ref = model.encode([x], 'ys')['ys']['xs']
+            else:
+                eout_ref = reference_rnn(model, x, params)
+
+        session.reset()
+        eouts = []
+        t, i = 0, 0
+        while t < xmax:
+            feed_size = feed_sizes[i % len(feed_sizes)]
+            eouts.append(session.accept(x[t:t + feed_size]))
+            t += feed_size
+            i += 1
+        eouts.append(session.finalize())
+        eout = torch.cat(eouts, dim=1)
+
+        assert eout.size() == eout_ref.size()
+        assert torch.allclose(eout, eout_ref, atol=1e-5)
+
+
+@pytest.mark.parametrize("pe_type", ['relative', 'relative_xl'])
+def test_streaming_session_conformer(pe_type, monkeypatch):
+    args = make_args(enc_type='conformer', transformer_enc_pe_type=pe_type, conformer_kernel_size=5,
+                     lc_chunk_size_left=8, lc_chunk_size_current=8, lc_chunk_size_right=4)
+    args.update({'transformer_d_model': 16, 'transformer_d_ff': 32, 'transformer_n_heads': 2})
+    model = build_model(args, monkeypatch)
+    model.eval()
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.streaming')
+    session = module.StreamingSession(model, {})
+
+    # encoder outputs do not depend on how input features are fed
+    x = np.random.randn(75, INPUT_DIM).astype(np.float32)
+    outputs = []
+    for feed_size in [1, 7, 75]:
+        session.reset()
+        eouts = [session.accept(x[t:t + feed_size]) for t in range(0, len(x), feed_size)]
+        eouts.append(session.finalize())
+        outputs.append(torch.cat(eouts, dim=1))
+    assert outputs[0].size() == (1, len(x), 16)
+    for eout in outputs[1:]:
+        assert torch.allclose(eout, outputs[0], atol=1e-5)
@@ -156,3 +156,59 @@ def test_forward(args):
             if args['n_layers_sub2'] > 0:
                 assert enc_out_dict['ys_sub2']['xs'].size(0) == batch_size, xs.size()
                 assert enc_out_dict['ys_sub2']['xs'].size(1) == enc_out_dict['ys_sub2']['xlens'][0], xs.size()
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_layers_sub1': 2, 'task_specific_layer': True}),
+        ({'subsample': "1_2_1", 'streaming_type': 'reshape',
+          'chunk_size_left': 64, 'chunk_size_current': 64, 'chunk_size_right': 32}),
+        ({'subsample': "1_2_1", 'streaming_type': 'mask',
+          'chunk_size_left': 64, 'chunk_size_current': 64, 'chunk_size_right': 32}),
+    ]
+)
+def test_attention_capture(args):
+    args = make_args(**args)
+    batch_size = 3
+    xmax = 400 if args['chunk_size_left'] > 0 else 40
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+    capture_module = importlib.import_module('neural_sp.models.modules.attention_capture')
+    enc = module.TransformerEncoder(**args)
+    enc = enc.to(device)
+    enc.eval()
+
+    xs = np.random.randn(batch_size, xmax, args['input_dim']).astype(np.float32)
+    xlens = torch.IntTensor([len(x) - i * 10 for i, x in enumerate(xs)])
+    xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+
+    with torch.no_grad():
+        # nothing is recorded by default
+        eouts = enc(xs, xlens, task='all')['ys']['xs']
+        assert len(enc.aws_dict) == 0
+
+        enc.capture_attention(capture_module.AttentionCapture())
+        assert torch.equal(enc(xs, xlens, task='all')['ys']['xs'], eouts)
+        aws_all = enc.aws_dict
+        n_keys = args['n_layers'] + (1 if args['task_specific_layer'] else 0)
+        assert len(aws_all) == n_keys
+        for k, aw in aws_all.items():
+            lth = k.split('_')[-1].replace('layer', '')
+            elens = enc.data_dict['elens' + lth]
+            assert aw.shape == (batch_size, args['n_heads'], max(elens), max(elens))
+            if args['streaming_type'] != 'reshape':
+                assert np.allclose(aw[-1, :, :elens[-1]].sum(-1), 1., atol=1e-5)
+        elens1 = enc.data_dict['elens1']
+
+        enc.capture_attention(capture_module.AttentionCapture(layers=[1], heads=[0, 2], utterances=[-1]))
+        enc(xs, xlens, task='all')
+        assert sorted(enc.aws_dict.keys()) == sorted(k for k in aws_all.keys() if k.endswith('_layer1'))
+        assert np.array_equal(enc.aws_dict['xx_aws_layer1'], aws_all['xx_aws_layer1'][-1:, [0, 2]])
+        assert np.array_equal(enc.data_dict['elens1'], elens1[-1:])
+
+        # recorded weights are kept after stopping capture
+        enc.capture_attention(None)
+        enc(xs[:1], xlens[:1], task='all')
+        assert enc.aws_dict['xx_aws_layer1'].shape[:2] == (1, 2)
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for edit distance."""
+
+import importlib
+import numpy as np
+import pytest
+
+
+def edit_distance_naive(ref, hyp):
+    d = np.zeros((len(ref) + 1, len(hyp) + 1), dtype=np.int64)
+    d[:, 0] = np.arange(len(ref) + 1)
+    d[0, :] = np.arange(len(hyp) + 1)
+    for i in range(1, len(ref) + 1):
+        for j in range(1, len(hyp) + 1):
+            d[i][j] = min(d[i - 1][j - 1] + int(ref[i - 1] != hyp[j - 1]),
+                          d[i][j - 1] + 1, d[i - 1][j] + 1)
+    return d
+
+
+def make_pairs(n_pairs=30, vocab=5, max_len=15):
+    rng = np.random.RandomState(0)
+    words = ['w%d' % i for i in range(vocab)]
+    refs, hyps = [], []
+    for _ in range(n_pairs):
+        refs.append([words[i] for i in rng.randint(0, vocab, rng.randint(0, max_len))])
+        hyps.append([words[i] for i in rng.randint(0, vocab, rng.randint(0, max_len))])
+    refs.append(['a', 'b', 'c'])
+    hyps.append(['a', 'b', 'c'])
+    return refs, hyps
+
+
+def test_wer():
+    module = importlib.import_module('neural_sp.evaluators.edit_distance')
+    refs, hyps = make_pairs()
+
+    results = module.compute_wer_batch(refs, hyps)
+    assert len(results) == len(refs)
+    for ref, hyp, (wer, n_sub, n_ins, n_del) in zip(refs, hyps, results):
+        d = edit_distance_naive(ref, hyp)
+        assert wer == d[-1, -1] * 100
+        assert wer == n_sub + n_ins + n_del
+        assert module.compute_wer(ref, hyp) == (wer, n_sub, n_ins, n_del)
+        assert module._backtrace(d, ref, hyp) == module._backtrace(
+            module._distance_table([ref], [hyp])[0], ref, hyp)
+    assert results[-1] == (0, 0, 0, 0)
+
+
+@pytest.mark.parametrize(
+    "ref, hyp, expected",
+    [
+        ('a b c d', 'a b c d', (0, 0, 0, 0)),
+        ('a b c d', 'a x c d', (100, 100, 0, 0)),
+        ('a b c d', 'a b x c d', (100, 0, 100, 0)),
+        ('a b c d', 'a c d', (100, 0, 0, 100)),
+        ('a b', 'x y z', (300, 200, 100, 0)),
+    ]
+)
+def test_wer_counts(ref, hyp, expected):
+    module = importlib.import_module('neural_sp.evaluators.edit_distance')
+    assert module.compute_wer(ref.split(' '), hyp.split(' ')) == expected
+    wer = module.compute_wer(ref.split(' '), hyp.split(' '), normalize=True)[0]
+    assert wer == expected[0] / len(ref.split(' '))
+
+
+def test_cer_per():
+    module = importlib.import_module('neural_sp.evaluators.edit_distance')
+    refs, hyps = make_pairs()
+    for ref, hyp in zip(refs, hyps):
+        d = edit_distance_naive(ref, hyp)
+        assert module.compute_per(ref, hyp) == d[-1, -1] * 100
+    assert module.compute_cer('kitten', 'sitting') == 300
+    assert module.compute_cer('abc', 'abc') == 0
+    assert module.compute_cer('abcd', 'ab', normalize=True) == 50
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for frame stacking."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import pad_list
+
+
+def stack_frame_naive(feat, n_stacks, n_skips):
+    # frame-by-frame stacking in the original implementation
+    T, input_dim = feat.shape
+    T_new = T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
+    stacked_feat = np.zeros((T_new, input_dim * n_stacks), dtype=np.float32)
+    stack_count = 0
+    stack = []
+    for t, frame_t in enumerate(feat):
+        if t == len(feat) - 1:
+            stack.append(frame_t)
+            while stack_count != int(T_new):
+                for i in range(len(stack)):
+                    stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
+                stack_count += 1
+                for _ in range(n_skips):
+                    if len(stack) != 0:
+                        stack.pop(0)
+        elif len(stack) < n_stacks:
+            stack.append(frame_t)
+        if len(stack) == n_stacks:
+            for i in range(n_stacks):
+                stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
+            stack_count += 1
+            for _ in range(n_skips):
+                stack.pop(0)
+    return stacked_feat
+
+
+@pytest.mark.parametrize(
+    "n_stacks, n_skips",
+    [(1, 1), (2, 1), (2, 2), (3, 1), (3, 3), (4, 2), (4, 3)]
+)
+def test_stack_frame(n_stacks, n_skips):
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.frame_stacking')
+    rng = np.random.RandomState(0)
+    xlens = [1, 2, 7, 8, 9, 20]
+    feats = [rng.randn(xlen, 5) for xlen in xlens]
+
+    outs = [module.stack_frame(feat, n_stacks, n_skips) for feat in feats]
+    if n_stacks > 1:
+        for feat, out in zip(feats, outs):
+            out_ref = stack_frame_naive(feat, n_stacks, n_skips)
+            assert out.dtype == out_ref.dtype
+            assert np.array_equal(out, out_ref)
+
+    # padded batch
+    xs = pad_list([torch.from_numpy(feat).float() for feat in feats], 0.)
+    xs_out, xlens_out = module.stack_frame_batch(xs, torch.IntTensor(xlens), n_stacks, n_skips)
+    assert xlens_out.tolist() == [len(out) for out in outs]
+    assert torch.equal(xs_out, pad_list([torch.from_numpy(out).float() for out in outs], 0.))
+
+
+def test_stack_frame_error():
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.frame_stacking')
+    with pytest.raises(ValueError):
+        module.stack_frame(np.zeros((10, 5)), 2, 3)
+    with pytest.raises(ValueError):
+        module.stack_frame_batch(torch.zeros(2, 10, 5), torch.IntTensor([10, 8]), 2, 3)
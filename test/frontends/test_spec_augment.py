@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for SpecAugment."""
+
+import importlib
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import make_pad_mask
+
+
+def make_args(**kwargs):
+    args = dict(
+        F=8,
+        T=10,
+        n_freq_masks=2,
+        n_time_masks=2,
+        p=1.0,
+        W=0,
+        adaptive_number_ratio=0,
+        adaptive_size_ratio=0,
+        max_n_time_masks=20,
+    )
+    args.update(kwargs)
+    return args
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({}),
+        ({'n_freq_masks': 0}),
+        ({'n_time_masks': 0}),
+        ({'p': 0.2}),
+        ({'adaptive_number_ratio': 0.04, 'adaptive_size_ratio': 0.05}),
+        ({'W': 5}),
+        ({'W': 5, 'n_freq_masks': 0, 'n_time_masks': 0}),
+    ]
+)
+def test_call(args):
+    args = make_args(**args)
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    specaug = module.SpecAugment(**args)
+    torch.manual_seed(0)
+
+    bs, xmax, n_bins = 8, 100, 40
+    xlens = torch.IntTensor([100, 90, 60, 31, 10, 8, 1, 100])
+    mask = make_pad_mask(xlens).unsqueeze(2)
+    xs = (torch.randn(bs, xmax, n_bins) + 5.).masked_fill(~mask, 0.)
+    out = specaug(xs.clone(), xlens)
+    assert out.size() == xs.size()
+    assert (out.masked_select(~mask) == 0).all()  # padding is kept
+
+    if args['W'] == 0:
+        # only masking
+        assert ((out == xs) | (out == 0)).all()
+        if args['n_freq_masks'] > 0:
+            f_0, f_1 = specaug.freq_mask
+            assert f_0.size() == (bs, args['n_freq_masks'])
+            assert ((f_1 - f_0) < args['F']).all() and (f_1 <= n_bins).all()
+        if args['n_time_masks'] > 0 and args['adaptive_number_ratio'] == 0:
+            t_0, t_1 = specaug.time_mask
+            assert t_0.size() == (bs, args['n_time_masks'])
+            assert (t_1 <= xlens.long().unsqueeze(1)).all()  # within each utterance
+            assert ((t_1 - t_0).float() <= args['p'] * xlens.float().unsqueeze(1)).all()
+            # masks are sampled for each utterance
+            assert not (t_0 == t_0[:1]).all()
+    elif args['n_freq_masks'] == 0 and args['n_time_masks'] == 0:
+        # short utterances are not warped
+        assert torch.equal(out[xlens <= 2 * args['W'] + 1], xs[xlens <= 2 * args['W'] + 1])
+        # boundary frames are fixed
+        assert torch.allclose(out[:, 0], xs[:, 0])
+        idx = (xlens.long() - 1).view(bs, 1, 1).expand(bs, 1, n_bins)
+        assert torch.allclose(out.gather(1, idx), xs.gather(1, idx))
+
+
+def test_time_warp():
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    specaug = module.SpecAugment(**make_args(W=10, n_freq_masks=0, n_time_masks=0))
+    torch.manual_seed(1)
+
+    # warping a linear ramp keeps it monotonic and within the original range
+    bs, xmax = 16, 60
+    xs = torch.arange(xmax).float().view(1, xmax, 1).repeat(bs, 1, 3)
+    out = specaug.time_warp(xs, torch.full((bs,), xmax, dtype=torch.long))
+    assert (out[:, 1:] >= out[:, :-1]).all()
+    assert (out[:, 0] == 0).all() and (out[:, -1] == xmax - 1).all()
+    assert not torch.equal(out, xs)
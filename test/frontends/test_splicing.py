@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for splicing."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import pad_list
+
+
+def splice_naive(feat, n_splices, n_stacks):
+    # frame-by-frame splicing in the original implementation
+    max_xlen, input_dim = feat.shape
+    freq = (input_dim // 3) // n_stacks
+    feat_splice = np.zeros((max_xlen, freq * (n_splices * n_stacks) * 3), dtype=np.float32)
+    for i_time in range(max_xlen):
+        spliced_frames = np.zeros((n_splices * n_stacks, freq, 3))
+        for i_splice in range(0, n_splices, 1):
+            if i_time <= n_splices - 1 and i_splice < n_splices - i_time:
+                copy_frame = feat[0]
+            elif max_xlen - n_splices <= i_time and i_time + (i_splice - n_splices) > max_xlen - 1:
+                copy_frame = feat[-1]
+            else:
+                copy_frame = feat[i_time + (i_splice - n_splices)]
+            copy_frame = copy_frame.reshape((freq, 3, n_stacks))
+            copy_frame = np.transpose(copy_frame, (2, 0, 1))
+            spliced_frames[i_splice: i_splice + n_stacks] = copy_frame
+        spliced_frames = np.transpose(spliced_frames, (1, 0, 2))
+        feat_splice[i_time] = spliced_frames.reshape((freq * (n_splices * n_stacks) * 3))
+    return feat_splice
+
+
+@pytest.mark.parametrize(
+    "n_splices, n_stacks",
+    [(1, 1), (2, 1), (3, 1), (11, 1), (3, 2), (5, 3), (2, 4)]
+)
+def test_splice(n_splices, n_stacks):
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.splicing')
+    rng = np.random.RandomState(0)
+    xlens = [1, 3, 11, 12, 20]
+    feats = [rng.randn(xlen, 4 * 3 * n_stacks).astype(np.float32) for xlen in xlens]
+
+    outs = [module.splice(feat, n_splices, n_stacks) for feat in feats]
+    if n_splices > 1:
+        for feat, out in zip(feats, outs):
+            out_ref = splice_naive(feat, n_splices, n_stacks)
+            assert out.dtype == out_ref.dtype
+            assert np.array_equal(out, out_ref)
+
+    # padded batch
+    xs = pad_list([torch.from_numpy(feat) for feat in feats], 0.)
+    xs_out = module.splice_batch(xs, torch.IntTensor(xlens), n_splices, n_stacks)
+    assert torch.equal(xs_out, pad_list([torch.from_numpy(out) for out in outs], 0.))
@@ -79,3 +79,26 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+def test_attention_capture(tmpdir):
+    args = make_args()
+
+    ylens = [4, 5, 3, 7] * 4
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int64) for ylen in ylens]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    capture_module = importlib.import_module('neural_sp.models.modules.attention_capture')
+    lm = module.TransformerLM(args, save_path=str(tmpdir))
+    lm = lm.to(device)
+    lm.eval()
+    lm(ys, state=None, is_eval=True)
+    assert len(lm.aws_dict) == 0
+
+    lm.capture_attention(capture_module.AttentionCapture(layers=[0], utterances=[-1]))
+    lm(ys, state=None, is_eval=True)
+    assert list(lm.aws_dict.keys()) == ['layer0']
+    assert lm.aws_dict['layer0'].shape[:2] == (1, args.transformer_n_heads)
+    lm.plot_attention()
+    assert tmpdir.join('att_weights', 'layer0.png').check()
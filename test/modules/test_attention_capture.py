@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for opt-in capture of attention weights."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+
+def chunks_to_center_loop(aws, bs, n_chunks, N_l, N_c, emax):
+    n_heads = aws.size(1)
+    aws = aws[:, :, N_l:N_l + N_c, N_l:N_l + N_c]
+    aws = aws.reshape(bs, n_chunks, n_heads, N_c, N_c)
+    aws_center = aws.new_zeros(bs, n_heads, emax, emax)
+    for chunk_idx in range(n_chunks):
+        offset = chunk_idx * N_c
+        emax_chunk = aws_center[:, :, offset:offset + N_c].size(2)
+        aws_chunk = aws[:, chunk_idx, :, :emax_chunk, :emax_chunk]
+        aws_center[:, :, offset:offset + N_c, offset:offset + N_c] = aws_chunk
+    return aws_center
+
+
+@pytest.mark.parametrize(
+    "n_chunks, N_l, N_c, N_r, emax",
+    [
+        (1, 0, 8, 0, 8),
+        (3, 4, 8, 2, 24),
+        (3, 4, 8, 2, 19),
+        (5, 0, 4, 4, 17),
+    ]
+)
+def test_chunks_to_center(n_chunks, N_l, N_c, N_r, emax):
+    module = importlib.import_module('neural_sp.models.modules.attention_capture')
+    bs, n_heads = 2, 3
+    width = N_l + N_c + N_r
+    aws = torch.rand(bs * n_chunks, n_heads, width, width)
+    out = module.chunks_to_center(aws, bs, n_chunks, N_l, N_c, emax)
+    assert out.size() == (bs, n_heads, emax, emax)
+    assert torch.equal(out, chunks_to_center_loop(aws, bs, n_chunks, N_l, N_c, emax))
+
+
+@pytest.mark.parametrize(
+    "layers, heads, utterances",
+    [
+        (None, None, None),
+        ([0, 2], None, None),
+        (None, [1], [-1]),
+        ([1], [0, 3], [0, 2]),
+    ]
+)
+def test_select(layers, heads, utterances):
+    module = importlib.import_module('neural_sp.models.modules.attention_capture')
+    capture = module.AttentionCapture(layers, heads, utterances)
+    aws = torch.rand(3, 4, 5, 6)
+    xlens = torch.IntTensor([6, 5, 4])
+
+    ref = aws.numpy()
+    ref_lens = xlens.numpy()
+    if utterances is not None:
+        ref = ref[utterances]
+        ref_lens = ref_lens[utterances]
+    if heads is not None:
+        ref = ref[:, heads]
+    assert np.array_equal(capture.select(aws), ref)
+    assert np.array_equal(capture.select_batch(xlens), ref_lens)
+    assert [lth for lth in range(3) if lth in capture] == (layers or [0, 1, 2])
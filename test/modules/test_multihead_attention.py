@@ -63,3 +63,113 @@ def test_forward(args):
         cv, aws, _, _ = out
         assert cv.size() == (batch_size, 1, value.size(2))
         assert aws.size() == (batch_size, args['n_heads'], 1, klen)
+
+
+@pytest.mark.parametrize(
+    "args, max_len",
+    [
+        ({'n_heads': 1}, 64),
+        ({'n_heads': 4}, 64),
+        ({'n_heads': 4, 'atype': 'add'}, 64),
+        ({'n_heads': 4}, 2),  # buffer extension
+    ]
+)
+def test_kv_cache(args, max_len):
+    args = make_args(**args)
+    args['kdim'] = args['qdim']
+
+    batch_size = 4
+    qlen = 10
+    device = "cpu"
+
+    query = torch.randn(batch_size, qlen, args['qdim'], device=device)
+    causal_mask = torch.tril(torch.ones(qlen, qlen, device=device).byte()).unsqueeze(0).repeat([batch_size, 1, 1])
+
+    module = importlib.import_module('neural_sp.models.modules.multihead_attention')
+    attention = module.MultiheadAttentionMechanism(**args)
+    attention = attention.to(device)
+
+    attention.eval()
+    with torch.no_grad():
+        cv_full, aws_full, _, _ = attention(query, query, query, mask=causal_mask)
+
+        # incremental decoding
+        kv_cache = module.KVCache(max_len=max_len)
+        for i in range(qlen):
+            cv, aws, _, _ = attention(query[:, i:i + 1], query[:, i:i + 1], query[:, i:i + 1], mask=None,
+                                      kv_cache=kv_cache)
+            assert len(kv_cache) == i + 1
+            assert cv.size() == (batch_size, 1, args['odim'])
+            assert aws.size() == (batch_size, args['n_heads'], 1, i + 1)
+            assert torch.allclose(cv, cv_full[:, i:i + 1], atol=1e-6)
+            assert torch.allclose(aws, aws_full[:, :, i:i + 1, :i + 1], atol=1e-6)
+
+        # reorder for beam search
+        index = torch.LongTensor([3, 3, 0, 1])
+        kv_cache.index_select(index)
+        cv, _, _, _ = attention(query[index, -1:], query[index, -1:], query[index, -1:], mask=None,
+                                kv_cache=kv_cache)
+        assert len(kv_cache) == qlen + 1
+        assert cv.size() == (batch_size, 1, args['odim'])
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_heads': 1}),
+        ({'n_heads': 4}),
+        ({'n_heads': 4, 'atype': 'add'}),
+    ]
+)
+def test_shared_key(args):
+    args = make_args(**args)
+
+    n_utts = 2
+    beam_width = 3
+    klen = 40
+    qlen = 5
+    device = "cpu"
+
+    key = torch.randn(n_utts, klen, args['kdim'], device=device)
+    query = torch.randn(n_utts * beam_width, qlen, args['qdim'], device=device)
+    src_mask = torch.ones(n_utts, 1, klen, device=device).byte()
+    src_mask[-1, :, klen // 2:] = 0
+
+    module = importlib.import_module('neural_sp.models.modules.multihead_attention')
+    attention = module.MultiheadAttentionMechanism(**args)
+    attention = attention.to(device)
+
+    attention.eval()
+    with torch.no_grad():
+        # reference: encoder outputs repeated for each hypothesis
+        key_rep = key.repeat_interleave(beam_width, dim=0)
+        mask_rep = src_mask.repeat_interleave(beam_width, dim=0)
+        cv_ref, aws_ref, _, _ = attention(key_rep, key_rep, query, mask=mask_rep.repeat([1, qlen, 1]))
+
+        # key/value projections are cached once and broadcast over hypotheses
+        attention.reset()
+        for i in range(qlen):
+            cv, aws, _, _ = attention(key, key, query[:, i:i + 1], mask=src_mask, cache=True)
+            assert cv.size() == (n_utts * beam_width, 1, args['odim'])
+            assert aws.size() == (n_utts * beam_width, args['n_heads'], 1, klen)
+            assert torch.allclose(cv, cv_ref[:, i:i + 1], atol=1e-6)
+            assert torch.allclose(aws, aws_ref[:, :, i:i + 1], atol=1e-6)
+
+
+def test_autocast():
+    args = make_args(dropout=0.)
+    batch_size, klen, qlen = 4, 40, 5
+    key = torch.randn(batch_size, klen, args['kdim'])
+    query = torch.randn(batch_size, qlen, args['qdim'])
+    src_mask = torch.ones(batch_size, qlen, klen).byte()
+    src_mask[:, :, klen // 2:] = 0
+
+    module = importlib.import_module('neural_sp.models.modules.multihead_attention')
+    attention = module.MultiheadAttentionMechanism(**args)
+    attention.eval()
+    cv, aws, _, _ = attention(key, key, query, mask=src_mask, mode='parallel')
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        cv_bf16, aws_bf16, _, _ = attention(key, key, query, mask=src_mask, mode='parallel')
+    assert cv_bf16.dtype == torch.bfloat16
+    assert (aws_bf16[..., klen // 2:] == 0).all()
+    assert torch.allclose(cv_bf16.float(), cv, atol=5e-2)
@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for checkpoint writer."""
+
+import importlib
+import os
+import pytest
+import torch
+
+
+class Wrapper(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.module = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.Linear(8, 3))
+
+
+def make_optimizer(model):
+    module = importlib.import_module('neural_sp.trainers.lr_scheduler')
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.1)
+    return module.LRScheduler(optimizer, 0.1, decay_type='always',
+                              decay_start_epoch=1, decay_rate=0.5)
+
+
+def train_step(model, optimizer):
+    loss = model.module(torch.randn(5, 4)).pow(2).sum()
+    loss.backward()
+    optimizer.step()
+    optimizer.zero_grad()
+
+
+def test_snapshot():
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    model = Wrapper()
+    state_dict = model.module.state_dict()
+    obj = {'model_state_dict': state_dict, 'topk_list': [(1, 0.5)]}
+    obj_copy = module.snapshot(obj)
+    assert obj_copy['model_state_dict']._metadata == state_dict._metadata
+
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(1)
+    obj['topk_list'].append((2, 0.4))
+    for k, v in obj_copy['model_state_dict'].items():
+        assert torch.equal(v + 1, state_dict[k])
+    assert obj_copy['topk_list'] == [(1, 0.5)]
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+@pytest.mark.parametrize("split_optimizer", [False, True])
+def test_save_checkpoint(tmpdir, asynchronous, split_optimizer):
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    train_utils = importlib.import_module('neural_sp.bin.train_utils')
+    save_path = str(tmpdir)
+    torch.manual_seed(0)
+    model = Wrapper()
+    optimizer = make_optimizer(model)
+    writer = module.CheckpointWriter(asynchronous=asynchronous, max_in_flight=2,
+                                     split_optimizer=split_optimizer)
+
+    metrics = [0.5, 0.3, 0.4]
+    for epoch, metric in enumerate(metrics):
+        train_step(model, optimizer)
+        optimizer.epoch(metric)
+        state_dict = {k: v.clone() for k, v in model.module.state_dict().items()}
+        optimizer.save_checkpoint(model, save_path, remove_old=True, writer=writer)
+        train_step(model, optimizer)  # update parameters during saving
+    writer.close()
+
+    # the best and the latest checkpoints are kept
+    files = sorted(os.listdir(save_path))
+    expected = ['model.epoch-2', 'model.epoch-3']
+    if split_optimizer:
+        expected += ['optimizer.epoch-2', 'optimizer.epoch-3']
+    assert files == expected
+
+    # resume
+    model_new = Wrapper()
+    optimizer_new = make_optimizer(model_new)
+    topk_list = train_utils.load_checkpoint(os.path.join(save_path, 'model.epoch-3'),
+                                            model_new.module, optimizer_new)
+    assert topk_list == [(2, 0.3)]
+    for k, v in model_new.module.state_dict().items():
+        assert torch.equal(v, state_dict[k])
+    assert optimizer_new.n_steps == 5
+    assert optimizer_new.optimizer is not optimizer.optimizer
+    for p in model_new.parameters():
+        assert 'exp_avg' in optimizer_new.optimizer.state[p]
+
+    # evaluation does not need optimizer states
+    model_eval = Wrapper()
+    topk_list = train_utils.load_checkpoint(os.path.join(save_path, 'model.epoch-2'), model_eval.module)
+    assert topk_list == [(2, 0.3)]
+
+
+@pytest.mark.parametrize("split_optimizer", [False, True])
+def test_save_checkpoint_dataset(tmpdir, split_optimizer):
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    train_utils = importlib.import_module('neural_sp.bin.train_utils')
+    sampler = importlib.import_module('neural_sp.datasets.sampler')
+    save_path = str(tmpdir)
+    model = Wrapper()
+    optimizer = make_optimizer(model)
+    writer = module.CheckpointWriter(split_optimizer=split_optimizer)
+
+    # sampling state in the middle of an epoch (numpy arrays and RNG state)
+    dataset = sampler.EpochSampler(seed=1)
+    dataset.set_order(dataset.permutation(20))
+    dataset.take(7)
+    train_step(model, optimizer)
+    optimizer.epoch(0.5)
+    optimizer.save_checkpoint(model, save_path, writer=writer, dataset=dataset)
+    writer.close()
+    indices_next = dataset.take(5).tolist()
+    perm_next = dataset.permutation(20).tolist()
+
+    # resume sampling from the next mini-batch
+    model_new = Wrapper()
+    optimizer_new = make_optimizer(model_new)
+    dataset_new = sampler.EpochSampler(seed=2)
+    train_utils.load_checkpoint(os.path.join(save_path, 'model.epoch-1'),
+                                model_new.module, optimizer_new, dataset=dataset_new)
+    assert dataset_new.take(5).tolist() == indices_next
+    assert dataset_new.permutation(20).tolist() == perm_next
+
+
+def test_error(tmpdir):
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    writer = module.CheckpointWriter(asynchronous=True)
+    writer.save({'a': torch.zeros(3)}, str(tmpdir.join('not_found', 'model.epoch-1')))
+    with pytest.raises(FileNotFoundError):
+        writer.wait()
+    # the writer can be used after errors
+    writer.save({'a': torch.zeros(3)}, str(tmpdir.join('model.epoch-1')))
+    writer.close()
+    assert os.listdir(str(tmpdir)) == ['model.epoch-1']
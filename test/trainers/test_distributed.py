@@ -0,0 +1,144 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for multi-process distributed training."""
+
+import importlib
+import os
+import pytest
+import torch
+import torch.multiprocessing as mp
+
+WORLD_SIZE = 2
+BATCH_SIZE = 4
+
+
+class Model(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(3, 2)
+        self.unused = torch.nn.Linear(3, 2)
+
+    def forward(self, xs, ys):
+        loss = ((self.linear(xs) - ys) ** 2).sum(-1).mean()
+        observation = {'loss.train': loss.item(), 'acc.train': None}
+        return loss, observation
+
+
+def make_data(n_steps):
+    rng = torch.Generator().manual_seed(0)
+    return [(torch.randn(BATCH_SIZE, 3, generator=rng), torch.randn(BATCH_SIZE, 2, generator=rng))
+            for _ in range(n_steps)]
+
+
+def train(model, data, accum_grad_n_steps):
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    for step, (xs, ys) in enumerate(data):
+        loss, _ = model(xs, ys)
+        (loss / accum_grad_n_steps).backward()
+        if (step + 1) % accum_grad_n_steps == 0:
+            optimizer.step()
+            optimizer.zero_grad()
+
+
+def _worker(rank, init_method, accum_grad_n_steps, queue):
+    module = importlib.import_module('neural_sp.trainers.distributed')
+    module.init_distributed('gloo', init_method=init_method, world_size=WORLD_SIZE, rank=rank)
+    assert module.get_rank() == rank
+    assert module.get_world_size() == WORLD_SIZE
+    assert module.is_main_process() == (rank == 0)
+
+    torch.manual_seed(rank)  # different initialization is overwritten by rank 0
+    model = module.wrap_ddp(Model(), bucket_cap_mb=1)
+    data = make_data(n_steps=4)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    observations = []
+    for step, (xs, ys) in enumerate(data):
+        is_update = (step + 1) % accum_grad_n_steps == 0
+        with (model.no_sync() if not is_update else torch.enable_grad()):
+            loss, observation = model(xs[rank::WORLD_SIZE], ys[rank::WORLD_SIZE])
+            (loss / accum_grad_n_steps).backward()
+        observations.append(module.reduce_observation(observation))
+        if is_update:
+            optimizer.step()
+            optimizer.zero_grad()
+
+    metric = module.broadcast_object({'metric': rank + 1} if rank == 0 else None)
+    # NOTE: tensors are converted to lists to be sent after the process exits
+    state_dict = {k: v.tolist() for k, v in model.module.state_dict().items()}
+    queue.put((rank, state_dict, observations, metric))
+    module.barrier()
+    torch.distributed.destroy_process_group()
+
+
+@pytest.mark.parametrize("accum_grad_n_steps", [1, 2])
+def test_ddp(tmpdir, accum_grad_n_steps):
+    init_method = 'file://' + os.path.join(str(tmpdir), 'init')
+    ctx = mp.get_context('fork')
+    queue = ctx.SimpleQueue()
+    mp.start_processes(_worker, args=(init_method, accum_grad_n_steps, queue),
+                       nprocs=WORLD_SIZE, start_method='fork')
+    results = sorted([queue.get() for _ in range(WORLD_SIZE)], key=lambda x: x[0])
+
+    # reference: single process on global mini-batches
+    torch.manual_seed(0)
+    model = Model()
+    data = make_data(n_steps=4)
+    train(model, data, accum_grad_n_steps)
+
+    for rank, state_dict, observations, metric in results:
+        assert metric == {'metric': 1}
+        for k, v in model.state_dict().items():
+            if k.startswith('linear'):
+                assert torch.allclose(torch.tensor(state_dict[k]), v, atol=1e-6)
+        # parameters without gradients are also synchronized with rank 0
+        assert state_dict['unused.weight'] == results[0][1]['unused.weight']
+        for observation in observations:
+            assert observation['acc.train'] is None
+    assert [o['loss.train'] for o in results[0][2]] == [o['loss.train'] for o in results[1][2]]
+
+
+def _worker_observation(rank, init_method, queue):
+    module = importlib.import_module('neural_sp.trainers.distributed')
+    module.init_distributed('gloo', init_method=init_method, world_size=WORLD_SIZE, rank=rank)
+    observations = [
+        # None in different keys
+        {'loss.att': 1. + rank, 'loss.ctc': 2. if rank == 0 else None, 'acc': None},
+        # a key observed only in one process
+        {'loss.att': 3., 'loss.lm': 4. if rank == 1 else None} if rank == 1 else {'loss.att': 1.},
+        # no observed values
+        {'loss.att': None},
+    ]
+    queue.put((rank, [module.reduce_observation(o) for o in observations]))
+    module.barrier()
+    torch.distributed.destroy_process_group()
+
+
+def test_reduce_observation_with_missing_values(tmpdir):
+    init_method = 'file://' + os.path.join(str(tmpdir), 'init')
+    ctx = mp.get_context('fork')
+    queue = ctx.SimpleQueue()
+    mp.start_processes(_worker_observation, args=(init_method, queue),
+                       nprocs=WORLD_SIZE, start_method='fork')
+    results = sorted([queue.get() for _ in range(WORLD_SIZE)], key=lambda x: x[0])
+
+    for rank, observations in results:
+        assert observations[0]['loss.att'] == 1.5
+        assert observations[0]['loss.ctc'] == 2.
+        assert observations[0]['acc'] is None
+        assert observations[1]['loss.att'] == 2.
+        assert observations[1]['loss.lm'] == 4.
+        assert observations[2]['loss.att'] is None
+
+
+def test_single_process():
+    module = importlib.import_module('neural_sp.trainers.distributed')
+    assert not module.is_initialized()
+    assert module.get_rank() == 0
+    assert module.get_world_size() == 1
+    assert module.is_main_process()
+    obj = {'a': 1}
+    assert module.broadcast_object(obj) is obj
+    assert module.reduce_observation(obj) is obj
+    module.barrier()
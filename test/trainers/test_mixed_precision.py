@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for native mixed precision training."""
+
+import importlib
+import pytest
+import torch
+
+
+def make_optimizer(model):
+    module = importlib.import_module('neural_sp.trainers.lr_scheduler')
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    return module.LRScheduler(optimizer, 0.1, decay_type='always',
+                              decay_start_epoch=1, decay_rate=0.5)
+
+
+def test_float32_loss():
+    module = importlib.import_module('neural_sp.models.criterion')
+    torch.manual_seed(0)
+    logits = torch.randn(2, 5, 10)
+    ys = torch.randint(0, 10, (2, 5))
+    ys[1, 3:] = -1
+    loss, _ = module.cross_entropy_lsm(logits, ys, 0.1, -1, training=True)
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        loss_amp, _ = module.cross_entropy_lsm(logits.bfloat16(), ys, 0.1, -1, training=True)
+    assert loss_amp.dtype == torch.float32
+    assert torch.allclose(loss_amp, loss, rtol=1e-2)
+
+
+@pytest.mark.parametrize("dtype", ['bfloat16', 'float16'])
+def test_step(dtype):
+    module = importlib.import_module('neural_sp.trainers.mixed_precision')
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 3)
+    optimizer = make_optimizer(model)
+    amp = module.MixedPrecision(dtype, 'cpu', init_scale=1024.)
+
+    xs = torch.randn(8, 4)
+    with amp.autocast():
+        out = model(xs)
+    assert out.dtype == getattr(torch, dtype)
+    loss = out.float().pow(2).mean()
+    amp.backward(loss)
+    if dtype == 'float16':
+        assert amp.scale == 1024.
+        grad_scaled = model.weight.grad.clone()
+        amp.unscale_(optimizer.optimizer)
+        assert torch.allclose(model.weight.grad * 1024., grad_scaled)
+    else:
+        assert amp.scale == 1.
+    weight = model.weight.detach().clone()
+    optimizer.step(amp)
+    assert optimizer.n_steps == 1
+    assert not torch.equal(model.weight, weight)
+
+    # parameter updates are skipped when gradients overflow
+    optimizer.zero_grad()
+    with amp.autocast():
+        loss = model(xs).float().sum() * float('inf')
+    amp.backward(loss)
+    weight = model.weight.detach().clone()
+    optimizer.step(amp)
+    if dtype == 'float16':
+        assert torch.equal(model.weight, weight)
+        assert amp.scale == 512.
+
+    # checkpoint
+    amp_new = module.MixedPrecision(dtype, 'cpu')
+    amp_new.load_state_dict(amp.state_dict())
+    assert amp_new.scale == amp.scale
+
+
+def test_tensor2np():
+    module = importlib.import_module('neural_sp.models.torch_utils')
+    xs = torch.randn(3, 4)
+    assert module.tensor2np(xs.bfloat16()).dtype.name == 'float32'
+    with module.autocast('cpu', 'float32'):
+        assert not torch.is_autocast_enabled('cpu')
+    with module.autocast(xs.device, 'bfloat16'):
+        assert torch.is_autocast_enabled('cpu')
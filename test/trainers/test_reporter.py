@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for reporter and background plotting."""
+
+import importlib
+import numpy as np
+import os
+import pytest
+
+
+def train(reporter, n_steps, print_step=2, offset=0):
+    for step in range(n_steps):
+        reporter.add({'loss.att': 1. / (offset + step + 1), 'acc.att': 0.5, 'loss.ctc': None})
+        reporter.step()
+        if (step + 1) % print_step == 0:
+            reporter.add({'loss.att': 2. / (offset + step + 1), 'acc.att': 0.4}, is_eval=True)
+            reporter.step(is_eval=True)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_snapshot(tmpdir, asynchronous):
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    save_path = str(tmpdir)
+    reporter = module.Reporter(save_path, asynchronous=asynchronous)
+
+    train(reporter, 10)
+    reporter.snapshot()
+    train(reporter, 6, offset=10)
+    reporter.snapshot()
+    reporter.snapshot()  # nothing to be updated
+    reporter.epoch(30.)
+    reporter.epoch(20.)
+    reporter.close()
+
+    for name in ['loss.png', 'acc.png', 'wer.png']:
+        assert os.path.isfile(os.path.join(save_path, name))
+    assert not os.path.isfile(os.path.join(save_path, 'ppl.png'))  # not observed
+
+    # csv files are appended incrementally
+    loss = np.loadtxt(os.path.join(save_path, 'loss-att.csv'), delimiter=',')
+    assert loss.shape == (8, 3)
+    assert np.array_equal(loss[:, 0], reporter.steps)
+    assert np.allclose(loss[:, 2], reporter.obsv_dev['loss']['att'])
+    assert np.allclose(loss[:, 1], reporter.obsv_train['loss']['att'])
+
+
+def test_rate_limit(tmpdir, monkeypatch):
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    save_path = str(tmpdir)
+    reporter = module.Reporter(save_path, min_interval=3600)
+    plotted = []
+    monkeypatch.setattr(module, 'plot_curves', lambda path, *args: plotted.append(os.path.basename(path)))
+
+    train(reporter, 4)
+    reporter.snapshot()
+    assert sorted(plotted) == ['acc.png', 'loss.png']
+    train(reporter, 4)
+    reporter.snapshot()
+    assert len(plotted) == 2  # skipped
+    # but csv files are up-to-date
+    assert len(np.loadtxt(os.path.join(save_path, 'loss-att.csv'), delimiter=',')) == 4
+
+    # the latest curves are plotted at the end
+    reporter.close()
+    assert sorted(plotted) == ['acc.png', 'acc.png', 'loss.png', 'loss.png']
+
+
+def test_disabled(tmpdir):
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    reporter = module.Reporter(str(tmpdir), enabled=False)
+    train(reporter, 4)
+    reporter.snapshot()
+    reporter.epoch(10.)
+    reporter.close()
+    assert reporter.worker is None
+    assert os.listdir(str(tmpdir)) == []
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_worker(tmpdir, asynchronous):
+    module = importlib.import_module('neural_sp.trainers.report_worker')
+    worker = module.ReportWorker(asynchronous=asynchronous)
+    rng = np.random.RandomState(0)
+    aws = {'xy_aws': rng.rand(4, 5, 20), 'yy_aws': rng.rand(4, 5, 5)}
+    probs = rng.dirichlet(np.ones(10), size=30)
+
+    save_path_att = str(tmpdir.join('att'))
+    os.makedirs(save_path_att)
+    open(os.path.join(save_path_att, 'old.png'), 'w').close()
+    assert worker.submit('att', module.plot_attention_heads, save_path_att, aws, 2)
+    assert module.submit(worker, 'ctc', module.plot_ctc_posteriors, str(tmpdir.join('ctc')), probs)
+    worker.close()
+
+    assert sorted(os.listdir(save_path_att)) == ['xy_aws.png', 'yy_aws.png']
+    assert os.listdir(str(tmpdir.join('ctc'))) == ['prob.png']
@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Pack features in a Kaldi scp file into feature shards.
+   A new scp file pointing to the shards is written to the standard output,
+   which can be passed to make_tsv.py as --feat.
+"""
+
+import argparse
+import kaldiio
+import os
+from tqdm import tqdm
+
+from neural_sp.datasets.feat_shard import FeatShardWriter
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--feat', type=str,
+                    help='feats.scp file')
+parser.add_argument('--out_prefix', type=str,
+                    help='prefix of output shard files, e.g., dump/train/feats')
+parser.add_argument('--dtype', type=str, default='float32',
+                    choices=['float16', 'float32'],
+                    help='data type of features in shards')
+parser.add_argument('--shard_size', type=int, default=1024,
+                    help='maximum size of each shard in MB')
+args = parser.parse_args()
+
+
+def main():
+
+    if os.path.dirname(args.out_prefix):
+        os.makedirs(os.path.dirname(args.out_prefix), exist_ok=True)
+
+    with FeatShardWriter(os.path.abspath(args.out_prefix), dtype=args.dtype,
+                         max_shard_size=args.shard_size * 1024 * 1024) as writer:
+        for utt_id, feat in tqdm(kaldiio.load_scp_sequential(args.feat)):
+            print('%s %s' % (utt_id, writer.write(feat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,15 +9,16 @@
 import argparse
 import codecs
 from distutils.util import strtobool
-import kaldiio
 import os
 import re
 import sentencepiece as spm
 from tqdm import tqdm
 
+from neural_sp.datasets.feat_shard import load_feat
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--feat', type=str, default='', nargs='?',
-                    help='feats.scp file')
+                    help='feats.scp file (Kaldi ark or feature shards)')
 parser.add_argument('--utt2num_frames', type=str, nargs='?',
                     help='utt2num_frames file')
 parser.add_argument('--utt2spk', type=str, nargs='?',
@@ -119,7 +120,7 @@ def main():
             if utt_id in utt2num_frames.keys():
                 xlen = utt2num_frames[utt_id]
             else:
-                xlen = kaldiio.load_mat(feat_path).shape[-2]
+                xlen = load_feat(feat_path).shape[-2]
             speaker = utt2spk[utt_id]
 
             if not os.path.isfile(feat_path.split(':')[0]):
@@ -188,7 +189,7 @@ def main():
 
         if xdim is None:
             if args.feat:
-                xdim = kaldiio.load_mat(feat_path).shape[-1]
+                xdim = load_feat(feat_path).shape[-1]
             else:
                 xdim = 0
         ydim = len(token2idx.keys())